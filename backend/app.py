@@ -292,7 +292,7 @@ def change_password(current_user):
 @admin_required
 def get_all_users(current_user):
     """获取所有用户 (仅管理员)"""
-    users = db.get_all_users()
+    users = db.get_user_list()
     return jsonify([dict(user) for user in users])
 
 @app.route('/api/users', methods=['POST'])
@@ -410,9 +410,9 @@ def get_all_emails(current_user):
     """获取当前用户的所有邮箱"""
     # 普通用户只能获取自己的邮箱，管理员可以获取所有邮箱
     if current_user['is_admin']:
-        emails = db.get_all_emails()
+        emails = db.get_email_list()
     else:
-        emails = db.get_all_emails(current_user['id'])
+        emails = db.get_email_list(current_user['id'])
     
     return jsonify([dict(email) for email in emails])
 
@@ -582,16 +582,16 @@ def batch_check_emails(current_user):
     if not email_ids:
         # 如果没有提供 ID，则获取当前用户拥有的所有邮箱
         if current_user['is_admin']:
-            emails = db.get_all_emails()
+            emails = db.get_email_list()
         else:
-            emails = db.get_all_emails(current_user['id'])
+            emails = db.get_email_list(current_user['id'])
             
         email_ids = [email['id'] for email in emails]
     else:
         # 如果提供了ID，验证用户权限
         if not current_user['is_admin']:
             # 获取该用户拥有的邮箱
-            owned_emails = db.get_all_emails(current_user['id'])
+            owned_emails = db.get_email_list(current_user['id'])
             owned_ids = [email['id'] for email in owned_emails]
             # 过滤出用户有权限的邮箱ID
             email_ids = [id for id in email_ids if id in owned_ids]
@@ -639,14 +639,48 @@ def batch_check_emails(current_user):
 @app.route('/api/emails/<int:email_id>/mail_records', methods=['GET'])
 @token_required
 def get_mail_records(current_user, email_id):
-    """获取指定邮箱的邮件记录"""
+    """分页获取指定邮箱的邮件记录
+    
+    查询参数 limit 指定每页条数，cursor 传入上一页返回的 next_cursor 继续翻页
+    """
     # 获取邮箱信息
     email_info = db.get_email_by_id(email_id, None if current_user['is_admin'] else current_user['id'])
     if not email_info:
         return jsonify({'error': f'邮箱 ID {email_id} 不存在或您没有权限'}), 404
     
-    mail_records = db.get_mail_records(email_id)
-    return jsonify([dict(record) for record in mail_records])
+    try:
+        mail_records, next_cursor = db.get_mail_records_page(
+            email_id,
+            limit=request.args.get('limit'),
+            cursor=request.args.get('cursor')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'records': [dict(record) for record in mail_records],
+        'next_cursor': next_cursor
+    })
+
+@app.route('/api/mail_records/<int:record_id>', methods=['GET'])
+@token_required
+def get_mail_record(current_user, record_id):
+    """获取单封邮件的完整内容
+    
+    列表和搜索接口只返回摘要，查看邮件时通过该接口按需获取正文
+    """
+    if not hasattr(db, 'get_mail_record_by_id'):
+        return jsonify({'error': '当前数据库不支持按ID获取邮件'}), 501
+    record = db.get_mail_record_by_id(record_id)
+    if not record:
+        return jsonify({'error': f'邮件 ID {record_id} 不存在'}), 404
+    
+    # 验证邮件所属邮箱的访问权限
+    email_info = db.get_email_by_id(record['email_id'], None if current_user['is_admin'] else current_user['id'])
+    if not email_info:
+        return jsonify({'error': f'邮件 ID {record_id} 不存在或您没有权限'}), 404
+    
+    return jsonify(dict(record))
 
 @app.route('/api/emails/import', methods=['POST'])
 @token_required
@@ -734,16 +768,36 @@ def toggle_registration(current_user):
 @token_required
 @admin_required
 def backup_database(current_user):
-    """备份数据库"""
+    """在后台开始备份数据库，通过 GET 查询备份进度"""
     if not current_user['is_admin']:
         return jsonify({'error': '需要管理员权限'}), 403
         
-    success = db.backup_database()
-    if success:
-        return jsonify({'message': '数据库备份成功'})
+    job = db.backup_database()
+    if job:
+        return jsonify({'message': '数据库备份已开始', 'job': job}), 202
     else:
         return jsonify({'error': '数据库备份失败'}), 500
 
+@app.route('/api/admin/database/backup', methods=['GET'])
+@token_required
+@admin_required
+def get_backup_status(current_user):
+    """获取数据库备份进度和本地备份列表"""
+    if not current_user['is_admin']:
+        return jsonify({'error': '需要管理员权限'}), 403
+    
+    return jsonify(db.get_backup_status())
+
+@app.route('/api/admin/database/write_stats', methods=['GET'])
+@token_required
+@admin_required
+def get_database_write_stats(current_user):
+    """获取数据库组提交的批大小和提交耗时统计"""
+    stats = db.get_write_stats()
+    if stats is None:
+        return jsonify({'error': '当前数据库不支持写入统计'}), 501
+    return jsonify(stats)
+
 @app.route('/api/admin/database/webdav/config', methods=['GET'])
 @token_required
 @admin_required
@@ -851,6 +905,15 @@ def sync_to_webdav(current_user):
     else:
         return jsonify({'error': '同步数据库到WebDAV失败'}), 500
 
+@app.route('/api/admin/database/webdav/status', methods=['GET'])
+@token_required
+@admin_required
+def get_webdav_sync_status(current_user):
+    """获取WebDAV后台同步状态"""
+    if not hasattr(db, 'get_sync_status'):
+        return jsonify({'error': '当前数据库不支持同步状态查询'}), 501
+    return jsonify(db.get_sync_status())
+
 @app.route('/api/admin/database/webdav/sync-from', methods=['POST'])
 @token_required
 @admin_required
@@ -879,8 +942,7 @@ def get_database_info(current_user):
     info = {
         'type': DB_TYPE,
         'webdav_enabled': WEBDAV_ENABLED,
-        'user_count': len(db.get_all_users()),
-        'email_count': len(db.get_all_emails())
+        **db.get_database_stats()
     }
     
     return jsonify(info)
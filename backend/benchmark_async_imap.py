@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+对比线程池和异步引擎检查大量邮箱的速度
+
+在本地启动 benchmark_imap_fetch 中的简化IMAP服务器，每个命令的响应前等待指定的延迟，
+每个邮箱有几封邮件。线程池与 EmailBatchProcessor 相同，用 5 个线程逐个调用 IMAPMailHandler.fetch_emails；
+异步引擎把全部邮箱提交到一个事件循环，同一服务器的并发连接数受 --max-per-host 限制。
+输出每秒检查的邮箱数。
+"""
+
+import time
+import logging
+import argparse
+import threading
+import concurrent.futures
+
+from database import config
+from utils.email.imap import IMAPMailHandler
+from utils.email.imap_pool import imap_pool
+from utils.email.async_imap import AsyncIMAPMailHandler, async_engine
+from tests.standins import IMAPStandIn, build_messages
+
+
+class BusyIMAPStandIn(IMAPStandIn):
+    """同时接受大量连接的本地IMAP服务器"""
+    request_queue_size = 1024
+
+
+def check_with_threads(port, accounts, workers, expected):
+    """线程池逐个检查邮箱，返回耗时(秒)"""
+    def check(index):
+        return IMAPMailHandler.fetch_emails(f'user{index}@example.com', 'secret', '127.0.0.1', port=port, use_ssl=False)
+
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        counts = [len(records) for records in pool.map(check, range(accounts))]
+    elapsed = time.perf_counter() - started
+    if counts != [expected] * accounts:
+        raise RuntimeError(f"线程池获取的邮件数不正确: {set(counts)}")
+    return elapsed
+
+
+def check_with_engine(port, accounts, max_per_host, expected):
+    """异步引擎同时检查全部邮箱，返回耗时(秒)"""
+    async_engine.max_per_host = max_per_host
+    # 新的上限在下次创建信号量时生效
+    async_engine.close()
+    started = time.perf_counter()
+    futures = [
+        async_engine.submit(AsyncIMAPMailHandler.fetch_emails_async(
+            f'user{index}@example.com', 'secret', '127.0.0.1', port=port, use_ssl=False
+        ))
+        for index in range(accounts)
+    ]
+    counts = [len(future.result()) for future in futures]
+    elapsed = time.perf_counter() - started
+    if counts != [expected] * accounts:
+        raise RuntimeError(f"异步引擎获取的邮件数不正确: {set(counts)}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='对比线程池和异步引擎检查大量邮箱的速度')
+    parser.add_argument('--accounts', type=int, default=500, help='邮箱数')
+    parser.add_argument('--messages', type=int, default=5, help='每个邮箱的邮件数')
+    parser.add_argument('--latency', type=float, default=50, help='每次往返的延迟(毫秒)')
+    parser.add_argument('--workers', type=int, default=5, help='线程池的线程数')
+    parser.add_argument('--max-per-host', type=int, nargs='+', default=[50, 200], help='异步引擎同一服务器的并发连接数')
+    args = parser.parse_args()
+
+    # 只输出结果，不输出每封邮件的处理日志
+    logging.disable(logging.INFO)
+    # 每个邮箱只检查一次，不保留连接
+    imap_pool.enabled = False
+    config.IMAP_ASYNC_MAX_CONNECTIONS = max(args.max_per_host)
+    async_engine.max_connections = max(args.max_per_host)
+
+    server = BusyIMAPStandIn(build_messages(args.messages, 2048), args.latency / 1000)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    port = server.server_address[1]
+    print(f"{args.accounts} 个邮箱，每个 {args.messages} 封邮件，延迟 {args.latency:g}ms")
+    print(f"{'方式':<24}{'耗时(s)':>10}{'邮箱/秒':>10}")
+    try:
+        elapsed = check_with_threads(port, args.accounts, args.workers, args.messages)
+        print(f"{f'线程池 {args.workers} 线程':<24}{elapsed:>10.2f}{args.accounts / elapsed:>10.1f}")
+        for max_per_host in args.max_per_host:
+            elapsed = check_with_engine(port, args.accounts, max_per_host, args.messages)
+            print(f"{f'异步引擎 每服务器 {max_per_host}':<24}{elapsed:>10.2f}{args.accounts / elapsed:>10.1f}")
+    finally:
+        async_engine.close()
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
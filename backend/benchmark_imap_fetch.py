@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+对比不同批量大小下IMAP收信的吞吐量
+
+在本地启动一个简化的IMAP服务器，每个命令的响应前等待指定的延迟，模拟到邮件服务器的网络往返，
+然后用 IMAPMailHandler.fetch_emails 按不同的 IMAP_FETCH_BATCH_SIZE 获取全部邮件。
+批量大小为1时每封邮件一次往返，与逐封获取相同。
+
+最后对比邮件都已保存时重新全量同步（如 UIDVALIDITY 变化）的传输量：
+直接下载全部正文，和先获取邮件头、排除已保存的邮件后再下载正文。
+批量对比使用完整的 RFC822。最后每封邮件带一个 --attachment-size 大小的附件，
+对比获取完整邮件和按 BODYSTRUCTURE 只获取正文的传输量和耗时。
+另外对比没有新邮件时每次检查的耗时：每次新建连接并登录，和复用连接池中已登录的连接。
+最后测量 IDLE 推送的延迟：服务器收到新邮件到收信完成的时间，轮询时平均要等半个检查间隔。
+"""
+
+import time
+import email
+import logging
+import argparse
+import threading
+from datetime import datetime
+from email.message import EmailMessage
+from email.utils import format_datetime
+
+from database import config
+from utils.email.imap import IMAPMailHandler
+from utils.email.imap_pool import imap_pool
+from utils.email.imap_idle import IdleWatcher
+from utils.email.common import parse_email_headers, build_header_dedup_keys
+from tests.standins import IMAPStandIn, build_messages
+
+
+def measure(port, batch_size, expected, key_filter=None, partial=True):
+    """按指定批量大小获取全部邮件，返回耗时(秒)"""
+    config.IMAP_FETCH_BATCH_SIZE = batch_size
+    config.IMAP_PARTIAL_FETCH = partial
+    started = time.perf_counter()
+    records = IMAPMailHandler.fetch_emails(
+        'bench@example.com', 'secret', '127.0.0.1', port=port, use_ssl=False, key_filter=key_filter
+    )
+    elapsed = time.perf_counter() - started
+    if len(records) != expected:
+        raise RuntimeError(f"获取到 {len(records)} 封邮件，应为 {expected} 封")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='对比不同批量大小下IMAP收信的吞吐量')
+    parser.add_argument('--messages', type=int, default=200, help='邮件数')
+    parser.add_argument('--size', type=int, default=4096, help='每封邮件正文的字节数')
+    parser.add_argument('--latency', type=float, nargs='+', default=[0, 5, 20, 50], help='每次往返的延迟(毫秒)')
+    parser.add_argument('--batch-size', type=int, nargs='+', default=[1, 10, 50, 100], help='每个FETCH命令获取的邮件数')
+    parser.add_argument('--attachment-size', type=int, default=256 * 1024, help='对比部分获取时每封邮件附件的字节数，0表示不带附件')
+    args = parser.parse_args()
+
+    # 只输出结果，不输出每封邮件的处理日志
+    logging.disable(logging.INFO)
+    # 吞吐量对比每次都新建连接，只有检查空邮箱的对比使用连接池
+    imap_pool.enabled = False
+
+    messages = build_messages(args.messages, args.size)
+    print(f"{args.messages} 封邮件，每封约 {args.size} 字节，单位: 封/秒")
+    print(f"{'延迟(ms)':<10}" + ''.join(f"{f'批量{size}':>12}" for size in args.batch_size))
+    for latency in args.latency:
+        server = IMAPStandIn(messages, latency / 1000)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            port = server.server_address[1]
+            row = [args.messages / measure(port, size, args.messages, partial=False) for size in args.batch_size]
+        finally:
+            server.shutdown()
+            server.server_close()
+        print(f"{latency:<10g}" + ''.join(f"{value:>12.1f}" for value in row))
+
+    resync(messages, args.latency[-1], max(args.batch_size))
+    attachments(build_messages(args.messages, args.size, args.attachment_size),
+                args.attachment_size, args.latency[-1], max(args.batch_size))
+    push_latency(messages, args.latency[-1])
+    poll_idle(messages, args.latency[-1])
+
+
+def poll_idle(messages, latency, polls=20):
+    """没有新邮件时反复检查，对比每次新建连接和复用连接池中的连接"""
+    print(f"\n检查没有新邮件的邮箱 {polls} 次，延迟 {latency:g}ms")
+    print(f"{'方式':<16}{'每次(ms)':>12}")
+    server = IMAPStandIn(messages, latency / 1000)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        port = server.server_address[1]
+        for name, pooled in (('每次新建连接', False), ('复用连接', True)):
+            imap_pool.enabled = pooled
+            # 同步位置已是最新，选择文件夹后根据 UIDNEXT 判断没有新邮件
+            sync_state = {'folder': 'INBOX', 'uidvalidity': 1, 'last_uid': len(messages), 'changed': False}
+            # 第一次检查建立连接，不计入耗时
+            IMAPMailHandler.fetch_emails('bench@example.com', 'secret', '127.0.0.1', port=port,
+                                         use_ssl=False, sync_state=sync_state)
+            started = time.perf_counter()
+            for _ in range(polls):
+                IMAPMailHandler.fetch_emails('bench@example.com', 'secret', '127.0.0.1', port=port,
+                                             use_ssl=False, sync_state=sync_state)
+            print(f"{name:<16}{(time.perf_counter() - started) * 1000 / polls:>12.1f}")
+    finally:
+        imap_pool.close()
+        server.shutdown()
+        server.server_close()
+
+
+def push_latency(messages, latency, deliveries=10):
+    """IDLE 推送：测量投递新邮件到收信完成的延迟"""
+    print(f"\nIDLE 推送 {deliveries} 封新邮件，延迟 {latency:g}ms")
+    server = IMAPStandIn(dict(messages), latency / 1000)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    imap_pool.enabled = True
+    sync_state = {'folder': 'INBOX', 'uidvalidity': 1, 'last_uid': len(messages), 'changed': False}
+    notified = threading.Event()
+    delivered_at = {}
+    latencies = []
+    done = threading.Event()
+
+    def fetch_loop():
+        # 与实时检查一样，收到通知后按同步位置增量收信
+        while not done.is_set():
+            if not notified.wait(0.1):
+                continue
+            notified.clear()
+            records = IMAPMailHandler.fetch_emails('bench@example.com', 'secret', '127.0.0.1', port=port,
+                                                   use_ssl=False, sync_state=sync_state)
+            finished = time.perf_counter()
+            for record in records:
+                if record['message_id'] in delivered_at:
+                    latencies.append(finished - delivered_at[record['message_id']])
+
+    account = {'id': 1, 'email': 'bench@example.com', 'password': 'secret', 'mail_type': 'imap',
+               'server': '127.0.0.1', 'port': server.server_address[1], 'use_ssl': False}
+    port = account['port']
+    watcher = IdleWatcher(lambda _: notified.set(), enabled=True, max_sessions=1)
+    fetcher = threading.Thread(target=fetch_loop, daemon=True)
+    fetcher.start()
+    try:
+        watcher.watch(account)
+        # 等待会话进入 IDLE，第一次连接触发的补收信完成
+        deadline = time.monotonic() + 10
+        while not watcher.watch(account) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        time.sleep(0.5)
+        for i in range(deliveries):
+            msg = EmailMessage()
+            msg['Subject'] = f'push {i}'
+            msg['From'] = 'sender@example.com'
+            msg['To'] = 'bench@example.com'
+            msg['Date'] = format_datetime(datetime.now())
+            msg['Message-ID'] = f'<push-{i}@example.com>'
+            msg.set_content('new mail')
+            delivered_at[msg['Message-ID']] = time.perf_counter()
+            server.deliver(msg.as_bytes())
+            time.sleep(0.5)
+    finally:
+        done.set()
+        fetcher.join()
+        watcher.stop()
+        server.shutdown()
+        server.server_close()
+    if len(latencies) != deliveries:
+        raise RuntimeError(f"收到 {len(latencies)} 封推送的邮件，应为 {deliveries} 封")
+    print(f"{'平均(ms)':>12}{'最大(ms)':>12}")
+    print(f"{sum(latencies) * 1000 / len(latencies):>12.1f}{max(latencies) * 1000:>12.1f}")
+
+
+def run_case(messages, latency, batch_size, expected, key_filter=None, partial=True):
+    """启动本地服务器获取一次，返回 (传输字节数, 耗时秒)"""
+    server = IMAPStandIn(messages, latency / 1000)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        elapsed = measure(server.server_address[1], batch_size, expected, key_filter, partial)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return server.bytes_sent, elapsed
+
+
+def attachments(messages, attachment_size, latency, batch_size):
+    """邮件带附件时，对比获取完整邮件和按 BODYSTRUCTURE 只获取正文"""
+    print(f"\n获取 {len(messages)} 封带 {attachment_size // 1024}KB 附件的邮件，延迟 {latency:g}ms，批量 {batch_size}")
+    print(f"{'方式':<16}{'传输(KB)':>12}{'耗时(ms)':>12}")
+    for name, partial in (('完整邮件', False), ('只获取正文', True)):
+        sent, elapsed = run_case(messages, latency, batch_size, len(messages), partial=partial)
+        print(f"{name:<16}{sent / 1024:>12.1f}{elapsed * 1000:>12.1f}")
+
+
+def resync(messages, latency, batch_size):
+    """邮件都已保存时重新全量同步，对比直接下载正文和先获取邮件头的传输量与耗时"""
+    stored = set()
+    for body in messages.values():
+        headers = parse_email_headers(email.message_from_bytes(body))
+        stored.update(build_header_dedup_keys(headers))
+
+    print(f"\n重新全量同步 {len(messages)} 封已保存的邮件，延迟 {latency:g}ms，批量 {batch_size}")
+    print(f"{'方式':<16}{'传输(KB)':>12}{'耗时(ms)':>12}")
+    cases = [
+        ('直接下载正文', None, len(messages)),
+        ('先获取邮件头', lambda keys: stored.intersection(keys), 0),
+    ]
+    for name, key_filter, expected in cases:
+        sent, elapsed = run_case(messages, latency, batch_size, expected, key_filter)
+        print(f"{name:<16}{sent / 1024:>12.1f}{elapsed * 1000:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
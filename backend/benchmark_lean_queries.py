@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+对比ORM查询和轻量查询的耗时
+
+在临时SQLite数据库中生成邮箱和邮件记录，分别用加载完整ORM对象的方式
+和只查询需要的列、COUNT(*) 统计的方式执行列表和统计查询。
+"""
+
+import os
+import time
+import shutil
+import secrets
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+from flask import Flask
+from sqlalchemy import insert
+
+from database import config
+
+# 使用临时SQLite数据库，不从WebDAV恢复
+config.WEBDAV_ENABLED = False
+config.DB_TYPE = 'sqlite'
+
+from database.database import Database, User, Email, MailRecord
+
+
+def populate(db, rows, content_size):
+    """生成一个用户、rows 个邮箱和 rows 封邮件，邮件都属于第一个邮箱"""
+    session = db.db.session
+    session.execute(insert(User), [{
+        'username': 'bench', 'password': 'bench', 'password_hash': 'x', 'salt': 'x', 'is_admin': True
+    }])
+    user_id = session.query(User.id).scalar()
+
+    token = secrets.token_hex(800)
+    batch = 5000
+    for start in range(0, rows, batch):
+        session.execute(insert(Email), [{
+            'user_id': user_id,
+            'email': f'user{i}@example.com',
+            'password': 'secret',
+            'client_id': secrets.token_hex(16),
+            'refresh_token': token,
+            'access_token': token,
+        } for i in range(start, min(start + batch, rows))])
+    email_id = session.query(Email.id).order_by(Email.id).limit(1).scalar()
+
+    content = 'x' * content_size
+    now = datetime.utcnow()
+    for start in range(0, rows, batch):
+        session.execute(insert(MailRecord), [{
+            'email_id': email_id,
+            'subject': f'subject {i}',
+            'sender': 'sender@example.com',
+            'received_time': now - timedelta(seconds=i),
+            'content': content,
+            'folder': 'INBOX',
+        } for i in range(start, min(start + batch, rows))])
+    session.commit()
+    return user_id, email_id
+
+
+def measure(db, func, repeat):
+    """执行 repeat 次，返回最短耗时(毫秒)和结果行数"""
+    best = None
+    count = 0
+    for _ in range(repeat):
+        # 清空会话，避免ORM命中已加载的对象
+        db.db.session.remove()
+        started = time.perf_counter()
+        result = func()
+        elapsed = (time.perf_counter() - started) * 1000
+        count = result if isinstance(result, int) else len(result)
+        best = elapsed if best is None else min(best, elapsed)
+    return best, count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='对比ORM查询和轻量查询的耗时')
+    parser.add_argument('--rows', type=int, default=100000, help='生成的邮箱数和邮件数')
+    parser.add_argument('--content-size', type=int, default=2000, help='每封邮件正文的字节数')
+    parser.add_argument('--repeat', type=int, default=3, help='每个查询执行的次数，取最短耗时')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='firemail_bench_')
+    db_path = os.path.join(work_dir, 'bench.db')
+    config.SQLITE_DB_PATH = db_path
+    config.SQLALCHEMY_DATABASE_URI = f"sqlite:///{db_path}"
+
+    app = Flask(__name__)
+    db = Database()
+    db.init_app(app)
+
+    try:
+        with app.app_context():
+            started = time.perf_counter()
+            user_id, email_id = populate(db, args.rows, args.content_size)
+            print(f"生成 {args.rows} 个邮箱和 {args.rows} 封邮件，耗时 {time.perf_counter() - started:.1f} 秒，"
+                  f"数据库大小 {os.path.getsize(db_path) / 1024 / 1024:.1f} MB")
+
+            cases = [
+                ('邮箱列表',
+                 lambda: Email.query.all(),
+                 lambda: db.get_email_list()),
+                ('用户的邮箱列表',
+                 lambda: Email.query.filter_by(user_id=user_id).all(),
+                 lambda: db.get_email_list(user_id)),
+                ('邮件列表',
+                 lambda: MailRecord.query.filter_by(email_id=email_id).order_by(
+                     MailRecord.received_time.desc(), MailRecord.id.desc()).all(),
+                 lambda: db.get_mail_record_list(email_id)),
+                ('邮件分页(第一页)',
+                 lambda: MailRecord.query.filter_by(email_id=email_id).order_by(
+                     MailRecord.received_time.desc(), MailRecord.id.desc()).limit(50).all(),
+                 lambda: db.get_mail_records_page(email_id, limit=50)[0]),
+                ('数据库统计',
+                 lambda: len(User.query.all()) + len(Email.query.all()) + len(MailRecord.query.all()),
+                 lambda: sum(db.get_database_stats().values())),
+            ]
+
+            print(f"{'查询':<16}{'行数':>10}{'ORM(ms)':>12}{'轻量(ms)':>12}{'加速':>8}")
+            for name, orm_func, lean_func in cases:
+                orm_ms, count = measure(db, orm_func, args.repeat)
+                lean_ms, _ = measure(db, lean_func, args.repeat)
+                print(f"{name:<16}{count:>10}{orm_ms:>12.1f}{lean_ms:>12.1f}{orm_ms / lean_ms:>7.1f}x")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+对比逐个新建连接和共用连接池刷新Outlook访问令牌的速度
+
+在本地启动一个简化的令牌接口，每个请求的响应前等待 --latency 毫秒，每个新连接额外等待 --handshake 毫秒
+模拟TCP和TLS握手；每 --fail-every 个请求返回一次 503 模拟服务器繁忙。依次测试：
+原来每次 requests.post 新建连接、不重试地逐个刷新；通过 http_pool 逐个刷新；
+refresh_due 由多个线程并行刷新。输出耗时、成功数和打开的连接数。
+最后请求一个不响应的地址，确认读取超时后返回，不会一直占用线程。
+"""
+
+import time
+import logging
+import argparse
+import threading
+
+import requests
+
+from database import config
+from utils.email.outlook import OutlookMailHandler
+from utils.email.http_pool import HTTPSessionPool, http_pool
+from utils.email.token_cache import OutlookTokenCache
+from tests.standins import TokenStandIn
+
+
+def refresh_with_new_connections(url, accounts):
+    """原来的方式：每次新建连接，没有超时和重试，返回成功数"""
+    succeeded = 0
+    for account in accounts:
+        response = requests.post(url, data={
+            'grant_type': 'refresh_token',
+            'refresh_token': account['refresh_token'],
+            'client_id': account['client_id'],
+        })
+        succeeded += response.status_code == 200
+    return succeeded
+
+
+def refresh_with_pool(accounts):
+    """通过 http_pool 逐个刷新，返回成功数"""
+    return sum(1 for account in accounts
+               if OutlookMailHandler.refresh_access_token(account['refresh_token'], account['client_id']))
+
+
+def refresh_in_batches(accounts, workers):
+    """refresh_due 并行刷新，返回成功数"""
+    cache = OutlookTokenCache(enabled=True, workers=workers)
+    try:
+        return cache.refresh_due(accounts)
+    finally:
+        cache.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='对比逐个新建连接和共用连接池刷新Outlook访问令牌的速度')
+    parser.add_argument('--accounts', type=int, default=200, help='Outlook邮箱数')
+    parser.add_argument('--latency', type=float, default=50, help='每个请求的延迟(毫秒)')
+    parser.add_argument('--handshake', type=float, default=100, help='每个新连接的握手延迟(毫秒)')
+    parser.add_argument('--fail-every', type=int, default=20, help='每多少个请求返回一次503，0表示不失败')
+    parser.add_argument('--workers', type=int, default=8, help='并行刷新的线程数')
+    args = parser.parse_args()
+
+    # 只输出结果，不输出每次刷新的日志
+    logging.disable(logging.WARNING)
+
+    server = TokenStandIn(args.latency / 1000, args.handshake / 1000, args.fail_every)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    config.OUTLOOK_TOKEN_URL = f'{base_url}/token'
+    http_pool.pool_size = args.workers
+    http_pool.backoff = 0.05
+    accounts = [
+        {'id': index, 'mail_type': 'outlook', 'refresh_token': f'refresh-{index}', 'client_id': 'benchmark'}
+        for index in range(1, args.accounts + 1)
+    ]
+
+    print(f"{args.accounts} 个Outlook邮箱，请求延迟 {args.latency:g}ms，握手 {args.handshake:g}ms，"
+          f"每 {args.fail_every} 个请求失败一次")
+    print(f"{'方式':<24}{'耗时(s)':>10}{'成功':>8}{'连接数':>8}")
+    methods = [
+        ('逐个新建连接', lambda: refresh_with_new_connections(config.OUTLOOK_TOKEN_URL, accounts)),
+        ('连接池逐个刷新', lambda: refresh_with_pool(accounts)),
+        (f'连接池并行 {args.workers} 线程', lambda: refresh_in_batches(accounts, args.workers)),
+    ]
+    try:
+        for name, method in methods:
+            http_pool.close()
+            server.reset()
+            started = time.perf_counter()
+            succeeded = method()
+            elapsed = time.perf_counter() - started
+            print(f"{name:<24}{elapsed:>10.2f}{succeeded:>8}{server.counters['connections']:>8}")
+
+        # 不响应的令牌接口在读取超时后返回，重试一次
+        pool = HTTPSessionPool(pool_size=1, connect_timeout=1, read_timeout=0.5, retries=1, backoff=0.1)
+        started = time.perf_counter()
+        try:
+            pool.post(f'{base_url}/hang', data={})
+            outcome = '返回响应'
+        except requests.Timeout:
+            outcome = '超时'
+        print(f"\n不响应的令牌接口: {outcome}，耗时 {time.perf_counter() - started:.2f}s（读取超时 0.5s，重试 1 次）")
+        pool.close()
+    finally:
+        server.stopped.set()
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
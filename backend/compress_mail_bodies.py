@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+压缩历史邮件正文
+
+启用 MAIL_BODY_COMPRESSION 后，新写入的邮件正文会自动压缩，
+该脚本用于一次性压缩已有的邮件正文，并整理数据库文件回收空间。
+可以中断后重新执行，已压缩的记录会被跳过。
+"""
+
+import os
+import argparse
+import logging
+
+from database.db import Database
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('db-compressor')
+
+def format_size(size):
+    """格式化字节数"""
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+def main():
+    parser = argparse.ArgumentParser(description='压缩历史邮件正文')
+    parser.add_argument('--batch-size', type=int, default=200, help='每批处理的记录数')
+    parser.add_argument('--no-vacuum', action='store_true', help='压缩后不整理数据库文件')
+    args = parser.parse_args()
+    
+    db = Database()
+    size_before = os.path.getsize(db.db_path)
+    
+    def progress_callback(processed, total):
+        logger.info(f"压缩进度: {processed}/{total}")
+    
+    stats = db.compress_existing_mail_bodies(batch_size=args.batch_size, progress_callback=progress_callback)
+    
+    if not args.no_vacuum and stats['compressed']:
+        db.vacuum()
+    size_after = os.path.getsize(db.db_path)
+    
+    saved = stats['bytes_before'] - stats['bytes_after']
+    ratio = saved / stats['bytes_before'] * 100 if stats['bytes_before'] else 0
+    logger.info(f"处理记录: {stats['processed']}，压缩记录: {stats['compressed']}")
+    logger.info(f"正文大小: {format_size(stats['bytes_before'])} -> {format_size(stats['bytes_after'])}，节省 {ratio:.1f}%")
+    logger.info(f"数据库文件: {format_size(size_before)} -> {format_size(size_after)}")
+    
+    db.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+import os
+import gzip
+import time
+import shutil
+import sqlite3
+import threading
+import logging
+from datetime import datetime
+
+from . import config
+
+# 配置日志
+logger = logging.getLogger('database')
+
+BACKUP_PREFIX = 'firemail_backup_'
+BACKUP_SUFFIX = '.db.gz'
+
+
+def copy_snapshot(db_path, target_path, pages_per_step=None, step_interval=None, progress=None):
+    """使用备份API分步把数据库复制为一个一致的快照文件
+
+    复制期间源连接持有一个读事务，WAL模式下得到的是开始时刻的快照，
+    其他连接的写入不会导致备份反复从头开始。
+
+    Args:
+        db_path: 数据库文件路径
+        target_path: 快照文件路径，已存在时会被覆盖
+        pages_per_step: 每步复制的页数
+        step_interval: 两步之间的休眠时间，单位为秒
+        progress: 进度回调 progress(status, remaining, total)
+    """
+    pages_per_step = pages_per_step or config.BACKUP_PAGES_PER_STEP
+    step_interval = config.BACKUP_STEP_INTERVAL if step_interval is None else step_interval
+    source = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+    target = sqlite3.connect(target_path)
+    try:
+        # 开启读事务固定快照
+        source.execute("BEGIN")
+        source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        source.backup(target, pages=pages_per_step, progress=progress, sleep=step_interval)
+        source.execute("COMMIT")
+    finally:
+        target.close()
+        source.close()
+
+
+class BackupManager:
+    """SQLite在线备份
+
+    使用 sqlite3 的备份API分步复制数据库页，每步之间短暂休眠，不会长时间阻塞写入。
+    复制完成后压缩为 .db.gz 并按保留策略清理旧备份。
+    """
+
+    def __init__(self, db_path, backup_dir, pages_per_step=None, step_interval=None,
+                 retention_count=None, retention_days=None, after_backup=None):
+        """初始化备份管理器
+
+        Args:
+            db_path: 数据库文件路径
+            backup_dir: 备份目录
+            pages_per_step: 每步复制的页数
+            step_interval: 两步之间的休眠时间，单位为秒
+            retention_count: 最多保留的备份数量，0表示不限制
+            retention_days: 备份最长保留天数，0表示不限制
+            after_backup: 本地备份成功后的回调，参数为备份文件路径
+        """
+        self.db_path = db_path
+        self.backup_dir = backup_dir
+        self.pages_per_step = pages_per_step or config.BACKUP_PAGES_PER_STEP
+        self.step_interval = config.BACKUP_STEP_INTERVAL if step_interval is None else step_interval
+        self.retention_count = config.BACKUP_RETENTION_COUNT if retention_count is None else retention_count
+        self.retention_days = config.BACKUP_RETENTION_DAYS if retention_days is None else retention_days
+        self.after_backup = after_backup
+
+        self._lock = threading.Lock()
+        self._job = None
+        self._thread = None
+
+    def start(self):
+        """在后台线程中开始一次备份，已有备份在进行时返回该任务
+
+        Returns:
+            任务状态字典
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return dict(self._job)
+            self._job = {
+                'id': datetime.now().strftime('%Y%m%d%H%M%S'),
+                'status': 'running',
+                'progress': 0,
+                'pages_total': 0,
+                'pages_remaining': 0,
+                'file': None,
+                'size': 0,
+                'error': None,
+                'started_at': datetime.now().isoformat(timespec='seconds'),
+                'finished_at': None,
+            }
+            self._thread = threading.Thread(target=self._run, name='db-backup', daemon=True)
+            self._thread.start()
+            return dict(self._job)
+
+    def status(self):
+        """返回最近一次备份任务的状态，没有任务时返回 None"""
+        with self._lock:
+            return dict(self._job) if self._job else None
+
+    def _update(self, **fields):
+        """更新任务状态，直接调用 backup() 时没有任务则忽略"""
+        with self._lock:
+            if self._job is not None:
+                self._job.update(fields)
+
+    def _run(self):
+        """后台线程入口，备份失败只记录日志和任务状态"""
+        try:
+            path = self.backup()
+            self._update(status='success', progress=100, file=os.path.basename(path),
+                         size=os.path.getsize(path))
+        except Exception as e:
+            logger.error(f"备份数据库失败: {str(e)}")
+            self._update(status='failed', error=str(e))
+        finally:
+            self._update(finished_at=datetime.now().isoformat(timespec='seconds'))
+
+    def backup(self):
+        """执行一次完整备份
+
+        Returns:
+            压缩后的备份文件路径
+        """
+        os.makedirs(self.backup_dir, exist_ok=True)
+        name = f"{BACKUP_PREFIX}{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        snapshot_path = os.path.join(self.backup_dir, f"{name}.db.tmp")
+        target_path = os.path.join(self.backup_dir, f"{name}{BACKUP_SUFFIX}")
+        partial_path = f"{target_path}.tmp"
+
+        started = time.time()
+        try:
+            self._copy_snapshot(snapshot_path)
+            self._update(status='compressing')
+            with open(snapshot_path, 'rb') as src, gzip.open(partial_path, 'wb', compresslevel=config.BACKUP_COMPRESSION_LEVEL) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.replace(partial_path, target_path)
+        finally:
+            for path in (snapshot_path, partial_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        logger.info(
+            f"数据库已备份到: {target_path}，原始大小 {os.path.getsize(self.db_path)} 字节，"
+            f"压缩后 {os.path.getsize(target_path)} 字节，耗时 {time.time() - started:.1f} 秒"
+        )
+
+        self.rotate()
+        if self.after_backup:
+            try:
+                self.after_backup(target_path)
+            except Exception as e:
+                logger.error(f"备份后续处理失败: {str(e)}")
+        return target_path
+
+    def _copy_snapshot(self, snapshot_path):
+        """分步把数据库复制到临时文件"""
+        def progress(status, remaining, total):
+            done = total - remaining
+            self._update(
+                pages_total=total,
+                pages_remaining=remaining,
+                progress=int(done * 90 / total) if total else 90
+            )
+
+        copy_snapshot(self.db_path, snapshot_path, self.pages_per_step, self.step_interval, progress)
+
+    def list_backups(self):
+        """列出本地备份，按时间从新到旧排列"""
+        if not os.path.isdir(self.backup_dir):
+            return []
+        backups = []
+        for name in os.listdir(self.backup_dir):
+            if not name.startswith(BACKUP_PREFIX) or name.endswith('.tmp'):
+                continue
+            path = os.path.join(self.backup_dir, name)
+            if not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            backups.append({
+                'file': name,
+                'size': stat.st_size,
+                'created_at': datetime.fromtimestamp(stat.st_mtime).isoformat(timespec='seconds'),
+                'mtime': stat.st_mtime,
+            })
+        backups.sort(key=lambda item: item['mtime'], reverse=True)
+        return backups
+
+    def rotate(self):
+        """按数量和天数清理旧备份，最新的一份总是保留
+
+        Returns:
+            删除的备份数量
+        """
+        backups = self.list_backups()
+        now = time.time()
+        removed = 0
+        for index, item in enumerate(backups):
+            if index == 0:
+                continue
+            too_many = self.retention_count and index >= self.retention_count
+            too_old = self.retention_days and now - item['mtime'] > self.retention_days * 86400
+            if not (too_many or too_old):
+                continue
+            try:
+                os.remove(os.path.join(self.backup_dir, item['file']))
+                removed += 1
+            except OSError as e:
+                logger.warning(f"删除旧备份失败: {item['file']}, 错误: {str(e)}")
+        if removed:
+            logger.info(f"已清理 {removed} 个旧备份")
+        return removed
@@ -0,0 +1,97 @@
+import zlib
+import hashlib
+import logging
+
+from . import config
+
+# zstd为可选依赖，未安装时退回zlib
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 配置日志
+logger = logging.getLogger('database')
+
+CODEC_ZLIB = 'zlib'
+CODEC_ZSTD = 'zstd'
+
+# 压缩后至少要节省的比例，收益太小时按原文保存
+MIN_SAVING_RATIO = 0.1
+
+
+def resolve_codec(name=None):
+    """根据配置确定写入时使用的压缩算法，返回 None 表示不压缩"""
+    name = (name if name is not None else config.MAIL_BODY_COMPRESSION or '').strip().lower()
+    if name in ('', 'none', 'off', 'false'):
+        return None
+    if name == CODEC_ZSTD:
+        if zstandard is None:
+            logger.warning("未安装zstandard，邮件正文改用zlib压缩")
+            return CODEC_ZLIB
+        return CODEC_ZSTD
+    if name != CODEC_ZLIB:
+        logger.warning(f"未知的邮件正文压缩算法: {name}，改用zlib压缩")
+    return CODEC_ZLIB
+
+
+def compress_body(content, codec):
+    """压缩邮件正文
+
+    正文过短或压缩收益不足时保留原文。
+
+    Returns:
+        (value, codec) 元组，未压缩时 codec 为 None
+    """
+    if not codec or not content or not isinstance(content, str):
+        return content, None
+
+    raw = content.encode('utf-8')
+    if len(raw) < config.MAIL_BODY_COMPRESSION_MIN_SIZE:
+        return content, None
+
+    if codec == CODEC_ZSTD:
+        packed = zstandard.ZstdCompressor(level=config.MAIL_BODY_COMPRESSION_LEVEL).compress(raw)
+    else:
+        packed = zlib.compress(raw, config.MAIL_BODY_COMPRESSION_LEVEL)
+
+    if len(packed) > len(raw) * (1 - MIN_SAVING_RATIO):
+        return content, None
+    return packed, codec
+
+
+def decompress_body(value, codec):
+    """还原邮件正文，codec 为空时原样返回"""
+    if value is None:
+        return None
+    if not codec:
+        if isinstance(value, bytes):
+            return value.decode('utf-8', errors='replace')
+        return value
+
+    if codec == CODEC_ZLIB:
+        raw = zlib.decompress(value)
+    elif codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("邮件正文使用zstd压缩，但未安装zstandard")
+        raw = zstandard.ZstdDecompressor().decompress(value)
+    else:
+        raise ValueError(f"未知的邮件正文压缩算法: {codec}")
+    return raw.decode('utf-8', errors='replace')
+
+
+def normalize_body(content):
+    """规范化邮件正文，统一换行符并去除首尾空白，使相同正文得到相同的哈希"""
+    if not isinstance(content, str):
+        return content
+    return content.replace('\r\n', '\n').replace('\r', '\n').strip()
+
+
+def hash_body(content):
+    """计算规范化后正文的哈希，作为 mail_bodies 表的键"""
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def register_sql_functions(conn):
+    """在连接上注册 mail_body_text(content, codec) 函数，供SQL中读取压缩后的正文"""
+    conn.create_function('mail_body_text', 2, decompress_body, deterministic=True)
@@ -29,6 +29,12 @@ WEBDAV_USERNAME = os.environ.get('WEBDAV_USERNAME', '')
 WEBDAV_PASSWORD = os.environ.get('WEBDAV_PASSWORD', '')
 WEBDAV_ROOT_PATH = os.environ.get('WEBDAV_ROOT_PATH', '/firemail/')
 WEBDAV_DB_NAME = os.environ.get('WEBDAV_DB_NAME', 'firemail.db')
+WEBDAV_SYNC_MODE = os.environ.get('WEBDAV_SYNC_MODE', 'delta')  # delta: 只上传变化的页；full: 每次上传整个文件
+WEBDAV_DELTA_MAX_COUNT = int(os.environ.get('WEBDAV_DELTA_MAX_COUNT', 20))  # 增量数量达到该值时重新上传基础快照
+WEBDAV_DELTA_COMPACT_RATIO = float(os.environ.get('WEBDAV_DELTA_COMPACT_RATIO', 0.5))  # 增量累计大小超过基础快照的该比例时重新上传
+WEBDAV_SYNC_QUIET_PERIOD = float(os.environ.get('WEBDAV_SYNC_QUIET_PERIOD', 10))  # 最后一次写入后等待多少秒再后台同步
+WEBDAV_SYNC_MAX_DELAY = float(os.environ.get('WEBDAV_SYNC_MAX_DELAY', 300))  # 持续写入时最多延迟多少秒同步
+WEBDAV_STARTUP_RESTORE = os.environ.get('WEBDAV_STARTUP_RESTORE', 'background')  # 启动时从远程恢复: background、blocking 或 off
 
 # 数据库URI
 def get_database_uri():
@@ -47,4 +53,55 @@ BACKUP_DIR = os.path.join(
     os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
     'data',
     'backups'
-) 
\ No newline at end of file
+)
+BACKUP_PAGES_PER_STEP = int(os.environ.get('BACKUP_PAGES_PER_STEP', 256))  # 在线备份每步复制的页数
+BACKUP_STEP_INTERVAL = float(os.environ.get('BACKUP_STEP_INTERVAL', 0.01))  # 两步之间的休眠时间(秒)
+BACKUP_COMPRESSION_LEVEL = int(os.environ.get('BACKUP_COMPRESSION_LEVEL', 6))  # gzip压缩级别
+BACKUP_RETENTION_COUNT = int(os.environ.get('BACKUP_RETENTION_COUNT', 7))  # 最多保留的本地备份数，0表示不限制
+BACKUP_RETENTION_DAYS = int(os.environ.get('BACKUP_RETENTION_DAYS', 30))  # 本地备份最长保留天数，0表示不限制
+
+# SQLite 连接调优
+SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))  # 遇到锁时的等待时间(毫秒)
+SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', -20000))  # 每个连接的页缓存，负值表示KB
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_GROUP_COMMIT_INTERVAL = float(os.environ.get('SQLITE_GROUP_COMMIT_INTERVAL', 5))  # 组提交收到第一个写操作后最多等待的时间(毫秒)
+SQLITE_GROUP_COMMIT_MAX_BATCH = int(os.environ.get('SQLITE_GROUP_COMMIT_MAX_BATCH', 100))  # 一次组提交最多合并的写操作数
+
+# 邮件记录分页
+MAIL_RECORDS_PAGE_SIZE = int(os.environ.get('MAIL_RECORDS_PAGE_SIZE', 50))  # 默认每页条数
+MAIL_RECORDS_MAX_PAGE_SIZE = int(os.environ.get('MAIL_RECORDS_MAX_PAGE_SIZE', 200))  # 每页条数上限
+
+# 邮件正文压缩
+MAIL_BODY_COMPRESSION = os.environ.get('MAIL_BODY_COMPRESSION', 'zlib')  # zlib、zstd(需安装zstandard)或none
+MAIL_BODY_COMPRESSION_LEVEL = int(os.environ.get('MAIL_BODY_COMPRESSION_LEVEL', 6))
+MAIL_BODY_COMPRESSION_MIN_SIZE = int(os.environ.get('MAIL_BODY_COMPRESSION_MIN_SIZE', 1024))  # 小于该字节数的正文不压缩
+
+# 数据迁移配置
+MIGRATION_BACKFILL_BATCH_SIZE = int(os.environ.get('MIGRATION_BACKFILL_BATCH_SIZE', 500))  # 后台回填每批处理的记录数
+MIGRATION_BACKFILL_INTERVAL = float(os.environ.get('MIGRATION_BACKFILL_INTERVAL', 0.05))  # 两批之间让出写连接的时间(秒)
+
+# 收信配置
+IMAP_FETCH_BATCH_SIZE = int(os.environ.get('IMAP_FETCH_BATCH_SIZE', 50))  # 一个 UID FETCH 命令获取的邮件数
+IMAP_HEADER_BATCH_SIZE = int(os.environ.get('IMAP_HEADER_BATCH_SIZE', 500))  # 两阶段收信时一个命令获取的邮件头数
+IMAP_PARTIAL_FETCH = os.environ.get('IMAP_PARTIAL_FETCH', 'true').lower() == 'true'  # 按BODYSTRUCTURE只获取正文部分，不下载附件
+IMAP_POOL_ENABLED = os.environ.get('IMAP_POOL_ENABLED', 'true').lower() == 'true'  # 按账号复用已登录的IMAP连接
+IMAP_POOL_MAX_IDLE = int(os.environ.get('IMAP_POOL_MAX_IDLE', 50))  # 全局最多保留的空闲连接数，超过时关闭最久未使用的连接
+IMAP_POOL_KEEPALIVE_INTERVAL = float(os.environ.get('IMAP_POOL_KEEPALIVE_INTERVAL', 120))  # 空闲连接发送NOOP的间隔(秒)
+IMAP_POOL_IDLE_TIMEOUT = float(os.environ.get('IMAP_POOL_IDLE_TIMEOUT', 900))  # 空闲连接保留的最长时间(秒)
+IMAP_SOCKET_TIMEOUT = float(os.environ.get('IMAP_SOCKET_TIMEOUT', 60))  # IMAP连接建立和每次读写的超时(秒)，半开的连接超时后按失效处理
+IMAP_IDLE_ENABLED = os.environ.get('IMAP_IDLE_ENABLED', 'true').lower() == 'true'  # 实时检查的邮箱支持IDLE时改为服务器推送
+IMAP_IDLE_MAX_SESSIONS = int(os.environ.get('IMAP_IDLE_MAX_SESSIONS', 100))  # 最多同时保持的IDLE长连接数，超过的邮箱继续轮询
+IMAP_IDLE_RENEW_INTERVAL = float(os.environ.get('IMAP_IDLE_RENEW_INTERVAL', 600))  # 没有通知时重新进入IDLE的间隔(秒)，应小于29分钟
+IMAP_ASYNC_MAIL_TYPES = [t.strip() for t in os.environ.get('IMAP_ASYNC_MAIL_TYPES', '').split(',') if t.strip()]  # 由异步引擎收信的邮箱类型，如 imap,gmail,qq,outlook，为空时全部使用线程池
+IMAP_ASYNC_MAX_CONNECTIONS = int(os.environ.get('IMAP_ASYNC_MAX_CONNECTIONS', 1000))  # 异步引擎同时打开的IMAP连接数上限
+IMAP_ASYNC_MAX_PER_HOST = int(os.environ.get('IMAP_ASYNC_MAX_PER_HOST', 50))  # 异步引擎对同一服务器同时打开的连接数上限
+IMAP_ASYNC_TIMEOUT = float(os.environ.get('IMAP_ASYNC_TIMEOUT', 60))  # 异步引擎连接和等待响应的超时(秒)
+OUTLOOK_TOKEN_CACHE_ENABLED = os.environ.get('OUTLOOK_TOKEN_CACHE_ENABLED', 'true').lower() == 'true'  # 复用未过期的Outlook访问令牌，关闭时每次检查都刷新
+OUTLOOK_TOKEN_REFRESH_MARGIN = float(os.environ.get('OUTLOOK_TOKEN_REFRESH_MARGIN', 300))  # 访问令牌过期前多少秒在后台提前刷新
+OUTLOOK_TOKEN_REFRESH_WORKERS = int(os.environ.get('OUTLOOK_TOKEN_REFRESH_WORKERS', 8))  # 同时刷新访问令牌的线程数
+OUTLOOK_TOKEN_URL = os.environ.get('OUTLOOK_TOKEN_URL', 'https://login.microsoftonline.com/common/oauth2/v2.0/token')  # Outlook令牌接口地址
+OAUTH_HTTP_POOL_SIZE = int(os.environ.get('OAUTH_HTTP_POOL_SIZE', 10))  # 令牌接口每个主机保持的HTTP连接数
+OAUTH_HTTP_CONNECT_TIMEOUT = float(os.environ.get('OAUTH_HTTP_CONNECT_TIMEOUT', 5))  # 令牌接口建立连接的超时(秒)
+OAUTH_HTTP_READ_TIMEOUT = float(os.environ.get('OAUTH_HTTP_READ_TIMEOUT', 15))  # 令牌接口等待响应的超时(秒)
+OAUTH_HTTP_RETRIES = int(os.environ.get('OAUTH_HTTP_RETRIES', 2))  # 令牌接口网络错误或返回429、5xx时的重试次数
+OAUTH_HTTP_RETRY_BACKOFF = float(os.environ.get('OAUTH_HTTP_RETRY_BACKOFF', 0.5))  # 第一次重试前等待时间的上限(秒)，之后每次加倍并随机抖动
@@ -0,0 +1,307 @@
+import sqlite3
+import threading
+import queue
+import time
+import logging
+from collections import namedtuple
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+# 配置日志
+logger = logging.getLogger('database')
+
+# 单条写语句的执行结果
+WriteResult = namedtuple('WriteResult', ['lastrowid', 'rowcount'])
+
+class ConnectionPool:
+    """SQLite连接池
+
+    每个线程持有一个独立的读连接，所有写操作通过一个专用写连接串行执行。
+    数据库运行在WAL模式下，读操作不会被正在进行的写事务阻塞。
+
+    普通的写操作通过 submit/execute 提交到写线程，写线程把一段时间内收到的多个
+    写操作合并到同一个事务中提交(组提交)，减少事务提交和写锁竞争的次数。
+    迁移、回填等需要长时间独占写连接的操作仍然使用 writer()。
+    """
+
+    def __init__(self, db_path, busy_timeout=5000, cache_size=-20000, synchronous='NORMAL', on_connect=None,
+                 commit_interval=5, max_batch_size=100):
+        """初始化连接池
+
+        Args:
+            db_path: 数据库文件路径
+            busy_timeout: 遇到锁时的等待时间，单位为毫秒
+            cache_size: 每个连接的页缓存大小，负值表示以KB为单位
+            synchronous: synchronous级别，WAL模式下NORMAL即可保证一致性
+            on_connect: 新连接创建后的回调，用于注册自定义SQL函数等
+            commit_interval: 组提交时收到第一个写操作后最多等待的时间，单位为毫秒
+            max_batch_size: 一次组提交最多合并的写操作数量
+        """
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        self.cache_size = cache_size
+        self.synchronous = synchronous
+        self.on_connect = on_connect
+
+        self._local = threading.local()
+        self._write_lock = threading.RLock()
+        self._write_depth = 0
+        self._write_owner = None
+        self._writer = None
+        self._closed = False
+
+        self.commit_interval = commit_interval
+        self.max_batch_size = max(1, int(max_batch_size))
+        self._queue = queue.Queue()
+        self._writer_thread = None
+        self._writer_thread_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'batches': 0,
+            'operations': 0,
+            'failed_operations': 0,
+            'max_batch_size': 0,
+            'last_batch_size': 0,
+            'commit_ms_total': 0.0,
+            'max_commit_ms': 0.0,
+            'last_commit_ms': 0.0,
+            'wait_ms_total': 0.0,
+        }
+
+        # 写连接负责切换日志模式，journal_mode=WAL会持久化到数据库文件中
+        self._writer = self._create_connection()
+        mode = self._writer.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        if str(mode).lower() != 'wal':
+            logger.warning(f"无法切换到WAL模式，当前日志模式: {mode}")
+        logger.info(f"连接池已创建: {db_path}, 日志模式: {mode}")
+
+    def _create_connection(self, read_only=False):
+        """创建并配置一个新连接"""
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            timeout=self.busy_timeout / 1000
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout)}")
+        conn.execute(f"PRAGMA cache_size={int(self.cache_size)}")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        if self.on_connect:
+            self.on_connect(conn)
+        if read_only:
+            # 读连接禁止写入，避免绕过写连接造成锁竞争
+            conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    def reader(self):
+        """获取当前线程的读连接，不存在时自动创建"""
+        if self._closed:
+            raise sqlite3.ProgrammingError("连接池已关闭")
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._create_connection(read_only=True)
+            self._local.conn = conn
+            logger.debug(f"为线程 {threading.current_thread().name} 创建读连接")
+        return conn
+
+    @contextmanager
+    def writer(self):
+        """获取写连接
+
+        同一时刻只有一个线程持有写连接。最外层退出时提交事务，
+        发生异常时回滚；同一线程内可以嵌套调用，嵌套层不会提前提交。
+        """
+        if self._closed:
+            raise sqlite3.ProgrammingError("连接池已关闭")
+        with self._write_lock:
+            self._write_depth += 1
+            self._write_owner = threading.get_ident()
+            try:
+                yield self._writer
+                if self._write_depth == 1:
+                    self._writer.commit()
+            except Exception:
+                if self._write_depth == 1:
+                    self._writer.rollback()
+                raise
+            finally:
+                self._write_depth -= 1
+                if self._write_depth == 0:
+                    self._write_owner = None
+
+    def submit(self, func):
+        """提交写操作，由写线程与其他写操作合并提交
+
+        Args:
+            func: func(conn)，在写连接上执行写操作，不能自行提交或回滚
+
+        Returns:
+            Future，事务提交后得到 func 的返回值；func 抛出的异常只回滚它自己的修改
+        """
+        if self._closed:
+            raise sqlite3.ProgrammingError("连接池已关闭")
+
+        # 当前线程已持有写连接(包括写线程自身)时直接在当前事务中执行，避免互相等待
+        if self._write_owner == threading.get_ident():
+            future = Future()
+            try:
+                future.set_result(func(self._writer))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        future = Future()
+        self._ensure_writer_thread()
+        self._queue.put((func, future, time.monotonic()))
+        return future
+
+    def execute(self, sql, params=()):
+        """提交单条写语句
+
+        Returns:
+            Future，结果为 WriteResult(lastrowid, rowcount)
+        """
+        def _execute(conn):
+            cursor = conn.execute(sql, params)
+            return WriteResult(cursor.lastrowid, cursor.rowcount)
+        return self.submit(_execute)
+
+    def stats(self):
+        """返回组提交的统计信息，用于调整批大小和等待时间"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        batches = stats['batches']
+        operations = stats['operations']
+        return {
+            'batches': batches,
+            'operations': operations,
+            'failed_operations': stats['failed_operations'],
+            'avg_batch_size': round(operations / batches, 2) if batches else 0,
+            'max_batch_size': stats['max_batch_size'],
+            'last_batch_size': stats['last_batch_size'],
+            'avg_commit_ms': round(stats['commit_ms_total'] / batches, 3) if batches else 0,
+            'max_commit_ms': round(stats['max_commit_ms'], 3),
+            'last_commit_ms': round(stats['last_commit_ms'], 3),
+            'avg_wait_ms': round(stats['wait_ms_total'] / operations, 3) if operations else 0,
+            'queue_size': self._queue.qsize(),
+            'commit_interval_ms': self.commit_interval,
+            'batch_size_limit': self.max_batch_size,
+        }
+
+    def _ensure_writer_thread(self):
+        """首次提交写操作时启动写线程"""
+        if self._writer_thread is not None:
+            return
+        with self._writer_thread_lock:
+            if self._writer_thread is None:
+                self._writer_thread = threading.Thread(target=self._writer_loop, name='db-writer', daemon=True)
+                self._writer_thread.start()
+
+    def _writer_loop(self):
+        """写线程：收集写操作，达到数量上限或等待超时后合并提交"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stopping = False
+            deadline = time.monotonic() + self.commit_interval / 1000
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._commit_batch(batch)
+            if stopping:
+                return
+
+    def _commit_batch(self, batch):
+        """在一个事务中执行一批写操作
+
+        每个写操作包在单独的保存点中，失败时只回滚该操作；事务提交成功后才返回结果。
+        """
+        results = []
+        failed = 0
+        commit_ms = 0.0
+        with self._write_lock:
+            self._write_depth += 1
+            self._write_owner = threading.get_ident()
+            conn = self._writer
+            try:
+                if not conn.in_transaction:
+                    conn.execute("BEGIN IMMEDIATE")
+                for func, future, _ in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    conn.execute("SAVEPOINT group_commit")
+                    try:
+                        result = func(conn)
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO group_commit")
+                        conn.execute("RELEASE group_commit")
+                        future.set_exception(e)
+                        failed += 1
+                    else:
+                        conn.execute("RELEASE group_commit")
+                        results.append((future, result))
+                started = time.perf_counter()
+                conn.commit()
+                commit_ms = (time.perf_counter() - started) * 1000
+            except Exception as e:
+                logger.error(f"组提交失败，本批 {len(batch)} 个写操作已回滚: {str(e)}")
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                failed = len(batch)
+                results = []
+            finally:
+                self._write_depth -= 1
+                self._write_owner = None
+
+        for future, result in results:
+            future.set_result(result)
+
+        now = time.monotonic()
+        with self._stats_lock:
+            stats = self._stats
+            stats['batches'] += 1
+            stats['operations'] += len(batch)
+            stats['failed_operations'] += failed
+            stats['max_batch_size'] = max(stats['max_batch_size'], len(batch))
+            stats['last_batch_size'] = len(batch)
+            stats['commit_ms_total'] += commit_ms
+            stats['max_commit_ms'] = max(stats['max_commit_ms'], commit_ms)
+            stats['last_commit_ms'] = commit_ms
+            stats['wait_ms_total'] += sum(now - queued_at for _, _, queued_at in batch) * 1000
+
+    def close(self):
+        """关闭写连接和当前线程的读连接
+
+        其他线程的读连接会在线程结束时随线程局部数据一起释放。
+        """
+        self._closed = True
+        # 先让写线程处理完已提交的写操作
+        if self._writer_thread is not None:
+            self._queue.put(None)
+            if self._writer_thread is not threading.current_thread():
+                self._writer_thread.join()
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
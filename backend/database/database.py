@@ -4,14 +4,22 @@ import threading
 import hashlib
 import secrets
 import time
+import functools
 from datetime import datetime
 from typing import List, Dict, Optional, Any
+from flask import has_app_context
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import Session
-from sqlalchemy import event, create_engine
+from sqlalchemy import event, create_engine, or_, and_, select, func, update, insert, case, inspect, text
 
 from . import config
+from .pagination import clamp_page_limit, encode_cursor, decode_cursor
+from .compression import decompress_body
 from .webdav_handler import WebDAVHandler
+from .backup import BackupManager
+from .sync_scheduler import SyncScheduler
+from .db import Database as MailStore
+from utils.email.common import build_snippet, build_dedup_key, build_fallback_dedup_key, SNIPPET_LENGTH
 
 # 配置日志
 logger = logging.getLogger('database')
@@ -53,6 +61,7 @@ class Email(db.Model):
     client_id = db.Column(db.String(200))
     refresh_token = db.Column(db.Text)
     access_token = db.Column(db.Text)
+    token_expires_at = db.Column(db.Float)
     last_check_time = db.Column(db.DateTime)
     enable_realtime_check = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -60,6 +69,8 @@ class Email(db.Model):
     
     # 定义关系
     mail_records = db.relationship('MailRecord', backref='email', lazy=True, cascade="all, delete-orphan")
+    stats = db.relationship('EmailStats', uselist=False, lazy=True, cascade="all, delete-orphan")
+    sync_states = db.relationship('MailSyncState', lazy=True, cascade="all, delete-orphan")
     
     __table_args__ = (
         db.UniqueConstraint('user_id', 'email', name='uix_user_email'),
@@ -78,12 +89,99 @@ class MailRecord(db.Model):
     sender = db.Column(db.String(255))
     received_time = db.Column(db.DateTime)
     content = db.Column(db.Text)
+    # 去重键，优先取Message-ID，否则为主题、发件人和时间的哈希，同一邮箱内唯一
+    dedup_key = db.Column(db.String(255))
+    # 正文的压缩算法，未压缩时为空；正文迁移到 mail_bodies 后 content 为空，通过 body_hash 引用
+    content_codec = db.Column(db.String(20))
+    body_hash = db.Column(db.String(64))
+    snippet = db.Column(db.Text)
     folder = db.Column(db.String(50))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     def __repr__(self):
         return f'<MailRecord {self.subject}>'
 
+# 邮件正文表模型，按正文哈希去重保存，多个邮件记录可以引用同一份正文
+class MailBody(db.Model):
+    __tablename__ = 'mail_bodies'
+    
+    hash = db.Column(db.String(64), primary_key=True)
+    content = db.Column(db.LargeBinary)
+    content_codec = db.Column(db.String(20))
+    size = db.Column(db.Integer, nullable=False, default=0)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<MailBody {self.hash}: {self.ref_count}>'
+
+# 邮箱统计表模型，写入邮件和检查邮箱时增量维护
+class EmailStats(db.Model):
+    __tablename__ = 'email_stats'
+    
+    email_id = db.Column(db.Integer, db.ForeignKey('emails.id'), primary_key=True)
+    total_records = db.Column(db.Integer, nullable=False, default=0)
+    latest_received_time = db.Column(db.DateTime)
+    last_check_status = db.Column(db.String(20))
+    last_check_duration_ms = db.Column(db.Integer)
+    last_new_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<EmailStats {self.email_id}: {self.total_records}>'
+
+# 邮件同步状态表模型，按邮箱和文件夹记录IMAP增量同步的位置
+class MailSyncState(db.Model):
+    __tablename__ = 'mail_sync_state'
+    
+    email_id = db.Column(db.Integer, db.ForeignKey('emails.id'), primary_key=True)
+    folder = db.Column(db.String(100), primary_key=True)
+    uidvalidity = db.Column(db.BigInteger)
+    last_uid = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<MailSyncState {self.email_id}/{self.folder}: {self.last_uid}>'
+
+# 邮件列表按 (received_time, id) 倒序分页，该索引同时覆盖过滤和排序
+db.Index(
+    'idx_mail_records_email_received',
+    MailRecord.email_id, MailRecord.received_time.desc(), MailRecord.id.desc()
+)
+db.Index('idx_mail_records_body_hash', MailRecord.body_hash)
+db.Index('uix_mail_records_email_dedup_key', MailRecord.email_id, MailRecord.dedup_key, unique=True)
+
+# 列表和统计只查询需要的列，不加载密码、令牌和邮件正文
+USER_LIST_COLUMNS = (User.id, User.username, User.is_admin, User.created_at)
+EMAIL_LIST_COLUMNS = (
+    Email.id, Email.user_id, Email.email, Email.mail_type, Email.server, Email.port,
+    Email.use_ssl, Email.last_check_time, Email.enable_realtime_check, Email.created_at
+)
+EMAIL_STATS_COLUMNS = (
+    EmailStats.total_records, EmailStats.latest_received_time, EmailStats.last_check_status,
+    EmailStats.last_check_duration_ms, EmailStats.last_new_count
+)
+# 摘要使用写入时保存的 snippet，没有摘要的历史记录读取未压缩正文的开头，由 _with_snippets 合并空白后截取
+MAIL_RECORD_LIST_COLUMNS = (
+    MailRecord.id, MailRecord.email_id, MailRecord.subject, MailRecord.sender,
+    MailRecord.received_time, MailRecord.folder,
+    func.coalesce(
+        MailRecord.snippet,
+        case((MailRecord.content_codec.is_(None), func.substr(MailRecord.content, 1, SNIPPET_LENGTH * 4)))
+    ).label('snippet'),
+    MailRecord.created_at
+)
+# 正文已迁移到 mail_bodies 的记录从正文表读取，由 _decode_mail_record 还原
+MAIL_RECORD_DETAIL_COLUMNS = (
+    MailRecord.id, MailRecord.email_id, MailRecord.subject, MailRecord.sender,
+    MailRecord.received_time, MailRecord.content, MailRecord.content_codec,
+    MailBody.content.label('body_content'), MailBody.content_codec.label('body_codec'),
+    MailRecord.folder, MailRecord.created_at, Email.email.label('recipient')
+)
+MAIL_RECORD_DETAIL_FROM = MailRecord.__table__.join(Email.__table__).outerjoin(
+    MailBody.__table__, MailBody.hash == MailRecord.body_hash
+)
+
 # 系统配置表模型
 class SystemConfig(db.Model):
     __tablename__ = 'system_config'
@@ -98,6 +196,16 @@ class SystemConfig(db.Model):
     def __repr__(self):
         return f'<SystemConfig {self.key}={self.value}>'
 
+def in_app_context(method):
+    """收信线程中没有Flask应用上下文，调用时按需推入 init_app 传入的应用的上下文"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if has_app_context() or self.app is None:
+            return method(self, *args, **kwargs)
+        with self.app.app_context():
+            return method(self, *args, **kwargs)
+    return wrapper
+
 class Database:
     """数据库管理类，支持SQLite和MySQL"""
     _instance = None
@@ -109,12 +217,23 @@ class Database:
                 cls._instance = super(Database, cls).__new__(cls)
                 cls._instance.db = db
                 cls._instance.webdav = WebDAVHandler() if config.WEBDAV_ENABLED else None
+                cls._instance.backups = BackupManager(
+                    config.SQLITE_DB_PATH,
+                    config.BACKUP_DIR,
+                    after_backup=cls._instance._after_backup
+                )
+                cls._instance.sync_scheduler = SyncScheduler(cls._instance._run_webdav_sync)
+                cls._instance._engine = None
+                cls._instance.app = None
+                cls._instance.store = None
+                cls._instance._restore_in_background = False
+                cls._instance._restoring = False
                 
                 # 检查WebDAV同步
                 if config.WEBDAV_ENABLED and cls._instance.webdav:
-                    # 尝试从WebDAV同步数据库
+                    # 按需从WebDAV恢复数据库
                     if config.DB_TYPE == 'sqlite':
-                        cls._instance.webdav.sync_from_remote()
+                        cls._instance._startup_restore()
                 
                 return cls._instance
             return cls._instance
@@ -125,19 +244,39 @@ class Database:
         app.config['SQLALCHEMY_DATABASE_URI'] = config.SQLALCHEMY_DATABASE_URI
         app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = config.SQLALCHEMY_TRACK_MODIFICATIONS
         
+        # SQLite的邮件记录由共享存储写入，它与本类使用同一个数据库文件，
+        # 负责结构迁移、后台回填、正文表、全文索引和邮箱统计的维护
+        if config.DB_TYPE == 'sqlite':
+            self.store = MailStore.open(config.SQLITE_DB_PATH)
+        
         # 初始化SQLAlchemy
         self.db.init_app(app)
+        self.app = app
         
         with app.app_context():
             # 创建所有表
             self.db.create_all()
+            self._add_missing_columns()
+            
+            # SQLite的历史邮件由共享存储在迁移中补齐去重键
+            if self.store is None:
+                self._fill_dedup_keys()
+            
+            # create_all不会为已存在的表补建索引，这里单独检查
+            for index in MailRecord.__table__.indexes:
+                index.create(bind=self.db.engine, checkfirst=True)
             
             # 检查是否需要初始化系统配置
             self._init_system_config()
+            
+            # 新建的统计表需要根据已有邮件计算一次，SQLite由共享存储的后台回填计算
+            if self.store is None:
+                self._init_email_stats()
         
         # 设置SQLite关闭连接后自动同步到WebDAV
         if config.DB_TYPE == 'sqlite' and config.WEBDAV_ENABLED and self.webdav:
             engine = self.db.get_engine(app)
+            self._engine = engine
             
             @event.listens_for(engine, "connect")
             def set_sqlite_pragma(dbapi_connection, connection_record):
@@ -148,8 +287,117 @@ class Database:
             
             @event.listens_for(engine, "engine_disposed")
             def sync_to_webdav(engine):
-                if self.webdav:
-                    self.webdav.sync_to_remote()
+                # 替换数据库文件时释放连接也会触发该事件，此时不能上传
+                if not self._restoring:
+                    self.sync_scheduler.flush()
+            
+            # 本地数据库已可用，在后台检查远程是否有更新
+            if self._restore_in_background:
+                self._restore_in_background = False
+                threading.Thread(target=self._background_restore, name='webdav-restore', daemon=True).start()
+    
+    def _add_missing_columns(self):
+        """create_all不会为已存在的表添加新增的列，按模型补齐"""
+        inspector = inspect(self.db.engine)
+        for table in self.db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=self.db.engine.dialect)
+                logger.info(f"向表 {table.name} 添加列 {column.name}")
+                with self.db.engine.begin() as conn:
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+    
+    def _fill_dedup_keys(self):
+        """为缺少去重键的历史邮件生成去重键，在建立唯一索引之前执行
+        
+        规则与SQLite迁移相同：使用主题、发件人和接收时间的哈希值，同一邮箱内重复的键后追加记录ID。
+        """
+        last_id = 0
+        while True:
+            rows = self.db.session.execute(
+                select(MailRecord.id, MailRecord.email_id, MailRecord.subject, MailRecord.sender, MailRecord.received_time)
+                .where(MailRecord.dedup_key.is_(None), MailRecord.id > last_id)
+                .order_by(MailRecord.id).limit(config.MIGRATION_BACKFILL_BATCH_SIZE)
+            ).all()
+            if not rows:
+                return
+            
+            keys = {
+                row.id: (row.email_id, build_fallback_dedup_key(row.subject, row.sender, row.received_time))
+                for row in rows
+            }
+            taken = set(self.db.session.execute(
+                select(MailRecord.email_id, MailRecord.dedup_key)
+                .where(MailRecord.dedup_key.in_({key for _, key in keys.values()}))
+            ).all())
+            updates = []
+            for record_id, (email_id, key) in keys.items():
+                if (email_id, key) in taken:
+                    key = f"{key}:{record_id}"
+                taken.add((email_id, key))
+                updates.append({'id': record_id, 'dedup_key': key})
+            self.db.session.execute(update(MailRecord), updates)
+            self.db.session.commit()
+            logger.info(f"已为 {len(updates)} 封历史邮件生成去重键")
+            last_id = rows[-1].id
+    
+    def _startup_restore(self):
+        """启动时检查远程数据库
+        
+        本地数据库不存在或 WEBDAV_STARTUP_RESTORE=blocking 时立即检查并恢复；
+        否则先使用本地数据库提供服务，init_app 完成后在后台检查。
+        """
+        mode = (config.WEBDAV_STARTUP_RESTORE or 'background').lower()
+        if mode == 'off':
+            return
+        if mode == 'blocking' or not os.path.exists(config.SQLITE_DB_PATH):
+            self.webdav.restore_if_changed()
+            return
+        self._restore_in_background = True
+        # 检查完成前暂停上传，避免本地的旧数据覆盖远程的新数据
+        self.sync_scheduler.hold()
+    
+    def _background_restore(self):
+        """后台检查远程数据库，有变化时下载校验后替换本地数据库"""
+        try:
+            webdav = self.webdav
+            if webdav:
+                webdav.restore_if_changed(install=self._install_restored)
+        finally:
+            self.sync_scheduler.release()
+    
+    def _install_restored(self, swap):
+        """释放连接池中的连接后替换数据库文件，之后的请求使用新的数据库"""
+        logger.warning("远程数据库有更新，替换本地数据库，替换前未同步的本地写入将被丢弃")
+        self._restoring = True
+        try:
+            if self._engine is not None:
+                self._engine.dispose()
+            if self.store is not None:
+                self.store.close()
+            swap()
+            if self._engine is not None:
+                self._engine.dispose()
+        finally:
+            if self.store is not None:
+                self.store = MailStore.open(config.SQLITE_DB_PATH)
+            self._restoring = False
+    
+    def _mark_dirty(self):
+        """标记数据库有变化，由后台调度器合并后同步到WebDAV，不阻塞当前写入"""
+        if config.DB_TYPE == 'sqlite' and config.WEBDAV_ENABLED and self.webdav:
+            self.sync_scheduler.mark_dirty()
+    
+    def _run_webdav_sync(self):
+        """调度器执行的同步函数，使用当前的WebDAV处理器"""
+        webdav = self.webdav
+        if not webdav:
+            return False
+        return webdav.sync_to_remote()
     
     def _init_system_config(self):
         """初始化系统配置"""
@@ -172,6 +420,37 @@ class Database:
                 config_item.value = 'true'
                 self.db.session.commit()
     
+    def _init_email_stats(self):
+        """统计表为空而已有邮件时，按邮箱汇总一次邮件数和最新邮件时间"""
+        if self.count_rows(EmailStats) or not self.count_rows(MailRecord):
+            return
+        logger.info("初始化邮箱统计")
+        self.db.session.execute(
+            insert(EmailStats).from_select(
+                ['email_id', 'total_records', 'latest_received_time'],
+                select(MailRecord.email_id, func.count(), func.max(MailRecord.received_time))
+                .group_by(MailRecord.email_id)
+            )
+        )
+        self.db.session.commit()
+    
+    def _add_to_email_stats(self, email_id, count, received_time):
+        """在当前会话中更新邮箱的邮件数和最新邮件时间，由调用方提交"""
+        result = self.db.session.execute(
+            update(EmailStats).where(EmailStats.email_id == email_id).values(
+                total_records=EmailStats.total_records + count,
+                latest_received_time=case(
+                    (or_(EmailStats.latest_received_time.is_(None),
+                         EmailStats.latest_received_time < received_time), received_time),
+                    else_=EmailStats.latest_received_time
+                ) if received_time is not None else EmailStats.latest_received_time
+            )
+        )
+        if result.rowcount == 0:
+            self.db.session.add(EmailStats(
+                email_id=email_id, total_records=count, latest_received_time=received_time
+            ))
+    
     def _hash_password(self, password, salt):
         """密码哈希"""
         return hashlib.pbkdf2_hmac(
@@ -204,9 +483,8 @@ class Database:
                 
             self.db.session.commit()
             
-            # 如果是SQLite，同步到WebDAV
-            if config.DB_TYPE == 'sqlite' and config.WEBDAV_ENABLED and self.webdav:
-                self.webdav.sync_to_remote()
+            # 如果是SQLite，标记后由后台同步到WebDAV
+            self._mark_dirty()
                 
             logger.info(f"系统配置已更新: {key} = {value}")
             return True
@@ -275,7 +553,7 @@ class Database:
         try:
             # 检查是否需要将此用户设置为管理员（如果是第一个注册的用户）
             if not is_admin:
-                if User.query.count() == 0:
+                if self.count_rows(User) == 0:
                     is_admin = True
                     logger.info(f"第一个注册的用户 {username} 将被设置为管理员")
             
@@ -293,9 +571,8 @@ class Database:
             self.db.session.add(user)
             self.db.session.commit()
             
-            # 如果是SQLite，同步到WebDAV
-            if config.DB_TYPE == 'sqlite' and config.WEBDAV_ENABLED and self.webdav:
-                self.webdav.sync_to_remote()
+            # 如果是SQLite，标记后由后台同步到WebDAV
+            self._mark_dirty()
                 
             logger.info(f"创建用户成功: {username}, 管理员权限: {is_admin}")
             return True, is_admin
@@ -304,6 +581,51 @@ class Database:
             logger.error(f"创建用户失败: {str(e)}")
             return False, False
     
+    def select_rows(self, columns, *criteria, order_by=(), limit=None, select_from=None):
+        """只查询指定的列，返回字典列表，不创建ORM对象
+        
+        Args:
+            columns: 要查询的列
+            criteria: 过滤条件
+            order_by: 排序
+            limit: 最多返回的行数
+            select_from: 需要连接其他表时传入连接后的表
+        """
+        stmt = select(*columns)
+        if select_from is not None:
+            stmt = stmt.select_from(select_from)
+        stmt = stmt.where(*criteria).order_by(*order_by)
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        result = self.db.session.execute(stmt)
+        keys = tuple(result.keys())
+        return [dict(zip(keys, row)) for row in result]
+    
+    def count_rows(self, model, *criteria):
+        """使用 COUNT(*) 统计行数"""
+        stmt = select(func.count()).select_from(model).where(*criteria)
+        return self.db.session.execute(stmt).scalar_one()
+    
+    def get_database_stats(self):
+        """获取用户、邮箱和邮件记录的数量"""
+        try:
+            return {
+                'user_count': self.count_rows(User),
+                'email_count': self.count_rows(Email),
+                'mail_record_count': self.count_rows(MailRecord),
+            }
+        except Exception as e:
+            logger.error(f"获取数据库统计失败: {str(e)}")
+            return {'user_count': 0, 'email_count': 0, 'mail_record_count': 0}
+    
+    def get_user_list(self):
+        """获取用户列表，不包含密码"""
+        try:
+            return self.select_rows(USER_LIST_COLUMNS, order_by=(User.created_at.desc(),))
+        except Exception as e:
+            logger.error(f"获取用户列表出错: {str(e)}")
+            return []
+    
     def get_all_users(self):
         """获取所有用户"""
         try:
@@ -319,13 +641,13 @@ class Database:
             if not user:
                 logger.warning(f"删除用户失败: 用户ID {user_id} 不存在")
                 return False
-                
+            
+            self._delete_mail_records([email.id for email in user.emails])
             self.db.session.delete(user)
             self.db.session.commit()
             
-            # 如果是SQLite，同步到WebDAV
-            if config.DB_TYPE == 'sqlite' and config.WEBDAV_ENABLED and self.webdav:
-                self.webdav.sync_to_remote()
+            # 如果是SQLite，标记后由后台同步到WebDAV
+            self._mark_dirty()
                 
             logger.info(f"已删除用户: ID={user_id}, 用户名={user.username}")
             return True
@@ -351,9 +673,8 @@ class Database:
             
             self.db.session.commit()
             
-            # 如果是SQLite，同步到WebDAV
-            if config.DB_TYPE == 'sqlite' and config.WEBDAV_ENABLED and self.webdav:
-                self.webdav.sync_to_remote()
+            # 如果是SQLite，标记后由后台同步到WebDAV
+            self._mark_dirty()
                 
             logger.info(f"已重置用户密码: ID={user_id}, 用户名={user.username}")
             return True
@@ -363,33 +684,47 @@ class Database:
             return False
     
     def backup_database(self):
-        """备份数据库"""
+        """在后台开始备份数据库
+        
+        Returns:
+            备份任务状态，不支持备份时返回 None
+        """
         if config.DB_TYPE != 'sqlite':
             logger.warning("当前仅支持SQLite数据库的备份")
-            return False
-            
+            return None
+        
         try:
-            # 创建备份目录
-            os.makedirs(config.BACKUP_DIR, exist_ok=True)
-            
-            # 生成备份文件名
-            timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-            backup_file = os.path.join(config.BACKUP_DIR, f"firemail_backup_{timestamp}.db")
-            
-            # 创建本地备份
-            import shutil
-            shutil.copy2(config.SQLITE_DB_PATH, backup_file)
-            
-            logger.info(f"数据库已备份到: {backup_file}")
-            
-            # 如果启用了WebDAV，也创建远程备份
-            if config.WEBDAV_ENABLED and self.webdav:
-                self.webdav.create_remote_backup()
-                
-            return True
+            job = self.backups.start()
+            logger.info(f"数据库备份任务已开始: {job['id']}")
+            return job
         except Exception as e:
-            logger.error(f"备份数据库失败: {str(e)}")
-            return False
+            logger.error(f"启动数据库备份失败: {str(e)}")
+            return None
+    
+    def get_backup_status(self):
+        """获取最近一次备份任务的状态和本地备份列表"""
+        return {
+            'job': self.backups.status(),
+            'backups': [
+                {key: value for key, value in item.items() if key != 'mtime'}
+                for item in self.backups.list_backups()
+            ]
+        }
+    
+    def get_write_stats(self):
+        """获取SQLite共享存储写线程的组提交统计，邮件记录都经过该写线程写入
+        
+        Returns:
+            统计字典，没有共享存储的数据库返回 None
+        """
+        if self.store is None:
+            return None
+        return self.store.get_write_stats()
+    
+    def _after_backup(self, backup_file):
+        """本地备份完成后，如果启用了WebDAV，也创建远程备份"""
+        if config.WEBDAV_ENABLED and self.webdav:
+            self.webdav.create_remote_backup(backup_file)
             
     def sync_to_webdav(self):
         """手动同步数据库到WebDAV"""
@@ -401,7 +736,14 @@ class Database:
             logger.warning("当前仅支持SQLite数据库的WebDAV同步")
             return False
             
-        return self.webdav.sync_to_remote()
+        return self.sync_scheduler.sync_now()
+    
+    def get_sync_status(self):
+        """获取WebDAV后台同步状态"""
+        status = self.sync_scheduler.status()
+        status['enabled'] = bool(config.WEBDAV_ENABLED and self.webdav and config.DB_TYPE == 'sqlite')
+        status['restore'] = self.webdav.restore_status if self.webdav else None
+        return status
         
     def sync_from_webdav(self):
         """手动从WebDAV同步数据库"""
@@ -413,7 +755,7 @@ class Database:
             logger.warning("当前仅支持SQLite数据库的WebDAV同步")
             return False
             
-        return self.webdav.sync_from_remote()
+        return self.webdav.restore_if_changed(force=True, install=self._install_restored) == 'restored'
         
     # 邮箱相关方法
     def get_emails_by_user(self, user_id):
@@ -424,6 +766,14 @@ class Database:
             logger.error(f"获取用户邮箱失败: {str(e)}")
             return []
             
+    def get_emails_by_user_id(self, user_id):
+        """获取用户的邮箱列表，不包含密码和令牌"""
+        try:
+            return self.select_rows(EMAIL_LIST_COLUMNS, Email.user_id == user_id, order_by=(Email.created_at.desc(),))
+        except Exception as e:
+            logger.error(f"获取用户邮箱失败: {str(e)}")
+            return []
+            
     def get_all_emails(self):
         """获取所有邮箱"""
         try:
@@ -432,8 +782,125 @@ class Database:
             logger.error(f"获取所有邮箱失败: {str(e)}")
             return []
             
-    def get_email_by_id(self, email_id):
-        """根据ID获取邮箱"""
+    def get_email_list(self, user_id=None):
+        """获取邮箱列表及每个邮箱的统计信息，不包含密码和令牌，可以按用户ID过滤
+        
+        统计信息按主键连接 email_stats 表，不对邮件记录做聚合查询。
+        """
+        criteria = [Email.user_id == user_id] if user_id else []
+        try:
+            emails = self.select_rows(
+                EMAIL_LIST_COLUMNS + EMAIL_STATS_COLUMNS, *criteria,
+                order_by=(Email.created_at.desc(),),
+                select_from=Email.__table__.outerjoin(EmailStats.__table__)
+            )
+        except Exception as e:
+            logger.error(f"获取邮箱列表失败: {str(e)}")
+            return []
+        for email in emails:
+            email['total_records'] = email['total_records'] or 0
+            email['last_new_count'] = email['last_new_count'] or 0
+        return emails
+    
+    def get_email_stats(self, email_id):
+        """获取单个邮箱的统计信息，没有记录时返回 None"""
+        rows = self.select_rows(EMAIL_STATS_COLUMNS, EmailStats.email_id == email_id)
+        return rows[0] if rows else None
+    
+    @in_app_context
+    def record_check_result(self, email_id, status, duration_ms, new_count):
+        """记录邮箱最近一次检查的结果"""
+        try:
+            stats = self.db.session.get(EmailStats, email_id)
+            if stats is None:
+                stats = EmailStats(email_id=email_id, total_records=0)
+                self.db.session.add(stats)
+            stats.last_check_status = status
+            stats.last_check_duration_ms = duration_ms
+            stats.last_new_count = new_count
+            self.db.session.commit()
+            return True
+        except Exception as e:
+            self.db.session.rollback()
+            logger.error(f"记录邮箱检查结果失败, ID: {email_id}, 错误: {str(e)}")
+            return False
+            
+    @in_app_context
+    def get_sync_state(self, email_id, folder='INBOX'):
+        """获取邮箱文件夹的增量同步位置，没有记录时返回 None"""
+        rows = self.select_rows(
+            (MailSyncState.uidvalidity, MailSyncState.last_uid),
+            MailSyncState.email_id == email_id, MailSyncState.folder == folder
+        )
+        return rows[0] if rows else None
+    
+    @in_app_context
+    def update_sync_state(self, email_id, folder, uidvalidity, last_uid):
+        """保存邮箱文件夹的增量同步位置"""
+        try:
+            state = self.db.session.get(MailSyncState, (email_id, folder))
+            if state is None:
+                state = MailSyncState(email_id=email_id, folder=folder)
+                self.db.session.add(state)
+            state.uidvalidity = uidvalidity
+            state.last_uid = last_uid
+            self.db.session.commit()
+            return True
+        except Exception as e:
+            self.db.session.rollback()
+            logger.error(f"保存邮箱同步状态失败, ID: {email_id}, 文件夹: {folder}, 错误: {str(e)}")
+            return False
+    
+    @in_app_context
+    def update_email_token(self, email_id, access_token, expires_at=None, refresh_token=None):
+        """更新Outlook邮箱的访问令牌
+
+        Args:
+            email_id: 邮箱ID
+            access_token: 访问令牌
+            expires_at: 令牌过期的Unix时间戳
+            refresh_token: 刷新时服务器返回的新刷新令牌，None 表示刷新令牌没有变化
+        """
+        logger.debug(f"更新邮箱访问令牌, ID: {email_id}")
+        try:
+            email = self.db.session.get(Email, email_id)
+            if email is None:
+                logger.warning(f"邮箱不存在, ID: {email_id}")
+                return False
+            email.access_token = access_token
+            email.token_expires_at = expires_at
+            if refresh_token:
+                email.refresh_token = refresh_token
+            self.db.session.commit()
+            self._mark_dirty()
+            logger.info(f"成功更新邮箱 ID:{email_id} 的访问令牌")
+            return True
+        except Exception as e:
+            self.db.session.rollback()
+            logger.error(f"更新邮箱访问令牌失败, ID: {email_id}, 错误: {str(e)}")
+            return False
+    
+    @in_app_context
+    def get_email_token(self, email_id):
+        """读取Outlook邮箱保存的令牌
+
+        Returns:
+            {'access_token', 'token_expires_at', 'refresh_token', 'client_id'}，邮箱不存在时返回 None
+        """
+        try:
+            rows = self.select_rows(
+                (Email.access_token, Email.token_expires_at, Email.refresh_token, Email.client_id),
+                Email.id == email_id
+            )
+            return rows[0] if rows else None
+        except Exception as e:
+            logger.error(f"读取邮箱访问令牌失败, ID: {email_id}, 错误: {str(e)}")
+            return None
+            
+    def get_email_by_id(self, email_id, user_id=None):
+        """根据ID获取邮箱，传入 user_id 时验证所有者"""
+        if user_id:
+            return Email.query.filter_by(id=email_id, user_id=user_id).first()
         return Email.query.get(email_id)
         
     def add_email(self, user_id, email_address, password, mail_type='outlook', server=None, port=None,
@@ -461,9 +928,8 @@ class Database:
             self.db.session.add(email)
             self.db.session.commit()
             
-            # 如果是SQLite，同步到WebDAV
-            if config.DB_TYPE == 'sqlite' and config.WEBDAV_ENABLED and self.webdav:
-                self.webdav.sync_to_remote()
+            # 如果是SQLite，标记后由后台同步到WebDAV
+            self._mark_dirty()
                 
             logger.info(f"邮箱添加成功: {email_address}, 用户ID: {user_id}")
             return True
@@ -479,13 +945,13 @@ class Database:
             if not email:
                 logger.warning(f"删除邮箱失败: 邮箱ID {email_id} 不存在")
                 return False
-                
+            
+            self._delete_mail_records([email_id])
             self.db.session.delete(email)
             self.db.session.commit()
             
-            # 如果是SQLite，同步到WebDAV
-            if config.DB_TYPE == 'sqlite' and config.WEBDAV_ENABLED and self.webdav:
-                self.webdav.sync_to_remote()
+            # 如果是SQLite，标记后由后台同步到WebDAV
+            self._mark_dirty()
                 
             logger.info(f"邮箱删除成功: ID={email_id}, 地址={email.email}")
             return True
@@ -494,8 +960,22 @@ class Database:
             logger.error(f"删除邮箱失败: {str(e)}")
             return False
             
-    def add_mail_record(self, email_id, subject, sender, received_time, content, folder=None):
-        """添加邮件记录"""
+    def _delete_mail_records(self, email_ids):
+        """SQLite下先通过共享存储删除邮箱的邮件记录，同时移除全文索引并释放正文引用
+        
+        其他数据库由删除邮箱时的级联删除处理。
+        """
+        if self.store is not None:
+            self.store.delete_mail_records(email_ids)
+    
+    def add_mail_record(self, email_id, subject, sender, received_time, content, folder=None, message_id=None):
+        """添加邮件记录，去重键已存在时不添加，返回 False"""
+        if self.store is not None:
+            added = self.store.add_mail_record(email_id, subject, sender, received_time, content, folder, message_id)
+            if added:
+                self._mark_dirty()
+            return added
+        
         try:
             record = MailRecord(
                 email_id=email_id,
@@ -503,27 +983,243 @@ class Database:
                 sender=sender,
                 received_time=received_time,
                 content=content,
+                snippet=build_snippet(content),
+                dedup_key=build_dedup_key(message_id, subject, sender, received_time),
                 folder=folder
             )
             
             self.db.session.add(record)
+            self._add_to_email_stats(email_id, 1, received_time)
             self.db.session.commit()
             
-            # 同步频率控制：为避免频繁同步影响性能，每50条记录同步一次
-            if config.DB_TYPE == 'sqlite' and config.WEBDAV_ENABLED and self.webdav:
-                if MailRecord.query.count() % 50 == 0:
-                    self.webdav.sync_to_remote()
-                    
+            # 后台调度器合并短时间内的多次写入，只同步一次
+            self._mark_dirty()
+            
             return True
         except Exception as e:
             self.db.session.rollback()
             logger.error(f"添加邮件记录失败: {str(e)}")
             return False
             
+    @in_app_context
+    def bulk_add_mail_records(self, email_id, mail_records):
+        """批量保存邮件记录，跳过已存在的邮件
+        
+        Returns:
+            新增的记录数，写入失败时抛出异常
+        """
+        if not mail_records:
+            return 0
+        if self.store is not None:
+            saved_count = self.store.bulk_add_mail_records(email_id, mail_records)
+        else:
+            saved_count = self._insert_mail_records(email_id, mail_records)
+        if saved_count:
+            self._mark_dirty()
+        return saved_count
+    
+    def _insert_mail_records(self, email_id, mail_records):
+        """在一个事务中写入去重键不存在的记录，返回新增的记录数
+        
+        去重规则与共享存储相同，带Message-ID的邮件同时按主题、发件人和时间生成的键排除历史记录。
+        """
+        records = {}
+        fallback_keys = {}
+        for record in mail_records:
+            subject = record.get("subject", "(无主题)")
+            sender = record.get("sender", "(未知发件人)")
+            received_time = record.get("received_time", datetime.now())
+            dedup_key = build_dedup_key(record.get("message_id"), subject, sender, received_time)
+            if dedup_key in records:
+                continue
+            records[dedup_key] = (subject, sender, received_time, record)
+            fallback_key = build_fallback_dedup_key(subject, sender, received_time)
+            if fallback_key != dedup_key:
+                fallback_keys[fallback_key] = dedup_key
+        
+        try:
+            for key in self._select_existing_dedup_keys(email_id, list(records) + list(fallback_keys)):
+                records.pop(fallback_keys.get(key, key), None)
+            if not records:
+                return 0
+            
+            for dedup_key, (subject, sender, received_time, record) in records.items():
+                self.db.session.add(MailRecord(
+                    email_id=email_id,
+                    subject=subject,
+                    sender=sender,
+                    received_time=received_time,
+                    content=record.get("content", "(无内容)"),
+                    snippet=build_snippet(record.get("content", "(无内容)")),
+                    dedup_key=dedup_key,
+                    folder=record.get("folder", "INBOX")
+                ))
+            received_times = [received_time for _, _, received_time, _ in records.values() if received_time]
+            self._add_to_email_stats(email_id, len(records), max(received_times) if received_times else None)
+            self.db.session.commit()
+            return len(records)
+        except Exception:
+            self.db.session.rollback()
+            raise
+            
+    @in_app_context
+    def get_existing_dedup_keys(self, email_id, dedup_keys):
+        """返回邮箱中已存在的去重键，收信时据此跳过已保存邮件的正文下载"""
+        if not dedup_keys:
+            return set()
+        try:
+            return self._select_existing_dedup_keys(email_id, dedup_keys)
+        except Exception as e:
+            logger.error(f"查询已存在的邮件失败: {str(e)}")
+            return set()
+    
+    def _select_existing_dedup_keys(self, email_id, dedup_keys):
+        """按 (email_id, dedup_key) 唯一索引查询已存在的键，候选键分批查询，避免超出参数个数限制"""
+        keys = list(set(dedup_keys))
+        existing = set()
+        for i in range(0, len(keys), 500):
+            existing.update(self.db.session.execute(
+                select(MailRecord.dedup_key).where(
+                    MailRecord.email_id == email_id, MailRecord.dedup_key.in_(keys[i:i + 500])
+                )
+            ).scalars())
+        return existing
+            
     def get_mail_records(self, email_id):
         """获取邮箱的邮件记录"""
         try:
-            return MailRecord.query.filter_by(email_id=email_id).order_by(MailRecord.received_time.desc()).all()
+            return MailRecord.query.filter_by(email_id=email_id).order_by(MailRecord.received_time.desc(), MailRecord.id.desc()).all()
         except Exception as e:
             logger.error(f"获取邮件记录失败: {str(e)}")
-            return [] 
\ No newline at end of file
+            return []
+            
+    def get_mail_record_list(self, email_id):
+        """获取邮箱的邮件列表，不包含正文"""
+        try:
+            return self._with_snippets(self.select_rows(
+                MAIL_RECORD_LIST_COLUMNS, MailRecord.email_id == email_id,
+                order_by=(MailRecord.received_time.desc(), MailRecord.id.desc())
+            ))
+        except Exception as e:
+            logger.error(f"获取邮件列表失败: {str(e)}")
+            return []
+            
+    def get_mail_record_by_id(self, record_id):
+        """根据ID获取单封邮件的完整记录，包括正文"""
+        try:
+            records = self.select_rows(
+                MAIL_RECORD_DETAIL_COLUMNS, MailRecord.id == record_id, select_from=MAIL_RECORD_DETAIL_FROM
+            )
+        except Exception as e:
+            logger.error(f"获取邮件记录失败, ID: {record_id}, 错误: {str(e)}")
+            return None
+        if not records:
+            return None
+        return self._decode_mail_record(records[0])
+    
+    def _decode_mail_record(self, record):
+        """还原完整记录的正文并生成摘要
+        
+        正文已迁移到 mail_bodies 时从正文表读取，尚未迁移的历史记录正文仍在 content 中，按各自的压缩算法解压。
+        """
+        body_content = record.pop('body_content')
+        body_codec = record.pop('body_codec')
+        content_codec = record.pop('content_codec')
+        if body_content is not None:
+            record['content'] = decompress_body(body_content, body_codec)
+        else:
+            record['content'] = decompress_body(record['content'], content_codec)
+        record['snippet'] = build_snippet(record['content'])
+        return record
+            
+    def _with_snippets(self, records):
+        """把查询到的正文开头转换为摘要"""
+        for record in records:
+            record['snippet'] = build_snippet(record['snippet'])
+        return records
+            
+    def get_mail_records_page(self, email_id, limit=None, cursor=None):
+        """按接收时间倒序分页获取邮件记录，返回 (records, next_cursor)
+        
+        记录为不含正文的字典，游标无效时抛出 ValueError
+        """
+        limit = clamp_page_limit(limit)
+        criteria = [MailRecord.email_id == email_id]
+        
+        if cursor:
+            last_time, last_id = decode_cursor(cursor)
+            if last_time is None:
+                # 倒序时接收时间为空的记录排在最后，只需在其中继续按id翻页
+                criteria += [MailRecord.received_time.is_(None), MailRecord.id < last_id]
+            else:
+                try:
+                    last_time = datetime.fromisoformat(last_time)
+                except ValueError:
+                    raise ValueError("无效的分页游标")
+                criteria.append(or_(
+                    MailRecord.received_time < last_time,
+                    and_(MailRecord.received_time == last_time, MailRecord.id < last_id),
+                    MailRecord.received_time.is_(None)
+                ))
+        
+        try:
+            # 多取一条用于判断是否还有下一页
+            records = self._with_snippets(self.select_rows(
+                MAIL_RECORD_LIST_COLUMNS, *criteria,
+                order_by=(MailRecord.received_time.desc(), MailRecord.id.desc()),
+                limit=limit + 1
+            ))
+        except Exception as e:
+            logger.error(f"分页获取邮件记录失败: {str(e)}")
+            return [], None
+        
+        next_cursor = None
+        if len(records) > limit:
+            records = records[:limit]
+            next_cursor = encode_cursor(records[-1]['received_time'], records[-1]['id'])
+        return records, next_cursor
+    
+    def search_mail_records(self, email_ids, query, search_in_subject=True, search_in_sender=True, search_in_recipient=False, search_in_content=True, include_content=False):
+        """根据条件搜索邮件记录
+        
+        SQLite由共享存储搜索，全文索引建立完成后使用FTS，关键词过短或索引尚未建立时使用LIKE；
+        其他数据库使用LIKE匹配。参数与返回值同 db.Database.search_mail_records。
+        """
+        if self.store is not None:
+            return self.store.search_mail_records(
+                email_ids, query, search_in_subject, search_in_sender,
+                search_in_recipient, search_in_content, include_content
+            )
+        
+        # 数据库中没有收件人字段，search_in_recipient 不参与匹配
+        columns = [
+            column for column, enabled in (
+                (MailRecord.subject, search_in_subject),
+                (MailRecord.sender, search_in_sender),
+                (MailRecord.content, search_in_content),
+            ) if enabled
+        ]
+        if not email_ids or not query or not columns:
+            return []
+        
+        pattern = f"%{query}%"
+        try:
+            records = self.select_rows(
+                MAIL_RECORD_DETAIL_COLUMNS if include_content else MAIL_RECORD_LIST_COLUMNS + (Email.email.label('recipient'),),
+                MailRecord.email_id.in_(email_ids),
+                or_(*(column.like(pattern) for column in columns)),
+                order_by=(MailRecord.received_time.desc(),),
+                select_from=MAIL_RECORD_DETAIL_FROM
+            )
+        except Exception as e:
+            logger.error(f"搜索邮件失败: {str(e)}")
+            return []
+        if include_content:
+            return [self._decode_mail_record(record) for record in records]
+        return self._with_snippets(records)
+    
+    def close(self):
+        """关闭共享存储的连接，停止后台回填"""
+        if self.store is not None:
+            self.store.close()
+            self.store = None 
\ No newline at end of file
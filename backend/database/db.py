@@ -1,5 +1,6 @@
 import sqlite3
 import os
+import json
 import threading
 import logging
 import hashlib
@@ -7,20 +8,60 @@ import secrets
 from typing import List, Dict, Optional, Callable
 from datetime import datetime
 import traceback
-from utils.email.logger import logger, log_progress
+from utils.email.logger import log_progress
+from utils.email.common import build_dedup_key, build_fallback_dedup_key, build_snippet
+from database import config
+from database.connection_pool import ConnectionPool
+from database.pagination import clamp_page_limit, encode_cursor, decode_cursor
+from database.compression import resolve_codec, compress_body, decompress_body, normalize_body, hash_body, register_sql_functions
+from database.migrations import MigrationRunner, BackfillRunner
 
 # 配置日志
 logger = logging.getLogger('database')
 
+# 全文索引使用trigram分词，查询词至少需要3个字符
+FTS_MIN_QUERY_LENGTH = 3
+
+# 列表和搜索默认只返回元数据和摘要，正文通过 get_mail_record_by_id 单独获取
+MAIL_RECORD_SUMMARY_COLUMNS = ('id', 'email_id', 'subject', 'sender', 'received_time', 'folder', 'snippet', 'created_at')
+
+# 邮箱列表不返回密码和令牌，密码通过 /api/emails/<id>/password 单独获取
+EMAIL_LIST_COLUMNS = (
+    'id', 'user_id', 'email', 'mail_type', 'server', 'port', 'use_ssl',
+    'last_check_time', 'enable_realtime_check', 'created_at'
+)
+
+# 邮箱列表附带的统计信息，来自 email_stats 表
+EMAIL_STATS_COLUMNS = (
+    'total_records', 'latest_received_time', 'last_check_status',
+    'last_check_duration_ms', 'last_new_count'
+)
+
+# 正文保存在 mail_bodies 中，读取完整记录时需要 LEFT JOIN mail_bodies b ON b.hash = mr.body_hash
+# 尚未迁移的历史记录正文仍在 mail_records.content 中
+MAIL_RECORD_FULL_COLUMNS = "mr.*, b.content AS body_content, b.content_codec AS body_codec"
+MAIL_BODY_TEXT_SQL = "mail_body_text(COALESCE(b.content, mr.content), COALESCE(b.content_codec, mr.content_codec))"
+
+# 正文引用计数归零后，延迟一段时间再回收，合并连续的删除操作
+BODY_GC_DELAY = 5
+
+def encode_attachments(attachments):
+    """附件列表保存为JSON文本，没有附件时保存为 NULL"""
+    return json.dumps(attachments, ensure_ascii=False) if attachments else None
+
 class Database:
     _instance = None
     _lock = threading.Lock()
+    fts_enabled = False
+    _fts_indexed_upto = 0
+    _body_gc_lock = threading.Lock()
+    _body_gc_timer = None
     
     def __new__(cls):
         with cls._lock:
             if cls._instance is None:
                 cls._instance = super(Database, cls).__new__(cls)
-                cls._instance.conn = None
+                cls._instance.pool = None
                 
                 # 检查数据库文件是否存在
                 db_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'huohuo_email.db')
@@ -32,11 +73,11 @@ class Database:
                     cls._instance.connect_db(db_path)
                     
                     # 检查数据库是否有用户，如果有则认为数据库已经初始化
-                    cursor = cls._instance.conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name='users'")
+                    cursor = cls._instance._reader().execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name='users'")
                     table_exists = cursor.fetchone()[0] > 0
                     
                     if table_exists:
-                        cursor = cls._instance.conn.execute("SELECT COUNT(*) FROM users")
+                        cursor = cls._instance._reader().execute("SELECT COUNT(*) FROM users")
                         has_users = cursor.fetchone()[0] > 0
                         
                         if not has_users:
@@ -54,9 +95,24 @@ class Database:
                     cls._instance.connect_db(db_path)
                     cls._instance.init_db()
                 
+                # 补齐新增字段和索引
+                cls._instance._upgrade_schema()
+                
                 return cls._instance
             return cls._instance
     
+    @classmethod
+    def open(cls, db_path):
+        """打开指定路径的数据库，不经过单例
+        
+        执行未完成的结构迁移并在后台继续数据回填，供与本类共用数据库文件的其他数据库层使用。
+        """
+        instance = super(Database, cls).__new__(cls)
+        instance.pool = None
+        instance.connect_db(db_path)
+        instance._upgrade_schema()
+        return instance
+    
     def connect_db(self, db_path):
         """仅建立数据库连接，不初始化结构"""
         # 确保目录存在
@@ -66,81 +122,49 @@ class Database:
         self.db_path = db_path
         
         logger.info(f"连接数据库: {db_path}")
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
-        self.conn.row_factory = sqlite3.Row
+        self.pool = ConnectionPool(
+            db_path,
+            busy_timeout=config.SQLITE_BUSY_TIMEOUT,
+            cache_size=config.SQLITE_CACHE_SIZE,
+            synchronous=config.SQLITE_SYNCHRONOUS,
+            on_connect=register_sql_functions,
+            commit_interval=config.SQLITE_GROUP_COMMIT_INTERVAL,
+            max_batch_size=config.SQLITE_GROUP_COMMIT_MAX_BATCH
+        )
+        self.body_codec = resolve_codec()
+        
+        self.migrator = MigrationRunner(self.pool)
+        self.backfills = BackfillRunner(self.pool)
+        self.backfills.register('snippets', self._backfill_snippets)
+        self.backfills.register('mail_bodies', self._migrate_mail_bodies)
+        self.backfills.register('mail_fts', self._backfill_fts)
+        self.backfills.register('email_stats', self._backfill_email_stats)
+    
+    def _reader(self):
+        """获取当前线程的读连接"""
+        return self.pool.reader()
+    
+    def _writer(self):
+        """获取写连接，退出上下文时自动提交或回滚"""
+        return self.pool.writer()
+    
+    def _submit(self, func):
+        """提交写操作到写线程组提交，返回 Future，结果为 func(conn) 的返回值"""
+        return self.pool.submit(func)
+    
+    def _execute(self, sql, params=()):
+        """提交单条写语句到写线程组提交，返回 Future，结果为 WriteResult(lastrowid, rowcount)"""
+        return self.pool.execute(sql, params)
+    
+    def get_write_stats(self):
+        """获取组提交的批大小和提交耗时统计"""
+        return self.pool.stats()
     
     def init_db(self):
-        """初始化数据库连接和表结构"""
+        """初始化数据库表结构"""
         try:
-            # 创建用户表
-            self.conn.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE NOT NULL,
-                    password TEXT NOT NULL,
-                    password_hash TEXT NOT NULL,
-                    salt TEXT NOT NULL,
-                    is_admin INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # 创建邮箱表
-            self.conn.execute('''
-                CREATE TABLE IF NOT EXISTS emails (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    email TEXT NOT NULL,
-                    password TEXT NOT NULL,
-                    mail_type TEXT DEFAULT 'outlook',
-                    server TEXT,
-                    port INTEGER,
-                    use_ssl INTEGER DEFAULT 1,
-                    client_id TEXT,
-                    refresh_token TEXT,
-                    access_token TEXT,
-                    last_check_time TIMESTAMP,
-                    enable_realtime_check INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (id),
-                    UNIQUE (user_id, email)
-                )
-            ''')
-            
-            # 创建邮件记录表
-            self.conn.execute('''
-                CREATE TABLE IF NOT EXISTS mail_records (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    email_id INTEGER NOT NULL,
-                    subject TEXT,
-                    sender TEXT,
-                    received_time TIMESTAMP,
-                    content TEXT,
-                    folder TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (email_id) REFERENCES emails (id)
-                )
-            ''')
-            
-            # 创建配置表
-            self.conn.execute('''
-                CREATE TABLE IF NOT EXISTS system_config (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    key TEXT UNIQUE NOT NULL,
-                    value TEXT,
-                    description TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # 检查并添加新字段
-            self._check_and_add_column('emails', 'enable_realtime_check', 'INTEGER DEFAULT 0')
-            self._check_and_add_column('users', 'password_hash', 'TEXT NOT NULL')
+            self.migrator.migrate()
             
-            self.conn.commit()
             logger.info(f"初始化数据库表结构: {self.db_path}")
             
             # 初始化系统配置
@@ -149,44 +173,335 @@ class Database:
         except Exception as e:
             logger.error(f"初始化数据库表结构失败: {str(e)}")
             traceback.print_exc()
-            
-    def _check_and_add_column(self, table, column, type_def):
-        """检查表中是否存在某列，如果不存在则添加"""
+    
+    def _upgrade_schema(self):
+        """执行未完成的结构迁移，并在后台继续未完成的数据回填
+        
+        结构版本与代码一致时不做任何结构检查，只读取回填进度。
+        """
         try:
-            cursor = self.conn.execute(f"PRAGMA table_info({table})")
-            columns = [info[1] for info in cursor.fetchall()]
+            self.migrator.migrate()
+            state = self.backfills.load()
             
-            if column not in columns:
-                logger.info(f"向表 {table} 添加列 {column}")
-                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {type_def}")
-                self.conn.commit()
+            # 全文索引建立完成后搜索才使用FTS，建立过程中只维护已索引的记录
+            if 'mail_fts' in state:
+                last_id, done = state['mail_fts']
+                self.fts_enabled = done
+                self._fts_indexed_upto = last_id
+            
+            self.backfills.start(state)
+            self._schedule_body_gc()
+        except Exception as e:
+            logger.error(f"升级数据库结构失败: {str(e)}")
+    
+    def _index_fts(self, conn, rows):
+        """为新写入的邮件建立全文索引
+        
+        Args:
+            conn: 写连接
+            rows: (id, subject, sender, 正文明文) 元组列表
+        """
+        if self.fts_enabled and rows:
+            conn.executemany(
+                "INSERT INTO mail_records_fts (rowid, subject, sender, content) VALUES (?, ?, ?, ?)",
+                rows
+            )
+    
+    def _unindex_fts(self, conn, email_ids):
+        """在删除邮件记录之前移除对应的全文索引
+        
+        无内容表删除索引时需要提供与写入时相同的明文，因此在SQL中还原正文。
+        全文索引尚在后台建立时，只移除已经建立索引的记录。
+        """
+        if not email_ids or not (self.fts_enabled or self._fts_indexed_upto):
+            return
+        placeholders = ','.join(['?'] * len(email_ids))
+        params = list(email_ids)
+        condition = ''
+        if not self.fts_enabled:
+            condition = ' AND mr.id <= ?'
+            params.append(self._fts_indexed_upto)
+        conn.execute(
+            f"""
+            INSERT INTO mail_records_fts (mail_records_fts, rowid, subject, sender, content)
+            SELECT 'delete', mr.id, mr.subject, mr.sender, {MAIL_BODY_TEXT_SQL}
+            FROM mail_records mr
+            LEFT JOIN mail_bodies b ON b.hash = mr.body_hash
+            WHERE mr.email_id IN ({placeholders}){condition}
+            """,
+            params
+        )
+    
+    def _retain_bodies(self, conn, bodies):
+        """保存正文并增加引用计数
+        
+        已存在的正文只增加引用计数，不重复压缩和写入。
+        
+        Args:
+            conn: 写连接
+            bodies: {正文哈希: (规范化后的正文, 新增引用数)}
+        """
+        if not bodies:
+            return
+        
+        hashes = list(bodies.keys())
+        existing = set()
+        # 分批查询，避免超出SQLite的参数个数限制
+        for i in range(0, len(hashes), 500):
+            chunk = hashes[i:i + 500]
+            placeholders = ','.join(['?'] * len(chunk))
+            existing.update(
+                row[0] for row in conn.execute(
+                    f"SELECT hash FROM mail_bodies WHERE hash IN ({placeholders})", chunk
+                )
+            )
+        
+        conn.executemany(
+            "UPDATE mail_bodies SET ref_count = ref_count + ? WHERE hash = ?",
+            [(bodies[body_hash][1], body_hash) for body_hash in existing]
+        )
+        
+        new_bodies = []
+        for body_hash, (body, count) in bodies.items():
+            if body_hash in existing:
+                continue
+            stored_content, codec = compress_body(body, self.body_codec)
+            new_bodies.append((body_hash, stored_content, codec, len(body.encode('utf-8')), count))
+        conn.executemany(
+            "INSERT INTO mail_bodies (hash, content, content_codec, size, ref_count) VALUES (?, ?, ?, ?, ?)",
+            new_bodies
+        )
+    
+    def _release_bodies(self, conn, email_ids):
+        """在删除邮件记录之前减少其引用的正文的引用计数，计数归零的正文由后台回收"""
+        if not email_ids:
+            return
+        placeholders = ','.join(['?'] * len(email_ids))
+        conn.execute(
+            f"""
+            UPDATE mail_bodies SET ref_count = ref_count - refs.cnt
+            FROM (
+                SELECT body_hash, COUNT(*) AS cnt FROM mail_records
+                WHERE email_id IN ({placeholders}) AND body_hash IS NOT NULL
+                GROUP BY body_hash
+            ) AS refs
+            WHERE mail_bodies.hash = refs.body_hash
+            """,
+            list(email_ids)
+        )
+    
+    def _delete_mail_records(self, conn, email_ids):
+        """删除邮箱下的全部邮件记录，同时维护全文索引、正文引用计数、邮箱统计和同步状态"""
+        if not email_ids:
+            return
+        self._unindex_fts(conn, email_ids)
+        self._release_bodies(conn, email_ids)
+        placeholders = ','.join(['?'] * len(email_ids))
+        conn.execute(f"DELETE FROM mail_records WHERE email_id IN ({placeholders})", list(email_ids))
+        conn.execute(f"DELETE FROM email_stats WHERE email_id IN ({placeholders})", list(email_ids))
+        conn.execute(f"DELETE FROM mail_sync_state WHERE email_id IN ({placeholders})", list(email_ids))
+    
+    def _add_to_email_stats(self, conn, email_id, count, latest_received_time):
+        """在写入邮件的事务中更新邮箱的邮件数和最新邮件时间"""
+        if not count:
+            return
+        conn.execute(
+            """
+            INSERT INTO email_stats (email_id, total_records, latest_received_time)
+            VALUES (?, ?, ?)
+            ON CONFLICT(email_id) DO UPDATE SET
+                total_records = total_records + excluded.total_records,
+                latest_received_time = CASE
+                    WHEN latest_received_time IS NULL OR excluded.latest_received_time > latest_received_time
+                    THEN excluded.latest_received_time ELSE latest_received_time END,
+                updated_at = CURRENT_TIMESTAMP
+            """,
+            (email_id, count, latest_received_time)
+        )
+    
+    def _schedule_body_gc(self):
+        """安排一次后台正文回收，短时间内的多次调用只会执行一次"""
+        with self._body_gc_lock:
+            if self._body_gc_timer is not None and self._body_gc_timer.is_alive():
+                return
+            self._body_gc_timer = threading.Timer(BODY_GC_DELAY, self._run_body_gc)
+            self._body_gc_timer.daemon = True
+            self._body_gc_timer.start()
+    
+    def _run_body_gc(self):
+        """后台线程入口，回收失败只记录日志"""
+        try:
+            self.collect_mail_bodies()
         except Exception as e:
-            logger.error(f"检查和添加列失败: {str(e)}")
+            logger.error(f"回收邮件正文失败: {str(e)}")
+    
+    def collect_mail_bodies(self, batch_size=500):
+        """删除引用计数已归零的正文
+        
+        分批删除，每批单独提交，避免长时间占用写连接。
+        
+        Returns:
+            删除的正文数量
+        """
+        if not self.pool:
+            return 0
+        removed = 0
+        while True:
+            with self._writer() as conn:
+                cursor = conn.execute(
+                    "DELETE FROM mail_bodies WHERE hash IN "
+                    "(SELECT hash FROM mail_bodies WHERE ref_count <= 0 LIMIT ?)",
+                    (batch_size,)
+                )
+                count = cursor.rowcount
+            removed += count
+            if count < batch_size:
+                break
+        if removed:
+            logger.info(f"已回收 {removed} 份不再被引用的邮件正文")
+        return removed
+    
+    def _migrate_mail_bodies(self, conn, last_id, batch_size):
+        """后台回填：将历史记录中的正文迁移到 mail_bodies
+        
+        正文规范化后与原文不同且该记录已建立全文索引时，同时更新全文索引，
+        保证删除时提供的明文与索引一致。
+        """
+        rows = conn.execute(
+            "SELECT id, subject, sender, content, content_codec FROM mail_records "
+            "WHERE body_hash IS NULL AND content IS NOT NULL AND id > ? ORDER BY id LIMIT ?",
+            (last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            return None
+        
+        bodies = {}
+        updates = []
+        fts_deletes = []
+        fts_inserts = []
+        for row in rows:
+            text = decompress_body(row['content'], row['content_codec'])
+            body = normalize_body(text)
+            body_hash = hash_body(body)
+            count = bodies[body_hash][1] + 1 if body_hash in bodies else 1
+            bodies[body_hash] = (body, count)
+            updates.append((body_hash, row['id']))
+            if body != text and (self.fts_enabled or row['id'] <= self._fts_indexed_upto):
+                fts_deletes.append(('delete', row['id'], row['subject'], row['sender'], text))
+                fts_inserts.append((row['id'], row['subject'], row['sender'], body))
+        
+        self._retain_bodies(conn, bodies)
+        conn.executemany(
+            "UPDATE mail_records SET body_hash = ?, content = NULL, content_codec = NULL WHERE id = ?",
+            updates
+        )
+        if fts_deletes:
+            conn.executemany(
+                "INSERT INTO mail_records_fts (mail_records_fts, rowid, subject, sender, content) VALUES (?, ?, ?, ?, ?)",
+                fts_deletes
+            )
+            conn.executemany(
+                "INSERT INTO mail_records_fts (rowid, subject, sender, content) VALUES (?, ?, ?, ?)",
+                fts_inserts
+            )
+        return rows[-1]['id'] if len(rows) == batch_size else None
+    
+    def _backfill_snippets(self, conn, last_id, batch_size):
+        """后台回填：为缺少摘要的历史邮件记录生成摘要"""
+        rows = conn.execute(
+            f"""
+            SELECT mr.id, {MAIL_BODY_TEXT_SQL} AS body
+            FROM mail_records mr
+            LEFT JOIN mail_bodies b ON b.hash = mr.body_hash
+            WHERE mr.snippet IS NULL AND mr.id > ? ORDER BY mr.id LIMIT ?
+            """,
+            (last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            return None
+        conn.executemany(
+            "UPDATE mail_records SET snippet = ? WHERE id = ?",
+            [(build_snippet(row['body']), row['id']) for row in rows]
+        )
+        return rows[-1]['id'] if len(rows) == batch_size else None
+    
+    def _backfill_email_stats(self, conn, last_id, batch_size):
+        """后台回填：按邮箱计算邮件数和最新邮件时间
+        
+        在写连接中重新统计，覆盖回填前增量写入的不完整数值，不改变检查结果。
+        """
+        rows = conn.execute(
+            "SELECT id FROM emails WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            return None
+        conn.execute(
+            """
+            INSERT INTO email_stats (email_id, total_records, latest_received_time)
+            SELECT e.id,
+                   (SELECT COUNT(*) FROM mail_records WHERE email_id = e.id),
+                   (SELECT MAX(received_time) FROM mail_records WHERE email_id = e.id)
+            FROM emails e WHERE e.id > ? AND e.id <= ?
+            ON CONFLICT(email_id) DO UPDATE SET
+                total_records = excluded.total_records,
+                latest_received_time = excluded.latest_received_time,
+                updated_at = CURRENT_TIMESTAMP
+            """,
+            (last_id, rows[-1]['id'])
+        )
+        return rows[-1]['id'] if len(rows) == batch_size else None
+    
+    def _backfill_fts(self, conn, last_id, batch_size):
+        """后台回填：为已有邮件建立全文索引
+        
+        一直处理到最新的记录为止。最后一批与启用全文搜索在同一次写连接持有期间完成，
+        此后写入的邮件由写入路径建立索引，不会遗漏。
+        """
+        rows = conn.execute(
+            f"""
+            SELECT mr.id, mr.subject, mr.sender, {MAIL_BODY_TEXT_SQL} AS body
+            FROM mail_records mr
+            LEFT JOIN mail_bodies b ON b.hash = mr.body_hash
+            WHERE mr.id > ? ORDER BY mr.id LIMIT ?
+            """,
+            (last_id, batch_size)
+        ).fetchall()
+        conn.executemany(
+            "INSERT INTO mail_records_fts (rowid, subject, sender, content) VALUES (?, ?, ?, ?)",
+            [(row['id'], row['subject'], row['sender'], row['body']) for row in rows]
+        )
+        if rows:
+            self._fts_indexed_upto = rows[-1]['id']
+        if len(rows) == batch_size:
+            return rows[-1]['id']
+        self.fts_enabled = True
+        logger.info("全文索引建立完成，搜索改用全文索引")
+        return None
     
     def _init_system_config(self):
         """初始化系统配置"""
-        # 检查是否存在注册配置，默认为开启
-        cursor = self.conn.execute("SELECT value FROM system_config WHERE key = 'allow_register'")
-        result = cursor.fetchone()
-        if not result:
-            logger.info("初始化系统配置: 默认允许注册")
-            self.conn.execute(
-                "INSERT INTO system_config (key, value) VALUES ('allow_register', 'true')"
-            )
-            self.conn.commit()
-        else:
-            # 确保注册功能默认开启，防止旧数据导致无法注册
-            if result['value'] != 'true':
-                logger.info("重置系统配置: 默认允许注册")
-                self.conn.execute(
-                    "UPDATE system_config SET value = 'true' WHERE key = 'allow_register'"
+        with self._writer() as conn:
+            # 检查是否存在注册配置，默认为开启
+            cursor = conn.execute("SELECT value FROM system_config WHERE key = 'allow_register'")
+            result = cursor.fetchone()
+            if not result:
+                logger.info("初始化系统配置: 默认允许注册")
+                conn.execute(
+                    "INSERT INTO system_config (key, value) VALUES ('allow_register', 'true')"
                 )
-                self.conn.commit()
+            else:
+                # 确保注册功能默认开启，防止旧数据导致无法注册
+                if result['value'] != 'true':
+                    logger.info("重置系统配置: 默认允许注册")
+                    conn.execute(
+                        "UPDATE system_config SET value = 'true' WHERE key = 'allow_register'"
+                    )
     
     def get_system_config(self, key):
         """获取系统配置"""
         try:
-            cursor = self.conn.execute("SELECT value FROM system_config WHERE key = ?", (key,))
+            cursor = self._reader().execute("SELECT value FROM system_config WHERE key = ?", (key,))
             result = cursor.fetchone()
             return result['value'] if result else None
         except Exception as e:
@@ -196,11 +511,10 @@ class Database:
     def set_system_config(self, key, value):
         """设置系统配置"""
         try:
-            self.conn.execute(
+            self._execute(
                 "INSERT OR REPLACE INTO system_config (key, value, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)",
                 (key, value)
-            )
-            self.conn.commit()
+            ).result()
             logger.info(f"系统配置已更新: {key} = {value}")
             return True
         except Exception as e:
@@ -249,7 +563,7 @@ class Database:
     # 用户相关方法
     def authenticate_user(self, username, password):
         """验证用户凭据"""
-        cursor = self.conn.execute(
+        cursor = self._reader().execute(
             "SELECT id, username, password, password_hash, salt, is_admin FROM users WHERE username = ?",
             (username,)
         )
@@ -272,11 +586,10 @@ class Database:
             try:
                 salt = secrets.token_hex(16)
                 password_hash = self._hash_password(password, salt)
-                self.conn.execute(
+                self._execute(
                     "UPDATE users SET password_hash = ?, salt = ? WHERE id = ?",
                     (password_hash, salt, user['id'])
-                )
-                self.conn.commit()
+                ).result()
                 logger.info(f"用户 {username} 密码已自动升级到哈希格式")
             except Exception as e:
                 logger.error(f"自动升级密码格式失败: {str(e)}")
@@ -288,7 +601,7 @@ class Database:
     
     def get_user_by_id(self, user_id):
         """根据ID获取用户信息"""
-        cursor = self.conn.execute(
+        cursor = self._reader().execute(
             "SELECT id, username, is_admin FROM users WHERE id = ?",
             (user_id,)
         )
@@ -297,21 +610,25 @@ class Database:
     def create_user(self, username, password, is_admin=False):
         """创建新用户"""
         try:
-            # 检查是否需要将此用户设置为管理员（如果是第一个注册的用户）
-            if not is_admin:
-                cursor = self.conn.execute("SELECT COUNT(*) FROM users")
-                if cursor.fetchone()[0] == 0:
-                    is_admin = True
-                    logger.info(f"第一个注册的用户 {username} 将被设置为管理员")
-            
             salt = secrets.token_hex(16)
             password_hash = self._hash_password(password, salt)
             
-            self.conn.execute(
-                "INSERT INTO users (username, password, password_hash, salt, is_admin) VALUES (?, ?, ?, ?, ?)",
-                (username, password, password_hash, salt, 1 if is_admin else 0)
-            )
-            self.conn.commit()
+            def _create(conn):
+                admin = is_admin
+                # 检查是否需要将此用户设置为管理员（如果是第一个注册的用户）
+                if not admin:
+                    cursor = conn.execute("SELECT COUNT(*) FROM users")
+                    if cursor.fetchone()[0] == 0:
+                        admin = True
+                        logger.info(f"第一个注册的用户 {username} 将被设置为管理员")
+                
+                conn.execute(
+                    "INSERT INTO users (username, password, password_hash, salt, is_admin) VALUES (?, ?, ?, ?, ?)",
+                    (username, password, password_hash, salt, 1 if admin else 0)
+                )
+                return admin
+            
+            is_admin = self._submit(_create).result()
             logger.info(f"创建用户成功: {username}, 管理员权限: {is_admin}")
             return True, is_admin
         except sqlite3.IntegrityError:
@@ -327,11 +644,10 @@ class Database:
             salt = secrets.token_hex(16)
             password_hash = self._hash_password(new_password, salt)
             
-            self.conn.execute(
+            self._execute(
                 "UPDATE users SET password = ?, password_hash = ?, salt = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
                 (new_password, password_hash, salt, user_id)
-            )
-            self.conn.commit()
+            ).result()
             logger.info(f"用户ID {user_id} 密码更新成功")
             return True
         except Exception as e:
@@ -341,21 +657,22 @@ class Database:
     def delete_user(self, user_id):
         """删除用户"""
         try:
-            # 先获取用户关联的所有邮箱
-            cursor = self.conn.execute("SELECT id FROM emails WHERE user_id = ?", (user_id,))
-            email_ids = [row['id'] for row in cursor.fetchall()]
-            
-            # 删除邮件记录
-            if email_ids:
-                placeholders = ','.join(['?'] * len(email_ids))
-                self.conn.execute(f"DELETE FROM mail_records WHERE email_id IN ({placeholders})", email_ids)
-            
-            # 删除邮箱
-            self.conn.execute("DELETE FROM emails WHERE user_id = ?", (user_id,))
+            def _delete(conn):
+                # 先获取用户关联的所有邮箱
+                cursor = conn.execute("SELECT id FROM emails WHERE user_id = ?", (user_id,))
+                email_ids = [row['id'] for row in cursor.fetchall()]
+                
+                # 删除邮件记录
+                self._delete_mail_records(conn, email_ids)
+                
+                # 删除邮箱
+                conn.execute("DELETE FROM emails WHERE user_id = ?", (user_id,))
+                
+                # 删除用户
+                conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
             
-            # 删除用户
-            self.conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
-            self.conn.commit()
+            self._submit(_delete).result()
+            self._schedule_body_gc()
             logger.info(f"用户ID {user_id} 删除成功")
             return True
         except Exception as e:
@@ -364,9 +681,22 @@ class Database:
     
     def get_all_users(self):
         """获取所有用户"""
-        cursor = self.conn.execute("SELECT id, username, is_admin, created_at FROM users ORDER BY created_at DESC")
+        cursor = self._reader().execute("SELECT id, username, is_admin, created_at FROM users ORDER BY created_at DESC")
         return cursor.fetchall()
     
+    def get_user_list(self):
+        """获取用户列表，不包含密码"""
+        return [dict(row) for row in self.get_all_users()]
+    
+    def get_database_stats(self):
+        """获取用户、邮箱和邮件记录的数量"""
+        conn = self._reader()
+        return {
+            'user_count': conn.execute("SELECT COUNT(*) FROM users").fetchone()[0],
+            'email_count': conn.execute("SELECT COUNT(*) FROM emails").fetchone()[0],
+            'mail_record_count': conn.execute("SELECT COUNT(*) FROM mail_records").fetchone()[0],
+        }
+    
     # 邮箱相关方法
     def add_email(self, user_id, email, password, client_id=None, refresh_token=None, mail_type='outlook', server=None, port=None, use_ssl=True):
         """添加新的邮箱账号"""
@@ -381,23 +711,18 @@ class Database:
             
             # 根据邮箱类型处理SQL，默认启用实时检查
             if mail_type == 'outlook':
-                cursor = self.conn.execute(
-                    "INSERT INTO emails (user_id, email, password, client_id, refresh_token, mail_type, enable_realtime_check) VALUES (?, ?, ?, ?, ?, ?, 1)",
-                    (user_id, email, password, client_id, refresh_token, mail_type)
-                )
+                sql = "INSERT INTO emails (user_id, email, password, client_id, refresh_token, mail_type, enable_realtime_check) VALUES (?, ?, ?, ?, ?, ?, 1)"
+                params = (user_id, email, password, client_id, refresh_token, mail_type)
             elif mail_type in ['imap', 'gmail', 'qq']:
                 # 将布尔值转换为整数值 (1=True, 0=False)
                 use_ssl_int = 1 if use_ssl else 0
-                cursor = self.conn.execute(
-                    "INSERT INTO emails (user_id, email, password, mail_type, server, port, use_ssl, enable_realtime_check) VALUES (?, ?, ?, ?, ?, ?, ?, 1)",
-                    (user_id, email, password, mail_type, server, port, use_ssl_int)
-                )
+                sql = "INSERT INTO emails (user_id, email, password, mail_type, server, port, use_ssl, enable_realtime_check) VALUES (?, ?, ?, ?, ?, ?, ?, 1)"
+                params = (user_id, email, password, mail_type, server, port, use_ssl_int)
             else:
                 logger.error(f"不支持的邮箱类型: {mail_type}")
                 return False
             
-            self.conn.commit()
-            email_id = cursor.lastrowid
+            email_id = self._execute(sql, params).result().lastrowid
             logger.info(f"邮箱添加成功: {email}, ID: {email_id}, 类型: {mail_type}, 已启用实时检查")
             return email_id
         except sqlite3.IntegrityError as e:
@@ -412,18 +737,106 @@ class Database:
         """获取所有邮箱账号，可以按用户ID过滤"""
         logger.debug(f"获取所有邮箱账号 (用户ID: {user_id if user_id else 'all'})")
         if user_id:
-            cursor = self.conn.execute(
+            cursor = self._reader().execute(
                 "SELECT * FROM emails WHERE user_id = ? ORDER BY created_at DESC", 
                 (user_id,)
             )
         else:
-            cursor = self.conn.execute("SELECT * FROM emails ORDER BY created_at DESC")
+            cursor = self._reader().execute("SELECT * FROM emails ORDER BY created_at DESC")
         return cursor.fetchall()
     
+    def get_email_list(self, user_id=None):
+        """获取邮箱列表及每个邮箱的统计信息，不包含密码和令牌，可以按用户ID过滤
+        
+        统计信息按主键连接 email_stats 表，不对邮件记录做聚合查询。
+        """
+        columns = ', '.join(
+            [f"e.{column}" for column in EMAIL_LIST_COLUMNS]
+            + [f"s.{column}" for column in EMAIL_STATS_COLUMNS]
+        )
+        sql = f"SELECT {columns} FROM emails e LEFT JOIN email_stats s ON s.email_id = e.id"
+        if user_id:
+            cursor = self._reader().execute(f"{sql} WHERE e.user_id = ? ORDER BY e.created_at DESC", (user_id,))
+        else:
+            cursor = self._reader().execute(f"{sql} ORDER BY e.created_at DESC")
+        emails = []
+        for row in cursor.fetchall():
+            email = dict(row)
+            email['total_records'] = email['total_records'] or 0
+            email['last_new_count'] = email['last_new_count'] or 0
+            emails.append(email)
+        return emails
+    
+    def record_check_result(self, email_id, status, duration_ms, new_count):
+        """记录邮箱最近一次检查的结果
+        
+        Args:
+            email_id: 邮箱ID
+            status: 检查结果，success 或 failed
+            duration_ms: 检查耗时，单位为毫秒
+            new_count: 本次新增的邮件数
+        """
+        try:
+            self._execute(
+                """
+                INSERT INTO email_stats (email_id, last_check_status, last_check_duration_ms, last_new_count)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(email_id) DO UPDATE SET
+                    last_check_status = excluded.last_check_status,
+                    last_check_duration_ms = excluded.last_check_duration_ms,
+                    last_new_count = excluded.last_new_count,
+                    updated_at = CURRENT_TIMESTAMP
+                """,
+                (email_id, status, duration_ms, new_count)
+            ).result()
+            return True
+        except Exception as e:
+            logger.error(f"记录邮箱检查结果失败, ID: {email_id}, 错误: {str(e)}")
+            return False
+    
+    def get_email_stats(self, email_id):
+        """获取单个邮箱的统计信息，没有记录时返回 None"""
+        row = self._reader().execute(
+            f"SELECT {', '.join(EMAIL_STATS_COLUMNS)} FROM email_stats WHERE email_id = ?",
+            (email_id,)
+        ).fetchone()
+        return dict(row) if row else None
+    
+    def get_sync_state(self, email_id, folder='INBOX'):
+        """获取邮箱文件夹的增量同步位置
+        
+        Returns:
+            {'uidvalidity': ..., 'last_uid': ...}，没有记录时返回 None
+        """
+        row = self._reader().execute(
+            "SELECT uidvalidity, last_uid FROM mail_sync_state WHERE email_id = ? AND folder = ?",
+            (email_id, folder)
+        ).fetchone()
+        return dict(row) if row else None
+    
+    def update_sync_state(self, email_id, folder, uidvalidity, last_uid):
+        """保存邮箱文件夹的增量同步位置"""
+        try:
+            self._execute(
+                """
+                INSERT INTO mail_sync_state (email_id, folder, uidvalidity, last_uid)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(email_id, folder) DO UPDATE SET
+                    uidvalidity = excluded.uidvalidity,
+                    last_uid = excluded.last_uid,
+                    updated_at = CURRENT_TIMESTAMP
+                """,
+                (email_id, folder, uidvalidity, last_uid)
+            ).result()
+            return True
+        except Exception as e:
+            logger.error(f"保存邮箱同步状态失败, ID: {email_id}, 文件夹: {folder}, 错误: {str(e)}")
+            return False
+    
     def get_emails_by_user_id(self, user_id):
         """根据用户ID获取所有邮箱账号"""
         logger.debug(f"获取用户ID: {user_id} 的所有邮箱账号")
-        cursor = self.conn.execute(
+        cursor = self._reader().execute(
             "SELECT * FROM emails WHERE user_id = ? ORDER BY created_at DESC", 
             (user_id,)
         )
@@ -434,12 +847,12 @@ class Database:
         logger.debug(f"获取邮箱 ID: {email_id}")
         try:
             if user_id:
-                cursor = self.conn.execute(
+                cursor = self._reader().execute(
                     "SELECT * FROM emails WHERE id = ? AND user_id = ?", 
                     (email_id, user_id)
                 )
             else:
-                cursor = self.conn.execute("SELECT * FROM emails WHERE id = ?", (email_id,))
+                cursor = self._reader().execute("SELECT * FROM emails WHERE id = ?", (email_id,))
             
             email_info = cursor.fetchone()
             if not email_info:
@@ -494,8 +907,7 @@ class Database:
                 WHERE {where_condition}
             """
             
-            self.conn.execute(sql, params)
-            self.conn.commit()
+            self._execute(sql, params).result()
             logger.info(f"邮箱信息更新成功: ID={email_id}")
             return True
             
@@ -506,27 +918,51 @@ class Database:
     def update_check_time(self, email_id):
         """更新邮箱的最后检查时间"""
         logger.debug(f"更新邮箱最后检查时间, ID: {email_id}")
-        self.conn.execute(
+        self._execute(
             "UPDATE emails SET last_check_time = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
             (email_id,)
-        )
-        self.conn.commit()
+        ).result()
     
-    def update_email_token(self, email_id, access_token):
-        """更新Outlook邮箱的访问令牌"""
+    def update_email_token(self, email_id, access_token, expires_at=None, refresh_token=None):
+        """更新Outlook邮箱的访问令牌
+
+        Args:
+            email_id: 邮箱ID
+            access_token: 访问令牌
+            expires_at: 令牌过期的Unix时间戳
+            refresh_token: 刷新时服务器返回的新刷新令牌，None 表示刷新令牌没有变化
+        """
         logger.debug(f"更新邮箱访问令牌, ID: {email_id}")
         try:
-            self.conn.execute(
-                "UPDATE emails SET access_token = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-                (access_token, email_id)
-            )
-            self.conn.commit()
+            if refresh_token:
+                sql = "UPDATE emails SET access_token = ?, token_expires_at = ?, refresh_token = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?"
+                params = (access_token, expires_at, refresh_token, email_id)
+            else:
+                sql = "UPDATE emails SET access_token = ?, token_expires_at = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?"
+                params = (access_token, expires_at, email_id)
+            self._execute(sql, params).result()
             logger.info(f"成功更新邮箱 ID:{email_id} 的访问令牌")
             return True
         except Exception as e:
             logger.error(f"更新邮箱访问令牌失败, ID: {email_id}, 错误: {str(e)}")
             return False
     
+    def get_email_token(self, email_id):
+        """读取Outlook邮箱保存的令牌
+
+        Returns:
+            {'access_token', 'token_expires_at', 'refresh_token', 'client_id'}，邮箱不存在时返回 None
+        """
+        try:
+            row = self._reader().execute(
+                "SELECT access_token, token_expires_at, refresh_token, client_id FROM emails WHERE id = ?",
+                (email_id,)
+            ).fetchone()
+            return dict(row) if row else None
+        except Exception as e:
+            logger.error(f"读取邮箱访问令牌失败, ID: {email_id}, 错误: {str(e)}")
+            return None
+    
     def delete_email(self, email_id, user_id=None):
         """删除邮箱账号，可以验证所有者"""
         logger.info(f"删除邮箱账号, ID: {email_id}")
@@ -538,12 +974,15 @@ class Database:
             sql_where += " AND user_id = ?"
             params.append(user_id)
         
-        # 先删除相关的邮件记录
-        self.conn.execute("DELETE FROM mail_records WHERE email_id = ?", (email_id,))
+        def _delete(conn):
+            # 先删除相关的邮件记录
+            self._delete_mail_records(conn, [email_id])
+            
+            # 再删除邮箱
+            conn.execute(f"DELETE FROM emails WHERE {sql_where}", params)
         
-        # 再删除邮箱
-        self.conn.execute(f"DELETE FROM emails WHERE {sql_where}", params)
-        self.conn.commit()
+        self._submit(_delete).result()
+        self._schedule_body_gc()
     
     def delete_emails(self, email_ids, user_id=None):
         """批量删除邮箱账号，可以验证所有者"""
@@ -556,7 +995,7 @@ class Database:
         if user_id:
             # 获取该用户拥有的邮箱
             placeholders = ','.join(['?'] * len(email_ids))
-            cursor = self.conn.execute(
+            cursor = self._reader().execute(
                 f"SELECT id FROM emails WHERE id IN ({placeholders}) AND user_id = ?",
                 email_ids + [user_id]
             )
@@ -569,33 +1008,48 @@ class Database:
             email_ids = valid_ids
         
         placeholders = ','.join(['?'] * len(email_ids))
-        # 先删除相关的邮件记录
-        self.conn.execute(f"DELETE FROM mail_records WHERE email_id IN ({placeholders})", email_ids)
-        # 再删除邮箱
-        self.conn.execute(f"DELETE FROM emails WHERE id IN ({placeholders})", email_ids)
-        self.conn.commit()
+        def _delete(conn):
+            # 先删除相关的邮件记录
+            self._delete_mail_records(conn, email_ids)
+            # 再删除邮箱
+            conn.execute(f"DELETE FROM emails WHERE id IN ({placeholders})", email_ids)
+        
+        self._submit(_delete).result()
+        self._schedule_body_gc()
     
-    def add_mail_record(self, email_id, subject, sender, received_time, content, folder=None):
+    def delete_mail_records(self, email_ids):
+        """删除邮箱下的全部邮件记录，保留邮箱本身"""
+        if not email_ids:
+            return
+        self._submit(lambda conn: self._delete_mail_records(conn, email_ids)).result()
+        self._schedule_body_gc()
+    
+    def add_mail_record(self, email_id, subject, sender, received_time, content, folder=None, message_id=None, attachments=None):
         """添加邮件记录"""
         logger.debug(f"添加邮件记录, 邮箱ID: {email_id}, 主题: {subject}")
         try:
-            # 先检查邮件是否已存在
-            cursor = self.conn.execute(
-                "SELECT id FROM mail_records WHERE email_id = ? AND sender = ? AND subject = ? AND received_time = ?",
-                (email_id, sender, subject, received_time)
-            )
-            exists = cursor.fetchone() is not None
+            dedup_key = build_dedup_key(message_id, subject, sender, received_time)
+            body = normalize_body(content)
+            body_hash = hash_body(body) if body is not None else None
+            snippet = build_snippet(content)
+            
+            def _insert(conn):
+                # 依赖 (email_id, dedup_key) 唯一索引去重，已存在时不插入
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO mail_records (email_id, subject, sender, received_time, body_hash, folder, dedup_key, snippet, attachments) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (email_id, subject, sender, received_time, body_hash, folder, dedup_key, snippet, encode_attachments(attachments))
+                )
+                if cursor.rowcount == 0:
+                    return False
+                if body_hash:
+                    self._retain_bodies(conn, {body_hash: (body, 1)})
+                self._index_fts(conn, [(cursor.lastrowid, subject, sender, body)])
+                self._add_to_email_stats(conn, email_id, 1, received_time)
+                return True
             
-            if exists:
+            if not self._submit(_insert).result():
                 logger.debug(f"邮件已存在，跳过: 邮箱ID={email_id}, 主题={subject}")
                 return False  # 邮件已存在，返回False表示没有添加新记录
-            
-            # 邮件不存在，添加新记录
-            self.conn.execute(
-                "INSERT INTO mail_records (email_id, subject, sender, received_time, content, folder) VALUES (?, ?, ?, ?, ?, ?)",
-                (email_id, subject, sender, received_time, content, folder)
-            )
-            self.conn.commit()
             return True  # 添加了新记录，返回True
         except Exception as e:
             logger.error(f"添加邮件记录失败: {str(e)}")
@@ -612,13 +1066,108 @@ class Database:
                 logger.warning(f"用户ID {user_id} 没有权限访问邮箱ID {email_id}")
                 return []
         
-        cursor = self.conn.execute(
-            "SELECT * FROM mail_records WHERE email_id = ? ORDER BY received_time DESC", 
+        cursor = self._reader().execute(
+            f"""
+            SELECT {MAIL_RECORD_FULL_COLUMNS} FROM mail_records mr
+            LEFT JOIN mail_bodies b ON b.hash = mr.body_hash
+            WHERE mr.email_id = ? ORDER BY mr.received_time DESC, mr.id DESC
+            """,
             (email_id,)
         )
-        return cursor.fetchall()
+        return [self._decode_mail_record(row) for row in cursor.fetchall()]
     
-    def search_mail_records(self, email_ids, query, search_in_subject=True, search_in_sender=True, search_in_recipient=False, search_in_content=True):
+    def _decode_mail_record(self, row):
+        """将查询结果转换为字典，并还原压缩存储的正文"""
+        record = dict(row)
+        codec = record.pop('content_codec', None)
+        body_content = record.pop('body_content', None)
+        body_codec = record.pop('body_codec', None)
+        record.pop('body_hash', None)
+        if 'attachments' in record:
+            record['attachments'] = json.loads(record['attachments']) if record['attachments'] else []
+        if 'content' in record:
+            if body_content is not None:
+                record['content'] = decompress_body(body_content, body_codec)
+            else:
+                record['content'] = decompress_body(record['content'], codec)
+        return record
+    
+    def get_mail_records_page(self, email_id, limit=None, cursor=None, include_content=False):
+        """按接收时间倒序分页获取邮件记录
+        
+        使用 (received_time, id) 作为游标做键集分页，翻页开销与页码无关。
+        
+        Args:
+            email_id: 邮箱ID
+            limit: 每页条数，超出上限时按上限处理
+            cursor: 上一页返回的 next_cursor，为空时从最新的邮件开始
+            include_content: 是否返回完整正文，默认只返回元数据和摘要
+        
+        Returns:
+            (records, next_cursor) 元组，没有更多记录时 next_cursor 为 None
+        
+        Raises:
+            ValueError: 游标格式无效
+        """
+        limit = clamp_page_limit(limit)
+        params = [email_id]
+        condition = ""
+        
+        if cursor:
+            last_time, last_id = decode_cursor(cursor)
+            if last_time is None:
+                # 倒序时接收时间为空的记录排在最后，只需在其中继续按id翻页
+                condition = "AND received_time IS NULL AND id < ?"
+                params.append(last_id)
+            else:
+                condition = "AND ((received_time, id) < (?, ?) OR received_time IS NULL)"
+                params.extend([last_time, last_id])
+        
+        # 多取一条用于判断是否还有下一页
+        params.append(limit + 1)
+        if include_content:
+            columns = MAIL_RECORD_FULL_COLUMNS
+            join = "LEFT JOIN mail_bodies b ON b.hash = mr.body_hash"
+        else:
+            columns = ', '.join(f"mr.{column}" for column in MAIL_RECORD_SUMMARY_COLUMNS)
+            join = ""
+        rows = self._reader().execute(
+            f"""
+            SELECT {columns} FROM mail_records mr {join}
+            WHERE mr.email_id = ? {condition}
+            ORDER BY mr.received_time DESC, mr.id DESC
+            LIMIT ?
+            """,
+            params
+        ).fetchall()
+        
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor(last['received_time'], last['id'])
+        if include_content:
+            rows = [self._decode_mail_record(row) for row in rows]
+        
+        logger.debug(f"分页获取邮箱邮件记录, ID: {email_id}, 条数: {len(rows)}, 有下一页: {next_cursor is not None}")
+        return rows, next_cursor
+    
+    def get_mail_record_by_id(self, record_id):
+        """根据ID获取单封邮件的完整记录，包括正文"""
+        cursor = self._reader().execute(
+            f"""
+            SELECT {MAIL_RECORD_FULL_COLUMNS}, e.email as recipient
+            FROM mail_records mr
+            JOIN emails e ON mr.email_id = e.id
+            LEFT JOIN mail_bodies b ON b.hash = mr.body_hash
+            WHERE mr.id = ?
+            """,
+            (record_id,)
+        )
+        row = cursor.fetchone()
+        return self._decode_mail_record(row) if row else None
+    
+    def search_mail_records(self, email_ids, query, search_in_subject=True, search_in_sender=True, search_in_recipient=False, search_in_content=True, include_content=False):
         """根据条件搜索邮件记录
         
         Args:
@@ -628,6 +1177,7 @@ class Database:
             search_in_sender: 是否搜索发件人
             search_in_recipient: 是否搜索收件人
             search_in_content: 是否搜索正文内容
+            include_content: 是否返回完整正文，默认只返回元数据和摘要
         
         Returns:
             符合条件的邮件记录列表
@@ -637,53 +1187,61 @@ class Database:
             
         logger.info(f"搜索邮件: 关键词={query}, 邮箱IDs={email_ids}, 范围: 主题={search_in_subject}, 发件人={search_in_sender}, 收件人={search_in_recipient}, 正文={search_in_content}")
         
-        # 准备SQL查询条件
-        conditions = []
-        params = []
-        
-        # 添加邮箱ID条件
-        placeholders = ','.join(['?'] * len(email_ids))
-        conditions.append(f"email_id IN ({placeholders})")
-        params.extend(email_ids)
-        
-        # 添加搜索字段条件
-        search_conditions = []
+        # 收件人暂时用不到，因为数据库中没有专门的收件人字段
+        # 如果需要，可以从邮件内容中解析或在数据库中添加recipient字段
+        columns = []
         if search_in_subject:
-            search_conditions.append("subject LIKE ?")
-            params.append(f"%{query}%")
-        
+            columns.append('subject')
         if search_in_sender:
-            search_conditions.append("sender LIKE ?")
-            params.append(f"%{query}%")
-        
+            columns.append('sender')
         if search_in_content:
-            search_conditions.append("content LIKE ?")
-            params.append(f"%{query}%")
-        
-        # 收件人暂时用不到，因为数据库中没有专门的收件人字段
-        # 如果需要，可以从邮件内容中解析或在数据库中添加recipient字段
+            columns.append('content')
         
         # 如果没有任何搜索条件，直接返回空列表
-        if not search_conditions:
+        if not columns:
             return []
-            
-        # 将所有搜索条件用OR连接
-        conditions.append(f"({' OR '.join(search_conditions)})")
         
-        # 构建最终的SQL查询
-        sql = f"""
-            SELECT mr.*, e.email as recipient 
-            FROM mail_records mr
-            JOIN emails e ON mr.email_id = e.id
-            WHERE {' AND '.join(conditions)}
-            ORDER BY mr.received_time DESC
-        """
+        placeholders = ','.join(['?'] * len(email_ids))
+        select_columns = MAIL_RECORD_FULL_COLUMNS if include_content else ', '.join(f"mr.{column}" for column in MAIL_RECORD_SUMMARY_COLUMNS)
+        
+        if self.fts_enabled and len(query) >= FTS_MIN_QUERY_LENGTH:
+            # 整个关键词作为一个短语匹配，trigram分词下等价于子串匹配
+            phrase = '"' + query.replace('"', '""') + '"'
+            match_expr = f"{{{' '.join(columns)}}} : {phrase}"
+            
+            # 按相关度排序，主题命中的权重高于发件人和正文
+            sql = f"""
+                SELECT {select_columns}, e.email as recipient 
+                FROM mail_records_fts f
+                JOIN mail_records mr ON mr.id = f.rowid
+                JOIN emails e ON mr.email_id = e.id
+                LEFT JOIN mail_bodies b ON b.hash = mr.body_hash
+                WHERE mail_records_fts MATCH ? AND mr.email_id IN ({placeholders})
+                ORDER BY bm25(mail_records_fts, 10.0, 5.0, 1.0), mr.received_time DESC
+            """
+            params = [match_expr] + list(email_ids)
+        else:
+            # 过短的关键词无法使用trigram索引，退回LIKE匹配
+            # 正文可能被压缩存储，需要先还原再匹配
+            search_conditions = [
+                f"{MAIL_BODY_TEXT_SQL} LIKE ?" if column == 'content' else f"mr.{column} LIKE ?"
+                for column in columns
+            ]
+            sql = f"""
+                SELECT {select_columns}, e.email as recipient 
+                FROM mail_records mr
+                JOIN emails e ON mr.email_id = e.id
+                LEFT JOIN mail_bodies b ON b.hash = mr.body_hash
+                WHERE mr.email_id IN ({placeholders}) AND ({' OR '.join(search_conditions)})
+                ORDER BY mr.received_time DESC
+            """
+            params = list(email_ids) + [f"%{query}%"] * len(columns)
         
         try:
-            cursor = self.conn.execute(sql, params)
+            cursor = self._reader().execute(sql, params)
             results = cursor.fetchall()
             logger.info(f"搜索结果: 找到 {len(results)} 条记录")
-            return [dict(result) for result in results]
+            return [self._decode_mail_record(result) for result in results]
         except Exception as e:
             logger.error(f"搜索邮件记录失败: {str(e)}")
             return []
@@ -698,7 +1256,7 @@ class Database:
             placeholders = ','.join(['?' for _ in email_ids])
             
             # 执行查询
-            cursor = self.conn.execute(f'''
+            cursor = self._reader().execute(f'''
                 SELECT id, user_id, email, password, client_id, refresh_token, 
                        mail_type, server, port, use_ssl, last_check_time
                 FROM emails
@@ -731,26 +1289,226 @@ class Database:
     
     def close(self):
         """关闭数据库连接"""
-        if self.conn:
+        if self.pool:
             logger.info("关闭数据库连接")
-            self.conn.close()
-            self.conn = None
+            self.backfills.stop()
+            self.pool.close()
+            self.pool = None
 
     def get_mail_record_by_subject_and_sender(self, email_id, subject, sender):
         """根据主题和发件人获取邮件记录"""
         try:
-            cursor = self.conn.execute(
-                "SELECT * FROM mail_records WHERE email_id = ? AND subject = ? AND sender = ?",
+            cursor = self._reader().execute(
+                f"""
+                SELECT {MAIL_RECORD_FULL_COLUMNS} FROM mail_records mr
+                LEFT JOIN mail_bodies b ON b.hash = mr.body_hash
+                WHERE mr.email_id = ? AND mr.subject = ? AND mr.sender = ?
+                """,
                 (email_id, subject, sender)
             )
-            return cursor.fetchone()
+            row = cursor.fetchone()
+            return self._decode_mail_record(row) if row else None
         except Exception as e:
             logger.error(f"获取邮件记录失败: {str(e)}")
             return None
 
+    def get_existing_dedup_keys(self, email_id: int, dedup_keys: List[str]) -> set:
+        """返回邮箱中已存在的去重键
+        
+        所有候选键作为一个JSON数组参数传入，用一次 (email_id, dedup_key) 索引查询完成，
+        收信时据此跳过已保存邮件的正文下载。
+        """
+        if not dedup_keys:
+            return set()
+        try:
+            cursor = self._reader().execute(
+                """
+                SELECT dedup_key FROM mail_records
+                WHERE email_id = ? AND dedup_key IN (SELECT value FROM json_each(?))
+                """,
+                (email_id, json.dumps(list(dedup_keys)))
+            )
+            return {row[0] for row in cursor.fetchall()}
+        except Exception as e:
+            logger.error(f"查询已存在的邮件失败: {str(e)}")
+            return set()
+    
+    def bulk_add_mail_records(self, email_id: int, mail_records: List[Dict]) -> int:
+        """批量添加邮件记录
+        
+        在内存中计算去重键并去除批次内的重复，用一次索引查询排除已存在的记录，
+        剩余记录通过 executemany 以 INSERT OR IGNORE 写入，整批在同一个事务中提交。
+        
+        Args:
+            email_id: 邮箱ID
+            mail_records: 邮件记录列表
+        
+        Returns:
+            新增的记录数
+        """
+        if not mail_records:
+            return 0
+        
+        # 规范化记录并去除本批次内部的重复
+        candidates = {}
+        # 历史记录的去重键由主题、发件人和时间生成，带Message-ID的新邮件需要同时按该键排除
+        fallback_keys = {}
+        for record in mail_records:
+            subject = record.get("subject", "(无主题)")
+            sender = record.get("sender", "(未知发件人)")
+            received_time = record.get("received_time", datetime.now())
+            dedup_key = build_dedup_key(record.get("message_id"), subject, sender, received_time)
+            if dedup_key in candidates:
+                continue
+            candidates[dedup_key] = (
+                subject,
+                sender,
+                received_time,
+                record.get("content", "(无内容)"),
+                record.get("folder", "INBOX"),
+                record.get("attachments")
+            )
+            fallback_key = build_fallback_dedup_key(subject, sender, received_time)
+            if fallback_key != dedup_key:
+                fallback_keys[fallback_key] = dedup_key
+        
+        def _insert(conn):
+            # 将候选键写入临时表，与 mail_records 做一次连接查询找出已存在的邮件
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS temp_mail_keys (dedup_key TEXT)")
+            conn.execute("DELETE FROM temp_mail_keys")
+            conn.executemany(
+                "INSERT INTO temp_mail_keys (dedup_key) VALUES (?)",
+                [(key,) for key in list(candidates.keys()) + list(fallback_keys.keys())]
+            )
+            cursor = conn.execute("""
+                SELECT mr.dedup_key
+                FROM temp_mail_keys t
+                JOIN mail_records mr
+                  ON mr.email_id = ? AND mr.dedup_key = t.dedup_key
+            """, (email_id,))
+            for row in cursor.fetchall():
+                existing_key = fallback_keys.get(row[0], row[0])
+                candidates.pop(existing_key, None)
+            conn.execute("DELETE FROM temp_mail_keys")
+            
+            if not candidates:
+                return 0
+            
+            new_rows = []
+            for dedup_key, (subject, sender, received_time, content, folder, attachments) in candidates.items():
+                body = normalize_body(content)
+                body_hash = hash_body(body) if body is not None else None
+                candidates[dedup_key] = (subject, sender, body, body_hash)
+                new_rows.append((
+                    email_id, subject, sender, received_time, body_hash,
+                    folder, dedup_key, build_snippet(content), encode_attachments(attachments)
+                ))
+            
+            # 写连接持有写锁，本次插入的记录ID都大于当前最大ID
+            max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM mail_records").fetchone()[0]
+            
+            # executemany的rowcount是各条语句实际写入行数之和
+            cursor = conn.executemany(
+                "INSERT OR IGNORE INTO mail_records (email_id, subject, sender, received_time, body_hash, folder, dedup_key, snippet, attachments) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                new_rows
+            )
+            saved_count = max(cursor.rowcount, 0)
+            
+            if saved_count:
+                inserted = conn.execute(
+                    "SELECT id, dedup_key, received_time FROM mail_records WHERE id > ? AND email_id = ?",
+                    (max_id, email_id)
+                ).fetchall()
+                # 只为实际写入的记录增加正文引用，并用写入前的明文建立全文索引
+                bodies = {}
+                fts_rows = []
+                for row in inserted:
+                    subject, sender, body, body_hash = candidates[row['dedup_key']]
+                    if body_hash:
+                        count = bodies[body_hash][1] + 1 if body_hash in bodies else 1
+                        bodies[body_hash] = (body, count)
+                    fts_rows.append((row['id'], subject, sender, body))
+                self._retain_bodies(conn, bodies)
+                self._index_fts(conn, fts_rows)
+                received_times = [row['received_time'] for row in inserted if row['received_time'] is not None]
+                self._add_to_email_stats(conn, email_id, saved_count, max(received_times) if received_times else None)
+            return saved_count
+        
+        return self._submit(_insert).result()
+    
+    def compress_existing_mail_bodies(self, batch_size=200, progress_callback: Optional[Callable] = None) -> Dict:
+        """压缩历史邮件正文
+        
+        按行号分批处理正文表中未压缩的正文，每批单独提交，执行期间不会长时间阻塞其他写操作。
+        可以中断后重新执行，已压缩的正文会被跳过。
+        
+        Args:
+            batch_size: 每批处理的记录数
+            progress_callback: 进度回调函数，参数为 (processed, total)
+        
+        Returns:
+            统计信息字典，包括处理的正文数、压缩的正文数及压缩前后的字节数
+        """
+        stats = {'processed': 0, 'compressed': 0, 'bytes_before': 0, 'bytes_after': 0}
+        if not self.body_codec:
+            logger.warning("未启用邮件正文压缩(MAIL_BODY_COMPRESSION)，跳过压缩")
+            return stats
+        
+        total = self._reader().execute(
+            "SELECT COUNT(*) FROM mail_bodies WHERE content_codec IS NULL AND content IS NOT NULL"
+        ).fetchone()[0]
+        logger.info(f"开始压缩历史邮件正文，共 {total} 条，算法: {self.body_codec}")
+        
+        last_id = 0
+        while True:
+            with self._writer() as conn:
+                rows = conn.execute(
+                    "SELECT rowid AS id, content FROM mail_bodies "
+                    "WHERE content_codec IS NULL AND content IS NOT NULL AND rowid > ? ORDER BY rowid LIMIT ?",
+                    (last_id, batch_size)
+                ).fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1]['id']
+                
+                updates = []
+                for row in rows:
+                    content = decompress_body(row['content'], None)
+                    size = len(content.encode('utf-8'))
+                    stored_content, codec = compress_body(content, self.body_codec)
+                    stats['processed'] += 1
+                    stats['bytes_before'] += size
+                    if codec:
+                        stats['compressed'] += 1
+                        stats['bytes_after'] += len(stored_content)
+                        updates.append((stored_content, codec, row['id']))
+                    else:
+                        stats['bytes_after'] += size
+                conn.executemany("UPDATE mail_bodies SET content = ?, content_codec = ? WHERE rowid = ?", updates)
+            
+            if progress_callback:
+                progress_callback(stats['processed'], total)
+        
+        saved = stats['bytes_before'] - stats['bytes_after']
+        ratio = saved / stats['bytes_before'] * 100 if stats['bytes_before'] else 0
+        logger.info(
+            f"历史邮件正文压缩完成: 处理 {stats['processed']} 条, 压缩 {stats['compressed']} 条, "
+            f"正文 {stats['bytes_before']} -> {stats['bytes_after']} 字节, 节省 {ratio:.1f}%"
+        )
+        return stats
+    
+    def vacuum(self):
+        """整理数据库文件，回收删除或压缩数据后留下的空闲页"""
+        logger.info(f"开始整理数据库文件: {self.db_path}")
+        with self._writer() as conn:
+            conn.execute("VACUUM")
+        logger.info("数据库文件整理完成")
+    
     def save_mail_records(self, email_id: int, mail_records: List[Dict], progress_callback: Optional[Callable] = None) -> int:
-        """保存邮件记录到数据库"""
-        saved_count = 0
+        """保存邮件记录到数据库
+        
+        同步位置由调用方在保存成功后通过 update_sync_state 记录，这里不处理。
+        """
         total = len(mail_records)
         
         logger.info(f"开始保存 {total} 封邮件记录到数据库, 邮箱ID: {email_id}")
@@ -758,53 +1516,20 @@ class Database:
         if not progress_callback:
             progress_callback = lambda progress, message: None
         
-        for i, record in enumerate(mail_records):
-            try:
-                # 更新进度
-                progress = int((i + 1) / total * 100)
-                progress_message = f"正在保存邮件记录 ({i + 1}/{total})"
-                progress_callback(progress, progress_message)
-                
-                if i % 10 == 0 or i == total - 1:  # 每10封记录一次进度
-                    log_progress(email_id, progress, progress_message)
-                
-                # 检查邮件是否已存在
-                subject = record.get("subject", "(无主题)")
-                sender = record.get("sender", "(未知发件人)")
-                
-                logger.debug(f"检查邮件是否存在: '{subject[:30]}...' 发件人: '{sender[:30]}...'")
-                
-                existing = self.get_mail_record_by_subject_and_sender(
-                    email_id,
-                    subject,
-                    sender
-                )
-                
-                if not existing:
-                    # 保存新邮件记录
-                    logger.debug(f"保存新邮件记录: '{subject[:30]}...'")
-                    
-                    success = self.add_mail_record(
-                        email_id=email_id,
-                        subject=subject,
-                        sender=sender,
-                        content=record.get("content", "(无内容)"),
-                        received_time=record.get("received_time", datetime.now()),
-                        folder=record.get("folder", "INBOX")
-                    )
-                    
-                    if success:
-                        saved_count += 1
-                        logger.debug(f"邮件记录保存成功: '{subject[:30]}...'")
-                    else:
-                        logger.warning(f"邮件记录保存失败: '{subject[:30]}...'")
-                else:
-                    logger.debug(f"邮件记录已存在: '{subject[:30]}...'")
-                    
-            except Exception as e:
-                logger.error(f"保存邮件记录失败: {str(e)}")
-                traceback.print_exc()
-                continue
+        progress_message = f"正在保存邮件记录 (共 {total} 封)"
+        progress_callback(0, progress_message)
+        log_progress(email_id, 0, progress_message)
+        
+        try:
+            saved_count = self.bulk_add_mail_records(email_id, mail_records)
+        except Exception as e:
+            logger.error(f"保存邮件记录失败: {str(e)}")
+            traceback.print_exc()
+            saved_count = 0
+        
+        progress_message = f"邮件记录保存完成 ({total}/{total})"
+        progress_callback(100, progress_message)
+        log_progress(email_id, 100, progress_message)
         
         logger.info(f"完成保存邮件记录: 总计 {total} 封, 新增 {saved_count} 封")        
         return saved_count
@@ -812,7 +1537,7 @@ class Database:
     def get_all_email_ids(self) -> List[int]:
         """获取所有邮箱的ID列表"""
         try:
-            cursor = self.conn.execute("""
+            cursor = self._reader().execute("""
                 SELECT id FROM emails
             """)
             return [row[0] for row in cursor.fetchall()]
@@ -823,7 +1548,7 @@ class Database:
     def get_users_with_realtime_check(self) -> List[Dict]:
         """获取启用了实时检查的用户列表"""
         try:
-            cursor = self.conn.execute("""
+            cursor = self._reader().execute("""
                 SELECT id, username, is_admin
                 FROM users
                 WHERE id IN (
@@ -840,7 +1565,7 @@ class Database:
     def get_user_emails(self, user_id: int) -> List[Dict]:
         """获取用户的所有邮箱"""
         try:
-            cursor = self.conn.execute("""
+            cursor = self._reader().execute("""
                 SELECT id, email, password, mail_type, server, port, 
                        use_ssl, client_id, refresh_token, last_check_time,
                        enable_realtime_check
@@ -856,12 +1581,11 @@ class Database:
     def set_email_realtime_check(self, email_id: int, enable: bool) -> bool:
         """设置邮箱的实时检查状态"""
         try:
-            self.conn.execute("""
+            self._execute("""
                 UPDATE emails 
                 SET enable_realtime_check = ?, updated_at = CURRENT_TIMESTAMP
                 WHERE id = ?
-            """, (1 if enable else 0, email_id))
-            self.conn.commit()
+            """, (1 if enable else 0, email_id)).result()
             logger.info(f"已{'启用' if enable else '禁用'}邮箱ID {email_id}的实时检查")
             return True
         except Exception as e:
@@ -0,0 +1,454 @@
+import sqlite3
+import threading
+import time
+import logging
+
+from . import config
+from utils.email.common import build_fallback_dedup_key
+
+# 配置日志
+logger = logging.getLogger('database')
+
+
+def column_exists(conn, table, column):
+    """检查表中是否存在某列"""
+    return any(info[1] == column for info in conn.execute(f"PRAGMA table_info({table})"))
+
+
+def add_column(conn, table, column, type_def):
+    """表中不存在某列时添加该列"""
+    if not column_exists(conn, table, column):
+        logger.info(f"向表 {table} 添加列 {column}")
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {type_def}")
+
+
+def enqueue_backfill(conn, name, done=False):
+    """登记一个后台回填任务，已登记的任务保持原有进度"""
+    conn.execute(
+        "INSERT OR IGNORE INTO schema_backfills (name, done) VALUES (?, ?)",
+        (name, 1 if done else 0)
+    )
+
+
+def _create_base_tables(conn):
+    """创建用户、邮箱、邮件记录和系统配置表"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            password_hash TEXT NOT NULL,
+            salt TEXT NOT NULL,
+            is_admin INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS emails (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            email TEXT NOT NULL,
+            password TEXT NOT NULL,
+            mail_type TEXT DEFAULT 'outlook',
+            server TEXT,
+            port INTEGER,
+            use_ssl INTEGER DEFAULT 1,
+            client_id TEXT,
+            refresh_token TEXT,
+            access_token TEXT,
+            last_check_time TIMESTAMP,
+            enable_realtime_check INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            UNIQUE (user_id, email)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS mail_records (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email_id INTEGER NOT NULL,
+            subject TEXT,
+            sender TEXT,
+            received_time TIMESTAMP,
+            content TEXT,
+            folder TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (email_id) REFERENCES emails (id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS system_config (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            key TEXT UNIQUE NOT NULL,
+            value TEXT,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # 早期版本的表缺少以下字段
+    add_column(conn, 'emails', 'enable_realtime_check', 'INTEGER DEFAULT 0')
+    add_column(conn, 'users', 'password_hash', "TEXT NOT NULL DEFAULT ''")
+    add_column(conn, 'users', 'salt', "TEXT NOT NULL DEFAULT ''")
+
+
+def _create_backfill_table(conn):
+    """创建后台回填任务的进度表"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_backfills (
+            name TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL DEFAULT 0,
+            done INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _add_dedup_key(conn):
+    """添加邮件去重键，去重键在同一邮箱内唯一，写入时依赖该索引执行 INSERT OR IGNORE"""
+    add_column(conn, 'mail_records', 'dedup_key', 'TEXT')
+    conn.execute("DROP INDEX IF EXISTS idx_mail_records_email_subject_sender")
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uix_mail_records_email_dedup_key "
+        "ON mail_records (email_id, dedup_key)"
+    )
+    _fill_dedup_keys(conn)
+
+
+def _fill_dedup_keys(conn):
+    """为缺少去重键的历史邮件生成去重键
+
+    保存邮件时只按去重键排除已存在的记录，去重键为空的历史邮件会被重复写入，
+    因此在迁移事务中同步补齐，迁移完成前不接受写入。
+    历史记录没有保存Message-ID，使用主题、发件人和接收时间的哈希值，
+    与同一邮箱内已有记录冲突的键后追加记录ID，保证唯一索引成立。
+    """
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, subject, sender, received_time FROM mail_records "
+            "WHERE dedup_key IS NULL AND id > ? ORDER BY id LIMIT ?",
+            (last_id, config.MIGRATION_BACKFILL_BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+
+        keys = {
+            row['id']: build_fallback_dedup_key(row['subject'], row['sender'], row['received_time'])
+            for row in rows
+        }
+        conn.executemany(
+            "UPDATE OR IGNORE mail_records SET dedup_key = ? WHERE id = ?",
+            [(key, record_id) for record_id, key in keys.items()]
+        )
+        # 因唯一索引冲突而未更新的记录
+        conflicts = conn.execute(
+            "SELECT id FROM mail_records WHERE dedup_key IS NULL AND id BETWEEN ? AND ?",
+            (rows[0]['id'], rows[-1]['id'])
+        ).fetchall()
+        conn.executemany(
+            "UPDATE mail_records SET dedup_key = ? WHERE id = ?",
+            [(f"{keys[row[0]]}:{row[0]}", row[0]) for row in conflicts]
+        )
+        last_id = rows[-1]['id']
+
+    # 早期版本把去重键登记为后台回填，补齐后不再需要
+    conn.execute("UPDATE schema_backfills SET done = 1, updated_at = CURRENT_TIMESTAMP WHERE name = 'dedup_keys'")
+
+
+def _add_snippet(conn):
+    """添加邮件摘要字段，列表和搜索接口只返回摘要"""
+    add_column(conn, 'mail_records', 'snippet', 'TEXT')
+    enqueue_backfill(conn, 'snippets')
+
+
+def _add_content_codec(conn):
+    """添加正文压缩算法标记"""
+    add_column(conn, 'mail_records', 'content_codec', 'TEXT')
+
+
+def _add_list_indexes(conn):
+    """添加邮件列表和实时检查使用的复合索引"""
+    # 邮件列表按 (received_time, id) 倒序分页，该索引同时覆盖过滤和排序
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_mail_records_email_received "
+        "ON mail_records (email_id, received_time DESC, id DESC)"
+    )
+    # 按用户查询开启实时检查的邮箱
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_emails_user_realtime "
+        "ON emails (user_id, enable_realtime_check)"
+    )
+
+
+def _add_mail_bodies(conn):
+    """按正文哈希去重保存的正文，多个邮件记录可以引用同一份正文"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS mail_bodies (
+            hash TEXT PRIMARY KEY,
+            content BLOB,
+            content_codec TEXT,
+            size INTEGER NOT NULL DEFAULT 0,
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_mail_bodies_unreferenced "
+        "ON mail_bodies (hash) WHERE ref_count <= 0"
+    )
+    add_column(conn, 'mail_records', 'body_hash', 'TEXT')
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_mail_records_body_hash "
+        "ON mail_records (body_hash)"
+    )
+    enqueue_backfill(conn, 'mail_bodies')
+
+
+def _add_fts(conn):
+    """创建邮件全文索引
+
+    使用无内容(contentless)的FTS5表，索引主题、发件人和正文。正文可能被压缩存储，
+    无法通过触发器直接建立索引，因此由写入和删除邮件的代码路径负责维护索引。
+    trigram分词可以匹配任意位置的子串，适用于中文等不以空格分词的文本。
+    已有邮件的索引由后台回填任务建立，建立完成前搜索使用LIKE匹配。
+    """
+    row = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type='table' AND name='mail_records_fts'"
+    ).fetchone()
+    if row and "content=''" in row[0]:
+        # 已是无内容表，索引在升级前已经建立
+        enqueue_backfill(conn, 'mail_fts', done=True)
+        return
+
+    # 旧版本使用外部内容表加触发器同步，需要重建为无内容表
+    if row:
+        logger.info("全文索引结构已变更，正在重建")
+        for trigger in ('mail_records_fts_ai', 'mail_records_fts_ad', 'mail_records_fts_au'):
+            conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        conn.execute("DROP TABLE mail_records_fts")
+
+    try:
+        conn.execute('''
+            CREATE VIRTUAL TABLE mail_records_fts USING fts5(
+                subject, sender, content,
+                content='', tokenize='trigram'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        # SQLite未编译FTS5或版本过低(trigram需要3.34+)时退回LIKE搜索
+        logger.warning(f"全文索引不可用，搜索将使用LIKE匹配: {str(e)}")
+        return
+    enqueue_backfill(conn, 'mail_fts')
+
+
+def _add_email_stats(conn):
+    """按邮箱保存邮件数、最新邮件时间和最近一次检查的结果
+
+    写入和删除邮件时增量维护，邮箱列表只需按主键连接该表。
+    已有邮箱的统计由后台回填任务计算。
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS email_stats (
+            email_id INTEGER PRIMARY KEY,
+            total_records INTEGER NOT NULL DEFAULT 0,
+            latest_received_time TIMESTAMP,
+            last_check_status TEXT,
+            last_check_duration_ms INTEGER,
+            last_new_count INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # 邮箱列表按创建时间倒序，索引避免额外排序
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_emails_user_created "
+        "ON emails (user_id, created_at DESC)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_emails_created "
+        "ON emails (created_at DESC)"
+    )
+    enqueue_backfill(conn, 'email_stats')
+
+
+def _add_mail_sync_state(conn):
+    """按邮箱和文件夹保存IMAP增量同步的位置
+
+    只获取UID大于 last_uid 的邮件；服务器的 UIDVALIDITY 变化后原有UID失效，需要重新全量同步。
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS mail_sync_state (
+            email_id INTEGER NOT NULL,
+            folder TEXT NOT NULL,
+            uidvalidity INTEGER,
+            last_uid INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (email_id, folder)
+        )
+    ''')
+
+
+def _add_attachments(conn):
+    """添加附件列表字段，JSON格式记录附件的文件名、类型和大小，不保存附件内容"""
+    add_column(conn, 'mail_records', 'attachments', 'TEXT')
+
+
+def _add_token_expiry(conn):
+    """添加访问令牌的过期时间（Unix时间戳，秒），令牌未过期时直接使用，不再每次检查都刷新"""
+    add_column(conn, 'emails', 'token_expires_at', 'REAL')
+
+
+# 按顺序执行的结构迁移，(版本号, 说明, 迁移函数)
+# 迁移函数必须是幂等的：旧数据库的版本号为0，但可能已经具备部分结构
+MIGRATIONS = [
+    (1, '创建基础表', _create_base_tables),
+    (2, '创建回填进度表', _create_backfill_table),
+    (3, '添加邮件去重键', _add_dedup_key),
+    (4, '添加邮件摘要', _add_snippet),
+    (5, '添加正文压缩标记', _add_content_codec),
+    (6, '添加列表查询索引', _add_list_indexes),
+    (7, '添加正文表', _add_mail_bodies),
+    (8, '添加全文索引', _add_fts),
+    (9, '添加邮箱统计表', _add_email_stats),
+    (10, '添加邮件同步状态表', _add_mail_sync_state),
+    (11, '添加附件列表', _add_attachments),
+    (12, '添加访问令牌过期时间', _add_token_expiry),
+    (13, '补齐历史邮件的去重键', _fill_dedup_keys),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+class MigrationRunner:
+    """数据库结构迁移
+
+    结构版本保存在数据库文件头的 PRAGMA user_version 中。每个迁移在独立的事务中执行，
+    并在同一事务内更新版本号，迁移失败时整体回滚，下次启动从失败的迁移重新开始。
+    """
+
+    def __init__(self, pool, migrations=None):
+        self.pool = pool
+        self.migrations = migrations or MIGRATIONS
+
+    def current_version(self):
+        """读取数据库当前的结构版本"""
+        return self.pool.reader().execute("PRAGMA user_version").fetchone()[0]
+
+    def migrate(self):
+        """执行所有未执行的迁移
+
+        Returns:
+            执行的迁移数量
+        """
+        version = self.current_version()
+        pending = [m for m in self.migrations if m[0] > version]
+        if not pending:
+            return 0
+
+        logger.info(f"数据库结构版本 {version}，需要执行 {len(pending)} 个迁移")
+        for target, description, apply in pending:
+            with self.pool.writer() as conn:
+                # DDL默认不会开启事务，显式开启以保证迁移和版本号一起提交
+                if not conn.in_transaction:
+                    conn.execute("BEGIN IMMEDIATE")
+                apply(conn)
+                conn.execute(f"PRAGMA user_version = {int(target)}")
+            logger.info(f"已执行数据库迁移 {target}: {description}")
+        return len(pending)
+
+
+class BackfillRunner:
+    """后台分批回填
+
+    回填任务由迁移登记到 schema_backfills 表，在后台线程中分批执行，不阻塞启动。
+    每批在一个写事务中完成，并在同一事务内记录进度，中断后从上次提交的位置继续。
+    """
+
+    def __init__(self, pool, batch_size=None, interval=None):
+        self.pool = pool
+        self.batch_size = batch_size or config.MIGRATION_BACKFILL_BATCH_SIZE
+        self.interval = config.MIGRATION_BACKFILL_INTERVAL if interval is None else interval
+        self._steps = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def register(self, name, step):
+        """注册回填任务的处理函数
+
+        Args:
+            name: 任务名，与迁移中登记的名称一致
+            step: step(conn, last_id, batch_size)，处理 id 大于 last_id 的一批记录，
+                  返回本批最后一条记录的 id，全部处理完成时返回 None
+        """
+        self._steps.append((name, step))
+
+    def load(self):
+        """读取回填任务的进度
+
+        Returns:
+            {任务名: (last_id, 是否完成)}
+        """
+        rows = self.pool.reader().execute("SELECT name, last_id, done FROM schema_backfills")
+        return {row['name']: (row['last_id'], bool(row['done'])) for row in rows}
+
+    def pending(self, state=None):
+        """返回已登记但尚未完成的任务名"""
+        state = self.load() if state is None else state
+        return [name for name, _ in self._steps if name in state and not state[name][1]]
+
+    def start(self, state=None):
+        """有未完成的任务时启动后台线程"""
+        if not self.pending(state):
+            return False
+        if self._thread is not None and self._thread.is_alive():
+            return True
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='db-backfill', daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        """请求后台线程在当前批次结束后退出"""
+        self._stop.set()
+
+    def _run(self):
+        """后台线程入口，回填失败只记录日志"""
+        try:
+            self.run()
+        except Exception as e:
+            logger.error(f"后台数据回填失败: {str(e)}")
+
+    def run(self):
+        """按注册顺序执行所有未完成的回填任务"""
+        state = self.load()
+        for name, step in self._steps:
+            if name not in state or state[name][1]:
+                continue
+            last_id = state[name][0]
+            logger.info(f"开始后台回填 {name}，从记录 {last_id} 之后继续")
+            started = time.time()
+            while not self._stop.is_set():
+                with self.pool.writer() as conn:
+                    next_id = step(conn, last_id, self.batch_size)
+                    if next_id is None:
+                        conn.execute(
+                            "UPDATE schema_backfills SET done = 1, updated_at = CURRENT_TIMESTAMP WHERE name = ?",
+                            (name,)
+                        )
+                    else:
+                        conn.execute(
+                            "UPDATE schema_backfills SET last_id = ?, updated_at = CURRENT_TIMESTAMP WHERE name = ?",
+                            (next_id, name)
+                        )
+                if next_id is None:
+                    logger.info(f"后台回填 {name} 完成，耗时 {time.time() - started:.1f} 秒")
+                    break
+                last_id = next_id
+                # 两批之间让出写连接，避免影响正常的写入
+                if self.interval:
+                    self._stop.wait(self.interval)
+            if self._stop.is_set():
+                logger.info("后台数据回填已停止，下次启动时继续")
+                return
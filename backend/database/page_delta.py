@@ -0,0 +1,98 @@
+import os
+import gzip
+import shutil
+import struct
+import hashlib
+
+# 增量文件格式: 文件头 + 若干 (页号, 页内容)，整体使用gzip压缩
+DELTA_MAGIC = b'FMDELTA1'
+DELTA_HEADER = struct.Struct('>III')  # 页大小、变更后的总页数、变更页数
+PAGE_NUMBER = struct.Struct('>I')
+
+# 每页摘要的字节数
+DIGEST_SIZE = 16
+
+
+def read_page_size(path):
+    """从数据库文件头读取页大小"""
+    with open(path, 'rb') as f:
+        header = f.read(100)
+    if len(header) < 100 or not header.startswith(b'SQLite format 3\x00'):
+        raise ValueError(f"不是有效的SQLite数据库文件: {path}")
+    page_size = struct.unpack('>H', header[16:18])[0]
+    # 文件头中用1表示65536
+    return 65536 if page_size == 1 else page_size
+
+
+def page_digests(path, page_size):
+    """计算数据库文件每一页的摘要
+
+    Returns:
+        所有页摘要按页号顺序拼接成的 bytes
+    """
+    digests = bytearray()
+    with open(path, 'rb') as f:
+        while True:
+            page = f.read(page_size)
+            if not page:
+                break
+            digests += hashlib.blake2b(page, digest_size=DIGEST_SIZE).digest()
+    return bytes(digests)
+
+
+def changed_pages(old_digests, new_digests):
+    """比较两组页摘要，返回新增或内容变化的页号(从1开始)"""
+    changed = []
+    old_count = len(old_digests) // DIGEST_SIZE
+    for index in range(len(new_digests) // DIGEST_SIZE):
+        start = index * DIGEST_SIZE
+        if index >= old_count or old_digests[start:start + DIGEST_SIZE] != new_digests[start:start + DIGEST_SIZE]:
+            changed.append(index + 1)
+    return changed
+
+
+def write_delta(db_path, delta_path, page_size, pages, compresslevel=6):
+    """把数据库文件中指定的页写入增量文件
+
+    Args:
+        db_path: 数据库快照文件
+        delta_path: 增量文件路径
+        page_size: 页大小
+        pages: 需要写入的页号列表
+    """
+    page_count = os.path.getsize(db_path) // page_size
+    with open(db_path, 'rb') as src, gzip.open(delta_path, 'wb', compresslevel=compresslevel) as dst:
+        dst.write(DELTA_MAGIC)
+        dst.write(DELTA_HEADER.pack(page_size, page_count, len(pages)))
+        for page_no in pages:
+            src.seek((page_no - 1) * page_size)
+            dst.write(PAGE_NUMBER.pack(page_no))
+            dst.write(src.read(page_size))
+
+
+def apply_delta(db_path, delta_path):
+    """把增量文件中的页写回数据库文件，并截断到变更后的页数"""
+    with gzip.open(delta_path, 'rb') as src, open(db_path, 'r+b') as dst:
+        if src.read(len(DELTA_MAGIC)) != DELTA_MAGIC:
+            raise ValueError(f"无效的增量文件: {delta_path}")
+        page_size, page_count, count = DELTA_HEADER.unpack(src.read(DELTA_HEADER.size))
+        for _ in range(count):
+            page_no = PAGE_NUMBER.unpack(src.read(PAGE_NUMBER.size))[0]
+            page = src.read(page_size)
+            if len(page) != page_size:
+                raise ValueError(f"增量文件不完整: {delta_path}")
+            dst.seek((page_no - 1) * page_size)
+            dst.write(page)
+        dst.truncate(page_count * page_size)
+
+
+def compress_file(path, target_path, compresslevel=6):
+    """gzip压缩文件"""
+    with open(path, 'rb') as src, gzip.open(target_path, 'wb', compresslevel=compresslevel) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+
+def decompress_file(path, target_path):
+    """解压gzip文件"""
+    with gzip.open(path, 'rb') as src, open(target_path, 'wb') as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
@@ -0,0 +1,45 @@
+import base64
+import json
+from datetime import datetime
+
+from . import config
+
+
+def clamp_page_limit(limit):
+    """把请求中的每页条数限制在允许范围内，无法解析时使用默认值"""
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return config.MAIL_RECORDS_PAGE_SIZE
+    if limit <= 0:
+        return config.MAIL_RECORDS_PAGE_SIZE
+    return min(limit, config.MAIL_RECORDS_MAX_PAGE_SIZE)
+
+
+def encode_cursor(received_time, record_id):
+    """把一页最后一条记录的 (received_time, id) 编码为不透明的游标字符串"""
+    if isinstance(received_time, datetime):
+        received_time = received_time.isoformat(sep=' ')
+    payload = json.dumps([received_time, record_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解析游标字符串
+
+    Returns:
+        (received_time, id) 元组，received_time 为字符串或 None
+
+    Raises:
+        ValueError: 游标格式无效
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        received_time, record_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise ValueError("无效的分页游标")
+    if received_time is not None and not isinstance(received_time, str):
+        raise ValueError("无效的分页游标")
+    if not isinstance(record_id, int):
+        raise ValueError("无效的分页游标")
+    return received_time, record_id
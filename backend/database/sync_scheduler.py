@@ -0,0 +1,203 @@
+import time
+import threading
+import logging
+from datetime import datetime
+
+from . import config
+
+# 配置日志
+logger = logging.getLogger('webdav')
+
+
+class SyncScheduler:
+    """后台合并执行的WebDAV同步调度器
+
+    写入只调用 mark_dirty() 标记数据库有变化，由后台线程在写入停止
+    quiet_period 秒后执行一次同步；持续写入时，距离第一次未同步的写入
+    超过 max_delay 秒也会同步，避免远程数据无限期落后。
+    同一时间只执行一次同步，同步期间的写入会在结束后触发下一次同步。
+    """
+
+    def __init__(self, sync_func, quiet_period=None, max_delay=None):
+        """初始化调度器
+
+        Args:
+            sync_func: 执行同步的函数，成功返回 True
+            quiet_period: 最后一次写入后等待的秒数
+            max_delay: 第一次未同步的写入最多等待的秒数
+        """
+        self.sync_func = sync_func
+        self.quiet_period = config.WEBDAV_SYNC_QUIET_PERIOD if quiet_period is None else quiet_period
+        self.max_delay = config.WEBDAV_SYNC_MAX_DELAY if max_delay is None else max_delay
+
+        self._cond = threading.Condition()
+        self._sync_lock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+        # 暂停期间只记录写入不同步，例如启动时检查远程数据库期间
+        self._held = False
+        # 第一次和最后一次未同步写入的时间(monotonic)，None 表示没有未同步的写入
+        self._dirty_since = None
+        self._last_write = None
+
+        self._syncing = False
+        self._last_sync_at = None
+        self._last_success_at = None
+        self._last_result = None
+        self._last_error = None
+        self._last_duration = None
+        self._sync_count = 0
+        self._failure_count = 0
+        self._coalesced_writes = 0
+
+    def mark_dirty(self):
+        """标记数据库有未同步的写入，立即返回"""
+        with self._cond:
+            if self._stopped:
+                return
+            now = time.monotonic()
+            if self._dirty_since is None:
+                self._dirty_since = now
+            self._last_write = now
+            self._coalesced_writes += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='webdav-sync', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _due_in(self, now):
+        """返回距离下一次应同步还需等待的秒数，没有未同步的写入时返回 None"""
+        if self._dirty_since is None:
+            return None
+        quiet_due = self._last_write + self.quiet_period
+        max_due = self._dirty_since + self.max_delay
+        return max(0.0, min(quiet_due, max_due) - now)
+
+    def _run(self):
+        """后台线程：等待到期后执行同步"""
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    wait = None if self._held else self._due_in(time.monotonic())
+                    if wait == 0:
+                        break
+                    self._cond.wait(wait)
+                if self._stopped:
+                    return
+                # 同步开始前清除标记，同步期间的写入会触发下一次同步
+                self._dirty_since = None
+                self._last_write = None
+                coalesced = self._coalesced_writes
+                self._coalesced_writes = 0
+
+            success = self._sync(coalesced)
+            if not success:
+                # 失败时重新标记，等待下一个周期重试
+                with self._cond:
+                    now = time.monotonic()
+                    if self._dirty_since is None:
+                        self._dirty_since = now
+                    self._last_write = now
+                    self._coalesced_writes += coalesced
+
+    def _sync(self, coalesced=0):
+        """执行一次同步并记录结果"""
+        with self._sync_lock:
+            self._syncing = True
+            started = time.time()
+            try:
+                success = bool(self.sync_func())
+                error = None if success else '同步失败'
+            except Exception as e:
+                success = False
+                error = str(e)
+                logger.error(f"后台同步到WebDAV失败: {error}")
+            finally:
+                self._syncing = False
+
+            self._last_sync_at = datetime.now().isoformat(timespec='seconds')
+            self._last_duration = round(time.time() - started, 3)
+            self._last_result = 'success' if success else 'failed'
+            self._last_error = error
+            self._sync_count += 1
+            if success:
+                self._last_success_at = self._last_sync_at
+                if coalesced:
+                    logger.debug(f"后台同步到WebDAV完成，合并了 {coalesced} 次写入")
+            else:
+                self._failure_count += 1
+            return success
+
+    def hold(self):
+        """暂停后台同步，期间的写入在 release() 后再同步"""
+        with self._cond:
+            self._held = True
+
+    def release(self):
+        """恢复后台同步"""
+        with self._cond:
+            self._held = False
+            self._cond.notify()
+
+    def sync_now(self):
+        """立即同步一次并等待结果，与后台同步互斥
+
+        Returns:
+            同步是否成功
+        """
+        with self._cond:
+            pending = self._dirty_since is not None
+            self._dirty_since = None
+            self._last_write = None
+            coalesced = self._coalesced_writes
+            self._coalesced_writes = 0
+        success = self._sync(coalesced)
+        if not success and pending:
+            self.mark_dirty()
+        return success
+
+    def flush(self):
+        """有未同步的写入时立即同步，用于关闭前"""
+        with self._cond:
+            pending = self._dirty_since is not None
+        if pending:
+            return self.sync_now()
+        return True
+
+    def stop(self, flush=True):
+        """停止后台线程
+
+        Args:
+            flush: 停止前是否同步未同步的写入
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            thread.join()
+        if flush:
+            self.flush()
+
+    def status(self):
+        """返回同步状态"""
+        with self._cond:
+            pending = self._dirty_since is not None
+            pending_writes = self._coalesced_writes
+            due_in = self._due_in(time.monotonic())
+        return {
+            'pending': pending,
+            'held': self._held,
+            'pending_writes': pending_writes,
+            'next_sync_in': round(due_in, 1) if due_in is not None else None,
+            'syncing': self._syncing,
+            'last_sync_at': self._last_sync_at,
+            'last_success_at': self._last_success_at,
+            'last_result': self._last_result,
+            'last_error': self._last_error,
+            'last_duration': self._last_duration,
+            'sync_count': self._sync_count,
+            'failure_count': self._failure_count,
+            'quiet_period': self.quiet_period,
+            'max_delay': self.max_delay,
+        }
@@ -1,19 +1,38 @@
 import os
-import logging
+import json
 import time
+import shutil
+import sqlite3
+import logging
+import tempfile
+import threading
 from datetime import datetime
 from webdav3.client import Client
 from . import config
+from .backup import copy_snapshot
+from .page_delta import (
+    DIGEST_SIZE, read_page_size, page_digests, changed_pages,
+    write_delta, apply_delta, compress_file, decompress_file
+)
 
 # 配置日志
 logger = logging.getLogger('webdav')
 
 class WebDAVHandler:
-    """WebDAV文件同步处理器"""
+    """WebDAV文件同步处理器
+    
+    支持两种同步模式(WEBDAV_SYNC_MODE)：
+    - full: 每次上传整个数据库文件
+    - delta: 首次上传压缩的基础快照，之后只上传与上次同步相比发生变化的数据库页，
+      增量过多时重新上传基础快照。远程目录中的 manifest.json 记录基础快照和增量的顺序。
+    """
     
     def __init__(self):
         """初始化WebDAV处理器"""
         self.enabled = config.WEBDAV_ENABLED
+        self._sync_lock = threading.Lock()
+        # 最近一次从远程恢复的状态
+        self.restore_status = {'status': None, 'checked_at': None, 'error': None}
         
         if not self.enabled:
             logger.info("WebDAV 同步未启用")
@@ -40,6 +59,11 @@ class WebDAVHandler:
             self.remote_db_path = os.path.join(self.root_path, self.db_name)
             self.local_db_path = config.SQLITE_DB_PATH
             
+            # 增量同步的远程目录和本地状态目录
+            self.sync_mode = (config.WEBDAV_SYNC_MODE or 'delta').lower()
+            self.remote_delta_path = os.path.join(self.root_path, f"{self.db_name}.delta")
+            self.state_dir = os.path.join(os.path.dirname(self.local_db_path), 'webdav_sync')
+            
             # 确保远程目录存在
             self._ensure_remote_directory()
             
@@ -57,6 +81,9 @@ class WebDAVHandler:
             if not self.client.check(self.root_path):
                 logger.info(f"创建远程目录: {self.root_path}")
                 self.client.mkdir(self.root_path)
+            if self.sync_mode == 'delta' and not self.client.check(self.remote_delta_path):
+                logger.info(f"创建远程增量目录: {self.remote_delta_path}")
+                self.client.mkdir(self.remote_delta_path)
         except Exception as e:
             logger.error(f"创建远程目录失败: {str(e)}")
             
@@ -72,12 +99,20 @@ class WebDAVHandler:
             if not os.path.exists(self.local_db_path):
                 logger.error(f"本地数据库文件不存在: {self.local_db_path}")
                 return False
+            
+            if self.sync_mode == 'delta':
+                with self._sync_lock:
+                    success = self._sync_delta_to_remote()
+                if success:
+                    self._record_remote_state()
+                return success
                 
             # 上传到WebDAV
             self.client.upload_sync(
                 remote_path=self.remote_db_path,
                 local_path=self.local_db_path
             )
+            self._record_remote_state()
             
             logger.info(f"数据库成功同步到WebDAV: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
             return True
@@ -86,39 +121,359 @@ class WebDAVHandler:
             return False
             
     def sync_from_remote(self):
-        """从WebDAV服务器同步数据库到本地"""
+        """从WebDAV服务器同步数据库到本地，总是重新下载"""
         if not self.enabled:
             logger.debug("WebDAV同步未启用，跳过从远程同步")
             return False
-            
+        return self.restore_if_changed(force=True) == 'restored'
+    
+    def restore_if_changed(self, force=False, install=None):
+        """远程数据库有变化时下载并替换本地数据库
+        
+        比较远程文件的ETag、大小和修改时间与上次同步时的记录，一致且本地数据库存在时跳过下载。
+        下载先写入临时文件并校验，通过后才原子替换本地数据库。
+        
+        Args:
+            force: 不做比较，总是下载
+            install: 执行替换的函数，参数为完成替换的回调；应用运行中恢复时，
+                     调用方借此在替换前后释放数据库连接
+        
+        Returns:
+            'restored'、'up_to_date'、'no_remote' 或 'failed'
+        """
+        if not self.enabled:
+            return 'failed'
+        
+        self._set_restore_status('checking')
         try:
-            # 检查远程文件是否存在
-            if not self.client.check(self.remote_db_path):
-                logger.warning(f"远程数据库文件不存在: {self.remote_db_path}")
-                return False
-                
-            logger.info(f"开始从WebDAV同步数据库到本地: {self.local_db_path}")
+            with self._sync_lock:
+                result = self._restore(force, install)
+            self._set_restore_status(result)
+            return result
+        except Exception as e:
+            logger.error(f"从WebDAV同步数据库失败: {str(e)}")
+            self._set_restore_status('failed', str(e))
+            return 'failed'
+    
+    def _set_restore_status(self, status, error=None):
+        """更新恢复状态"""
+        self.restore_status = {
+            'status': status,
+            'checked_at': datetime.now().isoformat(timespec='seconds'),
+            'error': error,
+        }
+    
+    def _restore(self, force, install):
+        """比较远程状态，需要时下载、校验并替换本地数据库"""
+        remote_path = self.remote_db_path
+        if self.sync_mode == 'delta' and self.client.check(self._remote_path('manifest.json')):
+            remote_path = self._remote_path('manifest.json')
+        
+        fingerprint = self._remote_fingerprint(remote_path)
+        if fingerprint is None:
+            logger.warning(f"远程数据库文件不存在: {self.remote_db_path}")
+            return 'no_remote'
+        
+        local_exists = os.path.exists(self.local_db_path)
+        if not force and local_exists and self._same_remote(self._load_remote_record(), fingerprint):
+            logger.info("远程数据库自上次同步后没有变化，跳过下载")
+            return 'up_to_date'
+        
+        os.makedirs(self.state_dir, exist_ok=True)
+        work_dir = tempfile.mkdtemp(prefix='restore_', dir=self.state_dir)
+        try:
+            if remote_path == self.remote_db_path:
+                logger.info(f"开始从WebDAV同步数据库到本地: {self.local_db_path}")
+                db_path = self._download_full(work_dir)
+                self._install(db_path, install)
+            else:
+                manifest = self._read_remote_manifest()
+                local_manifest, _ = self._load_local_state()
+                # 远程记录变化但清单与本地一致(例如服务器改写了修改时间)，只更新记录
+                if (not force and local_exists and local_manifest
+                        and local_manifest.get('base') == manifest.get('base')
+                        and len(local_manifest.get('deltas', [])) == len(manifest.get('deltas', []))):
+                    self._save_remote_record(fingerprint)
+                    logger.info("远程增量清单与本地一致，跳过下载")
+                    return 'up_to_date'
+                db_path, digests = self._download_delta(manifest, work_dir)
+                self._install(db_path, install)
+                self._save_local_state(manifest, digests)
             
-            # 备份本地数据库(如果存在)
-            if os.path.exists(self.local_db_path):
-                backup_path = f"{self.local_db_path}.bak.{int(time.time())}"
-                os.rename(self.local_db_path, backup_path)
-                logger.info(f"已备份本地数据库: {backup_path}")
-                
-            # 确保目标目录存在
+            self._save_remote_record(fingerprint)
+            logger.info(f"数据库成功从WebDAV同步到本地: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+            return 'restored'
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    
+    def _remote_fingerprint(self, remote_path):
+        """读取远程文件的ETag、大小和修改时间，文件不存在时返回 None"""
+        if not self.client.check(remote_path):
+            return None
+        info = self.client.info(remote_path)
+        return {
+            'path': remote_path,
+            'etag': info.get('etag'),
+            'size': info.get('size'),
+            'modified': info.get('modified'),
+        }
+    
+    def _same_remote(self, record, fingerprint):
+        """判断远程文件是否与上次同步时一致，服务器不返回任何元数据时视为有变化"""
+        if not record or not any(fingerprint.get(key) for key in ('etag', 'size', 'modified')):
+            return False
+        return all(record.get(key) == fingerprint.get(key) for key in ('path', 'etag', 'size', 'modified'))
+    
+    def _load_remote_record(self):
+        """读取上次同步时记录的远程文件状态"""
+        path = os.path.join(self.state_dir, 'remote.json')
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"读取远程文件记录失败: {str(e)}")
+            return None
+    
+    def _save_remote_record(self, fingerprint):
+        """记录远程文件状态，下次启动时据此判断是否需要下载"""
+        if not fingerprint:
+            return
+        os.makedirs(self.state_dir, exist_ok=True)
+        path = os.path.join(self.state_dir, 'remote.json')
+        record = dict(fingerprint, recorded_at=datetime.now().isoformat(timespec='seconds'))
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False, indent=2)
+        os.replace(f"{path}.tmp", path)
+    
+    def _record_remote_state(self):
+        """上传完成后记录远程文件状态，避免下次启动时重新下载自己上传的数据"""
+        try:
+            if self.sync_mode == 'delta':
+                remote_path = self._remote_path('manifest.json')
+            else:
+                remote_path = self.remote_db_path
+            self._save_remote_record(self._remote_fingerprint(remote_path))
+        except Exception as e:
+            logger.warning(f"记录远程文件状态失败: {str(e)}")
+    
+    def _download_full(self, work_dir):
+        """把远程完整数据库下载到临时文件并校验"""
+        db_path = os.path.join(work_dir, 'download.db')
+        self.client.download_sync(remote_path=self.remote_db_path, local_path=db_path)
+        self._verify(db_path)
+        return db_path
+    
+    def _verify(self, db_path):
+        """校验下载或重建的数据库"""
+        conn = sqlite3.connect(db_path)
+        try:
+            result = conn.execute("PRAGMA quick_check").fetchone()[0]
+        finally:
+            conn.close()
+        if result != 'ok':
+            raise ValueError(f"下载的数据库校验失败: {result}")
+    
+    def _install(self, db_path, install=None):
+        """用校验过的临时文件原子替换本地数据库"""
+        def swap():
+            self._move_local_aside()
             os.makedirs(os.path.dirname(self.local_db_path), exist_ok=True)
-                
-            # 下载到本地
-            self.client.download_sync(
-                remote_path=self.remote_db_path,
-                local_path=self.local_db_path
-            )
+            os.replace(db_path, self.local_db_path)
+        
+        if install:
+            install(swap)
+        else:
+            swap()
+    
+    def _move_local_aside(self):
+        """把本地数据库连同WAL文件改名备份，避免旧的WAL被应用到新数据库上"""
+        if not os.path.exists(self.local_db_path):
+            return
+        backup_path = f"{self.local_db_path}.bak.{int(time.time())}"
+        os.rename(self.local_db_path, backup_path)
+        if os.path.exists(f"{self.local_db_path}-wal"):
+            os.rename(f"{self.local_db_path}-wal", f"{backup_path}-wal")
+        if os.path.exists(f"{self.local_db_path}-shm"):
+            os.remove(f"{self.local_db_path}-shm")
+        logger.info(f"已备份本地数据库: {backup_path}")
+    
+    def _remote_path(self, name):
+        """增量目录中文件的远程路径"""
+        return os.path.join(self.remote_delta_path, name)
+    
+    def _read_remote_manifest(self):
+        """读取远程的增量清单，不存在时返回 None"""
+        path = self._remote_path('manifest.json')
+        if not self.client.check(path):
+            return None
+        os.makedirs(self.state_dir, exist_ok=True)
+        fd, local_path = tempfile.mkstemp(prefix='manifest_', suffix='.json', dir=self.state_dir)
+        os.close(fd)
+        try:
+            self.client.download_sync(remote_path=path, local_path=local_path)
+            with open(local_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        finally:
+            os.remove(local_path)
+    
+    def _write_remote_manifest(self, manifest, work_dir):
+        """上传增量清单，清单最后上传，远程始终指向完整的快照和增量"""
+        local_path = os.path.join(work_dir, 'manifest.json')
+        with open(local_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        self.client.upload_sync(remote_path=self._remote_path('manifest.json'), local_path=local_path)
+    
+    def _load_local_state(self):
+        """读取上次同步时的清单和页摘要"""
+        manifest_path = os.path.join(self.state_dir, 'manifest.json')
+        digests_path = os.path.join(self.state_dir, 'pages.bin')
+        if not os.path.exists(manifest_path) or not os.path.exists(digests_path):
+            return None, b''
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            with open(digests_path, 'rb') as f:
+                digests = f.read()
+            return manifest, digests
+        except Exception as e:
+            logger.warning(f"读取本地同步状态失败，将重新上传基础快照: {str(e)}")
+            return None, b''
+    
+    def _save_local_state(self, manifest, digests):
+        """保存本次同步的清单和页摘要，先写临时文件再替换"""
+        os.makedirs(self.state_dir, exist_ok=True)
+        manifest_path = os.path.join(self.state_dir, 'manifest.json')
+        digests_path = os.path.join(self.state_dir, 'pages.bin')
+        with open(f"{digests_path}.tmp", 'wb') as f:
+            f.write(digests)
+        with open(f"{manifest_path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(f"{digests_path}.tmp", digests_path)
+        os.replace(f"{manifest_path}.tmp", manifest_path)
+    
+    def _sync_delta_to_remote(self):
+        """增量同步：只上传与上次同步相比发生变化的页"""
+        os.makedirs(self.state_dir, exist_ok=True)
+        work_dir = tempfile.mkdtemp(prefix='sync_', dir=self.state_dir)
+        try:
+            # 在线复制一个一致的快照，不阻塞写入
+            snapshot_path = os.path.join(work_dir, 'snapshot.db')
+            copy_snapshot(self.local_db_path, snapshot_path)
+            page_size = read_page_size(snapshot_path)
+            digests = page_digests(snapshot_path, page_size)
+            page_count = len(digests) // DIGEST_SIZE
             
-            logger.info(f"数据库成功从WebDAV同步到本地: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+            manifest, old_digests = self._load_local_state()
+            remote_manifest = self._read_remote_manifest()
+            
+            # 本地状态与远程不一致(首次同步、远程被修改或清理)时重新上传基础快照
+            if (not manifest or not remote_manifest
+                    or remote_manifest.get('base') != manifest.get('base')
+                    or len(remote_manifest.get('deltas', [])) != len(manifest.get('deltas', []))
+                    or manifest.get('page_size') != page_size):
+                return self._upload_base(snapshot_path, digests, page_size, work_dir, remote_manifest)
+            
+            pages = changed_pages(old_digests, digests)
+            if not pages and page_count == manifest['page_count']:
+                logger.info("数据库自上次同步后没有变化，跳过上传")
+                return True
+            
+            # 增量过多、累计大小或本次变化的页数超过一定比例时压缩为新的基础快照
+            delta_bytes = sum(delta['size'] for delta in manifest['deltas'])
+            if (len(manifest['deltas']) >= config.WEBDAV_DELTA_MAX_COUNT
+                    or delta_bytes > manifest['base_size'] * config.WEBDAV_DELTA_COMPACT_RATIO
+                    or len(pages) > page_count * config.WEBDAV_DELTA_COMPACT_RATIO):
+                logger.info(
+                    f"已有 {len(manifest['deltas'])} 个增量，共 {delta_bytes} 字节，"
+                    f"本次 {len(pages)}/{page_count} 页发生变化，重新上传基础快照"
+                )
+                return self._upload_base(snapshot_path, digests, page_size, work_dir, manifest)
+            
+            seq = len(manifest['deltas']) + 1
+            delta_name = f"{manifest['base']}-{seq:06d}.delta.gz"
+            delta_path = os.path.join(work_dir, delta_name)
+            write_delta(snapshot_path, delta_path, page_size, pages)
+            self.client.upload_sync(remote_path=self._remote_path(delta_name), local_path=delta_path)
+            
+            manifest['deltas'].append({
+                'file': delta_name,
+                'pages': len(pages),
+                'size': os.path.getsize(delta_path),
+                'page_count': page_count,
+                'created_at': datetime.now().isoformat(timespec='seconds'),
+            })
+            manifest['page_count'] = page_count
+            manifest['updated_at'] = datetime.now().isoformat(timespec='seconds')
+            self._write_remote_manifest(manifest, work_dir)
+            self._save_local_state(manifest, digests)
+            
+            logger.info(
+                f"数据库增量同步完成: {len(pages)}/{page_count} 页发生变化，"
+                f"上传 {os.path.getsize(delta_path)} 字节"
+            )
             return True
-        except Exception as e:
-            logger.error(f"从WebDAV同步数据库失败: {str(e)}")
-            return False
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    
+    def _upload_base(self, snapshot_path, digests, page_size, work_dir, old_manifest):
+        """上传新的基础快照，并删除旧的基础快照和增量"""
+        base_id = datetime.now().strftime('%Y%m%d%H%M%S%f')
+        base_name = f"base-{base_id}.db.gz"
+        base_path = os.path.join(work_dir, base_name)
+        compress_file(snapshot_path, base_path)
+        self.client.upload_sync(remote_path=self._remote_path(base_name), local_path=base_path)
+        
+        manifest = {
+            'format': 1,
+            'page_size': page_size,
+            'base': base_id,
+            'base_file': base_name,
+            'base_size': os.path.getsize(base_path),
+            'page_count': len(digests) // DIGEST_SIZE,
+            'deltas': [],
+            'updated_at': datetime.now().isoformat(timespec='seconds'),
+        }
+        self._write_remote_manifest(manifest, work_dir)
+        self._save_local_state(manifest, digests)
+        logger.info(f"已上传基础快照: {base_name}, {manifest['base_size']} 字节")
+        
+        # 新清单生效后再删除旧文件，清理失败不影响同步结果
+        if old_manifest:
+            stale = [old_manifest.get('base_file')] + [delta['file'] for delta in old_manifest.get('deltas', [])]
+            for name in stale:
+                if not name:
+                    continue
+                try:
+                    self.client.clean(self._remote_path(name))
+                except Exception as e:
+                    logger.warning(f"删除旧的同步文件失败: {name}, 错误: {str(e)}")
+        return True
+    
+    def _download_delta(self, manifest, work_dir):
+        """下载基础快照并依次应用增量，在临时文件中重建数据库
+        
+        Returns:
+            (重建的数据库路径, 页摘要) 元组
+        """
+        logger.info(f"开始从WebDAV增量恢复数据库: 基础快照 {manifest['base_file']}，{len(manifest['deltas'])} 个增量")
+        base_path = os.path.join(work_dir, manifest['base_file'])
+        db_path = os.path.join(work_dir, 'restore.db')
+        self.client.download_sync(remote_path=self._remote_path(manifest['base_file']), local_path=base_path)
+        decompress_file(base_path, db_path)
+        os.remove(base_path)
+        
+        for delta in manifest['deltas']:
+            delta_path = os.path.join(work_dir, delta['file'])
+            self.client.download_sync(remote_path=self._remote_path(delta['file']), local_path=delta_path)
+            apply_delta(db_path, delta_path)
+            os.remove(delta_path)
+        
+        # 先计算页摘要，校验时打开数据库不会修改数据页
+        digests = page_digests(db_path, manifest['page_size'])
+        self._verify(db_path)
+        return db_path, digests
             
     def list_remote_backups(self):
         """列出WebDAV上的所有数据库备份"""
@@ -127,24 +482,51 @@ class WebDAVHandler:
             
         try:
             files = self.client.list(self.root_path)
-            backups = [f for f in files if f.endswith('.db') or f.endswith('.sqlite')]
+            backups = [f for f in files if f.endswith('.db') or f.endswith('.sqlite') or f.endswith('.db.gz')]
             logger.info(f"找到 {len(backups)} 个远程数据库备份")
             return backups
         except Exception as e:
             logger.error(f"列出WebDAV备份失败: {str(e)}")
             return []
             
-    def create_remote_backup(self):
-        """在WebDAV上创建数据库备份"""
+    def create_remote_backup(self, local_backup_path=None):
+        """在WebDAV上创建数据库备份
+        
+        Args:
+            local_backup_path: 已生成的本地压缩备份，提供时直接上传该文件
+        """
         if not self.enabled:
             return False
             
         try:
+            if local_backup_path:
+                backup_name = os.path.basename(local_backup_path)
+                self.client.upload_sync(
+                    remote_path=os.path.join(self.root_path, backup_name),
+                    local_path=local_backup_path
+                )
+                logger.info(f"已上传远程数据库备份: {backup_name}")
+                return True
+            
             # 生成带时间戳的备份文件名
             timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
             backup_name = f"firemail_backup_{timestamp}.db"
             backup_path = os.path.join(self.root_path, backup_name)
             
+            if self.sync_mode == 'delta':
+                # 增量模式下远程没有完整的数据库文件，上传一个压缩快照
+                os.makedirs(self.state_dir, exist_ok=True)
+                work_dir = tempfile.mkdtemp(prefix='backup_', dir=self.state_dir)
+                try:
+                    snapshot_path = os.path.join(work_dir, 'snapshot.db')
+                    copy_snapshot(self.local_db_path, snapshot_path)
+                    compress_file(snapshot_path, f"{snapshot_path}.gz")
+                    self.client.upload_sync(remote_path=f"{backup_path}.gz", local_path=f"{snapshot_path}.gz")
+                finally:
+                    shutil.rmtree(work_dir, ignore_errors=True)
+                logger.info(f"已创建远程数据库备份: {backup_name}.gz")
+                return True
+            
             # 先同步最新数据
             if self.sync_to_remote():
                 # 在远程创建备份
@@ -156,4 +538,4 @@ class WebDAVHandler:
                 return False
         except Exception as e:
             logger.error(f"创建远程备份失败: {str(e)}")
-            return False 
\ No newline at end of file
+            return False
\ No newline at end of file
@@ -0,0 +1,112 @@
+"""
+测试共用的夹具
+本地服务器使用 standins.py 中的简化实现，不连接外部服务。
+"""
+
+import threading
+
+import pytest
+from flask import Flask
+
+from database import config
+from database.database import Database as AppDatabase
+from database.db import Database
+from utils.email.http_pool import http_pool
+from tests.standins import IMAPStandIn, TokenStandIn, build_messages
+
+
+def serve(server):
+    """在后台线程中运行本地服务器"""
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+@pytest.fixture
+def imap_server():
+    """有两封邮件、没有延迟的本地IMAP服务器"""
+    server = serve(IMAPStandIn(build_messages(2, 256), 0))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def db(tmp_path):
+    """临时目录中的数据库，结构迁移完成、后台回填执行完毕后返回"""
+    database = open_database(tmp_path / 'test.db')
+    yield database
+    database.close()
+
+
+def open_database(path):
+    """打开指定路径的数据库，与启动时一样执行迁移，并等待后台回填完成"""
+    database = Database.open(str(path))
+    wait_for_backfills(database)
+    return database
+
+
+@pytest.fixture
+def app_db(tmp_path, monkeypatch):
+    """应用使用的SQLAlchemy数据库，SQLite文件位于临时目录，在应用上下文中返回"""
+    path = tmp_path / 'app.db'
+    monkeypatch.setattr(config, 'DB_TYPE', 'sqlite')
+    monkeypatch.setattr(config, 'WEBDAV_ENABLED', False)
+    monkeypatch.setattr(config, 'SQLITE_DB_PATH', str(path))
+    monkeypatch.setattr(config, 'SQLALCHEMY_DATABASE_URI', f'sqlite:///{path}')
+    monkeypatch.setattr(AppDatabase, '_instance', None)
+    app = Flask(__name__)
+    database = AppDatabase()
+    database.init_app(app)
+    wait_for_backfills(database.store)
+    with app.app_context():
+        yield database
+    database.close()
+
+
+@pytest.fixture
+def app_user_id(app_db):
+    """应用数据库中的测试用户"""
+    app_db.create_user('tester', 'secret')
+    return app_db.authenticate_user('tester', 'secret').id
+
+
+@pytest.fixture
+def app_email_id(app_db, app_user_id):
+    """应用数据库中测试用户名下的一个IMAP邮箱"""
+    app_db.add_email(app_user_id, 'tester@example.com', 'secret', mail_type='imap')
+    return app_db.get_emails_by_user_id(app_user_id)[0]['id']
+
+
+def wait_for_backfills(database):
+    """等待后台回填线程结束"""
+    thread = database.backfills._thread
+    if thread is not None:
+        thread.join(10)
+
+
+@pytest.fixture
+def user_id(db):
+    """测试用户"""
+    db.create_user('tester', 'secret')
+    return db._reader().execute("SELECT id FROM users WHERE username = 'tester'").fetchone()[0]
+
+
+@pytest.fixture
+def email_id(db, user_id):
+    """测试用户名下的一个IMAP邮箱"""
+    return db.add_email(user_id, 'tester@example.com', 'secret', mail_type='imap', server='127.0.0.1', port=143, use_ssl=False)
+
+
+@pytest.fixture
+def token_server(monkeypatch):
+    """本地令牌接口，每个请求等待0.1秒，令牌接口地址指向它"""
+    server = serve(TokenStandIn(0.1, 0, 0))
+    monkeypatch.setattr(config, 'OUTLOOK_TOKEN_URL', f'http://127.0.0.1:{server.server_address[1]}/token')
+    monkeypatch.setattr(http_pool, 'backoff', 0.01)
+    http_pool.close()
+    yield server
+    http_pool.close()
+    server.stopped.set()
+    server.shutdown()
+    server.server_close()
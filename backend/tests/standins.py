@@ -0,0 +1,302 @@
+"""
+测试和基准测试共用的本地服务器
+
+简化的IMAP服务器和Outlook令牌接口，只实现收信和刷新令牌用到的部分，不连接外部服务。
+"""
+
+import os
+import re
+import json
+import time
+import email
+import socket
+import threading
+import socketserver
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from email.utils import format_datetime
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COMMAND_PATTERN = re.compile(r'^(\S+) (?:UID )?(\S+)(?: (.*))?$', re.IGNORECASE)
+
+
+def build_messages(count, size, attachment_size=0):
+    """生成 count 封正文约为 size 字节的邮件，UID从1开始，attachment_size 大于0时附带一个附件"""
+    messages = {}
+    started = datetime(2024, 1, 1)
+    for uid in range(1, count + 1):
+        msg = EmailMessage()
+        msg['Subject'] = f'benchmark {uid}'
+        msg['From'] = 'sender@example.com'
+        msg['To'] = 'bench@example.com'
+        msg['Date'] = format_datetime(started + timedelta(minutes=uid))
+        msg['Message-ID'] = f'<bench-{uid}@example.com>'
+        msg.set_content(('x' * 76 + '\n') * max(1, size // 77))
+        if attachment_size:
+            msg.add_attachment(os.urandom(attachment_size), maintype='application',
+                               subtype='octet-stream', filename=f'report-{uid}.bin')
+        messages[uid] = msg.as_bytes()
+    return messages
+
+
+def parse_uid_set(text, max_uid):
+    """解析消息集，如 1:5,8,10:*"""
+    uids = []
+    for part in text.split(','):
+        if ':' in part:
+            start, end = part.split(':')
+            end = max_uid if end == '*' else int(end)
+            uids.extend(range(int(start), end + 1))
+        else:
+            uids.append(max_uid if part == '*' else int(part))
+    return uids
+
+
+def quote(value):
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def body_structure(part):
+    """按 RFC 3501 的格式生成邮件部分的 BODYSTRUCTURE，信封等收信用不到的字段为 NIL"""
+    if part.is_multipart() and part.get_content_type() != 'message/rfc822':
+        children = ''.join(body_structure(child) for child in part.get_payload())
+        return f'({children} {quote(part.get_content_subtype().upper())})'
+    params = ' '.join(f'{quote(name)} {quote(value)}' for name, value in (part.get_params() or [])[1:]) or None
+    raw = part_body(part)
+    fields = [
+        quote(part.get_content_maintype().upper()), quote(part.get_content_subtype().upper()),
+        f'({params})' if params else 'NIL', 'NIL', 'NIL',
+        quote((part.get('Content-Transfer-Encoding') or '7bit').upper()), str(len(raw)),
+    ]
+    if part.get_content_type() == 'message/rfc822':
+        fields += ['NIL', body_structure(part.get_payload(0)), str(raw.count(b'\n'))]
+    elif part.get_content_maintype() == 'text':
+        fields.append(str(raw.count(b'\n')))
+    disposition = part.get_content_disposition()
+    if disposition:
+        filename = part.get_filename()
+        disposition = f'({quote(disposition)} ' + (f'("filename" {quote(filename)})' if filename else 'NIL') + ')'
+    fields += ['NIL', disposition or 'NIL', 'NIL', 'NIL']
+    return '(' + ' '.join(fields) + ')'
+
+
+def part_body(part):
+    """部分的原始内容(传输编码后)"""
+    return part.as_bytes().split(b'\n\n', 1)[-1]
+
+
+def find_part(msg, section):
+    """按部分编号查找邮件部分，非多部分的邮件只有部分1"""
+    part = msg
+    for index in section.split('.'):
+        if part.is_multipart() and part.get_content_type() != 'message/rfc822':
+            part = part.get_payload()[int(index) - 1]
+    return part
+
+
+class IMAPStandInHandler(socketserver.StreamRequestHandler):
+    """只实现收信需要的命令：LOGIN、SELECT、EXAMINE、UID SEARCH、UID FETCH、IDLE、CLOSE、LOGOUT"""
+
+    # 响应分多次写入，关闭Nagle算法避免额外的等待
+    disable_nagle_algorithm = True
+
+    def send(self, line):
+        self.write(line.encode() + b'\r\n')
+
+    def setup(self):
+        super().setup()
+        # IDLE 期间新邮件通知由投递邮件的线程写入
+        self.write_lock = threading.Lock()
+
+    def write(self, data):
+        with self.write_lock:
+            self.server.bytes_sent += len(data)
+            self.wfile.write(data)
+
+    def handle(self):
+        messages = self.server.messages
+        latency = self.server.latency
+        self.send('* OK [CAPABILITY IMAP4rev1 IDLE] IMAP stand-in ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            match = COMMAND_PATTERN.match(line.decode().strip())
+            if not match:
+                continue
+            tag, command, args = match.group(1), match.group(2).upper(), match.group(3) or ''
+            # 模拟一次网络往返
+            if latency:
+                time.sleep(latency)
+            if command == 'CAPABILITY':
+                self.send('* CAPABILITY IMAP4rev1 IDLE')
+            elif command in ('SELECT', 'EXAMINE'):
+                self.send(f'* {len(messages)} EXISTS')
+                self.send(f'* OK [UIDVALIDITY {self.server.uidvalidity}] UIDs valid')
+                self.send(f'* OK [UIDNEXT {max(messages, default=0) + 1}] Predicted next UID')
+                self.send(f'{tag} OK [READ-WRITE] SELECT completed')
+                continue
+            elif command == 'SEARCH':
+                uids = sorted(messages)
+                if args.upper().startswith('UID '):
+                    wanted = set(parse_uid_set(args[4:], max(messages)))
+                    uids = [uid for uid in uids if uid in wanted]
+                self.send('* SEARCH ' + ' '.join(map(str, uids)))
+            elif command == 'FETCH':
+                uid_set, items = args.split(' ', 1)
+                for uid in parse_uid_set(uid_set, max(messages)):
+                    if uid in messages:
+                        self.write(f'* {uid} FETCH (UID {uid}'.encode())
+                        for name, body in self.fetch_items(uid, items.upper()):
+                            if isinstance(body, str):
+                                self.write(f' {name} {body}'.encode())
+                            else:
+                                self.write(f' {name} {{{len(body)}}}\r\n'.encode() + body)
+                        self.write(b')\r\n')
+            elif command == 'IDLE':
+                self.send('+ idling')
+                with self.server.lock:
+                    self.server.idlers.add(self)
+                # 等待客户端发送 DONE 或断开
+                done = self.rfile.readline()
+                with self.server.lock:
+                    self.server.idlers.discard(self)
+                if not done:
+                    return
+            elif command == 'LOGOUT':
+                self.send('* BYE logging out')
+                self.send(f'{tag} OK LOGOUT completed')
+                return
+            self.send(f'{tag} OK {command} completed')
+
+    def fetch_items(self, uid, items):
+        """返回请求的数据项，(名称, 内容)，内容为 bytes 时作为字面量发送"""
+        raw = self.server.messages[uid]
+        # 邮件头与正文之间隔一个空行
+        header = raw.split(b'\n\n', 1)[0] + b'\n\n'
+        if 'HEADER.FIELDS' in items:
+            return [('BODY[HEADER.FIELDS (MESSAGE-ID SUBJECT FROM DATE)]', header)]
+        if 'RFC822' in items:
+            return [('RFC822', raw)]
+        msg = self.server.parsed[uid]
+        results = []
+        if 'BODYSTRUCTURE' in items:
+            results.append(('BODYSTRUCTURE', body_structure(msg)))
+        for section in re.findall(r'BODY(?:\.PEEK)?\[([^\]]*)\]', items):
+            body = header if section == 'HEADER' else part_body(find_part(msg, section))
+            results.append((f'BODY[{section}]', body))
+        return results
+
+
+class IMAPStandIn(socketserver.ThreadingTCPServer):
+    """本地IMAP服务器"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, messages, latency):
+        super().__init__(('127.0.0.1', 0), IMAPStandInHandler)
+        self.messages = messages
+        self.parsed = {uid: email.message_from_bytes(raw) for uid, raw in messages.items()}
+        self.latency = latency
+        self.uidvalidity = 1
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+        self.idlers = set()
+
+    def deliver(self, raw):
+        """投递一封新邮件，向 IDLE 中的连接推送 EXISTS"""
+        with self.lock:
+            uid = max(self.messages, default=0) + 1
+            self.parsed[uid] = email.message_from_bytes(raw)
+            self.messages[uid] = raw
+            idlers = list(self.idlers)
+        for handler in idlers:
+            try:
+                handler.send(f'* {len(self.messages)} EXISTS')
+            except OSError:
+                pass
+
+    def renumber(self, first_uid):
+        """从 first_uid 开始重新分配UID并更换 UIDVALIDITY，模拟服务器重建邮箱"""
+        with self.lock:
+            # 已连接的会话持有同一个字典，原地替换
+            renumbered = {first_uid + i: raw for i, (_, raw) in enumerate(sorted(self.messages.items()))}
+            self.messages.clear()
+            self.messages.update(renumbered)
+            self.parsed = {uid: email.message_from_bytes(raw) for uid, raw in renumbered.items()}
+            self.uidvalidity += 1
+
+    def drop_idlers(self):
+        """关闭 IDLE 中的连接，模拟服务器断开"""
+        with self.lock:
+            idlers = list(self.idlers)
+        for handler in idlers:
+            try:
+                handler.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class TokenHandler(BaseHTTPRequestHandler):
+    """令牌接口：POST /token 用刷新令牌换访问令牌，POST /hang 不返回响应"""
+    protocol_version = 'HTTP/1.1'
+    # 响应头和正文一起发送，避免长连接上等待延迟确认
+    wbufsize = 1 << 16
+
+    def setup(self):
+        super().setup()
+        self.server.count('connections')
+        time.sleep(self.server.handshake)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.path == '/hang':
+            self.server.stopped.wait()
+            return
+        time.sleep(self.server.latency)
+        if self.server.count('requests') % self.server.fail_every == 0:
+            self.reply(503, {'error': 'temporarily_unavailable'})
+            return
+        refresh_token = parse_qs(body.decode())['refresh_token'][0]
+        self.reply(200, {
+            'token_type': 'Bearer',
+            'access_token': f'access-{refresh_token}',
+            'expires_in': 3600,
+            'refresh_token': f'{refresh_token}-next',
+        })
+
+    def reply(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TokenStandIn(ThreadingHTTPServer):
+    """本地令牌接口"""
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, latency, handshake, fail_every):
+        super().__init__(('127.0.0.1', 0), TokenHandler)
+        self.latency = latency
+        self.handshake = handshake
+        self.fail_every = fail_every or 1 << 62
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.counters = {'connections': 0, 'requests': 0}
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+            return self.counters[name]
+
+    def reset(self):
+        with self.lock:
+            self.counters = {'connections': 0, 'requests': 0}
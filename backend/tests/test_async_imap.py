@@ -0,0 +1,156 @@
+"""
+异步IMAP客户端的测试
+"""
+
+import asyncio
+import imaplib
+import socketserver
+
+import pytest
+
+from utils.email.async_imap import AsyncIMAPClient, AsyncIMAPError
+from tests.conftest import serve
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 5))
+
+
+async def fetch_async(port, *args):
+    client = await AsyncIMAPClient.connect('127.0.0.1', port, use_ssl=False, timeout=2)
+    try:
+        await client.login('user', 'secret')
+        await client.select('INBOX', readonly=True)
+        return await client.uid('FETCH', *args)
+    finally:
+        await client.logout()
+
+
+def fetch_sync(port, *args):
+    mail = imaplib.IMAP4('127.0.0.1', port)
+    try:
+        mail.login('user', 'secret')
+        mail.select('INBOX', readonly=True)
+        return mail.uid('FETCH', *args)
+    finally:
+        mail.logout()
+
+
+@pytest.mark.parametrize('items, literals', [
+    ('(BODY.PEEK[HEADER.FIELDS (MESSAGE-ID SUBJECT FROM DATE)])', 2),
+    # 一个 FETCH 响应中有多个字面量，每个字面量后的续行属于同一个响应
+    ('(BODYSTRUCTURE BODY.PEEK[HEADER] BODY.PEEK[1])', 4),
+])
+def test_literal_responses_match_imaplib(imap_server, items, literals):
+    port = imap_server.server_address[1]
+    status, data = run(fetch_async(port, '1:2', items))
+    assert status == 'OK'
+    assert (status, data) == fetch_sync(port, '1:2', items)
+    assert sum(isinstance(item, tuple) for item in data) == literals
+
+
+class ScriptedHandler(socketserver.StreamRequestHandler):
+    """按命令名返回预设的响应，{tag} 替换为命令的标记，没有预设的命令返回 OK"""
+
+    def handle(self):
+        self.wfile.write(b'* OK ready\r\n')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            tag, command = line.decode().strip().split(' ', 2)[:2]
+            for response in self.server.script.get(command.upper(), ['{tag} OK done']):
+                if response is None:
+                    # 不回复标记响应，直接断开
+                    return
+                self.wfile.write(response.format(tag=tag).encode() + b'\r\n')
+
+
+class ScriptedServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, script):
+        super().__init__(('127.0.0.1', 0), ScriptedHandler)
+        self.script = script
+
+
+@pytest.fixture
+def scripted_server():
+    servers = []
+
+    def start(script):
+        server = serve(ScriptedServer(script))
+        servers.append(server)
+        return server.server_address[1]
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+async def connect(port):
+    return await AsyncIMAPClient.connect('127.0.0.1', port, use_ssl=False, timeout=2)
+
+
+def test_bye_during_command_raises(scripted_server):
+    port = scripted_server({'SELECT': ['* BYE server shutting down', None]})
+
+    async def select():
+        client = await connect(port)
+        try:
+            await client.login('user', 'secret')
+            with pytest.raises(AsyncIMAPError, match='server shutting down'):
+                await client.select()
+        finally:
+            client.close()
+
+    run(select())
+
+
+def test_bye_during_logout_is_expected(scripted_server):
+    port = scripted_server({'LOGOUT': ['* BYE logging out', '{tag} OK LOGOUT completed']})
+
+    async def logout():
+        client = await connect(port)
+        status, _ = await client.command('LOGOUT')
+        client.close()
+        return status, client.response('BYE')
+
+    assert run(logout()) == ('OK', ('BYE', [b'logging out']))
+
+
+def test_tagged_no_is_returned_as_status(scripted_server):
+    port = scripted_server({
+        'SELECT': ['{tag} NO [NONEXISTENT] Mailbox does not exist'],
+        'LOGIN': ['{tag} NO [AUTHENTICATIONFAILED] Invalid credentials'],
+    })
+
+    async def commands():
+        client = await connect(port)
+        try:
+            status, data = await client.select('Missing')
+            assert (status, data) == ('NO', [b'[NONEXISTENT] Mailbox does not exist'])
+            # 登录被拒绝时抛出异常，连接仍可继续使用
+            with pytest.raises(AsyncIMAPError, match='AUTHENTICATIONFAILED'):
+                await client.login('user', 'wrong')
+            assert (await client.command('NOOP'))[0] == 'OK'
+        finally:
+            client.close()
+
+    run(commands())
+
+
+def test_tagged_bad_raises(scripted_server):
+    port = scripted_server({'UID': ['{tag} BAD Invalid sequence set']})
+
+    async def fetch():
+        client = await connect(port)
+        try:
+            with pytest.raises(AsyncIMAPError, match='Invalid sequence set'):
+                await client.uid('FETCH', '0', '(UID)')
+        finally:
+            client.close()
+
+    run(fetch())
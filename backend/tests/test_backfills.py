@@ -0,0 +1,91 @@
+"""
+后台回填的测试
+"""
+
+import pytest
+
+from database.migrations import BackfillRunner, enqueue_backfill
+
+
+@pytest.fixture
+def items(db):
+    with db._writer() as conn:
+        conn.execute("CREATE TABLE backfill_items (id INTEGER PRIMARY KEY, visits INTEGER NOT NULL DEFAULT 0)")
+        conn.executemany("INSERT INTO backfill_items (id) VALUES (?)", [(i,) for i in range(1, 11)])
+        enqueue_backfill(conn, 'visits')
+    return db.pool
+
+
+def visit_step(runner, stop_after=None):
+    """每批把 id 大于 last_id 的记录访问一次，处理 stop_after 批后请求停止"""
+    batches = []
+
+    def step(conn, last_id, batch_size):
+        rows = conn.execute(
+            "SELECT id FROM backfill_items WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch_size)
+        ).fetchall()
+        conn.executemany("UPDATE backfill_items SET visits = visits + 1 WHERE id = ?", [(row[0],) for row in rows])
+        batches.append([row[0] for row in rows])
+        if stop_after is not None and len(batches) == stop_after:
+            runner.stop()
+        return rows[-1][0] if len(rows) == batch_size else None
+
+    return step, batches
+
+
+def visits(pool):
+    return [row[0] for row in pool.reader().execute("SELECT visits FROM backfill_items ORDER BY id")]
+
+
+def test_stopped_backfill_resumes_after_last_batch(items):
+    runner = BackfillRunner(items, batch_size=3, interval=0)
+    step, batches = visit_step(runner, stop_after=2)
+    runner.register('visits', step)
+    runner.run()
+    assert batches == [[1, 2, 3], [4, 5, 6]]
+    assert runner.load()['visits'] == (6, False)
+
+    # 重新启动后从已提交的进度继续，已处理的记录不会重复处理
+    resumed = BackfillRunner(items, batch_size=3, interval=0)
+    step, batches = visit_step(resumed)
+    resumed.register('visits', step)
+    assert resumed.pending() == ['visits']
+    resumed.run()
+    assert batches == [[7, 8, 9], [10]]
+    assert resumed.load()['visits'][1]
+    assert resumed.pending() == []
+    assert visits(items) == [1] * 10
+
+
+def test_failed_batch_is_rolled_back_with_its_progress(items):
+    runner = BackfillRunner(items, batch_size=4, interval=0)
+    step, batches = visit_step(runner)
+
+    def failing_step(conn, last_id, batch_size):
+        next_id = step(conn, last_id, batch_size)
+        if len(batches) == 2:
+            raise RuntimeError('interrupted')
+        return next_id
+
+    runner.register('visits', failing_step)
+    with pytest.raises(RuntimeError):
+        runner.run()
+    # 第二批的修改和进度一起回滚
+    assert runner.load()['visits'] == (4, False)
+    assert visits(items) == [1] * 4 + [0] * 6
+
+
+def test_database_backfill_restarts_from_saved_progress(db, email_id):
+    for i in range(5):
+        db.add_mail_record(email_id, f'subject {i}', 'sender@example.com', '2024-01-01 10:00:00', f'body {i}',
+                           message_id=f'<r{i}@example.com>')
+    with db._writer() as conn:
+        conn.execute("UPDATE mail_records SET snippet = NULL")
+        # 模拟上次启动时处理到第2条后中断
+        conn.execute("UPDATE mail_records SET snippet = 'kept' WHERE id <= 2")
+        conn.execute("UPDATE schema_backfills SET done = 0, last_id = 2 WHERE name = 'snippets'")
+    db.backfills.batch_size = 2
+    db.backfills.run()
+    snippets = [row[0] for row in db._reader().execute("SELECT snippet FROM mail_records ORDER BY id")]
+    assert snippets == ['kept', 'kept', 'body 2', 'body 3', 'body 4']
+    assert db.backfills.pending() == []
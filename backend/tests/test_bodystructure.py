@@ -0,0 +1,86 @@
+"""
+BODYSTRUCTURE 解析和部分编号的测试
+"""
+
+import imaplib
+from email.message import EmailMessage
+
+import pytest
+
+from tests.standins import IMAPStandIn, body_structure
+from utils.email.bodystructure import parse_fetch_items, plan_parts, fetch_messages
+from tests.conftest import serve
+
+
+def parse_structure(text):
+    return parse_fetch_items([b'1 (UID 7 BODYSTRUCTURE ' + text + b')'])[7][b'BODYSTRUCTURE']
+
+
+def sections(parts):
+    return [(part['section'], part['content_type']) for part in parts]
+
+
+def nested_message():
+    """mixed(related(alternative(plain, html), inline 图片), pdf 附件)"""
+    msg = EmailMessage()
+    msg['Subject'] = 'nested'
+    msg['Message-ID'] = '<nested@example.com>'
+    msg.set_content('plain body\n')
+    msg.add_alternative('<p>html body</p>\n', subtype='html')
+    msg.get_payload()[1].add_related(b'\x89PNG' * 10, maintype='image', subtype='png', cid='<logo>')
+    msg.add_attachment(b'%PDF' * 300, maintype='application', subtype='pdf', filename='report.pdf')
+    return msg
+
+
+def test_rfc3501_example():
+    structure = parse_structure(
+        b'(("TEXT" "PLAIN" ("CHARSET" "US-ASCII") NIL NIL "7BIT" 1152 23)'
+        b'("TEXT" "PLAIN" ("CHARSET" "US-ASCII" "NAME" "cc.diff") "<960723163407.20117h@cac.washington.edu>"'
+        b' "Compiler diff" "BASE64" 4554 73) "MIXED")'
+    )
+    body_parts, attachments = plan_parts(structure, prefer_plain=False)
+    assert sections(body_parts) == [('1', 'text/plain'), ('2', 'text/plain')]
+    assert body_parts[1]['encoding'] == 'base64'
+    assert attachments == []
+
+
+def test_single_part_message_is_section_one():
+    structure = parse_structure(b'("TEXT" "HTML" ("CHARSET" "UTF-8") NIL NIL "QUOTED-PRINTABLE" 120 4 NIL NIL NIL NIL)')
+    body_parts, _ = plan_parts(structure)
+    assert sections(body_parts) == [('1', 'text/html')]
+
+
+@pytest.mark.parametrize('prefer_plain, expected', [
+    (True, [('1.1', 'text/plain')]),
+    (False, [('1.1', 'text/plain'), ('1.2.1', 'text/html')]),
+])
+def test_nested_multipart_sections(prefer_plain, expected):
+    structure = parse_structure(body_structure(nested_message()).encode())
+    body_parts, attachments = plan_parts(structure, prefer_plain)
+    assert sections(body_parts) == expected
+    # 内嵌图片和附件只记录信息，不下载
+    assert [(item['filename'], item['content_type']) for item in attachments] == [
+        ('', 'image/png'), ('report.pdf', 'application/pdf')
+    ]
+    assert attachments[1]['size'] == pytest.approx(1200, rel=0.05)
+
+
+def test_fetch_downloads_only_planned_sections(monkeypatch):
+    monkeypatch.setattr('database.config.IMAP_PARTIAL_FETCH', True)
+    server = serve(IMAPStandIn({1: nested_message().as_bytes()}, 0))
+    mail = imaplib.IMAP4('127.0.0.1', server.server_address[1])
+    try:
+        mail.login('user', 'secret')
+        mail.select('INBOX')
+        before = server.bytes_sent
+        [(uid, msg, attachments)] = fetch_messages(mail, [1])
+        assert uid == 1
+        assert msg['Subject'] == 'nested'
+        assert msg.get_payload(decode=True) == b'plain body\n'
+        assert [item['filename'] for item in attachments] == ['', 'report.pdf']
+        # 附件内容没有下载
+        assert server.bytes_sent - before < 1200
+    finally:
+        mail.logout()
+        server.shutdown()
+        server.server_close()
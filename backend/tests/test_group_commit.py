@@ -0,0 +1,23 @@
+"""
+写线程组提交的测试
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+def test_app_mail_writes_are_group_committed(app_db, app_email_id):
+    before = app_db.get_write_stats()['operations']
+
+    def add(i):
+        return app_db.add_mail_record(app_email_id, f'subject {i}', 'sender@example.com', '2024-01-01 10:00:00', f'body {i}')
+
+    with ThreadPoolExecutor(8) as executor:
+        assert all(executor.map(add, range(16)))
+    stats = app_db.get_write_stats()
+    assert stats['operations'] - before == 16
+    assert stats['failed_operations'] == 0
+
+
+def test_write_stats_need_the_shared_store(app_db):
+    app_db.close()
+    assert app_db.get_write_stats() is None
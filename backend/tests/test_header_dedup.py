@@ -0,0 +1,61 @@
+"""
+先获取邮件头时按去重键排除已保存邮件的测试
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytest
+
+from database.database import MailRecord
+from utils.email.common import build_dedup_key, build_fallback_dedup_key
+from utils.email.uid_sync import stored_key_filter
+
+RECEIVED = datetime(2024, 1, 1, 10)
+
+
+def record(i, message_id=None):
+    return {'subject': f'subject {i}', 'sender': 'sender@example.com', 'received_time': RECEIVED,
+            'content': f'body {i}', 'message_id': message_id}
+
+
+@pytest.fixture(params=['store', 'sqlalchemy'])
+def app_db_variant(request, app_db):
+    """共享存储写入，以及没有共享存储时（MySQL）由SQLAlchemy直接写入"""
+    if request.param == 'sqlalchemy':
+        app_db.close()
+    return app_db
+
+
+def test_key_filter_runs_in_worker_threads(app_db_variant, app_email_id):
+    assert app_db_variant.bulk_add_mail_records(app_email_id, [record(0, '<a@example.com>'), record(1)]) == 2
+    key_filter = stored_key_filter(app_db_variant, app_email_id)
+    keys = [build_dedup_key('<a@example.com>'), build_fallback_dedup_key('subject 1', 'sender@example.com', RECEIVED),
+            build_dedup_key('<missing@example.com>')]
+    # 收信线程中没有应用上下文
+    with ThreadPoolExecutor(1) as executor:
+        assert executor.submit(key_filter, keys).result() == set(keys[:2])
+
+
+def test_bulk_add_skips_stored_mail(app_db_variant, app_email_id):
+    assert app_db_variant.bulk_add_mail_records(app_email_id, [record(0), record(1, '<b@example.com>')]) == 2
+    # 历史记录没有Message-ID，带Message-ID的同一封邮件按主题、发件人和时间排除
+    assert app_db_variant.bulk_add_mail_records(
+        app_email_id, [record(0, '<a@example.com>'), record(1, '<b@example.com>'), record(2)]
+    ) == 1
+    assert app_db_variant.get_email_stats(app_email_id)['total_records'] == 3
+
+
+def test_legacy_records_get_dedup_keys_without_the_store(app_db, app_email_id):
+    app_db.close()
+    app_db.db.session.add_all([
+        MailRecord(email_id=app_email_id, subject='hello', sender='a@example.com', received_time=RECEIVED)
+        for _ in range(2)
+    ])
+    app_db.db.session.commit()
+    app_db._fill_dedup_keys()
+    keys = app_db.db.session.execute(
+        MailRecord.__table__.select().with_only_columns(MailRecord.id, MailRecord.dedup_key).order_by(MailRecord.id)
+    ).all()
+    fallback_key = build_fallback_dedup_key('hello', 'a@example.com', RECEIVED)
+    assert [key for _, key in keys] == [fallback_key, f'{fallback_key}:{keys[1][0]}']
@@ -0,0 +1,66 @@
+"""
+令牌接口连接池和批量刷新的测试
+"""
+
+import time
+
+import pytest
+import requests
+
+from utils.email.http_pool import HTTPSessionPool, http_pool
+from utils.email.outlook import OutlookMailHandler
+from utils.email.token_cache import OutlookTokenCache
+
+
+def accounts(count):
+    return [
+        {'id': index, 'mail_type': 'outlook', 'refresh_token': f'refresh-{index}', 'client_id': 'client'}
+        for index in range(1, count + 1)
+    ]
+
+
+def test_refresh_reuses_pooled_connections(token_server):
+    for account in accounts(5):
+        token = OutlookMailHandler.refresh_access_token(account['refresh_token'], account['client_id'])
+        assert token['access_token'] == f"access-{account['refresh_token']}"
+    assert token_server.counters == {'connections': 1, 'requests': 5}
+
+
+def test_unavailable_responses_are_retried(token_server):
+    # 第2、4、6个请求返回503
+    token_server.fail_every = 2
+    retries = http_pool.status()['retries']
+    for account in accounts(4):
+        assert OutlookMailHandler.refresh_access_token(account['refresh_token'], account['client_id'])
+    assert http_pool.status()['retries'] - retries == 3
+    assert token_server.counters['requests'] == 7
+
+
+def test_refresh_due_runs_in_parallel_within_pool_size(token_server, monkeypatch):
+    monkeypatch.setattr(http_pool, 'pool_size', 4)
+    cache = OutlookTokenCache(enabled=True, workers=4)
+    try:
+        started = time.monotonic()
+        assert cache.refresh_due(accounts(12) + [{'id': 99, 'mail_type': 'imap'}]) == 12
+        # 逐个刷新需要 1.2 秒
+        assert time.monotonic() - started < 0.8
+        assert token_server.counters['requests'] == 12
+        assert token_server.counters['connections'] <= 4
+        # 令牌未到提前刷新的时间，不再请求
+        assert cache.refresh_due(accounts(12)) == 0
+        assert token_server.counters['requests'] == 12
+    finally:
+        cache.close()
+
+
+def test_unresponsive_endpoint_times_out(token_server):
+    pool = HTTPSessionPool(pool_size=1, connect_timeout=1, read_timeout=0.3, retries=1, backoff=0.01)
+    url = f'http://127.0.0.1:{token_server.server_address[1]}/hang'
+    started = time.monotonic()
+    try:
+        with pytest.raises(requests.Timeout):
+            pool.post(url, data={})
+    finally:
+        pool.close()
+    assert time.monotonic() - started < 2
+    assert pool.status()['failed'] == 1
@@ -0,0 +1,60 @@
+"""
+IMAP IDLE 会话的测试
+"""
+
+import time
+import threading
+
+from utils.email.imap_idle import IdleSession
+
+
+def wait_for(condition, timeout=3):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def start_session(port):
+    notified = threading.Event()
+    account = {
+        'id': 1, 'email': 'idle@example.com', 'password': 'secret', 'mail_type': 'imap',
+        'server': '127.0.0.1', 'port': port, 'use_ssl': False,
+    }
+    session = IdleSession(account, lambda _: notified.set(), lambda _: None, renew_interval=30)
+    session.start()
+    assert wait_for(lambda: session.active), "会话没有进入 IDLE"
+    return session, notified
+
+
+def test_new_mail_notification(imap_server):
+    session, notified = start_session(imap_server.server_address[1])
+    try:
+        # 第一次连接补一次收信
+        assert notified.wait(1)
+        notified.clear()
+        imap_server.deliver(b'Subject: pushed\r\nMessage-ID: <pushed@example.com>\r\n\r\nbody\r\n')
+        assert notified.wait(2)
+    finally:
+        session.stop()
+
+
+def test_server_closes_connection_during_idle(imap_server):
+    session, _ = start_session(imap_server.server_address[1])
+    try:
+        imap_server.drop_idlers()
+        # 连接断开后进入重试等待，而不是在空读取上循环
+        assert wait_for(lambda: not session.active)
+    finally:
+        session.stop()
+    session._thread.join(2)
+    assert not session.alive
+
+
+def test_stop_during_idle_ends_thread(imap_server):
+    session, _ = start_session(imap_server.server_address[1])
+    session.stop()
+    session._thread.join(2)
+    assert not session.alive
@@ -0,0 +1,98 @@
+"""
+IMAP连接池的测试
+"""
+
+import time
+import imaplib
+import socketserver
+
+import pytest
+
+from database import config
+from utils.email.imap_pool import IMAPConnectionPool, account_key
+from tests.conftest import serve
+
+
+class SilentHandler(socketserver.StreamRequestHandler):
+    """登录后不再响应，模拟NAT丢弃连接后的半开套接字"""
+
+    def handle(self):
+        self.wfile.write(b'* OK [CAPABILITY IMAP4rev1] ready\r\n')
+        tag = self.rfile.readline().split(b' ', 1)[0]
+        self.wfile.write(b'* CAPABILITY IMAP4rev1\r\n' + tag + b' OK done\r\n')
+        while self.rfile.readline():
+            pass
+
+
+class SilentServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+@pytest.fixture
+def silent_server():
+    server = serve(SilentServer(('127.0.0.1', 0), SilentHandler))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def short_timeout(monkeypatch):
+    monkeypatch.setattr(config, 'IMAP_SOCKET_TIMEOUT', 0.3)
+
+
+def connector(port, username='user'):
+    def connect():
+        mail = imaplib.IMAP4('127.0.0.1', port)
+        mail.login(username, 'secret')
+        return mail
+    return connect
+
+
+def test_half_open_connection_is_replaced(imap_server, silent_server):
+    pool = IMAPConnectionPool(enabled=True, max_idle=5, keepalive_interval=60, idle_timeout=60)
+    key = account_key('127.0.0.1', 143, 'user')
+    try:
+        # 池中的连接没有设置超时，对端不再响应
+        pool.release(key, imaplib.IMAP4('127.0.0.1', silent_server.server_address[1]))
+        started = time.monotonic()
+        mail = pool.acquire(key, connector(imap_server.server_address[1]))
+        assert time.monotonic() - started < 2
+        assert mail.noop()[0] == 'OK'
+        assert pool.status()['reconnected'] == 1
+        pool.release(key, mail)
+    finally:
+        pool.close()
+
+
+def test_keepalive_drops_half_open_connection(imap_server, silent_server):
+    pool = IMAPConnectionPool(enabled=True, max_idle=5, keepalive_interval=0.05, idle_timeout=60)
+    port = imap_server.server_address[1]
+    healthy = account_key('127.0.0.1', port, 'healthy')
+    try:
+        pool.release(account_key('127.0.0.1', 143, 'silent'), imaplib.IMAP4('127.0.0.1', silent_server.server_address[1]))
+        pool.release(healthy, connector(port, 'healthy')())
+        time.sleep(1)
+        # 超时的连接被关闭，保活线程继续为其他连接发送 NOOP
+        assert pool.status()['idle'] == 1
+        assert pool._idle[healthy][2] > time.monotonic() - 0.5
+    finally:
+        pool.close()
+
+
+def test_keepalive_does_not_change_eviction_order(imap_server):
+    pool = IMAPConnectionPool(enabled=True, max_idle=2, keepalive_interval=0.05, idle_timeout=60)
+    port = imap_server.server_address[1]
+    first, second, third = (account_key('127.0.0.1', port, name) for name in ('first', 'second', 'third'))
+    try:
+        pool.release(first, connector(port, 'first')())
+        time.sleep(0.01)
+        pool.release(second, connector(port, 'second')())
+        # 等两个连接都发送过 NOOP
+        time.sleep(0.3)
+        pool.release(third, connector(port, 'third')())
+        assert set(pool._idle) == {second, third}
+        assert pool.status()['evicted'] == 1
+    finally:
+        pool.close()
@@ -0,0 +1,86 @@
+"""
+共享正文存储的引用计数和回收的测试
+"""
+
+import pytest
+
+from database.compression import CODEC_ZLIB, compress_body
+from utils.email.common import build_snippet
+
+
+@pytest.fixture
+def second_email_id(db, user_id):
+    return db.add_email(user_id, 'other@example.com', 'secret', mail_type='imap', server='127.0.0.1', port=143, use_ssl=False)
+
+
+def ref_counts(db):
+    rows = db._reader().execute("SELECT ref_count FROM mail_bodies ORDER BY ref_count").fetchall()
+    return [row[0] for row in rows]
+
+
+def record(i, content):
+    return {
+        'subject': f'subject {i}', 'sender': 'sender@example.com', 'received_time': f'2024-01-01 10:00:0{i}',
+        'content': content, 'message_id': f'<b{i}@example.com>',
+    }
+
+
+def test_identical_bodies_are_stored_once(db, email_id, second_email_id):
+    assert db.bulk_add_mail_records(email_id, [record(0, 'shared'), record(1, 'shared'), record(2, 'own')]) == 3
+    assert db.add_mail_record(second_email_id, 'copy', 'sender@example.com', '2024-01-02 10:00:00', 'shared')
+    assert ref_counts(db) == [1, 3]
+    # 去重跳过的记录不增加引用
+    assert db.bulk_add_mail_records(email_id, [record(0, 'shared')]) == 0
+    assert ref_counts(db) == [1, 3]
+    contents = sorted(r['content'] for r in db.get_mail_records(second_email_id) + db.get_mail_records(email_id))
+    assert contents == ['own', 'shared', 'shared', 'shared']
+
+
+def test_deleting_records_releases_bodies_for_collection(db, email_id, second_email_id):
+    db.bulk_add_mail_records(email_id, [record(0, 'shared'), record(1, 'own')])
+    db.add_mail_record(second_email_id, 'copy', 'sender@example.com', '2024-01-02 10:00:00', 'shared')
+
+    db.delete_email(email_id)
+    assert ref_counts(db) == [0, 1]
+    assert db.collect_mail_bodies() == 1
+    assert ref_counts(db) == [1]
+    assert db.get_mail_records(second_email_id)[0]['content'] == 'shared'
+
+    db.delete_email(second_email_id)
+    assert db.collect_mail_bodies() == 1
+    assert ref_counts(db) == []
+
+
+def test_collection_runs_in_batches(db, email_id):
+    db.bulk_add_mail_records(email_id, [record(i, f'body {i}') for i in range(5)])
+    db.delete_email(email_id)
+    assert db.collect_mail_bodies(batch_size=2) == 5
+    assert ref_counts(db) == []
+
+
+def test_app_database_reads_bodies_from_body_table(app_db, app_email_id):
+    body = ' '.join(['quarterly report'] * 100)
+    assert app_db.bulk_add_mail_records(app_email_id, [record(0, body)]) == 1
+    stored = app_db.store._reader().execute("SELECT content, content_codec FROM mail_records").fetchone()
+    assert stored['content'] is None and stored['content_codec'] is None
+
+    records, _ = app_db.get_mail_records_page(app_email_id)
+    assert records[0]['snippet'] == build_snippet(body)
+    detail = app_db.get_mail_record_by_id(records[0]['id'])
+    assert detail['content'] == body
+    assert detail['recipient'] == 'tester@example.com'
+
+
+def test_app_database_decompresses_legacy_bodies(app_db, app_email_id):
+    body = ' '.join(['legacy body'] * 100)
+    content, codec = compress_body(body, CODEC_ZLIB)
+    assert codec == CODEC_ZLIB
+    with app_db.store._writer() as conn:
+        conn.execute(
+            "INSERT INTO mail_records (email_id, subject, sender, content, content_codec, dedup_key) VALUES (?, 'old', 'a@example.com', ?, ?, 'h:old')",
+            (app_email_id, content, codec)
+        )
+    records, _ = app_db.get_mail_records_page(app_email_id)
+    # 压缩保存且没有摘要的记录不读取正文开头
+    assert records[0]['snippet'] == ''
+    assert app_db.get_mail_record_by_id(records[0]['id'])['content'] == body
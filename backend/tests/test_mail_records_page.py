@@ -0,0 +1,72 @@
+"""
+邮件记录键集分页的测试
+"""
+
+import pytest
+
+from database.pagination import encode_cursor, decode_cursor
+
+
+def add_records(db, email_id, times):
+    """按顺序写入邮件，times 中的 None 表示没有接收时间"""
+    for i, received_time in enumerate(times):
+        assert db.add_mail_record(email_id, f'subject {i}', 'sender@example.com', received_time, f'body {i}',
+                                  folder='INBOX', message_id=f'<m{i}@example.com>')
+
+
+def all_pages(db, email_id, limit):
+    records, cursor, pages = [], None, 0
+    while True:
+        page, cursor = db.get_mail_records_page(email_id, limit=limit, cursor=cursor)
+        records.extend(page)
+        pages += 1
+        if cursor is None:
+            return records, pages
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor('2024-01-02 03:04:05', 42)
+    assert decode_cursor(cursor) == ('2024-01-02 03:04:05', 42)
+    assert decode_cursor(encode_cursor(None, 7)) == (None, 7)
+
+
+@pytest.mark.parametrize('cursor', ['not-a-cursor', encode_cursor('2024-01-01', 1)[:-2], 'WzEsMl0'])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_pages_cover_records_once_in_order(db, email_id):
+    # 相同的接收时间按 id 倒序
+    add_records(db, email_id, ['2024-01-01 10:00:00', '2024-01-03 10:00:00', '2024-01-02 10:00:00',
+                               '2024-01-02 10:00:00', '2024-01-05 10:00:00'])
+    records, pages = all_pages(db, email_id, 2)
+    assert pages == 3
+    assert [record['subject'] for record in records] == [
+        'subject 4', 'subject 1', 'subject 3', 'subject 2', 'subject 0'
+    ]
+    assert 'content' not in records[0]
+    assert records[0]['snippet'] == 'body 4'
+
+
+def test_null_received_time_at_page_boundary(db, email_id):
+    # 没有接收时间的记录排在最后，有时间的最后一条和没有时间的第一条正好在两页之间
+    add_records(db, email_id, [None, '2024-01-01 10:00:00', None, '2024-01-02 10:00:00', None])
+    first, cursor = db.get_mail_records_page(email_id, limit=2)
+    assert [record['subject'] for record in first] == ['subject 3', 'subject 1']
+    assert decode_cursor(cursor)[0] is not None
+
+    second, cursor = db.get_mail_records_page(email_id, limit=2, cursor=cursor)
+    assert [record['subject'] for record in second] == ['subject 4', 'subject 2']
+    assert decode_cursor(cursor)[0] is None
+
+    third, cursor = db.get_mail_records_page(email_id, limit=2, cursor=cursor)
+    assert [record['subject'] for record in third] == ['subject 0']
+    assert cursor is None
+
+
+def test_last_full_page_has_no_cursor(db, email_id):
+    add_records(db, email_id, ['2024-01-01 10:00:00', '2024-01-02 10:00:00'])
+    records, cursor = db.get_mail_records_page(email_id, limit=2)
+    assert len(records) == 2
+    assert cursor is None
@@ -0,0 +1,52 @@
+"""
+数据库结构迁移的测试
+"""
+
+import sqlite3
+
+import pytest
+
+from database.migrations import _create_base_tables
+from tests.conftest import open_database
+
+RECEIVED = '2024-01-01 10:00:00'
+
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    """引入结构版本之前的数据库，两条历史邮件的主题、发件人和时间相同"""
+    path = tmp_path / 'legacy.db'
+    conn = sqlite3.connect(path)
+    _create_base_tables(conn)
+    conn.execute("INSERT INTO users (username, password, password_hash, salt) VALUES ('tester', '', '', '')")
+    conn.execute("INSERT INTO emails (user_id, email, password, mail_type) VALUES (1, 'tester@example.com', 'secret', 'imap')")
+    conn.executemany(
+        "INSERT INTO mail_records (email_id, subject, sender, received_time, content) VALUES (1, ?, ?, ?, ?)",
+        [('hello', 'a@example.com', RECEIVED, 'first'),
+         ('hello', 'a@example.com', RECEIVED, 'copy'),
+         ('other', 'b@example.com', RECEIVED, 'second')]
+    )
+    conn.commit()
+    conn.close()
+    database = open_database(path)
+    yield database
+    database.close()
+
+
+def test_legacy_records_have_dedup_keys_after_migration(legacy_db):
+    keys = [row[0] for row in legacy_db._reader().execute("SELECT dedup_key FROM mail_records ORDER BY id")]
+    assert keys[0].startswith('h:') and keys[2].startswith('h:')
+    # 冲突的键追加记录ID
+    assert keys[1] == f'{keys[0]}:2'
+    assert 'dedup_keys' not in legacy_db.backfills.pending()
+
+
+def test_resync_does_not_duplicate_legacy_records(legacy_db):
+    added = legacy_db.bulk_add_mail_records(1, [
+        {'message_id': '<hello@example.com>', 'subject': 'hello', 'sender': 'a@example.com',
+         'received_time': RECEIVED, 'content': 'first'},
+        {'message_id': '<new@example.com>', 'subject': 'new', 'sender': 'a@example.com',
+         'received_time': RECEIVED, 'content': 'new'},
+    ])
+    assert added == 1
+    assert legacy_db._reader().execute("SELECT COUNT(*) FROM mail_records").fetchone()[0] == 4
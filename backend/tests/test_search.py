@@ -0,0 +1,73 @@
+"""
+邮件搜索的测试
+"""
+
+from datetime import datetime
+
+import pytest
+
+
+@pytest.fixture
+def records(db, email_id):
+    for i, (subject, content) in enumerate([
+        ('季度报告', '请查收附件中的报告'),
+        ('Invoice 42', 'Payment is due'),
+        ('周末安排', 'no match here'),
+    ]):
+        db.add_mail_record(email_id, subject, 'sender@example.com', f'2024-01-0{i + 1} 10:00:00', content,
+                           message_id=f'<s{i}@example.com>')
+    return email_id
+
+
+def subjects(results):
+    return sorted(record['subject'] for record in results)
+
+
+def test_full_text_index_is_enabled(db, records):
+    assert db.fts_enabled
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('报告', ['季度报告']),
+    ('42', ['Invoice 42']),
+    ('ue', ['Invoice 42']),
+])
+def test_short_query_falls_back_to_like(db, records, query, expected):
+    # trigram 索引无法匹配少于3个字符的关键词，需要退回 LIKE 匹配
+    assert subjects(db.search_mail_records([records], query)) == expected
+
+
+def test_long_query_uses_full_text_index(db, records):
+    assert subjects(db.search_mail_records([records], 'nvoic')) == ['Invoice 42']
+    assert subjects(db.search_mail_records([records], '附件中', search_in_subject=False)) == ['季度报告']
+    assert db.search_mail_records([records], '附件中', search_in_content=False) == []
+
+
+def test_short_and_long_queries_agree_before_index_is_built(db, records):
+    db.fts_enabled = False
+    assert subjects(db.search_mail_records([records], 'Payment')) == ['Invoice 42']
+    assert subjects(db.search_mail_records([records], '报告')) == ['季度报告']
+
+
+@pytest.fixture
+def app_records(app_db, app_email_id):
+    app_db.bulk_add_mail_records(app_email_id, [
+        {'message_id': f'<a{i}@example.com>', 'subject': subject, 'sender': 'sender@example.com',
+         'received_time': datetime(2024, 1, i + 1, 10), 'content': content}
+        for i, (subject, content) in enumerate([('季度报告', '请查收附件中的报告'), ('Invoice 42', 'Payment is due')])
+    ])
+    return app_email_id
+
+
+def test_app_database_searches_full_text_index(app_db, app_records):
+    assert app_db.store.fts_enabled
+    results = app_db.search_mail_records([app_records], '附件中')
+    assert subjects(results) == ['季度报告']
+    assert results[0]['recipient'] == 'tester@example.com'
+    assert subjects(app_db.search_mail_records([app_records], 'ue')) == ['Invoice 42']
+
+
+def test_app_database_unindexes_deleted_mail(app_db, app_records):
+    assert app_db.delete_email(app_records)
+    assert app_db.search_mail_records([app_records], 'Payment') == []
+    assert app_db.store._reader().execute("SELECT COUNT(*) FROM mail_records_fts").fetchone()[0] == 0
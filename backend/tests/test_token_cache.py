@@ -0,0 +1,94 @@
+"""
+Outlook访问令牌缓存的测试
+"""
+
+import threading
+
+import pytest
+
+from utils.email.token_cache import OutlookTokenCache
+
+
+@pytest.fixture
+def cache():
+    cache = OutlookTokenCache(enabled=True, refresh_margin=300, workers=4)
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def outlook_ids(db, user_id):
+    return [
+        db.add_email(user_id, f'outlook{i}@example.com', '', client_id='client', refresh_token=f'refresh-{i}')
+        for i in range(3)
+    ]
+
+
+def test_concurrent_refreshes_are_collapsed(db, outlook_ids, cache, token_server):
+    account = db.get_email_by_id(outlook_ids[0])
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_token(account, db))) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ['access-refresh-0'] * 10
+    assert token_server.counters['requests'] == 1
+    assert cache.status()['collapsed'] == 9
+
+
+def test_cached_token_survives_restart_and_rotation(db, outlook_ids, cache, token_server):
+    account = db.get_email_by_id(outlook_ids[0])
+    assert cache.get_token(account, db) == 'access-refresh-0'
+    assert cache.get_token(account, db) == 'access-refresh-0'
+    # 轮换后的刷新令牌和访问令牌保存到数据库
+    saved = db.get_email_token(outlook_ids[0])
+    assert (saved['access_token'], saved['refresh_token']) == ('access-refresh-0', 'refresh-0-next')
+
+    # 重新启动后从数据库读取，轮换前读取的邮箱信息不视为重新授权
+    restarted = OutlookTokenCache(enabled=True, refresh_margin=300)
+    try:
+        assert restarted.get_token(account, db) == 'access-refresh-0'
+        assert restarted.status()['loaded'] == 1
+    finally:
+        restarted.close()
+    assert token_server.counters['requests'] == 1
+
+
+def test_reauthorization_replaces_cached_token(db, outlook_ids, cache, token_server):
+    account = db.get_email_by_id(outlook_ids[0])
+    assert cache.get_token(account, db) == 'access-refresh-0'
+    db.update_email(outlook_ids[0], refresh_token='reauthorized')
+    assert cache.get_token(db.get_email_by_id(outlook_ids[0]), db) == 'access-reauthorized'
+    assert token_server.counters['requests'] == 2
+
+
+def test_disabled_cache_refreshes_every_time(db, outlook_ids, token_server):
+    cache = OutlookTokenCache(enabled=False)
+    account = db.get_email_by_id(outlook_ids[0])
+    cache.get_token(account, db)
+    cache.get_token(account, db)
+    assert token_server.counters['requests'] == 2
+
+
+def test_app_database_keeps_tokens(app_db, app_user_id, cache, token_server):
+    app_db.add_email(app_user_id, 'outlook@example.com', '', client_id='client', refresh_token='refresh-0')
+    email_id = app_db.get_emails_by_user_id(app_user_id)[0]['id']
+    account = {'id': email_id, 'client_id': 'client', 'refresh_token': 'refresh-0'}
+    # 后台线程中没有应用上下文，令牌仍然写入应用数据库
+    results = []
+    thread = threading.Thread(target=lambda: results.append(cache.get_token(account, app_db)))
+    thread.start()
+    thread.join()
+    assert results == ['access-refresh-0']
+    saved = app_db.get_email_token(email_id)
+    assert (saved['access_token'], saved['refresh_token']) == ('access-refresh-0', 'refresh-0-next')
+    assert saved['token_expires_at']
+
+    restarted = OutlookTokenCache(enabled=True, refresh_margin=300)
+    try:
+        assert restarted.get_token(account, app_db) == 'access-refresh-0'
+        assert restarted.status()['loaded'] == 1
+    finally:
+        restarted.close()
+    assert token_server.counters['requests'] == 1
@@ -0,0 +1,76 @@
+"""
+UID增量同步的测试
+"""
+
+import pytest
+
+from utils.email.imap import IMAPMailHandler
+from utils.email.imap_pool import imap_pool
+from utils.email.uid_sync import plan_uid_search, advance_sync_state
+
+
+def state(uidvalidity, last_uid):
+    return {'folder': 'INBOX', 'uidvalidity': uidvalidity, 'last_uid': last_uid, 'changed': False}
+
+
+def test_plan_searches_after_last_uid():
+    assert plan_uid_search('INBOX', state(5, 10), (5, 20), 'SINCE 01-Jan-2024') == ('UID 11:*', 10)
+
+
+def test_plan_skips_search_without_new_uids():
+    assert plan_uid_search('INBOX', state(5, 10), (5, 11)) == (None, 10)
+
+
+def test_plan_resyncs_all_after_uidvalidity_change():
+    # 旧的 UID 已经失效，不能再按日期条件跳过邮件
+    assert plan_uid_search('INBOX', state(5, 10), (6, 3), 'SINCE 01-Jan-2024') == ('ALL', 0)
+
+
+def test_advance_resets_last_uid_after_uidvalidity_change():
+    sync_state = state(5, 900)
+    advance_sync_state(sync_state, (6, 4), [1, 2, 3])
+    assert (sync_state['uidvalidity'], sync_state['last_uid'], sync_state['changed']) == (6, 3, True)
+
+
+def test_advance_stops_before_first_failed_uid():
+    sync_state = state(5, 10)
+    advance_sync_state(sync_state, (5, 16), [11, 12, 13, 14, 15], failed_uids=[13])
+    assert sync_state['last_uid'] == 12
+    # 全部失败时不回退到已同步的位置之前
+    advance_sync_state(sync_state, (5, 16), [13, 14, 15], failed_uids=[13])
+    assert sync_state['last_uid'] == 12
+
+
+@pytest.fixture
+def account(db, email_id, imap_server, monkeypatch):
+    monkeypatch.setattr(imap_pool, 'enabled', False)
+    db.update_email(email_id, port=imap_server.server_address[1])
+    return db.get_email_by_id(email_id)
+
+
+def check(db, account):
+    IMAPMailHandler.check_mail(account, db)
+    return db.get_sync_state(account['id']), len(db.get_mail_records(account['id']))
+
+
+def test_uidvalidity_reset_resyncs_without_duplicates(db, account, imap_server):
+    assert check(db, account) == ({'uidvalidity': 1, 'last_uid': 2}, 2)
+    assert check(db, account) == ({'uidvalidity': 1, 'last_uid': 2}, 2)
+
+    # 服务器重建邮箱后UID从101开始，已保存的邮件按邮件头排除
+    imap_server.renumber(101)
+    assert check(db, account) == ({'uidvalidity': 2, 'last_uid': 102}, 2)
+
+    imap_server.deliver(b'Subject: new\nMessage-ID: <new@example.com>\n\nbody\n')
+    assert check(db, account) == ({'uidvalidity': 2, 'last_uid': 103}, 3)
+
+
+def test_failed_save_keeps_previous_sync_state(db, account, monkeypatch):
+    def fail(email_id, mail_records):
+        raise RuntimeError('disk full')
+
+    monkeypatch.setattr(db, 'bulk_add_mail_records', fail)
+    assert check(db, account) == (None, 0)
+    del db.bulk_add_mail_records
+    # 下次检查重新获取上次未保存的邮件
+    assert check(db, account) == ({'uidvalidity': 1, 'last_uid': 2}, 2)
@@ -10,6 +10,8 @@ from .common import (
     remove_extra_blank_lines,
     parse_email_date,
     decode_email_content,
+    build_dedup_key,
+    build_snippet,
 )
 from .outlook import OutlookMailHandler
 from .imap import IMAPMailHandler
@@ -23,6 +25,8 @@ __all__ = [
     'remove_extra_blank_lines',
     'parse_email_date',
     'decode_email_content',
+    'build_dedup_key',
+    'build_snippet',
     'OutlookMailHandler',
     'IMAPMailHandler',
     'MailProcessor',
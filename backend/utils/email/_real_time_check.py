@@ -8,6 +8,8 @@ import threading
 import concurrent.futures
 from datetime import datetime, timedelta
 from .common import normalize_check_time
+from .imap_idle import IdleWatcher
+from .token_cache import outlook_token_cache
 
 # 创建日志记录器
 logger = logging.getLogger(__name__)
@@ -29,6 +31,11 @@ class RealTimeChecker:
         self.check_interval = 60  # 默认检查间隔为60秒
         self.last_check_time = {}  # 记录每个邮箱的最后检查时间
         self.thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=5)
+        # 服务器支持IDLE的邮箱由推送触发收信，不再轮询
+        self.idle_watcher = IdleWatcher(self._on_new_mail, db)
+        self.push_lock = threading.Lock()
+        self.push_running = set()  # 正在执行推送收信的邮箱ID
+        self.push_pending = set()  # 收信期间又收到通知的邮箱ID
     
     def start(self, check_interval=60):
         """启动实时邮件检查
@@ -64,6 +71,7 @@ class RealTimeChecker:
             return False
         
         self.running = False
+        self.idle_watcher.stop()
         if self.thread:
             self.thread.join(timeout=5)
             logger.info("实时邮件检查已停止")
@@ -79,21 +87,46 @@ class RealTimeChecker:
                 users = self.db.get_users_with_realtime_check()
                 if not users:
                     logger.info("没有启用实时检查的用户")
+                    self.idle_watcher.retain(())
                     time.sleep(self.check_interval)
                     continue
                 
-                # 对每个用户进行处理
+                # 本轮仍需实时检查的邮箱，其余的IDLE会话关闭
+                account_ids = set()
+                
+                # 获取每个用户的所有邮箱
+                user_accounts = []
                 for user in users:
+                    try:
+                        user_accounts.append((user, self.db.get_user_emails(user['id'])))
+                    except Exception as e:
+                        logger.error(f"获取用户 {user.get('username', user['id'])} 的邮箱时出错: {str(e)}")
+                
+                # 并行刷新本轮即将过期的Outlook访问令牌，检查时不再逐个等待令牌接口
+                try:
+                    outlook_token_cache.refresh_due(
+                        [account for _, email_accounts in user_accounts for account in email_accounts], self.db
+                    )
+                except Exception as e:
+                    logger.error(f"刷新Outlook访问令牌时出错: {str(e)}")
+                
+                # 对每个用户进行处理
+                for user, email_accounts in user_accounts:
                     if not self.running:
                         break
                     
                     try:
-                        # 获取用户的所有邮箱
-                        email_accounts = self.db.get_user_emails(user['id'])
-                        
                         # 处理每个邮箱
                         for account in email_accounts:
-                            if not self.running or self.email_processor.is_email_being_processed(account['id']):
+                            if not self.running:
+                                continue
+                            account_ids.add(account['id'])
+                            
+                            # 已由IDLE会话推送的邮箱不再轮询
+                            if self.idle_watcher.watch(account):
+                                continue
+                            
+                            if self.email_processor.is_email_being_processed(account['id']):
                                 continue
                             
                             # 提交检查任务
@@ -105,6 +138,9 @@ class RealTimeChecker:
                     except Exception as e:
                         logger.error(f"处理用户 {user.get('username', user['id'])} 的邮箱时出错: {str(e)}")
                 
+                if self.running:
+                    self.idle_watcher.retain(account_ids)
+                
                 # 等待下一次检查周期
                 for _ in range(self.check_interval):
                     if not self.running:
@@ -160,4 +196,51 @@ class RealTimeChecker:
             logger.info(f"已为邮箱 {account['email']} 提交检查任务")
             
         except Exception as e:
-            logger.error(f"提交邮箱 {account.get('email', account_id)} 检查任务失败: {str(e)}") 
\ No newline at end of file
+            logger.error(f"提交邮箱 {account.get('email', account_id)} 检查任务失败: {str(e)}")
+    
+    def _on_new_mail(self, account):
+        """IDLE会话收到新邮件通知时提交收信任务，同一邮箱同时只有一个推送收信任务
+        
+        Args:
+            account: 邮箱账户信息
+        """
+        account_id = account['id']
+        with self.push_lock:
+            if account_id in self.push_running:
+                # 正在收信，结束后再收一次，避免漏掉收信期间到达的邮件
+                self.push_pending.add(account_id)
+                return
+            self.push_running.add(account_id)
+        try:
+            self.email_processor.realtime_thread_pool.submit(self._push_check, account)
+            logger.info(f"邮箱 {account['email']} 收到新邮件通知，已提交检查任务")
+        except Exception as e:
+            with self.push_lock:
+                self.push_running.discard(account_id)
+            logger.error(f"提交邮箱 {account.get('email', account_id)} 检查任务失败: {str(e)}")
+    
+    def _push_check(self, account):
+        """推送触发的收信任务，收信期间又收到通知时再收一次"""
+        account_id = account['id']
+        
+        def progress_callback(progress, message):
+            logger.info(f"邮箱 ID {account_id} 处理进度: {progress}%, 消息: {message}")
+        
+        try:
+            while self.running:
+                # 手动检查等任务正在处理该邮箱时等它结束
+                if self.email_processor.is_email_being_processed(account_id):
+                    time.sleep(0.5)
+                    continue
+                self.last_check_time[account_id] = datetime.now()
+                self.email_processor._check_email_task(account, progress_callback)
+                with self.push_lock:
+                    if account_id not in self.push_pending:
+                        break
+                    self.push_pending.discard(account_id)
+        except Exception as e:
+            logger.error(f"邮箱 {account.get('email', account_id)} 推送收信失败: {str(e)}")
+        finally:
+            with self.push_lock:
+                self.push_running.discard(account_id)
+                self.push_pending.discard(account_id)
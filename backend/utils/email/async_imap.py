@@ -0,0 +1,469 @@
+"""
+异步IMAP收信引擎
+在一个事件循环中同时处理大量邮箱的收信，不再每个邮箱占用一个线程等待网络。
+协议部分只实现收信需要的命令，响应整理为与 imaplib 相同的格式，
+UID增量同步、邮件头去重和按结构获取正文的逻辑与同步收信共用。
+"""
+
+import re
+import ssl
+import base64
+import asyncio
+import email
+import threading
+from datetime import datetime
+from contextlib import asynccontextmanager
+
+from database import config
+from .common import (
+    decode_mime_words,
+    parse_email_date,
+    parse_email_message,
+    normalize_check_time,
+    format_date_for_imap_search,
+    parse_email_headers,
+    build_header_dedup_keys,
+)
+from .logger import logger, log_message_processing, log_message_error
+from .uid_sync import (
+    STATUS_PATTERN,
+    HEADER_FETCH_ITEM,
+    plan_uid_search,
+    is_incremental,
+    advance_sync_state,
+    header_dedup_keys,
+    exclude_stored_uids,
+    format_uid_set,
+    parse_fetch_response,
+)
+from .bodystructure import partial_batch_steps
+
+# 行末的字面量长度标记，如 {1024}
+LITERAL_PATTERN = re.compile(rb'\{(\d+)\}$')
+
+# 带序号的未标记响应，如 * 12 EXISTS、* 3 FETCH (...)
+UNTAGGED_STATUS_PATTERN = re.compile(rb'(\d+) ([A-Za-z-]+)(?: (.*))?$', re.DOTALL)
+
+# 其他未标记响应，如 * SEARCH 1 2 3、* OK [UIDVALIDITY 1]
+UNTAGGED_PATTERN = re.compile(rb'([A-Za-z-]+)(?: (.*))?$', re.DOTALL)
+
+# 状态响应中的响应码，如 [UIDNEXT 100]
+RESPONSE_CODE_PATTERN = re.compile(rb'\[([A-Za-z-]+)(?: ([^\]]*))?\]')
+
+# 一行响应的最大长度，与 imaplib 相同
+MAX_LINE = 1000000
+
+
+class AsyncIMAPError(Exception):
+    """服务器返回错误或连接断开"""
+
+
+def _quote(value):
+    """把参数写成带引号的字符串"""
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+class AsyncIMAPClient:
+    """基于 asyncio 流的IMAP客户端
+
+    命令的返回值与 imaplib 相同，为 (状态, 数据)，数据中的字面量为 (前缀, 内容) 元组。
+    一个连接同一时间只执行一个命令。
+    """
+
+    def __init__(self, reader, writer, timeout):
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+        self.untagged = {}
+        self._tag = 0
+
+    @classmethod
+    async def connect(cls, host, port=993, use_ssl=True, timeout=None):
+        """连接服务器并读取欢迎信息"""
+        timeout = config.IMAP_ASYNC_TIMEOUT if timeout is None else timeout
+        context = ssl.create_default_context() if use_ssl else None
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=context, limit=MAX_LINE), timeout
+        )
+        client = cls(reader, writer, timeout)
+        try:
+            _, line = await client._read_response()
+            if not line.upper().startswith((b'* OK', b'* PREAUTH')):
+                raise AsyncIMAPError(f"服务器拒绝连接: {line.decode('utf-8', errors='replace')}")
+        except BaseException:
+            client.close()
+            raise
+        return client
+
+    async def _readline(self):
+        line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+        if not line:
+            raise AsyncIMAPError("连接已断开")
+        return line.rstrip(b'\r\n')
+
+    async def _read_response(self):
+        """读取一个完整的响应，返回 (字面量列表, 最后一行)，字面量为 (前缀, 内容)"""
+        literals = []
+        line = await self._readline()
+        while True:
+            match = LITERAL_PATTERN.search(line)
+            if not match:
+                return literals, line
+            literal = await asyncio.wait_for(self.reader.readexactly(int(match.group(1))), self.timeout)
+            literals.append((line, literal))
+            line = await self._readline()
+
+    def _store_untagged(self, literals, line):
+        """按 imaplib 的方式保存未标记响应，返回响应类型"""
+        first = literals[0][0] if literals else line
+        match = UNTAGGED_STATUS_PATTERN.match(first, 2)
+        if match:
+            name = match.group(2)
+            data = match.group(1) + (b' ' + match.group(3) if match.group(3) is not None else b'')
+        else:
+            match = UNTAGGED_PATTERN.match(first, 2)
+            if not match:
+                return None
+            name, data = match.group(1), match.group(2) or b''
+        name = name.upper().decode()
+        if name in ('OK', 'NO', 'BAD'):
+            code = RESPONSE_CODE_PATTERN.match(data)
+            if code:
+                self.untagged.setdefault(code.group(1).upper().decode(), []).append(code.group(2))
+        items = self.untagged.setdefault(name, [])
+        if literals:
+            items.append((data, literals[0][1]))
+            items.extend(literals[1:])
+            items.append(line)
+        else:
+            items.append(data)
+        return name
+
+    async def command(self, name, *args, response=None, continuation=None):
+        """发送命令并读取到标记响应
+
+        Args:
+            name: 命令名
+            args: 参数，需要引号的参数由调用方处理
+            response: 返回的未标记响应类型，默认与命令名相同
+            continuation: 服务器要求继续时发送的内容，只发送一次
+
+        Returns:
+            (状态, 数据)
+        """
+        self._tag += 1
+        tag = f'A{self._tag:04d}'.encode()
+        self.untagged = {}
+        self.writer.write(tag + b' ' + ' '.join((name,) + args).encode() + b'\r\n')
+        await self.writer.drain()
+        while True:
+            literals, line = await self._read_response()
+            if not literals and line.startswith(tag + b' '):
+                status, _, text = line[len(tag) + 1:].partition(b' ')
+                status = status.upper().decode()
+                if status == 'BAD':
+                    raise AsyncIMAPError(f"{name} 命令错误: {text.decode('utf-8', errors='replace')}")
+                return status, self.untagged.get(response or name, [text])
+            if not literals and line.startswith(b'+'):
+                # 认证失败时服务器用继续请求返回错误信息，回复空行结束
+                self.writer.write((continuation or b'') + b'\r\n')
+                continuation = None
+                await self.writer.drain()
+                continue
+            if self._store_untagged(literals, line) == 'BYE' and name != 'LOGOUT':
+                raise AsyncIMAPError(f"服务器关闭了连接: {line.decode('utf-8', errors='replace')}")
+
+    def response(self, code):
+        """返回上一个命令的未标记响应，与 imaplib 的 response 相同"""
+        return code, self.untagged.get(code, [None])
+
+    async def login(self, user, password):
+        status, data = await self.command('LOGIN', _quote(user), _quote(password))
+        if status != 'OK':
+            raise AsyncIMAPError(f"登录失败: {data}")
+
+    async def authenticate_xoauth2(self, user, access_token):
+        auth_string = f"user={user}\1auth=Bearer {access_token}\1\1".encode()
+        status, data = await self.command('AUTHENTICATE', 'XOAUTH2', continuation=base64.b64encode(auth_string))
+        if status != 'OK':
+            raise AsyncIMAPError(f"OAuth2认证失败: {data}")
+
+    async def select(self, folder="INBOX", readonly=False):
+        return await self.command('EXAMINE' if readonly else 'SELECT', _quote(folder), response='EXISTS')
+
+    async def uid(self, command, *args):
+        return await self.command('UID', command, *args, response=command)
+
+    async def logout(self):
+        """登出并关闭连接，忽略连接已断开等错误"""
+        try:
+            await self.command('LOGOUT')
+        except Exception:
+            pass
+        self.close()
+
+    def close(self):
+        try:
+            self.writer.close()
+        except Exception:
+            pass
+
+
+async def read_uid_status(client, folder):
+    """读取刚选择的文件夹的 (UIDVALIDITY, UIDNEXT)，与 uid_sync.read_uid_status 相同"""
+    values = {}
+    for name in ('UIDVALIDITY', 'UIDNEXT'):
+        data = client.response(name)[1]
+        try:
+            values[name] = int(data[-1])
+        except (TypeError, ValueError):
+            values[name] = None
+    if None in values.values():
+        try:
+            status, data = await client.command('STATUS', _quote(folder), '(UIDVALIDITY UIDNEXT)')
+            if status == 'OK' and data and data[0]:
+                for name, value in STATUS_PATTERN.findall(data[0]):
+                    if values[name.decode()] is None:
+                        values[name.decode()] = int(value)
+        except AsyncIMAPError as e:
+            logger.warning(f"查询文件夹 {folder} 的UID状态失败: {str(e)}")
+    return values['UIDVALIDITY'], values['UIDNEXT']
+
+
+async def _fetch_items(client, uids, item):
+    """对一组邮件发送一个 UID FETCH，返回响应数据，失败时返回空列表"""
+    try:
+        status, data = await client.uid('FETCH', format_uid_set(uids), f'(UID {item})')
+        if status == 'OK':
+            return data
+        logger.error(f"批量获取邮件失败: {status}")
+    except AsyncIMAPError as e:
+        logger.error(f"批量获取邮件失败: {str(e)}")
+    return []
+
+
+async def fetch_uid_batches(client, uids, item, batch_size=None):
+    """按批获取邮件，返回 [(uid, 内容)]，与 uid_sync.fetch_uid_batches 相同"""
+    batch_size = max(1, batch_size or config.IMAP_FETCH_BATCH_SIZE)
+    results = []
+    for start in range(0, len(uids), batch_size):
+        batch = uids[start:start + batch_size]
+        contents = parse_fetch_response(await _fetch_items(client, batch, item))
+        results.extend((uid, contents.get(uid)) for uid in batch)
+    return results
+
+
+async def fetch_messages(client, uids, prefer_plain=True, batch_size=None):
+    """按批获取邮件，返回 [(uid, 邮件对象, 附件列表)]，与 bodystructure.fetch_messages 相同"""
+    if not config.IMAP_PARTIAL_FETCH:
+        return [
+            (uid, email.message_from_bytes(data) if data is not None else None, None)
+            for uid, data in await fetch_uid_batches(client, uids, 'RFC822', batch_size)
+        ]
+
+    batch_size = max(1, batch_size or config.IMAP_FETCH_BATCH_SIZE)
+    messages = []
+    for start in range(0, len(uids), batch_size):
+        batch = uids[start:start + batch_size]
+        steps = partial_batch_steps(batch, prefer_plain)
+        try:
+            request = next(steps)
+            while True:
+                request = steps.send(await _fetch_items(client, *request))
+        except StopIteration as stop:
+            results = stop.value
+        for uid in batch:
+            msg, attachments = results.get(uid, (None, None))
+            messages.append((uid, msg, attachments))
+    return messages
+
+
+class AsyncIMAPMailHandler:
+    """异步IMAP收信，由 AsyncIMAPEngine 在事件循环中执行"""
+
+    @staticmethod
+    async def fetch_emails_async(email_address, password, server, port=993, use_ssl=True, folder="INBOX",
+                                 callback=None, last_check_time=None, sync_state=None, key_filter=None,
+                                 access_token=None, prefer_plain=True):
+        """获取邮箱中的邮件，参数和返回值与 IMAPMailHandler.fetch_emails 相同
+
+        提供 access_token 时以 XOAUTH2 登录（Outlook），否则用密码登录。
+        key_filter 会查询数据库，在线程中执行，不阻塞事件循环。
+        全局和每个服务器同时打开的连接数由 async_engine 限制，连接在收信结束后登出。
+        """
+        if callback is None:
+            callback = lambda progress, message: None
+        last_check_time = normalize_check_time(last_check_time)
+        mail_records = []
+
+        try:
+            async with async_engine.slot(server):
+                callback(0, "正在连接邮箱服务器")
+                client = await AsyncIMAPClient.connect(server, port, use_ssl)
+                try:
+                    if access_token:
+                        await client.authenticate_xoauth2(email_address, access_token)
+                    else:
+                        await client.login(email_address, password)
+                    callback(10, "正在登录邮箱")
+
+                    status, _ = await client.select(folder)
+                    if status != 'OK':
+                        raise AsyncIMAPError(f"选择文件夹 {folder} 失败: {status}")
+                    callback(20, f"正在选择文件夹 {folder}")
+
+                    search_criteria = 'ALL'
+                    if last_check_time:
+                        date_str = format_date_for_imap_search(last_check_time)
+                        if date_str:
+                            search_criteria = f'SINCE {date_str}'
+
+                    uid_status = await read_uid_status(client, folder)
+                    criteria, min_uid = plan_uid_search(folder, sync_state, uid_status, search_criteria)
+                    uids = []
+                    if criteria is not None:
+                        status, data = await client.uid('SEARCH', criteria)
+                        if status != 'OK':
+                            raise AsyncIMAPError(f"搜索邮件失败: {status}")
+                        uids = sorted(uid for uid in map(int, (data[0] or b'').split()) if uid > min_uid)
+                    logger.info(f"找到 {len(uids)} 封邮件")
+
+                    # 第一阶段：不是按UID增量获取时，批量获取邮件头，排除数据库中已有的邮件
+                    new_uids = uids
+                    if key_filter and uids and not is_incremental(sync_state, uid_status):
+                        headers = await fetch_uid_batches(client, uids, HEADER_FETCH_ITEM, config.IMAP_HEADER_BATCH_SIZE)
+                        keys_by_uid = header_dedup_keys(
+                            headers, lambda header: build_header_dedup_keys(parse_email_headers(header))
+                        )
+                        existing = await asyncio.get_running_loop().run_in_executor(
+                            None, key_filter, [key for keys in keys_by_uid.values() for key in keys]
+                        )
+                        new_uids = exclude_stored_uids(uids, keys_by_uid, existing)
+
+                    # 第二阶段：按批获取新邮件的正文
+                    messages = await fetch_messages(client, new_uids, prefer_plain)
+                finally:
+                    await client.logout()
+        except Exception as e:
+            logger.error(f"获取邮件失败: {str(e)}")
+            return []
+
+        failed_uids = []
+        total_messages = len(messages)
+        for i, (uid, msg, attachments) in enumerate(messages):
+            try:
+                callback(int((i + 1) / total_messages * 100), f"正在处理第 {i + 1}/{total_messages} 封邮件")
+                if msg is None:
+                    failed_uids.append(uid)
+                    continue
+                subject = decode_mime_words(msg.get("subject", "")) if msg.get("subject") else "(无主题)"
+                sender = decode_mime_words(msg.get("from", "")) if msg.get("from") else "(未知发件人)"
+                date_str = msg.get("date", "")
+                received_time = parse_email_date(date_str) if date_str else datetime.now()
+
+                mail_record = parse_email_message(msg, folder, attachments)
+                if mail_record:
+                    mail_record['mail_key'] = f"{subject}|{sender}|{received_time.isoformat()}"
+                    mail_records.append(mail_record)
+                    log_message_processing(mail_record.get('message_id', 'unknown'), i + 1, total_messages,
+                                           mail_record.get('subject', '(无主题)'))
+            except Exception as e:
+                logger.error(f"处理邮件失败: {str(e)}")
+                log_message_error('unknown', str(e))
+                failed_uids.append(uid)
+
+        advance_sync_state(sync_state, uid_status, uids, failed_uids)
+        return mail_records
+
+    @classmethod
+    def fetch_emails(cls, email_address, password, server, port=993, use_ssl=True, folder="INBOX", callback=None,
+                     last_check_time=None, sync_state=None, key_filter=None):
+        """同步调用，在事件循环中收信并等待结果"""
+        return async_engine.run(cls.fetch_emails_async(
+            email_address, password, server, port, use_ssl, folder, callback,
+            last_check_time, sync_state, key_filter
+        ))
+
+
+class AsyncIMAPEngine:
+    """在后台线程的事件循环中执行收信协程
+
+    同时打开的连接数全局不超过 max_connections，同一服务器不超过 max_per_host，
+    超过的收信在事件循环中排队，不占用线程。
+    """
+
+    def __init__(self, mail_types=None, max_connections=None, max_per_host=None):
+        """初始化
+
+        Args:
+            mail_types: 使用异步引擎收信的邮箱类型
+            max_connections: 全局同时打开的连接数上限
+            max_per_host: 同一服务器同时打开的连接数上限
+        """
+        self.mail_types = set(config.IMAP_ASYNC_MAIL_TYPES if mail_types is None else mail_types)
+        self.max_connections = config.IMAP_ASYNC_MAX_CONNECTIONS if max_connections is None else max_connections
+        self.max_per_host = config.IMAP_ASYNC_MAX_PER_HOST if max_per_host is None else max_per_host
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        # 信号量只在事件循环线程中创建和使用
+        self._connections = None
+        self._hosts = {}
+        self._open = 0
+
+    def handles(self, mail_type):
+        """该类型的邮箱是否由异步引擎收信"""
+        return mail_type in self.mail_types
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name='imap-async', daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def submit(self, coro):
+        """提交协程，返回 concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    def run(self, coro):
+        """提交协程并等待结果"""
+        return self.submit(coro).result()
+
+    @asynccontextmanager
+    async def slot(self, host):
+        """占用一个连接名额，名额用完时等待"""
+        if self._connections is None:
+            self._connections = asyncio.Semaphore(max(1, self.max_connections))
+        host_limit = self._hosts.get(host)
+        if host_limit is None:
+            host_limit = self._hosts[host] = asyncio.Semaphore(max(1, self.max_per_host))
+        async with self._connections, host_limit:
+            self._open += 1
+            try:
+                yield
+            finally:
+                self._open -= 1
+
+    def close(self):
+        """停止事件循环"""
+        with self._lock:
+            loop, self._loop = self._loop, None
+            self._connections = None
+            self._hosts = {}
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+
+    def status(self):
+        """返回引擎状态"""
+        return {
+            'mail_types': sorted(self.mail_types),
+            'open_connections': self._open,
+            'max_connections': self.max_connections,
+            'max_per_host': self.max_per_host,
+        }
+
+
+# 所有邮箱共用的异步收信引擎
+async_engine = AsyncIMAPEngine()
@@ -0,0 +1,322 @@
+"""
+按 BODYSTRUCTURE 部分获取邮件
+先获取邮件结构和邮件头，只下载需要的正文部分（如 BODY[1.1]），
+附件只根据结构记录文件名、类型和大小，不下载附件内容。
+"""
+
+import re
+import email
+import imaplib
+import email.utils
+from collections import defaultdict
+from email.message import Message
+
+from database import config
+from .common import is_body_part, build_attachment_info
+from .logger import logger
+from .uid_sync import format_uid_set, fetch_uid_batches, parse_fetch_response
+
+# 结构和邮件头一次获取，PEEK 不会把邮件标记为已读
+STRUCTURE_FETCH_ITEM = 'BODYSTRUCTURE BODY.PEEK[HEADER]'
+
+# FETCH 响应的词法单元：括号、带引号的字符串、原子（BODY[...] 中可以包含空格和括号）
+TOKEN_PATTERN = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"\[]+(?:\[[^\]]*\][^\s()"]*)?))')
+
+# 响应行末尾的字面量长度标记，如 {1024}
+LITERAL_PATTERN = re.compile(rb'\{\d+\}\s*$')
+
+# 替换正文部分的邮件头时删除的原有内容头
+CONTENT_HEADERS = ('Content-Type', 'Content-Transfer-Encoding', 'Content-Disposition')
+
+
+def _tokenize(text):
+    """把响应文本拆分为 (类型, 值)，NIL 解析为 None"""
+    for match in TOKEN_PATTERN.finditer(text):
+        open_paren, close_paren, quoted, atom = match.groups()
+        if open_paren:
+            yield '(', None
+        elif close_paren:
+            yield ')', None
+        elif quoted is not None:
+            yield 'value', re.sub(rb'\\(.)', rb'\1', quoted)
+        elif atom is not None:
+            yield 'value', None if atom.upper() == b'NIL' else atom
+
+
+def parse_fetch_items(data):
+    """解析 FETCH 响应中每封邮件的全部数据项
+
+    imaplib 把字面量拆成 (前缀, 字面量) 元组，前缀以 {长度} 结尾，
+    这里把字面量放回原来的位置后按括号解析为嵌套列表。
+
+    Returns:
+        {uid: {数据项名: 值}}，数据项名为大写的 bytes，如 b'BODY[1.1]'
+    """
+    stack = [[]]
+    for item in data or []:
+        if isinstance(item, tuple):
+            text, literal = LITERAL_PATTERN.sub(b'', item[0]), item[1]
+        else:
+            text, literal = item, None
+        if not isinstance(text, bytes):
+            continue
+        for kind, value in _tokenize(text):
+            if kind == '(':
+                stack.append([])
+            elif kind == ')':
+                if len(stack) > 1:
+                    closed = stack.pop()
+                    stack[-1].append(closed)
+            else:
+                stack[-1].append(value)
+        if literal is not None:
+            stack[-1].append(literal)
+
+    results = {}
+    # 顶层是 "序号 (数据项 值 ...)" 的序列
+    for value in stack[0]:
+        if not isinstance(value, list):
+            continue
+        items = {}
+        for i in range(0, len(value) - 1, 2):
+            if isinstance(value[i], bytes):
+                items[value[i].upper()] = value[i + 1]
+        try:
+            results[int(items[b'UID'])] = items
+        except (KeyError, TypeError, ValueError):
+            continue
+    return results
+
+
+def _text(value):
+    return value.decode('utf-8', errors='replace') if isinstance(value, bytes) else (value or '')
+
+
+def _params(value):
+    """参数列表 ("name" "value" ...) 转换为字典"""
+    if not isinstance(value, list):
+        return {}
+    return {_text(value[i]).lower(): _text(value[i + 1]) for i in range(0, len(value) - 1, 2)}
+
+
+def _filename(type_params, disposition_params):
+    """按邮件库的规则取附件名，支持 RFC 2231 编码的参数"""
+    part = Message()
+    for header, main_value, params in (
+        ('Content-Type', 'application/octet-stream', type_params),
+        ('Content-Disposition', 'attachment', disposition_params),
+    ):
+        part[header] = main_value + ''.join(
+            f'; {name}="{email.utils.quote(value)}"' for name, value in params.items()
+        )
+    return part.get_filename()
+
+
+def _decoded_size(size, encoding):
+    """BODYSTRUCTURE 中的大小是传输编码后的字节数，base64 按每行76个字符加换行估算原始大小"""
+    if encoding == 'base64':
+        return size * 57 // 78
+    return size
+
+
+def _leaf_part(node, section):
+    """解析单个部分的结构"""
+    content_type = f"{_text(node[0])}/{_text(node[1])}".lower()
+    # 文本部分在大小之后有行数，message/rfc822 还有信封、结构和行数，之后才是扩展字段
+    if content_type == 'message/rfc822':
+        disposition_index = 11
+    elif content_type.startswith('text/'):
+        disposition_index = 9
+    else:
+        disposition_index = 8
+    disposition = node[disposition_index] if len(node) > disposition_index else None
+    disposition_type, disposition_params = '', {}
+    if isinstance(disposition, list) and disposition:
+        disposition_type = _text(disposition[0]).lower()
+        disposition_params = _params(disposition[1]) if len(disposition) > 1 else {}
+    return {
+        'section': section,
+        'content_type': content_type,
+        'params': _params(node[2]),
+        'encoding': _text(node[5]).lower() or '7bit',
+        'size': int(node[6] or 0),
+        'disposition': disposition_type,
+        'disposition_params': disposition_params,
+    }
+
+
+def _walk(node, section, leaves):
+    """按部分编号展开结构，多部分的子部分编号为 父编号.序号"""
+    if node and isinstance(node[0], list):
+        index = 0
+        for child in node:
+            if not isinstance(child, list):
+                # 子部分之后是多部分的子类型和扩展字段
+                break
+            index += 1
+            _walk(child, f"{section}.{index}" if section else str(index), leaves)
+    else:
+        # 非多部分的邮件只有部分1
+        leaves.append(_leaf_part(node, section or '1'))
+
+
+def plan_parts(structure, prefer_plain=True):
+    """根据 BODYSTRUCTURE 确定需要下载的正文部分
+
+    Args:
+        structure: parse_fetch_items 解析出的 BODYSTRUCTURE
+        prefer_plain: 有非空的纯文本部分时只下载纯文本，与 extract_email_content 的选择一致；
+                      为 False 时下载全部纯文本和HTML部分
+
+    Returns:
+        (正文部分列表, 附件信息列表)
+    """
+    leaves = []
+    _walk(structure, '', leaves)
+    body_parts = []
+    attachments = []
+    for part in leaves:
+        if is_body_part(part['content_type'], part['disposition']):
+            body_parts.append(part)
+        else:
+            filename = _filename(part['params'], part['disposition_params'])
+            attachments.append(build_attachment_info(
+                filename, part['content_type'], _decoded_size(part['size'], part['encoding'])
+            ))
+    if prefer_plain and any(part['content_type'] == 'text/plain' and part['size'] for part in body_parts):
+        body_parts = [part for part in body_parts if part['content_type'] == 'text/plain']
+    return body_parts, attachments
+
+
+def _set_content(target, part, data):
+    """按结构中的类型、参数和传输编码设置部分内容，get_payload(decode=True) 可以正常解码"""
+    params = ''.join(f'; {name}="{email.utils.quote(value)}"' for name, value in part['params'].items())
+    target['Content-Type'] = part['content_type'] + params
+    target['Content-Transfer-Encoding'] = part['encoding']
+    # 与邮件解析器一致，8bit内容用 surrogateescape 保存原始字节
+    target.set_payload(data.decode('ascii', 'surrogateescape'))
+
+
+def build_message(header, body_parts, contents):
+    """用邮件头和下载的正文部分组成邮件对象，可以直接交给 parse_email_message 解析"""
+    msg = email.message_from_bytes(header or b'')
+    for name in CONTENT_HEADERS:
+        del msg[name]
+    if len(body_parts) == 1:
+        _set_content(msg, body_parts[0], contents[0])
+    elif body_parts:
+        msg['Content-Type'] = 'multipart/mixed'
+        msg.set_payload([])
+        for part, data in zip(body_parts, contents):
+            sub_part = Message()
+            _set_content(sub_part, part, data)
+            msg.attach(sub_part)
+    else:
+        msg['Content-Type'] = 'text/plain'
+        msg.set_payload('')
+    return msg
+
+
+def _fetch_items(mail, uids, item):
+    """对一组邮件发送一个 UID FETCH，返回响应数据，失败时返回空列表"""
+    try:
+        status, data = mail.uid('FETCH', format_uid_set(uids), f'(UID {item})')
+        if status == 'OK':
+            return data
+        logger.error(f"批量获取邮件失败: {status}")
+    except imaplib.IMAP4.error as e:
+        logger.error(f"批量获取邮件失败: {str(e)}")
+    return []
+
+
+def partial_batch_steps(batch, prefer_plain):
+    """获取一批邮件的步骤，不直接访问网络，同步和异步收信共用
+
+    每一步产出 (uids, 数据项)，调用方对这些邮件发送一个 UID FETCH，
+    把响应数据（与 imaplib 的格式相同，失败时为空列表）发送回来。
+    没有返回结构、无法解析结构或正文部分获取失败的邮件改为获取完整内容。
+
+    Returns:
+        {uid: (邮件对象, 附件列表)}，获取完整内容的邮件附件列表为 None
+    """
+    structures = parse_fetch_items((yield batch, STRUCTURE_FETCH_ITEM))
+    plans = {}
+    full_uids = []
+    for uid in batch:
+        items = structures.get(uid)
+        if not items or b'BODYSTRUCTURE' not in items:
+            full_uids.append(uid)
+            continue
+        try:
+            plans[uid] = (items.get(b'BODY[HEADER]'), *plan_parts(items[b'BODYSTRUCTURE'], prefer_plain))
+        except Exception as e:
+            logger.warning(f"解析邮件结构失败, UID: {uid}, 获取完整邮件: {str(e)}")
+            full_uids.append(uid)
+
+    # 正文部分编号相同的邮件合并为一个命令，一批邮件通常只有几种结构
+    groups = defaultdict(list)
+    for uid, (_, body_parts, _) in plans.items():
+        sections = tuple(part['section'] for part in body_parts)
+        if sections:
+            groups[sections].append(uid)
+    contents = {}
+    for sections, uids in groups.items():
+        # 与获取 RFC822 一样把邮件标记为已读
+        contents.update(parse_fetch_items((yield uids, ' '.join(f'BODY[{section}]' for section in sections))))
+
+    results = {}
+    for uid, (header, body_parts, attachments) in plans.items():
+        items = contents.get(uid, {})
+        data = [items.get(f"BODY[{part['section']}]".encode()) for part in body_parts]
+        if header is None or any(value is None for value in data):
+            full_uids.append(uid)
+            continue
+        results[uid] = (build_message(header, body_parts, data), attachments)
+
+    if full_uids:
+        full_uids.sort()
+        for uid, data in parse_fetch_response((yield full_uids, 'RFC822')).items():
+            if uid in full_uids:
+                results[uid] = (email.message_from_bytes(data), None)
+    return results
+
+
+def _fetch_partial_batch(mail, batch, prefer_plain):
+    """获取一批邮件，返回 {uid: (邮件对象, 附件列表)}"""
+    steps = partial_batch_steps(batch, prefer_plain)
+    try:
+        request = next(steps)
+        while True:
+            request = steps.send(_fetch_items(mail, *request))
+    except StopIteration as stop:
+        return stop.value
+
+
+def fetch_messages(mail, uids, prefer_plain=True, batch_size=None):
+    """按批获取邮件
+
+    启用 IMAP_PARTIAL_FETCH 时每批先获取 BODYSTRUCTURE 和邮件头，再只下载正文部分，
+    否则每批获取完整的 RFC822。
+
+    Args:
+        mail: 已选择文件夹的IMAP连接
+        uids: 需要获取的UID列表
+        prefer_plain: 见 plan_parts
+        batch_size: 每批的邮件数，默认使用 IMAP_FETCH_BATCH_SIZE
+
+    Yields:
+        (uid, 邮件对象, 附件列表)，按 uids 的顺序产出；获取失败时邮件对象为 None，
+        附件列表为 None 表示获取的是完整邮件，附件从邮件中提取
+    """
+    if not config.IMAP_PARTIAL_FETCH:
+        for uid, data in fetch_uid_batches(mail, uids, 'RFC822', batch_size):
+            yield uid, email.message_from_bytes(data) if data is not None else None, None
+        return
+
+    batch_size = max(1, batch_size or config.IMAP_FETCH_BATCH_SIZE)
+    for start in range(0, len(uids), batch_size):
+        batch = uids[start:start + batch_size]
+        results = _fetch_partial_batch(mail, batch, prefer_plain)
+        for uid in batch:
+            msg, attachments = results.get(uid, (None, None))
+            yield uid, msg, attachments
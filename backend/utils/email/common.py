@@ -6,10 +6,12 @@ from bs4 import BeautifulSoup
 from email.header import decode_header
 from email.message import Message
 import chardet
-from datetime import datetime
+from datetime import datetime, timezone
 import email.utils
 import time
 import traceback
+import hashlib
+import re
 from typing import Union, Dict
 import os
 
@@ -130,37 +132,63 @@ def decode_email_content(byte_content):
         logger.error(f"解码邮件内容失败: {str(e)}")
         return str(byte_content)
 
+def parse_email_headers(msg: Message) -> dict:
+    """
+    解析邮件头中的主题、发件人、接收时间和Message-ID
+    
+    只获取了邮件头的消息也可以解析，得到的字段与 parse_email_message 相同，
+    两阶段收信时据此计算去重键。
+    """
+    subject = msg.get("subject", "")
+    sender = msg.get("from", "")
+    date_str = msg.get("date", "")
+    message_id = msg.get("message-id", "")
+    
+    # 记录开始解析
+    logger.debug(f"开始解析邮件: ID[{message_id}]")
+    
+    # 解码主题和发件人
+    try:
+        subject = decode_mime_words(subject) if subject else "(无主题)"
+        sender = decode_mime_words(sender) if sender else "(未知发件人)"
+        logger.debug(f"解码主题: {subject[:50]}...")
+        logger.debug(f"解码发件人: {sender[:50]}...")
+    except Exception as e:
+        logger.warning(f"解码邮件信息失败: {str(e)}")
+        subject = str(subject) or "(无主题)"
+        sender = str(sender) or "(未知发件人)"
+    
+    # 解析日期
+    try:
+        received_time = parse_email_date(date_str) if date_str else datetime.now()
+        logger.debug(f"解析日期: {date_str} -> {received_time}")
+    except Exception as e:
+        logger.warning(f"解析日期失败: {str(e)}, 使用当前时间")
+        received_time = datetime.now()
+    
+    return {
+        "subject": subject,
+        "sender": sender,
+        "received_time": received_time,
+        "message_id": message_id.strip() if message_id else "",
+        # 没有Date头时接收时间取当前时间，去重键不稳定
+        "has_date": bool(date_str)
+    }
+
 @timing_decorator
-def parse_email_message(msg: Message, folder: str = "INBOX") -> dict:
-    """解析邮件消息对象为结构化数据"""
+def parse_email_message(msg: Message, folder: str = "INBOX", attachments=None) -> dict:
+    """
+    解析邮件消息对象为结构化数据
+    
+    按 BODYSTRUCTURE 只获取了正文部分的邮件，附件列表由调用方传入 attachments，
+    否则从邮件中提取。
+    """
     try:
-        # 安全地获取邮件信息
-        subject = msg.get("subject", "")
-        sender = msg.get("from", "")
-        date_str = msg.get("date", "")
-        message_id = msg.get("message-id", "")
-        
-        # 记录开始解析
-        logger.debug(f"开始解析邮件: ID[{message_id}]")
-        
-        # 解码主题和发件人
-        try:
-            subject = decode_mime_words(subject) if subject else "(无主题)"
-            sender = decode_mime_words(sender) if sender else "(未知发件人)"
-            logger.debug(f"解码主题: {subject[:50]}...")
-            logger.debug(f"解码发件人: {sender[:50]}...")
-        except Exception as e:
-            logger.warning(f"解码邮件信息失败: {str(e)}")
-            subject = str(subject) or "(无主题)"
-            sender = str(sender) or "(未知发件人)"
-        
-        # 解析日期
-        try:
-            received_time = parse_email_date(date_str) if date_str else datetime.now()
-            logger.debug(f"解析日期: {date_str} -> {received_time}")
-        except Exception as e:
-            logger.warning(f"解析日期失败: {str(e)}, 使用当前时间")
-            received_time = datetime.now()
+        headers = parse_email_headers(msg)
+        subject = headers["subject"]
+        sender = headers["sender"]
+        received_time = headers["received_time"]
+        message_id = headers["message_id"]
         
         # 获取邮件内容
         start_time = time.time()
@@ -174,7 +202,9 @@ def parse_email_message(msg: Message, folder: str = "INBOX") -> dict:
             "sender": sender,
             "received_time": received_time,
             "content": content,
-            "folder": folder
+            "folder": folder,
+            "message_id": message_id,
+            "attachments": extract_attachments(msg) if attachments is None else attachments
         }
         
         logger.debug(f"完成邮件解析: {subject[:30]}...")
@@ -282,6 +312,55 @@ def extract_email_content(msg: Union[Message, Dict]) -> str:
         traceback.print_exc()
         return "(无法提取邮件内容)"
 
+def is_body_part(content_type, content_disposition=None):
+    """是否为正文部分：不是附件的纯文本或HTML，与 extract_email_content 的选择规则相同"""
+    return content_type in ("text/plain", "text/html") and "attachment" not in str(content_disposition or "").lower()
+
+def build_attachment_info(filename, content_type, size):
+    """附件信息，只记录文件名、类型和大小，不保存附件内容"""
+    try:
+        filename = decode_mime_words(filename) if filename else ""
+    except Exception:
+        filename = str(filename)
+    return {
+        "filename": filename,
+        "content_type": content_type,
+        "size": size
+    }
+
+def extract_attachments(msg: Message) -> list:
+    """
+    列出邮件中的附件
+    
+    正文以外的部分都视为附件，附件中的邮件(message/rfc822)整体作为一个附件。
+    
+    Returns:
+        list: 附件信息列表，每项包括 filename、content_type 和 size(字节)
+    """
+    attachments = []
+    
+    def visit(part):
+        content_type = part.get_content_type()
+        try:
+            if content_type == "message/rfc822":
+                inner = part.get_payload()
+                size = sum(len(item.as_bytes()) for item in inner) if isinstance(inner, list) else len(str(inner))
+            elif part.is_multipart():
+                for sub_part in part.get_payload():
+                    visit(sub_part)
+                return
+            elif is_body_part(content_type, part.get("content-disposition")):
+                return
+            else:
+                size = len(part.get_payload(decode=True) or b"")
+            attachments.append(build_attachment_info(part.get_filename(), content_type, size))
+        except Exception as e:
+            logger.warning(f"读取附件信息失败: {str(e)}")
+    
+    if isinstance(msg, Message):
+        visit(msg)
+    return attachments
+
 def normalize_check_time(last_check_time):
     """
     标准化处理上次检查时间参数
@@ -337,4 +416,92 @@ def format_date_for_imap_search(dt):
         return dt.strftime("%d-%b-%Y")
     except Exception as e:
         logger.error(f"格式化日期失败: {str(e)}")
-        return None 
\ No newline at end of file
+        return None
+
+def _normalize_dedup_time(received_time):
+    """将接收时间规范化为UTC秒级字符串，保证同一时间的不同表示得到相同结果"""
+    if not received_time:
+        return ""
+    
+    if isinstance(received_time, str):
+        try:
+            received_time = datetime.fromisoformat(received_time.strip().replace('Z', '+00:00'))
+        except ValueError:
+            return received_time.strip()
+    
+    if isinstance(received_time, datetime):
+        if received_time.tzinfo is not None:
+            received_time = received_time.astimezone(timezone.utc).replace(tzinfo=None)
+        return received_time.strftime("%Y-%m-%d %H:%M:%S")
+    
+    return str(received_time)
+
+def build_fallback_dedup_key(subject, sender, received_time):
+    """根据主题、发件人和接收时间生成去重键"""
+    raw = "\x1f".join([
+        (subject or "").strip(),
+        (sender or "").strip(),
+        _normalize_dedup_time(received_time)
+    ])
+    return "h:" + hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+def build_dedup_key(message_id=None, subject=None, sender=None, received_time=None):
+    """
+    生成邮件去重键
+    
+    优先使用Message-ID（去掉尖括号并转为小写），
+    没有Message-ID时使用主题、发件人和接收时间的哈希值。
+    
+    Args:
+        message_id: 邮件的Message-ID头
+        subject: 邮件主题
+        sender: 发件人
+        received_time: 接收时间，datetime对象或字符串
+        
+    Returns:
+        str: 去重键
+    """
+    if message_id:
+        normalized = message_id.strip().strip('<>').strip().lower()
+        if normalized:
+            return "mid:" + normalized
+    return build_fallback_dedup_key(subject, sender, received_time)
+
+def build_header_dedup_keys(headers):
+    """
+    根据 parse_email_headers 的结果生成用于查询已存在邮件的去重键
+    
+    带Message-ID的邮件同时返回按主题、发件人和时间生成的键，旧版本保存的记录使用该键。
+    
+    Returns:
+        tuple: 去重键，无法得到稳定的去重键时返回空元组
+    """
+    subject, sender, received_time = headers["subject"], headers["sender"], headers["received_time"]
+    fallback_key = build_fallback_dedup_key(subject, sender, received_time)
+    dedup_key = build_dedup_key(headers["message_id"], subject, sender, received_time)
+    if dedup_key != fallback_key:
+        return (dedup_key, fallback_key) if headers["has_date"] else (dedup_key,)
+    return (dedup_key,) if headers["has_date"] else ()
+
+# 列表中展示的摘要长度
+SNIPPET_LENGTH = 120
+
+def build_snippet(content, length=SNIPPET_LENGTH):
+    """
+    生成邮件正文摘要
+    
+    合并连续空白并截取前 length 个字符，用于列表展示，避免列表接口返回完整正文。
+    
+    Args:
+        content: 邮件正文（已去除HTML标签的纯文本）
+        length: 摘要最大长度
+        
+    Returns:
+        str: 摘要文本
+    """
+    if not content or not isinstance(content, str):
+        return ""
+    text = re.sub(r"\s+", " ", content[:length * 4]).strip()
+    if len(text) > length:
+        return text[:length].rstrip() + "…"
+    return text
@@ -13,6 +13,7 @@ import logging
 from datetime import datetime
 from typing import List, Dict, Optional, Callable
 from .logger import log_email_start, log_email_complete, log_email_error
+from .uid_sync import load_sync_state, commit_sync_state, stored_key_filter
 
 logger = logging.getLogger(__name__)
 
@@ -25,7 +26,7 @@ class GmailHandler(IMAPMailHandler):
     USE_SSL = True
     
     @classmethod
-    def fetch_emails(cls, email_address, password, folder="INBOX", callback=None, last_check_time=None):
+    def fetch_emails(cls, email_address, password, folder="INBOX", callback=None, last_check_time=None, sync_state=None, key_filter=None):
         """获取Gmail邮箱中的邮件"""
         return super().fetch_emails(
             email_address=email_address,
@@ -35,7 +36,9 @@ class GmailHandler(IMAPMailHandler):
             use_ssl=cls.USE_SSL,
             folder=folder,
             callback=callback,
-            last_check_time=last_check_time
+            last_check_time=last_check_time,
+            sync_state=sync_state,
+            key_filter=key_filter
         )
     
     @classmethod
@@ -54,15 +57,19 @@ class GmailHandler(IMAPMailHandler):
             # 获取上次检查时间
             last_check_time = email_info.get('last_check_time')
             
-            # 获取邮件
+            # 获取邮件，按UID只获取上次同步之后的新邮件
+            sync_state = load_sync_state(db, email_info['id'])
             mail_records = cls.fetch_emails(
                 email_address=email_info['email'],
                 password=email_info['password'],
                 callback=progress_callback,
-                last_check_time=last_check_time
+                last_check_time=last_check_time,
+                sync_state=sync_state,
+                key_filter=stored_key_filter(db, email_info['id'])
             )
             
             if not mail_records:
+                commit_sync_state(db, email_info['id'], sync_state)
                 if progress_callback:
                     progress_callback(0, "没有找到新邮件")
                 return {'success': False, 'message': '没有找到新邮件'}
@@ -71,8 +78,10 @@ class GmailHandler(IMAPMailHandler):
             if progress_callback:
                 progress_callback(50, f"开始保存 {len(mail_records)} 封邮件")
             
-            # 保存邮件记录
-            saved_count = db.save_mail_records(email_info['id'], mail_records, progress_callback)
+            # 保存邮件记录，全部保存成功后再记录同步位置
+            # 邮件处理器依赖本模块，在这里导入避免循环导入
+            from .mail_processor import MailProcessor
+            saved_count = MailProcessor.save_mail_records(db, email_info['id'], mail_records, progress_callback, sync_state)
             
             # 记录完成
             log_email_complete(email_info['email'], email_info['id'], len(mail_records), len(mail_records), saved_count)
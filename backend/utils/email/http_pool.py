@@ -0,0 +1,122 @@
+"""
+OAuth HTTP连接池
+令牌接口的请求共用一个 requests 会话，保持长连接，省去每次刷新的TCP握手和TLS握手。
+每个请求都有连接和读取超时，网络错误和服务器繁忙时按指数退避加随机抖动重试。
+"""
+
+import time
+import random
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from database import config
+from .logger import logger
+
+# 服务器繁忙或临时故障，可以重试的状态码
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# Retry-After 指定的等待时间上限(秒)
+MAX_RETRY_AFTER = 30
+
+
+class HTTPSessionPool:
+    """共用的 HTTP 会话
+
+    每个主机最多保持 pool_size 个连接，连接都在使用时其他线程等待空闲连接，
+    不会为令牌刷新打开无限多的连接。
+    """
+
+    def __init__(self, pool_size=None, connect_timeout=None, read_timeout=None, retries=None, backoff=None):
+        """初始化连接池
+
+        Args:
+            pool_size: 每个主机保持的连接数
+            connect_timeout: 建立连接的超时(秒)
+            read_timeout: 等待响应的超时(秒)
+            retries: 失败后最多重试的次数
+            backoff: 第一次重试前等待时间的上限(秒)，之后每次加倍，实际等待时间在 0 到上限之间随机
+        """
+        self.pool_size = config.OAUTH_HTTP_POOL_SIZE if pool_size is None else pool_size
+        self.connect_timeout = config.OAUTH_HTTP_CONNECT_TIMEOUT if connect_timeout is None else connect_timeout
+        self.read_timeout = config.OAUTH_HTTP_READ_TIMEOUT if read_timeout is None else read_timeout
+        self.retries = config.OAUTH_HTTP_RETRIES if retries is None else retries
+        self.backoff = config.OAUTH_HTTP_RETRY_BACKOFF if backoff is None else backoff
+        self._lock = threading.Lock()
+        self._session = None
+        self._stats = {'requests': 0, 'retries': 0, 'failed': 0}
+
+    def _get_session(self):
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, pool_block=True)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._session = session
+            return self._session
+
+    def post(self, url, **kwargs):
+        """发送 POST 请求，网络错误和可重试的状态码按退避时间重试
+
+        Returns:
+            最后一次请求的响应，重试后仍为可重试的状态码时也返回该响应
+
+        Raises:
+            requests.RequestException: 重试后仍无法连接或超时
+        """
+        kwargs.setdefault('timeout', (self.connect_timeout, self.read_timeout))
+        attempt = 0
+        while True:
+            with self._lock:
+                self._stats['requests'] += 1
+            try:
+                response = self._get_session().post(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.retries:
+                    with self._lock:
+                        self._stats['failed'] += 1
+                    raise
+                logger.warning(f"请求 {url} 失败，准备重试: {str(e)}")
+                delay = self._delay(attempt)
+            else:
+                if response.status_code not in RETRY_STATUS or attempt >= self.retries:
+                    return response
+                logger.warning(f"请求 {url} 返回 {response.status_code}，准备重试")
+                delay = self._delay(attempt, response.headers.get('Retry-After'))
+                response.close()
+            with self._lock:
+                self._stats['retries'] += 1
+            attempt += 1
+            time.sleep(delay)
+
+    def _delay(self, attempt, retry_after=None):
+        """第 attempt 次重试前的等待时间，多个线程同时失败时错开重试"""
+        if retry_after:
+            try:
+                return min(float(retry_after), MAX_RETRY_AFTER)
+            except ValueError:
+                pass
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    def close(self):
+        """关闭所有连接，下次请求时重新创建会话"""
+        with self._lock:
+            session, self._session = self._session, None
+        if session is not None:
+            session.close()
+
+    def status(self):
+        """返回连接池状态"""
+        with self._lock:
+            return {
+                'pool_size': self.pool_size,
+                'timeout': (self.connect_timeout, self.read_timeout),
+                'retries': self.retries,
+                **self._stats,
+            }
+
+
+# 令牌接口等OAuth请求共用的连接池
+http_pool = HTTPSessionPool()
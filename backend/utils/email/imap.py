@@ -4,7 +4,6 @@ IMAP邮件处理模块 - 增强版
 """
 
 import imaplib
-import email
 from email.header import decode_header
 from email.utils import parsedate_to_datetime
 import os
@@ -17,6 +16,7 @@ import time
 import traceback
 from typing import List, Dict, Optional, Callable
 
+from database import config
 from .common import (
     decode_mime_words,
     parse_email_date,
@@ -24,7 +24,9 @@ from .common import (
     parse_email_message,
     extract_email_content,
     normalize_check_time,
-    format_date_for_imap_search
+    format_date_for_imap_search,
+    parse_email_headers,
+    build_header_dedup_keys
 )
 from .logger import (
     logger, 
@@ -36,6 +38,17 @@ from .logger import (
     log_progress,
     timing_decorator
 )
+from .uid_sync import (
+    search_uids,
+    advance_sync_state,
+    skip_stored_uids,
+    is_incremental,
+    commit_sync_state,
+    load_sync_state,
+    stored_key_filter
+)
+from .bodystructure import fetch_messages
+from .imap_pool import imap_pool, account_key
 
 logger = logging.getLogger(__name__)
 
@@ -44,10 +57,18 @@ class IMAPMailHandler:
     
     @staticmethod
     @timing_decorator
-    def fetch_emails(email_address, password, server, port=993, use_ssl=True, folder="INBOX", callback=None, last_check_time=None):
-        """获取邮箱中的邮件"""
+    def fetch_emails(email_address, password, server, port=993, use_ssl=True, folder="INBOX", callback=None, last_check_time=None, sync_state=None, key_filter=None):
+        """获取邮箱中的邮件
+        
+        提供 sync_state 时按UID增量获取，只获取上次同步之后的新邮件，
+        并把新的同步位置记录在 sync_state 中，由调用方在保存邮件后写入数据库。
+        提供 key_filter 时，首次同步或重新全量同步先批量获取邮件头，只下载数据库中还没有的邮件的正文。
+        启用 IMAP_PARTIAL_FETCH 时按 BODYSTRUCTURE 只下载正文部分，附件只记录文件名和大小。
+        连接从连接池中获取，收信结束后放回，下次收信复用已登录的会话。
+        """
         mail_records = []
         mail = None
+        pool_key = account_key(server, port, email_address, use_ssl, password)
         
         try:
             # 创建回调函数
@@ -62,29 +83,28 @@ class IMAPMailHandler:
             else:
                 logger.info(f"获取所有邮件")
                 
-            # 连接IMAP服务器
-            logger.info(f"连接IMAP服务器 {server}:{port} (SSL: {use_ssl})")
             if callback:
                 callback(0, "正在连接邮箱服务器")
-                
-            if use_ssl:
-                mail = imaplib.IMAP4_SSL(server, port)
-            else:
-                mail = imaplib.IMAP4(server, port)
             
-            # 登录
-            logger.info(f"登录邮箱 {email_address}")
-            if callback:
-                callback(10, "正在登录邮箱")
+            def connect():
+                # 连接池中没有可用的连接时，连接IMAP服务器并登录
+                logger.info(f"连接IMAP服务器 {server}:{port} (SSL: {use_ssl})")
+                if use_ssl:
+                    new_mail = imaplib.IMAP4_SSL(server, port, timeout=config.IMAP_SOCKET_TIMEOUT)
+                else:
+                    new_mail = imaplib.IMAP4(server, port, timeout=config.IMAP_SOCKET_TIMEOUT)
                 
-            mail.login(email_address, password)
+                logger.info(f"登录邮箱 {email_address}")
+                if callback:
+                    callback(10, "正在登录邮箱")
+                new_mail.login(email_address, password)
+                return new_mail
             
             # 选择邮件文件夹
             logger.info(f"选择文件夹 {folder}")
+            mail = imap_pool.acquire(pool_key, connect, folder)
             if callback:
                 callback(20, f"正在选择文件夹 {folder}")
-                
-            mail.select(folder)
             
             # 搜索邮件
             search_criteria = 'ALL'
@@ -97,43 +117,41 @@ class IMAPMailHandler:
                     search_criteria = f'SINCE {date_str}'
                     logger.info(f"获取自 {date_str} 以来的新邮件")
             
-            _, messages = mail.search(None, search_criteria)
-            message_numbers = messages[0].split()
-            total_messages = len(message_numbers)
+            uids, uid_status = search_uids(mail, folder, sync_state, search_criteria)
+            failed_uids = []
             
-            logger.info(f"找到 {total_messages} 封邮件")
+            logger.info(f"找到 {len(uids)} 封邮件")
             
-            # 处理每封邮件
-            for i, num in enumerate(message_numbers):
+            # 第一阶段：不是按UID增量获取时，批量获取邮件头，排除数据库中已有的邮件
+            new_uids = uids
+            if not is_incremental(sync_state, uid_status):
+                new_uids = skip_stored_uids(
+                    mail, uids, lambda header: build_header_dedup_keys(parse_email_headers(header)), key_filter
+                )
+            total_messages = len(new_uids)
+            
+            # 第二阶段：按批获取新邮件的正文，每批只需少量网络往返
+            for i, (uid, msg, attachments) in enumerate(fetch_messages(mail, new_uids)):
                 try:
                     # 更新进度
                     progress = int((i + 1) / total_messages * 100)
                     if callback:
                         callback(progress, f"正在处理第 {i + 1}/{total_messages} 封邮件")
                     
-                    # 获取邮件头信息，用于提前判断是否已存在
-                    _, header_data = mail.fetch(num, '(BODY.PEEK[HEADER.FIELDS (SUBJECT FROM DATE)])')
-                    msg_header = email.message_from_bytes(header_data[0][1])
+                    if msg is None:
+                        failed_uids.append(uid)
+                        continue
                     
-                    subject = decode_mime_words(msg_header.get("subject", "")) if msg_header.get("subject") else "(无主题)"
-                    sender = decode_mime_words(msg_header.get("from", "")) if msg_header.get("from") else "(未知发件人)"
-                    date_str = msg_header.get("date", "")
+                    subject = decode_mime_words(msg.get("subject", "")) if msg.get("subject") else "(无主题)"
+                    sender = decode_mime_words(msg.get("from", "")) if msg.get("from") else "(未知发件人)"
+                    date_str = msg.get("date", "")
                     received_time = parse_email_date(date_str) if date_str else datetime.now()
                     
                     # 创建一个唯一标识用于检查邮件是否已存在
                     mail_key = f"{subject}|{sender}|{received_time.isoformat()}"
                     
-                    # 在这里可以添加检查邮件是否已存在于数据库的代码
-                    # 如果已经有接口可以查询，则直接调用
-                    # 此处仅收集基本信息，稍后在批量处理时进行检查
-                    
-                    # 获取完整邮件内容
-                    _, msg_data = mail.fetch(num, '(RFC822)')
-                    email_body = msg_data[0][1]
-                    msg = email.message_from_bytes(email_body)
-                    
                     # 解析邮件
-                    mail_record = parse_email_message(msg, folder)
+                    mail_record = parse_email_message(msg, folder, attachments)
                     if mail_record:
                         # 添加一些额外信息用于去重判断
                         mail_record['mail_key'] = mail_key
@@ -146,11 +164,13 @@ class IMAPMailHandler:
                     logger.error(f"处理邮件失败: {str(e)}")
                     message_id = 'unknown'
                     log_message_error(message_id, str(e))
+                    failed_uids.append(uid)
                     continue
             
-            # 关闭连接
-            mail.close()
-            mail.logout()
+            advance_sync_state(sync_state, uid_status, uids, failed_uids)
+            
+            # 放回连接池，不关闭连接
+            imap_pool.release(pool_key, mail)
             
             # 记录完成日志
             log_email_complete(email_address, "未知", len(mail_records), len(mail_records), len(mail_records))
@@ -160,12 +180,8 @@ class IMAPMailHandler:
         except Exception as e:
             logger.error(f"获取邮件失败: {str(e)}")
             log_email_error(email_address, "未知", str(e))
-            if mail:
-                try:
-                    mail.close()
-                    mail.logout()
-                except:
-                    pass
+            # 出错的连接状态不确定，直接关闭
+            imap_pool.release(pool_key, mail, broken=True)
             return []
     
     @staticmethod
@@ -185,22 +201,28 @@ class IMAPMailHandler:
                     progress_callback(progress, f"正在检查文件夹: {folder}")
             
             # 获取邮件
+            sync_state = load_sync_state(db, email_info['id'])
             mail_records = IMAPMailHandler.fetch_emails(
                 email_address=email_address,
                 password=password,
                 server=server,
                 port=port,
                 use_ssl=use_ssl,
-                callback=folder_progress_callback
+                callback=folder_progress_callback,
+                sync_state=sync_state,
+                key_filter=stored_key_filter(db, email_info['id'])
             )
             
             if not mail_records:
+                commit_sync_state(db, email_info['id'], sync_state)
                 if progress_callback:
                     progress_callback(0, "没有找到新邮件")
                 return {'success': False, 'message': '没有找到新邮件'}
             
-            # 保存邮件记录
-            saved_count = db.save_mail_records(email_info['id'], mail_records, progress_callback)
+            # 保存邮件记录，全部保存成功后再记录同步位置
+            # 邮件处理器依赖本模块，在这里导入避免循环导入
+            from .mail_processor import MailProcessor
+            saved_count = MailProcessor.save_mail_records(db, email_info['id'], mail_records, progress_callback, sync_state)
             
             if progress_callback:
                 progress_callback(100, f"成功获取 {len(mail_records)} 封邮件，新增 {saved_count} 封")
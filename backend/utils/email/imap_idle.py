@@ -0,0 +1,272 @@
+"""
+IMAP IDLE 推送
+为启用实时检查、服务器支持 IDLE 的邮箱保持一个长连接，收到新邮件的 EXISTS 通知后立即触发一次增量收信。
+服务器不支持 IDLE、会话数达到上限或会话断开重连期间，邮箱仍由实时检查按间隔轮询。
+"""
+
+import re
+import socket
+import imaplib
+import threading
+
+from database import config
+from .logger import logger
+from .outlook import OutlookMailHandler
+from .token_cache import outlook_token_cache
+from .gmail import GmailHandler
+from .qq import QQMailHandler
+
+# IDLE 期间服务器推送的新邮件数通知，如 * 23 EXISTS
+EXISTS_PATTERN = re.compile(rb'^\* (\d+) EXISTS', re.IGNORECASE)
+
+# 邮箱类型固定的服务器 (地址, 端口, SSL)，其他类型使用邮箱自己的配置
+FIXED_SERVERS = {
+    'outlook': ('outlook.office365.com', 993, True),
+    'gmail': (GmailHandler.SERVER, GmailHandler.PORT, GmailHandler.USE_SSL),
+    'qq': (QQMailHandler.SERVER, QQMailHandler.PORT, QQMailHandler.USE_SSL),
+}
+
+# 连接失败后重试的等待时间(秒)，连续失败时加倍
+RETRY_DELAY = 5
+MAX_RETRY_DELAY = 300
+
+
+class IdleNotSupported(Exception):
+    """服务器不支持 IDLE"""
+
+
+def connect_account(account, db=None):
+    """按邮箱类型连接服务器并登录，返回 IMAP 连接，db 用于读取和保存 Outlook 的访问令牌"""
+    mail_type = account.get('mail_type') or 'imap'
+    server, port, use_ssl = FIXED_SERVERS.get(
+        mail_type, (account.get('server'), account.get('port') or 993, account.get('use_ssl', True))
+    )
+    timeout = config.IMAP_SOCKET_TIMEOUT
+    mail = imaplib.IMAP4_SSL(server, port, timeout=timeout) if use_ssl else imaplib.IMAP4(server, port, timeout=timeout)
+    try:
+        if mail_type == 'outlook':
+            access_token = outlook_token_cache.get_token(account, db)
+            if not access_token:
+                raise imaplib.IMAP4.error("获取访问令牌失败")
+            auth_string = OutlookMailHandler.generate_auth_string(account['email'], access_token)
+            mail.authenticate('XOAUTH2', lambda x: auth_string)
+        else:
+            mail.login(account['email'], account['password'])
+    except Exception:
+        try:
+            mail.shutdown()
+        except Exception:
+            pass
+        raise
+    return mail
+
+
+class IdleSession:
+    """一个邮箱的 IDLE 长连接，在独立线程中等待服务器推送
+
+    imaplib 的连接读超时后不能继续读取，因此每隔 renew_interval 秒读超时后重新连接并进入 IDLE，
+    同时满足 RFC 2177 要求的29分钟内重新发送 IDLE。重新连接后邮件数变化时补一次收信。
+    """
+
+    def __init__(self, account, on_new_mail, on_unsupported, renew_interval, db=None, folder="INBOX"):
+        self.account = account
+        self.db = db
+        self.on_new_mail = on_new_mail
+        self.on_unsupported = on_unsupported
+        self.renew_interval = renew_interval
+        self.folder = folder
+        # 已进入 IDLE 时为 True，连接失败等待重试期间为 False，此时由轮询检查
+        self.active = False
+        self._stop = threading.Event()
+        self._mail = None
+        self._exists = None
+        self._thread = threading.Thread(target=self._run, name=f"imap-idle-{account['id']}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """停止会话，关闭套接字使阻塞的读取立即返回"""
+        self._stop.set()
+        mail = self._mail
+        if mail is not None:
+            try:
+                mail.sock.shutdown(socket.SHUT_RDWR)
+            except Exception:
+                pass
+
+    @property
+    def alive(self):
+        return self._thread.is_alive()
+
+    def _run(self):
+        delay = RETRY_DELAY
+        while not self._stop.is_set():
+            try:
+                self._idle_once()
+                delay = RETRY_DELAY
+            except IdleNotSupported:
+                self.active = False
+                logger.info(f"邮箱 {self.account['email']} 的服务器不支持IDLE，改为轮询检查")
+                self.on_unsupported(self.account)
+                return
+            except (socket.timeout, TimeoutError):
+                # 到了重新发送 IDLE 的时间
+                logger.debug(f"邮箱 {self.account['email']} 的IDLE会话到期，重新连接")
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                self.active = False
+                logger.warning(f"邮箱 {self.account['email']} 的IDLE会话断开，{delay}秒后重试: {str(e)}")
+                self._stop.wait(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+            finally:
+                self._close()
+        self.active = False
+
+    def _idle_once(self):
+        """连接、进入 IDLE 并等待通知，直到读超时、连接断开或服务器结束 IDLE"""
+        mail = connect_account(self.account, self.db)
+        self._mail = mail
+        if self._stop.is_set():
+            return
+        # 部分服务器登录后才列出 IDLE，重新查询一次
+        status, data = mail.capability()
+        capabilities = (data[0] or b'').upper().split() if status == 'OK' and data else []
+        if b'IDLE' not in capabilities:
+            raise IdleNotSupported()
+
+        # 只读方式选择文件夹，不影响邮件的已读状态
+        status, data = mail.select(self.folder, readonly=True)
+        if status != 'OK':
+            raise imaplib.IMAP4.error(f"选择文件夹 {self.folder} 失败: {status}")
+        exists = int(data[0]) if data and data[0] else 0
+        # 第一次连接、以及重新连接期间邮件数变化时补一次收信
+        if self._exists is None or exists != self._exists:
+            self.on_new_mail(self.account)
+        self._exists = exists
+
+        mail.sock.settimeout(self.renew_interval)
+        while not self._stop.is_set():
+            tag = mail._new_tag()
+            mail.send(tag + b' IDLE\r\n')
+            while True:
+                line = mail.readline()
+                if not line:
+                    # 服务器关闭连接或 stop() 关闭了套接字，readline 返回空字节而不抛出异常
+                    raise imaplib.IMAP4.abort('EOF')
+                if self._stop.is_set():
+                    return
+                if line.startswith(b'+'):
+                    self.active = True
+                    continue
+                if line.startswith(tag):
+                    break
+                match = EXISTS_PATTERN.match(line)
+                if match:
+                    self._exists = int(match.group(1))
+                    self.on_new_mail(self.account)
+                elif line.upper().startswith(b'* BYE'):
+                    raise imaplib.IMAP4.abort(line.decode('utf-8', errors='replace').strip())
+            # 服务器结束了 IDLE，返回 OK 时重新进入，第一次就被拒绝说明不支持
+            if not line[len(tag):].strip().upper().startswith(b'OK'):
+                if not self.active:
+                    raise IdleNotSupported()
+                raise imaplib.IMAP4.error(line.decode('utf-8', errors='replace').strip())
+
+    def _close(self):
+        mail, self._mail = self._mail, None
+        if mail is None:
+            return
+        try:
+            mail.shutdown()
+        except Exception:
+            pass
+
+
+class IdleWatcher:
+    """管理实时检查邮箱的 IDLE 会话
+
+    实时检查每轮对每个邮箱调用 watch，返回 True 的邮箱由推送触发收信，本轮不再轮询。
+    会话数达到 max_sessions 或服务器不支持 IDLE 时返回 False，邮箱继续轮询。
+    """
+
+    def __init__(self, on_new_mail, db=None, enabled=None, max_sessions=None, renew_interval=None):
+        """初始化
+
+        Args:
+            on_new_mail: on_new_mail(account)，收到新邮件通知时调用，在会话线程中执行，不应阻塞
+            db: 数据库对象，Outlook 邮箱登录时读取和保存访问令牌
+            enabled: 是否启用 IDLE 推送
+            max_sessions: 最多同时保持的 IDLE 会话数
+            renew_interval: 重新进入 IDLE 的间隔秒数
+        """
+        self.on_new_mail = on_new_mail
+        self.db = db
+        self.enabled = config.IMAP_IDLE_ENABLED if enabled is None else enabled
+        self.max_sessions = config.IMAP_IDLE_MAX_SESSIONS if max_sessions is None else max_sessions
+        self.renew_interval = config.IMAP_IDLE_RENEW_INTERVAL if renew_interval is None else renew_interval
+        self._lock = threading.Lock()
+        self._sessions = {}
+        # 服务器不支持 IDLE 的邮箱ID，停止实时检查后清空
+        self._unsupported = set()
+
+    def watch(self, account):
+        """确保邮箱有 IDLE 会话
+
+        Returns:
+            邮箱已由 IDLE 会话推送时返回 True，需要轮询时返回 False
+        """
+        if not self.enabled:
+            return False
+        account_id = account['id']
+        with self._lock:
+            if account_id in self._unsupported:
+                return False
+            session = self._sessions.get(account_id)
+            if session is not None and session.alive:
+                # 更新账号信息，密码或令牌变化后重新连接时使用新的值
+                session.account = account
+                return session.active
+            if len(self._sessions) >= self.max_sessions:
+                return False
+            session = IdleSession(account, self.on_new_mail, self._mark_unsupported, self.renew_interval, self.db)
+            self._sessions[account_id] = session
+        session.start()
+        # 新会话的第一次连接会补一次收信
+        return True
+
+    def retain(self, account_ids):
+        """关闭不在 account_ids 中的会话，如已关闭实时检查的邮箱"""
+        account_ids = set(account_ids)
+        with self._lock:
+            stale = [self._sessions.pop(account_id) for account_id in list(self._sessions) if account_id not in account_ids]
+        for session in stale:
+            session.stop()
+
+    def _mark_unsupported(self, account):
+        with self._lock:
+            self._unsupported.add(account['id'])
+            self._sessions.pop(account['id'], None)
+        # 开启会话时跳过了本轮轮询，补一次收信
+        self.on_new_mail(account)
+
+    def stop(self):
+        """关闭所有会话"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+            self._unsupported.clear()
+        for session in sessions:
+            session.stop()
+
+    def status(self):
+        """返回会话状态"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'sessions': len(self._sessions),
+                'active': sum(1 for session in self._sessions.values() if session.active),
+                'max_sessions': self.max_sessions,
+                'unsupported': len(self._unsupported),
+            }
@@ -0,0 +1,238 @@
+"""
+IMAP连接池
+按邮箱账号保留已登录的连接，实时检查和手动检查复用同一个会话，
+省去每次收信的TCP握手、TLS握手和登录。
+"""
+
+import time
+import socket
+import hashlib
+import threading
+
+from database import config
+from .logger import logger
+
+
+def account_key(server, port, username, use_ssl=True, secret=None):
+    """连接池中账号的键，密码变化后不再复用旧的会话"""
+    fingerprint = hashlib.sha256(secret.encode('utf-8')).hexdigest()[:16] if secret else None
+    return (server, int(port), bool(use_ssl), username, fingerprint)
+
+
+class IMAPConnectionPool:
+    """按账号复用的IMAP连接池
+
+    acquire 取出账号的空闲连接并重新选择文件夹，连接已失效时透明地重新连接；
+    release 把连接放回池中，不发送 CLOSE 和 LOGOUT。一个连接同一时间只由一个线程使用，
+    同一账号同时收信时另建连接。
+
+    连接的套接字都设置 IMAP_SOCKET_TIMEOUT 超时，半开的连接在重新选择文件夹或 NOOP 时超时，
+    按失效处理并直接关闭，不会一直阻塞收信线程或保活线程。
+
+    空闲连接总数超过 max_idle 时关闭最久未使用的连接；后台线程每隔 keepalive_interval 秒
+    对空闲连接发送 NOOP 保持会话，空闲超过 idle_timeout 秒的连接关闭。
+    """
+
+    def __init__(self, enabled=None, max_idle=None, keepalive_interval=None, idle_timeout=None):
+        """初始化连接池
+
+        Args:
+            enabled: 是否复用连接，关闭时每次收信新建连接并在结束后登出
+            max_idle: 全局最多保留的空闲连接数
+            keepalive_interval: 空闲连接发送 NOOP 的间隔秒数
+            idle_timeout: 空闲连接保留的最长秒数
+        """
+        self.enabled = config.IMAP_POOL_ENABLED if enabled is None else enabled
+        self.max_idle = config.IMAP_POOL_MAX_IDLE if max_idle is None else max_idle
+        self.keepalive_interval = config.IMAP_POOL_KEEPALIVE_INTERVAL if keepalive_interval is None else keepalive_interval
+        self.idle_timeout = config.IMAP_POOL_IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+
+        self._cond = threading.Condition()
+        # key -> (连接, 放回的时间, 上次和服务器通信的时间)，按放回的时间淘汰
+        self._idle = {}
+        self._thread = None
+        self._closed = False
+        self._stats = {'reused': 0, 'created': 0, 'reconnected': 0, 'evicted': 0, 'expired': 0}
+
+    def acquire(self, key, connect, folder="INBOX"):
+        """取出账号的连接并选择文件夹
+
+        Args:
+            key: account_key 生成的账号键
+            connect: 新建并登录连接的函数
+            folder: 要选择的文件夹
+
+        Returns:
+            已选择文件夹的连接，用完后调用 release 放回
+        """
+        mail = self._take(key) if self.enabled else None
+        if mail is not None:
+            try:
+                # 重新选择文件夹，服务器会返回最新的 UIDNEXT，同时检查连接是否可用
+                self._set_timeout(mail)
+                mail.select(folder)
+                self._count('reused')
+                return mail
+            except Exception as e:
+                # 服务器已断开、套接字超时、会话超时登出等，复用的连接上出现的任何异常都按失效处理
+                logger.info(f"复用的IMAP连接已失效，重新连接: {str(e)}")
+                self._shutdown(mail)
+                self._count('reconnected')
+        mail = connect()
+        self._count('created')
+        try:
+            self._set_timeout(mail)
+            mail.select(folder)
+        except Exception:
+            self._logout(mail)
+            raise
+        return mail
+
+    def release(self, key, mail, broken=False):
+        """收信结束后放回连接
+
+        Args:
+            key: 账号键
+            mail: acquire 返回的连接
+            broken: 收信过程中出错时为 True，连接状态不确定，直接关闭
+        """
+        if mail is None:
+            return
+        if broken:
+            # 可能是套接字超时，LOGOUT 也会等到超时，直接关闭
+            self._shutdown(mail)
+            return
+        if not self.enabled or self._closed:
+            self._logout(mail)
+            return
+        # 保活线程发送 NOOP 时也不能无限等待
+        self._set_timeout(mail)
+        now = time.monotonic()
+        evicted = []
+        with self._cond:
+            if key in self._idle:
+                # 同一账号同时收信时另建了连接，只保留一个
+                evicted.append(mail)
+            else:
+                self._idle[key] = (mail, now, now)
+                while len(self._idle) > max(0, self.max_idle):
+                    # 保活不改变放回的时间，按放回的时间找最久未使用的连接
+                    oldest = min(self._idle, key=lambda k: self._idle[k][1])
+                    evicted.append(self._idle.pop(oldest)[0])
+                    self._stats['evicted'] += 1
+                self._ensure_thread()
+            self._cond.notify()
+        for old_mail in evicted:
+            self._logout(old_mail)
+
+    def _take(self, key):
+        """取出账号的空闲连接，没有时返回 None"""
+        with self._cond:
+            entry = self._idle.pop(key, None)
+        if entry is None:
+            return None
+        mail, released_at, _ = entry
+        if time.monotonic() - released_at > self.idle_timeout:
+            self._logout(mail)
+            self._count('expired')
+            return None
+        return mail
+
+    def _ensure_thread(self):
+        """启动保活线程，调用时需持有 _cond"""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._keepalive_loop, name='imap-keepalive', daemon=True)
+            self._thread.start()
+
+    def _keepalive_loop(self):
+        """后台线程：关闭过期的空闲连接，对其余空闲连接定期发送 NOOP"""
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                self._cond.wait(self.keepalive_interval)
+                if self._closed:
+                    return
+                now = time.monotonic()
+                expired = []
+                due = []
+                for key, (mail, released_at, touched_at) in list(self._idle.items()):
+                    if now - released_at > self.idle_timeout:
+                        expired.append(self._idle.pop(key)[0])
+                        self._stats['expired'] += 1
+                    elif now - touched_at >= self.keepalive_interval:
+                        # 发送 NOOP 期间从池中取出，避免同时被收信使用
+                        due.append((key, self._idle.pop(key)))
+
+            for mail in expired:
+                self._logout(mail)
+            for key, (mail, released_at, _) in due:
+                try:
+                    mail.noop()
+                except Exception as e:
+                    logger.info(f"IMAP连接保活失败，关闭连接: {str(e)}")
+                    self._shutdown(mail)
+                    continue
+                with self._cond:
+                    if self._closed or key in self._idle:
+                        duplicate = True
+                    else:
+                        duplicate = False
+                        # 保留原来的放回时间，淘汰顺序不受保活影响
+                        self._idle[key] = (mail, released_at, time.monotonic())
+                if duplicate:
+                    self._logout(mail)
+
+    def _count(self, name):
+        with self._cond:
+            self._stats[name] += 1
+
+    @staticmethod
+    def _set_timeout(mail):
+        """确保连接的套接字有读写超时，连接函数没有设置时补上"""
+        sock = getattr(mail, 'sock', None)
+        if isinstance(sock, socket.socket) and sock.gettimeout() is None:
+            sock.settimeout(config.IMAP_SOCKET_TIMEOUT)
+
+    @staticmethod
+    def _shutdown(mail):
+        """不发送 LOGOUT 直接关闭失效的连接"""
+        try:
+            mail.shutdown()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _logout(mail):
+        """登出并关闭连接，忽略连接已断开等错误"""
+        try:
+            mail.logout()
+        except Exception:
+            try:
+                mail.shutdown()
+            except Exception:
+                pass
+
+    def close(self):
+        """关闭所有空闲连接并停止保活线程"""
+        with self._cond:
+            self._closed = True
+            idle = [mail for mail, _, _ in self._idle.values()]
+            self._idle.clear()
+            self._cond.notify_all()
+        for mail in idle:
+            self._logout(mail)
+
+    def status(self):
+        """返回连接池状态"""
+        with self._cond:
+            return {
+                'enabled': self.enabled,
+                'idle': len(self._idle),
+                'max_idle': self.max_idle,
+                **self._stats,
+            }
+
+
+# 所有邮箱处理类共用的连接池
+imap_pool = IMAPConnectionPool()
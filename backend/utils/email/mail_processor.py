@@ -12,6 +12,7 @@ import time
 import traceback
 import concurrent.futures
 import queue
+import asyncio
 
 from .common import (
     decode_mime_words,
@@ -24,6 +25,7 @@ from .common import (
     extract_email_content,
     normalize_check_time
 )
+from .uid_sync import load_sync_state, commit_sync_state, stored_key_filter
 from .logger import (
     logger, 
     log_email_start, 
@@ -39,6 +41,9 @@ from .imap import IMAPMailHandler
 from .gmail import GmailHandler
 from .qq import QQMailHandler
 from ._real_time_check import RealTimeChecker
+from .async_imap import async_engine, AsyncIMAPMailHandler
+from .imap_idle import FIXED_SERVERS
+from .token_cache import outlook_token_cache
 
 class MailProcessor:
     """统一的邮件处理类"""
@@ -66,16 +71,36 @@ class MailProcessor:
     
     @staticmethod
     @timing_decorator
-    def save_mail_records(db, email_id: int, mail_records: List[Dict], progress_callback: Optional[Callable] = None) -> int:
-        """保存邮件记录到数据库"""
+    def save_mail_records(db, email_id: int, mail_records: List[Dict], progress_callback: Optional[Callable] = None, sync_state: Optional[Dict] = None) -> int:
+        """保存邮件记录到数据库
+        
+        提供 sync_state 时，所有邮件都保存成功后再保存新的同步位置，
+        有邮件保存失败时保持原来的位置，下次重新获取。
+        """
         saved_count = 0
         total = len(mail_records)
+        failed = False
         
         logger.info(f"开始保存 {total} 封邮件记录到数据库, 邮箱ID: {email_id}")
         
         if not progress_callback:
             progress_callback = lambda progress, message: None
-        
+
+        # 数据库支持批量写入时，整批去重并在单个事务内提交
+        if hasattr(db, 'bulk_add_mail_records'):
+            progress_callback(0, f"正在保存邮件记录 (共 {total} 封)")
+            try:
+                saved_count = db.bulk_add_mail_records(email_id, mail_records)
+                commit_sync_state(db, email_id, sync_state)
+            except Exception as e:
+                logger.error(f"批量保存邮件记录失败: {str(e)}")
+                traceback.print_exc()
+            progress_message = f"邮件记录保存完成 ({total}/{total})"
+            progress_callback(100, progress_message)
+            log_progress(email_id, 100, progress_message)
+            logger.info(f"完成保存邮件记录: 总计 {total} 封, 新增 {saved_count} 封")
+            return saved_count
+
         for i, record in enumerate(mail_records):
             try:
                 # 更新进度
@@ -116,14 +141,19 @@ class MailProcessor:
                         logger.debug(f"邮件记录保存成功: '{subject[:30]}...'")
                     else:
                         logger.warning(f"邮件记录保存失败: '{subject[:30]}...'")
+                        failed = True
                 else:
                     logger.debug(f"邮件记录已存在: '{subject[:30]}...'")
                     
             except Exception as e:
                 logger.error(f"保存邮件记录失败: {str(e)}")
                 traceback.print_exc()
+                failed = True
                 continue
         
+        if not failed:
+            commit_sync_state(db, email_id, sync_state)
+        
         logger.info(f"完成保存邮件记录: 总计 {total} 封, 新增 {saved_count} 封")        
         return saved_count
 
@@ -189,9 +219,9 @@ class EmailBatchProcessor:
         """更新邮件检查时间"""
         return MailProcessor.update_check_time(db, email_id)
     
-    def save_mail_records(self, db, email_id: int, mail_records: List[Dict], progress_callback: Optional[Callable] = None) -> int:
+    def save_mail_records(self, db, email_id: int, mail_records: List[Dict], progress_callback: Optional[Callable] = None, sync_state: Optional[Dict] = None) -> int:
         """保存邮件记录到数据库"""
-        return MailProcessor.save_mail_records(db, email_id, mail_records, progress_callback)
+        return MailProcessor.save_mail_records(db, email_id, mail_records, progress_callback, sync_state)
     
     def check_emails(self, email_ids: List[int], progress_callback: Optional[Callable] = None, is_realtime: bool = False) -> bool:
         """批量检查邮箱邮件"""
@@ -234,12 +264,12 @@ class EmailBatchProcessor:
             with self.lock:
                 self.processing_emails[email_info['id']] = True
             
-            # 提交任务到线程池
-            future = thread_pool.submit(
-                self._check_email_task,
-                email_info,
-                create_email_progress_callback(email_info['id'])
-            )
+            # 提交任务，异步引擎处理的邮箱类型在事件循环中收信，不占用线程池
+            callback = create_email_progress_callback(email_info['id'])
+            if async_engine.handles(mail_type):
+                future = async_engine.submit(self._check_email_async(email_info, callback))
+            else:
+                future = thread_pool.submit(self._check_email_task, email_info, callback)
             futures.append(future)
         
         # 启动监控线程，处理完成的任务
@@ -257,6 +287,120 @@ class EmailBatchProcessor:
                 logger.error(f"任务执行失败: {str(e)}")
     
     def _check_email_task(self, email_info, callback=None):
+        """检查单个邮箱的邮件，并记录检查结果、耗时和新增邮件数"""
+        if async_engine.handles(email_info.get('mail_type')):
+            # 在异步引擎的事件循环中收信，当前线程等待结果
+            return async_engine.run(self._check_email_async(email_info, callback))
+        email_id = email_info['id']
+        started = time.time()
+        total_before = self._get_total_records(email_id)
+        result = None
+        try:
+            result = self._run_check_email_task(email_info, callback)
+            return result
+        finally:
+            self._record_check_result(email_id, result, started, total_before)
+    
+    async def _check_email_async(self, email_info, callback=None):
+        """在异步引擎中检查单个邮箱的邮件，数据库操作在线程中执行，不阻塞事件循环"""
+        email_id = email_info['id']
+        loop = asyncio.get_running_loop()
+        run = lambda func, *args: loop.run_in_executor(None, func, *args)
+        started = time.time()
+        total_before = await run(self._get_total_records, email_id)
+        result = None
+        try:
+            result = await self._run_check_email_async(email_info, callback, run)
+            return result
+        finally:
+            with self.lock:
+                self.processing_emails.pop(email_id, None)
+            await run(self._record_check_result, email_id, result, started, total_before)
+    
+    async def _run_check_email_async(self, email_info, callback, run):
+        """异步收信并保存，处理流程与 _run_check_email_task 的IMAP分支相同"""
+        email_id = email_info['id']
+        mail_type = email_info.get('mail_type') or 'imap'
+        if callback is None:
+            callback = lambda progress, message: None
+        try:
+            with self.lock:
+                self.processing_emails[email_id] = True
+            log_email_start(email_info['email'], email_id)
+            
+            server, port, use_ssl = FIXED_SERVERS.get(
+                mail_type, (email_info.get('server'), email_info.get('port') or 993, email_info.get('use_ssl', True))
+            )
+            access_token = None
+            if mail_type == 'outlook':
+                refresh_token = email_info.get('refresh_token')
+                client_id = email_info.get('client_id')
+                if not refresh_token or not client_id:
+                    callback(0, "缺少OAuth2.0认证信息")
+                    return {'success': False, 'message': "缺少OAuth2.0认证信息"}
+                access_token = await run(outlook_token_cache.get_token, email_info, self.db)
+                if not access_token:
+                    callback(0, "获取访问令牌失败")
+                    return {'success': False, 'message': "获取访问令牌失败"}
+            
+            # 获取邮件，按UID只获取上次同步之后的新邮件
+            sync_state = await run(load_sync_state, self.db, email_id)
+            mail_records = await AsyncIMAPMailHandler.fetch_emails_async(
+                email_info['email'],
+                email_info.get('password'),
+                server,
+                port=port,
+                use_ssl=use_ssl,
+                callback=callback,
+                last_check_time=email_info.get('last_check_time'),
+                sync_state=sync_state,
+                key_filter=stored_key_filter(self.db, email_id),
+                access_token=access_token,
+                prefer_plain=mail_type != 'outlook'
+            )
+            
+            if not mail_records:
+                await run(commit_sync_state, self.db, email_id, sync_state)
+                callback(100, "没有找到新邮件")
+                await run(self.update_check_time, self.db, email_id)
+                return {'success': True, 'message': '没有找到新邮件'}
+            
+            # 保存邮件记录，保存成功后再记录同步位置
+            saved_count = await run(self.save_mail_records, self.db, email_id, mail_records, callback, sync_state)
+            await run(self.update_check_time, self.db, email_id)
+            log_email_complete(email_info['email'], email_id, len(mail_records), len(mail_records), saved_count)
+            return {
+                'success': True,
+                'message': f'成功获取 {len(mail_records)} 封邮件，新增 {saved_count} 封'
+            }
+        except Exception as e:
+            error_msg = f"处理邮箱失败: {str(e)}"
+            log_email_error(email_info['email'], email_id, error_msg)
+            callback(0, error_msg)
+            return {'success': False, 'message': error_msg}
+    
+    def _get_total_records(self, email_id):
+        """读取邮箱当前的邮件数，数据库不支持邮箱统计时返回 None"""
+        if not hasattr(self.db, 'get_email_stats'):
+            return None
+        try:
+            stats = self.db.get_email_stats(email_id)
+            return stats['total_records'] if stats else 0
+        except Exception as e:
+            logger.error(f"读取邮箱统计失败: {str(e)}")
+            return None
+    
+    def _record_check_result(self, email_id, result, started, total_before):
+        """把检查结果写入邮箱统计"""
+        if total_before is None or not hasattr(self.db, 'record_check_result'):
+            return
+        status = 'success' if result and result.get('success') else 'failed'
+        duration_ms = int((time.time() - started) * 1000)
+        total_after = self._get_total_records(email_id)
+        new_count = max((total_after or 0) - total_before, 0)
+        self.db.record_check_result(email_id, status, duration_ms, new_count)
+    
+    def _run_check_email_task(self, email_info, callback=None):
         """检查单个邮箱的邮件"""
         email_id = email_info['id']
         try:
@@ -283,31 +427,33 @@ class EmailBatchProcessor:
                         callback(0, error_msg)
                     return {'success': False, 'message': error_msg}
                 
-                # 获取新的访问令牌
+                # 获取访问令牌，未过期时使用缓存的令牌，刷新后由缓存保存到数据库
                 try:
-                    access_token = OutlookMailHandler.get_new_access_token(refresh_token, client_id)
+                    access_token = outlook_token_cache.get_token(email_info, self.db)
                     if not access_token:
                         error_msg = "获取访问令牌失败"
                         if callback:
                             callback(0, error_msg)
                         return {'success': False, 'message': error_msg}
                     
-                    # 更新邮箱的访问令牌
-                    self.db.update_email_token(email_id, access_token)
                     email_info['access_token'] = access_token
                     
                     # 记录开始处理
                     log_email_start(email_info['email'], email_id)
                     
-                    # 获取邮件，增加last_check_time参数
+                    # 获取邮件，按UID只获取上次同步之后的新邮件
+                    sync_state = load_sync_state(self.db, email_id)
                     mail_records = OutlookMailHandler.fetch_emails(
                         email_info['email'],
                         access_token,
                         callback=callback,
-                        last_check_time=last_check_time
+                        last_check_time=last_check_time,
+                        sync_state=sync_state,
+                        key_filter=stored_key_filter(self.db, email_id)
                     )
                     
                     if not mail_records:
+                        commit_sync_state(self.db, email_id, sync_state)
                         if callback:
                             callback(100, "没有找到新邮件")
                         
@@ -316,9 +462,8 @@ class EmailBatchProcessor:
                         
                         return {'success': True, 'message': '没有找到新邮件'}
                     
-                    # 保存邮件记录，传递邮件键列表用于高效去重
-                    mail_keys = [record.get('mail_key', '') for record in mail_records if 'mail_key' in record]
-                    saved_count = self.save_mail_records(self.db, email_id, mail_records, callback)
+                    # 保存邮件记录，保存成功后再记录同步位置
+                    saved_count = self.save_mail_records(self.db, email_id, mail_records, callback, sync_state)
                     
                     # 更新最后检查时间
                     self.update_check_time(self.db, email_id)
@@ -358,7 +503,8 @@ class EmailBatchProcessor:
                     # 记录开始处理
                     log_email_start(email_info['email'], email_id)
                     
-                    # 获取邮件，增加last_check_time参数
+                    # 获取邮件，按UID只获取上次同步之后的新邮件
+                    sync_state = load_sync_state(self.db, email_id)
                     mail_records = IMAPMailHandler.fetch_emails(
                         email_info['email'],
                         email_info['password'],
@@ -366,10 +512,13 @@ class EmailBatchProcessor:
                         port=email_info.get('port'),
                         use_ssl=email_info.get('use_ssl', True),
                         callback=callback,
-                        last_check_time=last_check_time
+                        last_check_time=last_check_time,
+                        sync_state=sync_state,
+                        key_filter=stored_key_filter(self.db, email_id)
                     )
                     
                     if not mail_records:
+                        commit_sync_state(self.db, email_id, sync_state)
                         if callback:
                             callback(100, "没有找到新邮件")
                         
@@ -378,8 +527,8 @@ class EmailBatchProcessor:
                         
                         return {'success': True, 'message': '没有找到新邮件'}
                     
-                    # 保存邮件记录
-                    saved_count = self.save_mail_records(self.db, email_id, mail_records, callback)
+                    # 保存邮件记录，保存成功后再记录同步位置
+                    saved_count = self.save_mail_records(self.db, email_id, mail_records, callback, sync_state)
                     
                     # 更新最后检查时间
                     self.update_check_time(self.db, email_id)
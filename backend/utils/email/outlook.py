@@ -4,7 +4,6 @@ Outlook邮件处理模块
 
 import imaplib
 import email
-import requests
 from datetime import datetime
 import threading
 import socket
@@ -17,29 +16,50 @@ from .common import (
     remove_extra_blank_lines,
     normalize_check_time,
     format_date_for_imap_search,
+    build_header_dedup_keys,
+    extract_attachments,
 )
+from database import config
 from .logger import logger
+from .uid_sync import (
+    search_uids,
+    advance_sync_state,
+    skip_stored_uids,
+    is_incremental,
+    load_sync_state,
+    stored_key_filter,
+)
+from .bodystructure import fetch_messages
+from .imap_pool import imap_pool, account_key
+from .http_pool import http_pool
 
 class OutlookMailHandler:
     """Outlook邮箱处理类"""
     
     @staticmethod
-    def get_new_access_token(refresh_token, client_id="9e5f94bc-e8a4-4e73-b8be-63364c29d753"):
-        """刷新获取新的access_token"""
-        tenant_id = 'common'
+    def refresh_access_token(refresh_token, client_id="9e5f94bc-e8a4-4e73-b8be-63364c29d753"):
+        """用刷新令牌获取新的访问令牌
+
+        Returns:
+            令牌接口返回的字典，包含 access_token、expires_in，刷新令牌轮换时还包含新的 refresh_token；
+            失败时返回 None
+        """
         refresh_token_data = {
             'grant_type': 'refresh_token',
             'refresh_token': refresh_token,
             'client_id': client_id,
         }
 
-        token_url = f"https://login.microsoftonline.com/{tenant_id}/oauth2/v2.0/token"
         try:
-            response = requests.post(token_url, data=refresh_token_data)
+            # 共用连接池的长连接，超时和临时故障的重试由连接池处理
+            response = http_pool.post(config.OUTLOOK_TOKEN_URL, data=refresh_token_data)
             if response.status_code == 200:
-                new_access_token = response.json().get('access_token')
+                token = response.json()
+                if not token.get('access_token'):
+                    logger.error("刷新令牌的响应中没有访问令牌")
+                    return None
                 logger.info(f"成功获取新的访问令牌")
-                return new_access_token
+                return token
             else:
                 logger.error(f"刷新令牌失败: {response.status_code} - {response.text}")
                 return None
@@ -47,13 +67,30 @@ class OutlookMailHandler:
             logger.error(f"刷新令牌过程中发生异常: {str(e)}")
             return None
 
+    @staticmethod
+    def get_new_access_token(refresh_token, client_id="9e5f94bc-e8a4-4e73-b8be-63364c29d753"):
+        """刷新获取新的access_token，收信请使用 outlook_token_cache，令牌未过期时不会刷新"""
+        token = OutlookMailHandler.refresh_access_token(refresh_token, client_id)
+        return token['access_token'] if token else None
+
     @staticmethod
     def generate_auth_string(user, token):
         """生成 OAuth2 授权字符串"""
         return f"user={user}\1auth=Bearer {token}\1\1"
 
     @staticmethod
-    def fetch_emails(email_address, access_token, folder="INBOX", callback=None, last_check_time=None):
+    def parse_headers(msg):
+        """解析邮件的主题、发件人、接收时间和Message-ID，只有邮件头的消息也可以解析"""
+        return {
+            'subject': decode_mime_words(msg.get('Subject', '')),
+            'sender': decode_mime_words(msg.get('From', '')),
+            'received_time': email.utils.parsedate_to_datetime(msg.get('Date', '')),
+            'message_id': (msg.get('Message-ID') or '').strip(),
+            'has_date': bool(msg.get('Date')),
+        }
+
+    @staticmethod
+    def fetch_emails(email_address, access_token, folder="INBOX", callback=None, last_check_time=None, sync_state=None, key_filter=None):
         """
         通过IMAP协议获取Outlook/Hotmail邮箱中的邮件
         
@@ -63,6 +100,10 @@ class OutlookMailHandler:
             folder: 邮件文件夹，默认为收件箱
             callback: 进度回调函数
             last_check_time: 上次检查时间，如果提供，只获取该时间之后的邮件
+            sync_state: UID同步状态，如果提供，只获取上次同步之后的新邮件，
+                        并在其中记录新的同步位置，由调用方在保存邮件后写入数据库
+            key_filter: 查询已存在去重键的函数，如果提供，首次同步或重新全量同步时先批量获取邮件头，
+                        只下载新邮件的正文
             
         Returns:
             list: 邮件记录列表
@@ -85,73 +126,82 @@ class OutlookMailHandler:
         # 尝试连接次数
         max_retries = 3
         
+        # 访问令牌过期前会被令牌缓存替换，已登录的会话不受影响，连接池的键不包含令牌
+        pool_key = account_key('outlook.office365.com', 993, email_address)
+        
+        def connect():
+            # 创建IMAP连接
+            new_mail = imaplib.IMAP4_SSL('outlook.office365.com', timeout=config.IMAP_SOCKET_TIMEOUT)
+            
+            # 使用OAuth2登录
+            auth_string = OutlookMailHandler.generate_auth_string(email_address, access_token)
+            new_mail.authenticate('XOAUTH2', lambda x: auth_string)
+            return new_mail
+        
         for retry in range(max_retries):
+            mail = None
+            broken = True
             try:
                 logger.info(f"尝试连接Outlook邮箱 (尝试 {retry+1}/{max_retries})")
                 callback(10, folder)
                 
-                # 创建IMAP连接
-                mail = imaplib.IMAP4_SSL('outlook.office365.com')
-                
-                # 使用OAuth2登录
-                auth_string = OutlookMailHandler.generate_auth_string(email_address, access_token)
-                mail.authenticate('XOAUTH2', lambda x: auth_string)
-                
-                # 选择文件夹
-                mail.select(folder)
+                # 从连接池获取已登录的连接并选择文件夹
+                mail = imap_pool.acquire(pool_key, connect, folder)
                 callback(20, folder)
                 
-                # 定义搜索条件
+                # 定义搜索条件，没有可用的同步位置时使用
                 if last_check_time:
                     # 将上次检查时间转换为IMAP日期格式 (DD-MMM-YYYY)
                     search_date = format_date_for_imap_search(last_check_time)
                     search_cmd = f'(SINCE "{search_date}")'
                     logger.info(f"搜索{search_date}之后的邮件")
-                    status, data = mail.search(None, search_cmd)
                 else:
-                    # 获取最近的100封邮件
-                    status, data = mail.search(None, 'ALL')
+                    search_cmd = 'ALL'
                 
-                if status != 'OK':
-                    logger.error(f"搜索邮件失败: {status}")
-                    continue
-                
-                # 获取所有邮件ID
-                mail_ids = data[0].split()
+                # 有同步位置时只搜索UID更大的新邮件
+                uids, uid_status = search_uids(mail, folder, sync_state, search_cmd)
                 
                 # 只处理最近的100封邮件
-                mail_ids = mail_ids[-100:] if len(mail_ids) > 100 else mail_ids
+                mail_ids = uids[-100:] if len(uids) > 100 else uids
+                failed_uids = []
+                
+                # 不是按UID增量获取时，先批量获取邮件头，排除数据库中已有的邮件
+                if not is_incremental(sync_state, uid_status):
+                    mail_ids = skip_stored_uids(
+                        mail, mail_ids,
+                        lambda header: build_header_dedup_keys(OutlookMailHandler.parse_headers(header)),
+                        key_filter
+                    )
                 
                 total_mails = len(mail_ids)
                 logger.info(f"找到{total_mails}封邮件")
                 
-                # 处理每封邮件
-                for i, mail_id in enumerate(mail_ids):
+                # 已获取的邮件标识，重试时跳过上次已获取的邮件
+                seen_keys = {record.get('mail_key') for record in mail_records}
+                
+                # 按批获取邮件，每批只需少量网络往返；按结构获取时下载全部纯文本和HTML部分
+                for i, (mail_id, msg, attachments) in enumerate(fetch_messages(mail, mail_ids, prefer_plain=False)):
                     # 更新进度
                     progress = int(20 + (i / total_mails) * 70) if total_mails > 0 else 90
                     callback(progress, folder)
                     
                     try:
-                        # 获取邮件
-                        status, mail_data = mail.fetch(mail_id, '(RFC822)')
-                        
-                        if status != 'OK':
-                            logger.error(f"获取邮件ID {mail_id} 失败: {status}")
+                        if msg is None:
+                            logger.error(f"获取邮件UID {mail_id} 失败")
+                            failed_uids.append(mail_id)
                             continue
                         
-                        # 解析邮件
-                        msg = email.message_from_bytes(mail_data[0][1])
-                        
                         # 获取邮件基本信息
-                        subject = decode_mime_words(msg.get('Subject', ''))
-                        sender = decode_mime_words(msg.get('From', ''))
-                        received_time = email.utils.parsedate_to_datetime(msg.get('Date', ''))
+                        headers = OutlookMailHandler.parse_headers(msg)
+                        subject = headers['subject']
+                        sender = headers['sender']
+                        received_time = headers['received_time']
                         
                         # 创建唯一标识，用于去重
                         mail_key = f"{subject}|{sender}|{received_time.isoformat() if received_time else 'unknown'}"
                         
                         # 检查此邮件是否已处理（通过内存中的集合进行快速检查）
-                        if mail_key in [record.get('mail_key') for record in mail_records]:
+                        if mail_key in seen_keys:
                             logger.info(f"跳过重复邮件: {subject}")
                             continue
                         
@@ -170,19 +220,27 @@ class OutlookMailHandler:
                             content = msg.get_payload(decode=True).decode()
                         
                         # 添加到结果列表
+                        seen_keys.add(mail_key)
                         mail_records.append({
                             'subject': subject,
                             'sender': sender,
                             'received_time': received_time,
                             'content': content,
+                            'message_id': headers['message_id'],
+                            'attachments': extract_attachments(msg) if attachments is None else attachments,
                             'mail_key': mail_key  # 添加唯一标识，用于后续去重
                         })
                         
                     except Exception as e:
-                        logger.error(f"处理邮件ID {mail_id} 时出错: {str(e)}")
+                        logger.error(f"处理邮件UID {mail_id} 时出错: {str(e)}")
+                        failed_uids.append(mail_id)
+                
+                # 超过100封时跳过的旧邮件不再获取，同步位置记到最新的邮件
+                advance_sync_state(sync_state, uid_status, uids, failed_uids)
                 
                 # 成功获取邮件，跳出重试循环
                 callback(90, folder)
+                broken = False
                 break
                 
             except imaplib.IMAP4.error as e:
@@ -194,11 +252,8 @@ class OutlookMailHandler:
                 time.sleep(1)  # 等待一秒再重试
                 
             finally:
-                # 确保关闭连接
-                try:
-                    mail.logout()
-                except:
-                    pass
+                # 成功时放回连接池，出错时关闭连接
+                imap_pool.release(pool_key, mail, broken)
         
         return mail_records
 
@@ -207,8 +262,6 @@ class OutlookMailHandler:
         """检查Outlook/Hotmail邮箱中的邮件并存储到数据库"""
         email_id = email_info['id']
         email_address = email_info['email']
-        refresh_token = email_info['refresh_token']
-        client_id = email_info['client_id']
         
         logger.info(f"开始检查Outlook邮箱: ID={email_id}, 邮箱={email_address}")
         
@@ -220,8 +273,10 @@ class OutlookMailHandler:
         progress_callback(0, "正在获取访问令牌...")
         
         try:
-            # 获取新的访问令牌
-            access_token = OutlookMailHandler.get_new_access_token(refresh_token, client_id)
+            # 获取访问令牌，未过期时使用缓存的令牌，刷新后由缓存保存到数据库
+            # 令牌缓存和邮件处理器依赖本模块，在这里导入避免循环导入
+            from .token_cache import outlook_token_cache
+            access_token = outlook_token_cache.get_token(email_info, db)
             if not access_token:
                 error_msg = f"邮箱{email_address}(ID={email_id})获取访问令牌失败"
                 logger.error(error_msg)
@@ -231,9 +286,6 @@ class OutlookMailHandler:
                     'message': error_msg
                 }
             
-            # 更新令牌到数据库
-            db.update_email_token(email_id, access_token)
-            
             # 报告进度
             progress_callback(10, "开始获取邮件...")
             
@@ -245,32 +297,27 @@ class OutlookMailHandler:
                 progress_callback(total_progress, msg)
             
             try:
+                sync_state = load_sync_state(db, email_id)
                 mail_records = OutlookMailHandler.fetch_emails(
                     email_address, 
                     access_token, 
                     "INBOX", 
-                    folder_progress_callback
+                    folder_progress_callback,
+                    sync_state=sync_state,
+                    key_filter=stored_key_filter(db, email_id)
                 )
                 
                 # 报告进度
                 count = len(mail_records)
                 progress_callback(90, f"获取到{count}封邮件，正在保存...")
                 
-                # 将邮件记录保存到数据库
-                saved_count = 0
-                for record in mail_records:
-                    try:
-                        success = db.add_mail_record(
-                            email_id, 
-                            record['subject'], 
-                            record['sender'], 
-                            record['received_time'], 
-                            record['content']
-                        )
-                        if success:
-                            saved_count += 1
-                    except Exception as e:
-                        logger.error(f"保存邮件记录失败: {str(e)}")
+                # 与其他邮箱类型一样批量保存，保留附件和用于去重的Message-ID，
+                # 邮件都保存后再记录同步位置；保存进度映射到总进度90-100%
+                def save_progress_callback(progress, message):
+                    progress_callback(90 + int(progress * 0.1), message)
+                
+                from .mail_processor import MailProcessor
+                saved_count = MailProcessor.save_mail_records(db, email_id, mail_records, save_progress_callback, sync_state)
                 
                 # 更新最后检查时间
                 try:
@@ -0,0 +1,290 @@
+"""
+Outlook访问令牌缓存
+访问令牌有效期约一小时，缓存在内存中并和过期时间一起保存到数据库，未过期时直接使用，
+不再每次检查都请求令牌接口。后台线程在过期前 OUTLOOK_TOKEN_REFRESH_MARGIN 秒提前刷新，
+同一邮箱同时只发出一个刷新请求，令牌接口轮换的刷新令牌写回数据库。
+实时检查每轮开始前调用 refresh_due，由多个线程并行刷新这一轮需要的令牌。
+"""
+
+import time
+import threading
+import concurrent.futures
+
+from database import config
+from .logger import logger
+from .outlook import OutlookMailHandler
+
+# 令牌接口没有返回有效期时按一小时计算
+DEFAULT_EXPIRES_IN = 3600
+
+# 剩余有效期不足该秒数的令牌不再使用，避免登录过程中过期
+MIN_REMAINING = 60
+
+# 后台刷新失败后重试的间隔(秒)
+RETRY_INTERVAL = 60
+
+
+class OutlookTokenCache:
+    """按邮箱ID缓存Outlook访问令牌
+
+    get_token 返回未过期的令牌，没有时刷新；多个线程同时刷新同一邮箱时只有第一个请求令牌接口，
+    其余等待它的结果。刷新后的令牌有人使用过才会在过期前由后台线程提前刷新，
+    一个有效期内没有再使用的邮箱从内存中移除，下次使用时从数据库读取或重新刷新。
+    """
+
+    def __init__(self, enabled=None, refresh_margin=None, workers=None):
+        """初始化
+
+        Args:
+            enabled: 是否缓存令牌，关闭时每次都刷新
+            refresh_margin: 过期前多少秒提前刷新
+            workers: 批量刷新时同时请求令牌接口的线程数
+        """
+        self.enabled = config.OUTLOOK_TOKEN_CACHE_ENABLED if enabled is None else enabled
+        self.refresh_margin = config.OUTLOOK_TOKEN_REFRESH_MARGIN if refresh_margin is None else refresh_margin
+        self.workers = config.OUTLOOK_TOKEN_REFRESH_WORKERS if workers is None else workers
+        self._cond = threading.Condition()
+        # email_id -> 令牌信息，见 _store
+        self._tokens = {}
+        # email_id -> 正在进行的刷新，其他线程等待它的结果
+        self._inflight = {}
+        self._thread = None
+        self._executor = None
+        self._closed = False
+        self._stats = {'hits': 0, 'loaded': 0, 'refreshed': 0, 'proactive': 0, 'collapsed': 0, 'failed': 0}
+
+    def get_token(self, email_info, db=None):
+        """返回邮箱可用的访问令牌
+
+        Args:
+            email_info: 邮箱信息，需要 id、refresh_token、client_id
+            db: 数据库对象，用于读取和保存令牌，为 None 时只缓存在内存中
+
+        Returns:
+            访问令牌，刷新失败时返回 None
+        """
+        email_id = email_info['id']
+        if not self.enabled:
+            return self._refresh(email_id, email_info, db)
+
+        entry, source = self._lookup(email_info, db)
+        if entry is not None and entry['expires_at'] - time.time() > MIN_REMAINING:
+            with self._cond:
+                entry['used'] = True
+                self._stats[source] += 1
+            return entry['access_token']
+        return self._refresh(email_id, email_info, db)
+
+    def refresh_due(self, accounts, db=None):
+        """一轮实时检查开始前并行刷新即将过期的令牌
+
+        内存和数据库中都没有令牌、或令牌在 refresh_margin 秒内过期的 Outlook 邮箱，
+        最多 workers 个同时请求令牌接口，这一轮检查登录时直接使用缓存的令牌。
+
+        Args:
+            accounts: 邮箱信息列表，其他类型的邮箱忽略
+            db: 数据库对象
+
+        Returns:
+            刷新成功的邮箱数
+        """
+        if not self.enabled:
+            return 0
+        now = time.time()
+        due = []
+        for account in accounts:
+            if account.get('mail_type') != 'outlook' or not account.get('refresh_token'):
+                continue
+            entry, _ = self._lookup(account, db)
+            if entry is None or (entry['expires_at'] - now <= self.refresh_margin and entry['retry_at'] <= now):
+                due.append((account['id'], account, db))
+        if not due:
+            return 0
+        refreshed = sum(1 for access_token in self._refresh_batch(due) if access_token)
+        logger.info(f"实时检查前刷新了 {refreshed}/{len(due)} 个Outlook邮箱的访问令牌")
+        return refreshed
+
+    def _lookup(self, email_info, db):
+        """返回邮箱缓存的令牌，内存中没有时读取数据库
+
+        Returns:
+            (令牌信息, 统计项 'hits' 或 'loaded')，没有令牌时为 (None, None)
+        """
+        email_id = email_info['id']
+        refresh_token = email_info.get('refresh_token')
+        with self._cond:
+            entry = self._tokens.get(email_id)
+            if entry is not None and refresh_token and refresh_token not in entry['known_refresh_tokens']:
+                # 刷新令牌被修改（重新授权），原有的令牌不再使用，数据库中保存的也是旧令牌
+                del self._tokens[email_id]
+                return None, None
+        if entry is not None:
+            return entry, 'hits'
+        if self._load(email_id, email_info, db):
+            with self._cond:
+                return self._tokens.get(email_id), 'loaded'
+        return None, None
+
+    def _load(self, email_id, email_info, db):
+        """进程启动后第一次使用时读取数据库中保存的令牌"""
+        if db is None or not hasattr(db, 'get_email_token'):
+            return False
+        saved = db.get_email_token(email_id)
+        if not saved or not saved.get('access_token') or not saved.get('token_expires_at'):
+            return False
+        # 数据库中是最近一次轮换后的刷新令牌，传入的邮箱信息可能是轮换前读取的
+        self._store(email_id, saved['access_token'], saved['token_expires_at'],
+                    saved.get('refresh_token') or email_info.get('refresh_token'),
+                    email_info.get('client_id') or saved.get('client_id'), db, used=True,
+                    known={email_info.get('refresh_token')})
+        return True
+
+    def _store(self, email_id, access_token, expires_at, refresh_token, client_id, db, used, previous=None, known=()):
+        """保存令牌到内存并唤醒后台刷新线程"""
+        known = set(known) | (previous['known_refresh_tokens'] if previous else set())
+        known.add(refresh_token)
+        known.discard(None)
+        with self._cond:
+            self._tokens[email_id] = {
+                'access_token': access_token,
+                'expires_at': expires_at,
+                'refresh_token': refresh_token,
+                # 刷新令牌轮换后，之前读取的邮箱信息中仍是旧值，不视为重新授权
+                'known_refresh_tokens': known,
+                'client_id': client_id,
+                'db': db,
+                'used': used,
+                'retry_at': 0,
+            }
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._refresh_loop, name='outlook-token-refresh', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _refresh(self, email_id, email_info, db, proactive=False):
+        """请求令牌接口刷新，同一邮箱同时只有一个请求"""
+        with self._cond:
+            future = self._inflight.get(email_id)
+            owner = future is None
+            if owner:
+                future = self._inflight[email_id] = concurrent.futures.Future()
+            else:
+                self._stats['collapsed'] += 1
+            entry = self._tokens.get(email_id)
+        if not owner:
+            return future.result()
+
+        # 使用最近一次轮换后的刷新令牌
+        refresh_token = entry['refresh_token'] if entry else email_info.get('refresh_token')
+        client_id = email_info.get('client_id') or (entry['client_id'] if entry else None)
+        db = db if db is not None else (entry['db'] if entry else None)
+        access_token = None
+        try:
+            token = OutlookMailHandler.refresh_access_token(refresh_token, client_id)
+            if token:
+                access_token = token['access_token']
+                expires_at = time.time() + float(token.get('expires_in') or DEFAULT_EXPIRES_IN)
+                rotated = token.get('refresh_token')
+                if rotated == refresh_token:
+                    rotated = None
+                if self.enabled:
+                    self._store(email_id, access_token, expires_at, rotated or refresh_token, client_id, db,
+                                used=not proactive, previous=entry, known={refresh_token})
+                if db is not None and hasattr(db, 'update_email_token'):
+                    db.update_email_token(email_id, access_token, expires_at, rotated)
+                if rotated:
+                    logger.info(f"邮箱 ID:{email_id} 的刷新令牌已轮换，已保存新的刷新令牌")
+                with self._cond:
+                    self._stats['proactive' if proactive else 'refreshed'] += 1
+            else:
+                with self._cond:
+                    self._stats['failed'] += 1
+                    if email_id in self._tokens:
+                        self._tokens[email_id]['retry_at'] = time.time() + RETRY_INTERVAL
+                        if proactive:
+                            # 重试前没有再使用时不再提前刷新
+                            self._tokens[email_id]['used'] = False
+        except Exception as e:
+            logger.error(f"刷新邮箱 ID:{email_id} 的访问令牌失败: {str(e)}")
+        finally:
+            with self._cond:
+                self._inflight.pop(email_id, None)
+                # 刷新期间后台线程跳过了该邮箱，唤醒它重新计算下次刷新时间
+                self._cond.notify()
+            future.set_result(access_token)
+        return access_token
+
+    def _refresh_batch(self, items, proactive=False):
+        """并行刷新多个邮箱，同时请求令牌接口的线程数不超过 workers
+
+        Args:
+            items: (email_id, email_info, db) 列表
+            proactive: 是否为后台提前刷新
+
+        Returns:
+            与 items 对应的访问令牌列表，刷新失败的为 None
+        """
+        if len(items) == 1:
+            email_id, email_info, db = items[0]
+            return [self._refresh(email_id, email_info, db, proactive)]
+        with self._cond:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix='outlook-token'
+                )
+            executor = self._executor
+        futures = [executor.submit(self._refresh, email_id, email_info, db, proactive) for email_id, email_info, db in items]
+        return [future.result() for future in futures]
+
+    def _refresh_loop(self):
+        """后台线程：在令牌过期前提前刷新仍在使用的邮箱"""
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                now = time.time()
+                due = []
+                next_at = None
+                for email_id, entry in list(self._tokens.items()):
+                    refresh_at = max(entry['expires_at'] - self.refresh_margin, entry['retry_at'])
+                    if email_id in self._inflight:
+                        continue
+                    if refresh_at > now:
+                        next_at = refresh_at if next_at is None else min(next_at, refresh_at)
+                    elif entry['used']:
+                        due.append((email_id, entry))
+                    else:
+                        # 上次刷新后没有再使用，不再提前刷新
+                        del self._tokens[email_id]
+                if not due:
+                    self._cond.wait(RETRY_INTERVAL if next_at is None else min(max(next_at - now, 1), RETRY_INTERVAL))
+                    continue
+
+            self._refresh_batch(
+                [(email_id, {'id': email_id, 'client_id': entry['client_id']}, entry['db']) for email_id, entry in due],
+                proactive=True,
+            )
+
+    def close(self):
+        """停止后台刷新线程"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def status(self):
+        """返回缓存状态"""
+        with self._cond:
+            return {
+                'enabled': self.enabled,
+                'tokens': len(self._tokens),
+                'refresh_margin': self.refresh_margin,
+                'workers': self.workers,
+                **self._stats,
+            }
+
+
+# 所有Outlook邮箱共用的令牌缓存
+outlook_token_cache = OutlookTokenCache()
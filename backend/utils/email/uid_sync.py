@@ -0,0 +1,304 @@
+"""
+IMAP UID增量同步
+按邮箱和文件夹保存 (UIDVALIDITY, 已获取的最大UID)，每次只获取UID更大的邮件。
+UIDVALIDITY 变化说明服务器重新分配了UID，此时重新全量同步。
+获取邮件时按批发送 UID FETCH，一个命令获取多封邮件，减少网络往返。
+首次同步或重新全量同步时先批量获取邮件头，排除数据库中已有的邮件，只下载新邮件的正文。
+"""
+
+import re
+import email
+import imaplib
+
+from database import config
+from .logger import logger
+
+# STATUS 响应中的 UIDVALIDITY 和 UIDNEXT
+STATUS_PATTERN = re.compile(rb'(UIDVALIDITY|UIDNEXT) (\d+)')
+
+# FETCH 响应中的UID
+FETCH_UID_PATTERN = re.compile(rb'UID (\d+)')
+
+# 第一阶段只获取计算去重键需要的邮件头，PEEK 不会把邮件标记为已读
+HEADER_FETCH_ITEM = 'BODY.PEEK[HEADER.FIELDS (MESSAGE-ID SUBJECT FROM DATE)]'
+
+
+def load_sync_state(db, email_id, folder="INBOX"):
+    """读取邮箱文件夹的同步位置
+
+    Returns:
+        同步状态字典，fetch_emails 会在其中记录新的同步位置；
+        数据库不支持保存同步状态时返回 None，按搜索条件全量获取
+    """
+    if db is None or not hasattr(db, 'get_sync_state'):
+        return None
+    state = {'folder': folder, 'uidvalidity': None, 'last_uid': 0, 'changed': False}
+    try:
+        saved = db.get_sync_state(email_id, folder)
+    except Exception as e:
+        logger.error(f"读取邮箱同步状态失败, ID: {email_id}, 错误: {str(e)}")
+        saved = None
+    if saved:
+        state['uidvalidity'] = saved['uidvalidity']
+        state['last_uid'] = saved['last_uid'] or 0
+    return state
+
+
+def commit_sync_state(db, email_id, state):
+    """邮件保存成功后保存新的同步位置，位置没有变化时不写数据库"""
+    if not state or not state.get('changed') or not hasattr(db, 'update_sync_state'):
+        return False
+    if db.update_sync_state(email_id, state['folder'], state['uidvalidity'], state['last_uid']):
+        state['changed'] = False
+        return True
+    return False
+
+
+def _response_number(mail, name):
+    """读取 SELECT 返回的响应码数值，如 [UIDVALIDITY 123]"""
+    try:
+        _, data = mail.response(name)
+        return int(data[-1]) if data and data[-1] is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def read_uid_status(mail, folder):
+    """读取刚选择的文件夹的 UIDVALIDITY 和 UIDNEXT
+
+    服务器一般在 SELECT 的响应中返回这两个值，没有时再用 STATUS 查询。
+
+    Returns:
+        (uidvalidity, uidnext)，无法获取的值为 None
+    """
+    uidvalidity = _response_number(mail, 'UIDVALIDITY')
+    uidnext = _response_number(mail, 'UIDNEXT')
+    if uidvalidity is None or uidnext is None:
+        try:
+            status, data = mail.status(folder, '(UIDVALIDITY UIDNEXT)')
+            if status == 'OK' and data and data[0]:
+                values = dict(STATUS_PATTERN.findall(data[0]))
+                if uidvalidity is None and b'UIDVALIDITY' in values:
+                    uidvalidity = int(values[b'UIDVALIDITY'])
+                if uidnext is None and b'UIDNEXT' in values:
+                    uidnext = int(values[b'UIDNEXT'])
+        except Exception as e:
+            logger.warning(f"查询文件夹 {folder} 的UID状态失败: {str(e)}")
+    return uidvalidity, uidnext
+
+
+def _search_uids(mail, criteria):
+    """执行 UID SEARCH，返回从小到大排列的UID列表"""
+    status, data = mail.uid('SEARCH', None, criteria)
+    if status != 'OK':
+        raise RuntimeError(f"搜索邮件失败: {status}")
+    return sorted(int(uid) for uid in (data[0] or b'').split())
+
+
+def plan_uid_search(folder, sync_state, uid_status, criteria='ALL'):
+    """根据同步状态和服务器的UID状态确定搜索条件
+
+    同步状态中的 UIDVALIDITY 与服务器一致时只搜索 last_uid 之后的邮件，
+    UIDNEXT 表明没有新邮件时不需要搜索。否则按 criteria 搜索，
+    UIDVALIDITY 变化时忽略 criteria 重新全量同步。
+
+    Returns:
+        (搜索条件, 最小UID)，搜索条件为 None 表示没有新邮件；搜索结果只保留大于最小UID的邮件
+    """
+    uidvalidity, uidnext = uid_status
+    if sync_state is None or uidvalidity is None:
+        return criteria, 0
+
+    saved_validity = sync_state['uidvalidity']
+    last_uid = sync_state['last_uid']
+    if saved_validity == uidvalidity:
+        if uidnext is not None and uidnext <= last_uid + 1:
+            logger.info(f"文件夹 {folder} 没有UID大于 {last_uid} 的新邮件")
+            return None, last_uid
+        # n:* 至少返回最大UID的邮件，即使它小于 n，需要再过滤一次
+        return f'UID {last_uid + 1}:*', last_uid
+
+    if saved_validity is not None:
+        logger.info(f"文件夹 {folder} 的UIDVALIDITY从 {saved_validity} 变为 {uidvalidity}，重新全量同步")
+        criteria = 'ALL'
+    return criteria, 0
+
+
+def search_uids(mail, folder, sync_state, criteria='ALL'):
+    """确定本次需要获取的邮件UID，搜索条件见 plan_uid_search
+
+    Args:
+        mail: 已选择文件夹的IMAP连接
+        folder: 文件夹名
+        sync_state: load_sync_state 返回的同步状态，None 表示不做增量同步
+        criteria: 没有可用的同步位置时使用的搜索条件
+
+    Returns:
+        (uids, uid_status)，uid_status 为 (uidvalidity, uidnext)，传给 advance_sync_state
+    """
+    uid_status = read_uid_status(mail, folder)
+    criteria, min_uid = plan_uid_search(folder, sync_state, uid_status, criteria)
+    if criteria is None:
+        return [], uid_status
+    uids = [uid for uid in _search_uids(mail, criteria) if uid > min_uid]
+    if min_uid:
+        logger.info(f"文件夹 {folder} 有 {len(uids)} 封UID大于 {min_uid} 的新邮件")
+    return uids, uid_status
+
+
+def is_incremental(sync_state, uid_status):
+    """本次是否只搜索了 last_uid 之后的邮件，这些邮件不需要再按邮件头排除已保存的邮件"""
+    uidvalidity = uid_status[0]
+    return sync_state is not None and uidvalidity is not None and sync_state['uidvalidity'] == uidvalidity
+
+
+def advance_sync_state(sync_state, uid_status, uids, failed_uids=()):
+    """获取完成后在同步状态中记录新的同步位置
+
+    处理失败的邮件不计入同步位置，下次从第一封失败的邮件开始重新获取，
+    已保存的邮件由数据库去重。
+
+    Args:
+        sync_state: 同步状态，None 时不做任何处理
+        uid_status: search_uids 返回的 (uidvalidity, uidnext)
+        uids: 本次搜索到的UID
+        failed_uids: 处理失败的UID
+    """
+    uidvalidity, uidnext = uid_status
+    if sync_state is None or uidvalidity is None:
+        return
+    if sync_state['uidvalidity'] == uidvalidity:
+        last_uid = sync_state['last_uid']
+    else:
+        last_uid = 0
+    # 全量同步时按条件跳过的旧邮件也视为已同步，UIDNEXT之前的UID都已分配
+    last_uid = max([last_uid] + list(uids) + ([uidnext - 1] if uidnext else []))
+    if failed_uids:
+        last_uid = min(last_uid, min(failed_uids) - 1)
+        if sync_state['uidvalidity'] == uidvalidity:
+            last_uid = max(last_uid, sync_state['last_uid'])
+    if (uidvalidity, last_uid) != (sync_state['uidvalidity'], sync_state['last_uid']):
+        sync_state.update(uidvalidity=uidvalidity, last_uid=last_uid, changed=True)
+
+
+def format_uid_set(uids):
+    """把UID列表写成IMAP消息集，连续的UID合并为区间，如 1:5,8,10:12"""
+    ranges = []
+    for uid in sorted(uids):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ','.join(str(start) if start == end else f'{start}:{end}' for start, end in ranges)
+
+
+def parse_fetch_response(data):
+    """解析一次 FETCH 返回的多封邮件
+
+    每封邮件的内容是一个 (响应头, 字面量) 元组，UID 一般在响应头中，
+    也有服务器把 UID 放在字面量之后的 b' UID 123)' 中。
+
+    Returns:
+        {uid: 内容}
+    """
+    results = {}
+    pending = None
+    for item in data or []:
+        if isinstance(item, tuple) and len(item) > 1:
+            match = FETCH_UID_PATTERN.search(item[0])
+            if match:
+                results[int(match.group(1))] = item[1]
+                pending = None
+            else:
+                pending = item[1]
+        elif isinstance(item, bytes) and pending is not None:
+            match = FETCH_UID_PATTERN.search(item)
+            if match:
+                results[int(match.group(1))] = pending
+            pending = None
+    return results
+
+
+def fetch_uid_batches(mail, uids, item, batch_size=None):
+    """按批获取邮件，每批发送一个 UID FETCH 命令
+
+    Args:
+        mail: 已选择文件夹的IMAP连接
+        uids: 需要获取的UID列表
+        item: 获取的数据项，如 RFC822
+        batch_size: 每批的邮件数，默认使用 IMAP_FETCH_BATCH_SIZE
+
+    Yields:
+        (uid, 内容)，按 uids 的顺序产出，获取失败的邮件内容为 None
+    """
+    batch_size = max(1, batch_size or config.IMAP_FETCH_BATCH_SIZE)
+    for start in range(0, len(uids), batch_size):
+        batch = uids[start:start + batch_size]
+        results = {}
+        try:
+            status, data = mail.uid('FETCH', format_uid_set(batch), f'(UID {item})')
+            if status == 'OK':
+                results = parse_fetch_response(data)
+            else:
+                logger.error(f"批量获取邮件失败: {status}")
+        except imaplib.IMAP4.error as e:
+            # 服务器拒绝了这一批，后续批次仍然可以获取
+            logger.error(f"批量获取邮件失败: {str(e)}")
+        for uid in batch:
+            yield uid, results.get(uid)
+
+
+def stored_key_filter(db, email_id):
+    """返回查询邮箱中已存在去重键的函数，数据库不支持时返回 None"""
+    if db is None or not hasattr(db, 'get_existing_dedup_keys'):
+        return None
+    return lambda dedup_keys: db.get_existing_dedup_keys(email_id, dedup_keys)
+
+
+def skip_stored_uids(mail, uids, build_keys, key_filter):
+    """两阶段收信的第一阶段：批量获取邮件头，排除数据库中已有的邮件
+
+    Args:
+        mail: 已选择文件夹的IMAP连接
+        uids: 候选邮件的UID
+        build_keys: build_keys(邮件头Message)，返回该邮件可能的去重键，无法判断时返回空元组
+        key_filter: key_filter(去重键列表)，返回其中已存在的键，None 表示不过滤
+
+    Returns:
+        需要下载正文的UID，获取邮件头失败或无法判断的邮件也会下载
+    """
+    if not key_filter or not uids:
+        return uids
+    headers = fetch_uid_batches(mail, uids, HEADER_FETCH_ITEM, config.IMAP_HEADER_BATCH_SIZE)
+    keys_by_uid = header_dedup_keys(headers, build_keys)
+    existing = key_filter([key for keys in keys_by_uid.values() for key in keys])
+    return exclude_stored_uids(uids, keys_by_uid, existing)
+
+
+def header_dedup_keys(headers, build_keys):
+    """计算每封邮件的去重键
+
+    Args:
+        headers: (uid, 邮件头内容) 序列，获取失败的内容为 None
+        build_keys: 见 skip_stored_uids
+
+    Returns:
+        {uid: 去重键}，获取或解析邮件头失败的邮件不在其中
+    """
+    keys_by_uid = {}
+    for uid, header in headers:
+        if header is None:
+            continue
+        try:
+            keys_by_uid[uid] = build_keys(email.message_from_bytes(header))
+        except Exception as e:
+            logger.warning(f"解析邮件头失败, UID: {uid}, 错误: {str(e)}")
+    return keys_by_uid
+
+
+def exclude_stored_uids(uids, keys_by_uid, existing):
+    """排除去重键已存在的邮件，返回需要下载正文的UID"""
+    new_uids = [uid for uid in uids if not any(key in existing for key in keys_by_uid.get(uid, ()))]
+    if len(new_uids) < len(uids):
+        logger.info(f"{len(uids)} 封邮件中有 {len(uids) - len(new_uids)} 封已保存，只下载 {len(new_uids)} 封新邮件的正文")
+    return new_uids
@@ -127,7 +127,11 @@ class WebSocketHandler:
             
             elif action == 'get_mail_records':
                 email_id = message.get('email_id')
-                await self.handle_get_mail_records(websocket, email_id)
+                await self.handle_get_mail_records(
+                    websocket, email_id,
+                    limit=message.get('limit'),
+                    cursor=message.get('cursor')
+                )
             
             elif action == 'import_emails':
                 data = message.get('data', [])
@@ -250,8 +254,8 @@ class WebSocketHandler:
             'message': f'Started checking {len(email_ids)} emails'
         })
     
-    async def handle_get_mail_records(self, websocket, email_id):
-        """处理获取邮件记录的请求"""
+    async def handle_get_mail_records(self, websocket, email_id, limit=None, cursor=None):
+        """处理获取邮件记录的请求，按游标分页返回"""
         if not email_id:
             await self.send_to_client(websocket, {
                 'type': 'error',
@@ -259,13 +263,22 @@ class WebSocketHandler:
             })
             return
         
-        mail_records = self.db.get_mail_records(email_id)
+        try:
+            mail_records, next_cursor = self.db.get_mail_records_page(email_id, limit=limit, cursor=cursor)
+        except ValueError as e:
+            await self.send_to_client(websocket, {
+                'type': 'error',
+                'message': str(e)
+            })
+            return
         mail_records_list = [dict(record) for record in mail_records]
         
         await self.send_to_client(websocket, {
             'type': 'mail_records',
             'email_id': email_id,
-            'data': mail_records_list
+            'data': mail_records_list,
+            'cursor': cursor,
+            'next_cursor': next_cursor
         })
     
     async def handle_import_emails(self, websocket, data, mail_type='outlook'):
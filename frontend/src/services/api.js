@@ -142,6 +142,10 @@ const apiMethods = {
     return api.post('/admin/database/backup');
   },
   
+  getBackupStatus: () => {
+    return api.get('/admin/database/backup');
+  },
+  
   syncToWebDAV: () => {
     return api.post('/admin/database/webdav/sync-to');
   },
@@ -287,7 +291,12 @@ const apiMethods = {
   emails: {
     getAll: () => api.get('/emails').then(res => res.data),
     getPassword: (emailId) => api.get(`/emails/${emailId}/password`).then(res => res.data),
-    getRecords: (emailId) => api.get(`/emails/${emailId}/mail_records`).then(res => res.data),
+    // 按游标分页，cursor 为上一页返回的 next_cursor
+    getRecords: (emailId, cursor) => api.get(`/emails/${emailId}/mail_records`, {
+      params: cursor ? { cursor } : {}
+    }).then(res => res.data),
+    // 列表只返回摘要，查看邮件时再获取完整正文
+    getRecord: (recordId) => api.get(`/mail_records/${recordId}`).then(res => res.data),
     add: (emailData) => api.post('/emails', emailData),
     check: (emailIds) => {
       if (Array.isArray(emailIds) && emailIds.length === 1) {
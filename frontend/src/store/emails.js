@@ -2,6 +2,17 @@ import { defineStore } from 'pinia';
 import api from '@/services/api';
 import websocket from '@/services/websocket';
 
+// 整理列表接口返回的邮件记录，列表不返回正文，查看时通过 fetchMailContent 获取
+const normalizeMailRecord = (record) => ({
+  id: record.id || Date.now() + Math.random().toString(36).substring(2, 10),
+  subject: record.subject || '(无主题)',
+  sender: record.sender || '(未知发件人)',
+  received_time: record.received_time || new Date().toISOString(),
+  snippet: record.snippet || '',
+  content: record.content,
+  folder: record.folder || 'INBOX'
+});
+
 export const useEmailsStore = defineStore('emails', {
   state: () => ({
     emails: [],
@@ -11,6 +22,9 @@ export const useEmailsStore = defineStore('emails', {
     processingEmails: {},
     currentMailRecords: [],
     currentEmailId: null,
+    // 下一页邮件记录的游标，为 null 时已加载全部
+    mailRecordsCursor: null,
+    loadingMoreRecords: false,
     isConnected: false
   }),
   
@@ -27,6 +41,8 @@ export const useEmailsStore = defineStore('emails', {
       return Array.isArray(state.selectedEmails) && state.selectedEmails.length > 0;
     },
     
+    hasMoreMailRecords: (state) => !!state.mailRecordsCursor,
+    
     selectedEmailsCount: (state) => {
       return Array.isArray(state.selectedEmails) ? state.selectedEmails.length : 0;
     },
@@ -101,25 +117,23 @@ export const useEmailsStore = defineStore('emails', {
         if (data.email_id === this.currentEmailId) {
           // 添加数据验证和清理
           if (Array.isArray(data.data)) {
-            // 确保每条记录都有必要的字段
-            this.currentMailRecords = data.data.map(record => ({
-              id: record.id || Date.now() + Math.random().toString(36).substring(2, 10),
-              subject: record.subject || '(无主题)',
-              sender: record.sender || '(未知发件人)',
-              received_time: record.received_time || new Date().toISOString(),
-              content: record.content || '(无内容)',
-              folder: record.folder || 'INBOX'
-            }));
+            // 确保每条记录都有必要的字段，带游标请求的是后续页，追加到列表末尾
+            const records = data.data.map(normalizeMailRecord);
+            this.currentMailRecords = data.cursor ? [...this.currentMailRecords, ...records] : records;
+            this.mailRecordsCursor = data.next_cursor || null;
           } else {
             this.currentMailRecords = [];
+            this.mailRecordsCursor = null;
             console.error('收到的邮件记录数据不是数组格式:', data);
           }
         }
+        this.loadingMoreRecords = false;
       });
       
       // 错误处理
       websocket.onMessage('error', (data) => {
         this.error = data.message;
+        this.loadingMoreRecords = false;
         console.error('WebSocket 错误：', data.message);
       });
     },
@@ -295,35 +309,15 @@ export const useEmailsStore = defineStore('emails', {
       }
     },
     
-    // 获取邮件记录
+    // 获取邮件记录的第一页
     async fetchMailRecords(emailId) {
       this.loading = true;
       this.error = null;
       
       try {
-        if (!websocket.isConnected) {
-          const response = await api.emails.getRecords(emailId);
-          
-          // 确保返回数据是数组且每条记录格式正确
-          if (Array.isArray(response)) {
-            this.currentMailRecords = response.map(record => ({
-              id: record.id || Date.now() + Math.random().toString(36).substring(2, 10),
-              subject: record.subject || '(无主题)',
-              sender: record.sender || '(未知发件人)',
-              received_time: record.received_time || new Date().toISOString(),
-              content: record.content || '(无内容)',
-              folder: record.folder || 'INBOX'
-            }));
-          } else {
-            this.currentMailRecords = [];
-            console.error('API返回的邮件记录数据不是数组格式:', response);
-          }
-          
-          this.currentEmailId = emailId;
-        } else {
-          this.currentEmailId = emailId;
-          websocket.send('get_mail_records', { email_id: emailId });
-        }
+        this.currentEmailId = emailId;
+        this.mailRecordsCursor = null;
+        await this.requestMailRecords(emailId, null);
       } catch (error) {
         this.error = '获取邮件记录失败';
         console.error(error);
@@ -332,6 +326,57 @@ export const useEmailsStore = defineStore('emails', {
       }
     },
     
+    // 按游标加载下一页邮件记录，追加到当前列表
+    async fetchMoreMailRecords() {
+      if (!this.mailRecordsCursor || this.loadingMoreRecords) return;
+      
+      this.loadingMoreRecords = true;
+      this.error = null;
+      
+      try {
+        await this.requestMailRecords(this.currentEmailId, this.mailRecordsCursor);
+      } catch (error) {
+        this.error = '加载更多邮件失败';
+        console.error(error);
+      } finally {
+        // 通过WebSocket请求时在收到 mail_records 消息后结束加载
+        if (!websocket.isConnected) {
+          this.loadingMoreRecords = false;
+        }
+      }
+    },
+    
+    // 请求一页邮件记录，cursor 为 null 时请求第一页
+    async requestMailRecords(emailId, cursor) {
+      if (websocket.isConnected) {
+        websocket.send('get_mail_records', cursor ? { email_id: emailId, cursor } : { email_id: emailId });
+        return;
+      }
+      
+      const response = await api.emails.getRecords(emailId, cursor);
+      // 接口按页返回 { records, next_cursor }
+      const records = response && response.records;
+      
+      // 确保返回数据是数组且每条记录格式正确
+      if (Array.isArray(records)) {
+        const page = records.map(normalizeMailRecord);
+        this.currentMailRecords = cursor ? [...this.currentMailRecords, ...page] : page;
+        this.mailRecordsCursor = response.next_cursor || null;
+      } else {
+        if (!cursor) {
+          this.currentMailRecords = [];
+        }
+        this.mailRecordsCursor = null;
+        console.error('API返回的邮件记录数据不是数组格式:', response);
+      }
+    },
+    
+    // 获取单封邮件的完整正文
+    async fetchMailContent(recordId) {
+      const record = await api.emails.getRecord(recordId);
+      return record ? record.content : null;
+    },
+    
     // 获取邮箱密码
     async getEmailPassword(emailId) {
       try {